@@ -0,0 +1,85 @@
+"""
+Cache em memória TTL + LRU com versão por grupo, base dos caches de
+principal (app/core/principal_cache.py) e de sugestões de compra
+(app/core/sugestao_cache.py).
+
+Cada item pertence a um grupo (e-mail do usuário, empresa...) e tem uma chave
+opcional dentro dele. `invalidar(grupo)` incrementa a versão do grupo e
+descarta seus itens. Quem preenche o cache lê `versao(grupo)` ANTES de
+consultar o banco e passa essa versão para `guardar`: se o grupo for
+invalidado enquanto a consulta está em andamento, o resultado antigo fica
+com a versão anterior e é descartado na próxima leitura.
+
+O cache é por processo; em vários workers, uma invalidação feita em outro
+processo vale no máximo após o TTL.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+Chave = Tuple[Hashable, Optional[Hashable]]
+
+
+class CacheVersionado(Generic[V]):
+    """Cache TTL + LRU de valores por (grupo, chave), com versão por grupo."""
+
+    def __init__(self, ttl_segundos: float, max_itens: int):
+        self.ttl_segundos = max(0.0, ttl_segundos)
+        self.max_itens = max(0, max_itens)
+        # (grupo, chave) -> (versão, expira_em, valor)
+        self._itens: "OrderedDict[Chave, Tuple[int, float, V]]" = OrderedDict()
+        self._versoes: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ativo(self) -> bool:
+        return self.ttl_segundos > 0 and self.max_itens > 0
+
+    def versao(self, grupo: Hashable) -> int:
+        """Versão atual do grupo; leia antes de consultar o banco e passe para `guardar`."""
+        with self._lock:
+            return self._versoes.get(grupo, 0)
+
+    def obter(self, grupo: Hashable, chave: Optional[Hashable] = None) -> Optional[V]:
+        if not self.ativo:
+            return None
+        item_chave = (grupo, chave)
+        with self._lock:
+            item = self._itens.get(item_chave)
+            if item is None:
+                return None
+            versao, expira_em, valor = item
+            if versao != self._versoes.get(grupo, 0) or expira_em <= time.monotonic():
+                del self._itens[item_chave]
+                return None
+            self._itens.move_to_end(item_chave)
+            return valor
+
+    def guardar(self, grupo: Hashable, valor: V, versao: int, chave: Optional[Hashable] = None) -> None:
+        if not self.ativo:
+            return
+        item_chave = (grupo, chave)
+        with self._lock:
+            self._itens[item_chave] = (versao, time.monotonic() + self.ttl_segundos, valor)
+            self._itens.move_to_end(item_chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def invalidar(self, *grupos: Optional[Hashable]) -> None:
+        """Descarta os itens dos grupos informados (None é ignorado)."""
+        with self._lock:
+            for grupo in grupos:
+                if grupo is None:
+                    continue
+                self._versoes[grupo] = self._versoes.get(grupo, 0) + 1
+                for item_chave in [c for c in self._itens if c[0] == grupo]:
+                    del self._itens[item_chave]
+
+    def limpar(self) -> None:
+        with self._lock:
+            for grupo in {c[0] for c in self._itens}:
+                self._versoes[grupo] = self._versoes.get(grupo, 0) + 1
+            self._itens.clear()
@@ -42,7 +42,38 @@ class Settings(BaseSettings):
     # File Upload
     MAX_UPLOAD_SIZE: int = 50 * 1024 * 1024  # 50MB
     ALLOWED_EXTENSIONS: List[str] = [".pdf", ".xlsx", ".xls"]
-    
+
+    # Parsing de uploads (app/core/parse_executor.py)
+    PARSE_PROCESS_POOL_SIZE: int = 2  # processos para extração de PDF/Excel (0 = usar threads)
+    PARSE_QUEUE_LIMIT: int = 8  # arquivos em extração/espera antes de responder 503
+    PARSE_DB_THREADS: int = 4  # threads para o trabalho de banco dos uploads (<= pool do SQLAlchemy)
+
+    # Cache de parsing de NFs por hash do conteúdo (app/core/parse_cache.py)
+    PARSE_CACHE_MAX_ITENS: int = 256  # entradas em memória (LRU; 0 = desativado)
+    PARSE_CACHE_DIR: Optional[str] = None  # diretório do cache em disco (None = apenas memória)
+    PARSE_CACHE_DISCO_MAX_ARQUIVOS: int = 5000
+
+    # Importação de NFs em lote (app/services/nf_importacao_lote_service.py)
+    NF_LOTE_MAX_ARQUIVOS: int = 200  # arquivos por lote
+    NF_LOTE_ARQUIVOS_PARALELOS: int = 2  # arquivos de um lote processados ao mesmo tempo
+    NF_LOTE_HEARTBEAT_SEGUNDOS: int = 30  # intervalo do sinal de vida do processo que processa o lote
+    NF_LOTE_HEARTBEAT_EXPIRACAO_SEGUNDOS: int = 300  # sem sinal de vida por mais que isso, o lote é considerado abandonado
+
+    # Extração de texto de PDF por página (app/utils/pdf_texto.py)
+    PDF_PAGINAS_PROCESSOS: int = 0  # processos extraindo páginas em paralelo (0 = automático pela CPU, 1 = sequencial)
+    PDF_PAGINAS_MIN_PARALELO: int = 4  # PDFs com menos páginas são lidos no próprio processo
+
+    # Cache do usuário autenticado (app/core/principal_cache.py)
+    PRINCIPAL_CACHE_TTL_SEGUNDOS: float = 30  # 0 = desativado
+    PRINCIPAL_CACHE_MAX_ITENS: int = 1024
+
+    # Cache das sugestões de compra globais por clientes (app/core/sugestao_cache.py)
+    SUGESTAO_CLIENTES_CACHE_TTL_SEGUNDOS: float = 60  # 0 = desativado
+    SUGESTAO_CLIENTES_CACHE_MAX_ITENS: int = 256
+
+    # Jobs incrementais por id (app/services/posicao_incremental.py)
+    INCREMENTAL_JANELA_SEGURANCA_MINUTOS: int = 30  # duração máxima suposta de uma transação de lançamento
+
     # Timeouts
     REQUEST_TIMEOUT: int = 300  # 5 minutos
     DB_QUERY_TIMEOUT: int = 30  # 30 segundos
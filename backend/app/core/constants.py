@@ -6,7 +6,7 @@ para facilitar manutenção e evitar erros de digitação.
 """
 
 from enum import Enum
-from typing import List
+from typing import List, Tuple
 
 
 class OrcamentoStatus(str, Enum):
@@ -34,6 +34,18 @@ class OrigemMovimentacao(str, Enum):
     OUTRO = "OUTRO"
 
 
+class CanalMovimentacao(str, Enum):
+    """Canal que gerou a movimentação (movimentacoes_estoque.canal), classificado pela observação."""
+    VENDA_VENDEDOR = "VENDA_VENDEDOR"  # App de vendedores
+    IMPORTACAO_NF = "IMPORTACAO_NF"  # Baixas automáticas de NFs importadas
+    NF_AUTOMATICA = "NF_AUTOMATICA"  # Demais entradas/saídas automáticas por NF
+    ORCAMENTO = "ORCAMENTO"
+    ORDEM_COMPRA = "ORDEM_COMPRA"
+    INVENTARIO = "INVENTARIO"
+    REVERSAO = "REVERSAO"
+    MANUAL = "MANUAL"  # Observação livre ou vazia
+
+
 # Status válidos para confirmação de orçamento
 STATUS_CONFIRMAVEL: List[str] = [
     OrcamentoStatus.ENVIADO.value,
@@ -54,6 +66,29 @@ ORIGENS_MANUAIS: List[str] = [
     OrigemMovimentacao.AJUSTE.value
 ]
 
+# Prefixos de observação (sem diferenciar maiúsculas/minúsculas) de cada canal,
+# avaliados em ordem; observação sem prefixo conhecido = MANUAL
+PREFIXOS_CANAL_MOVIMENTACAO: List[Tuple[str, str]] = [
+    ("Venda Operador", CanalMovimentacao.VENDA_VENDEDOR.value),
+    ("Venda realizada pelo vendedor", CanalMovimentacao.VENDA_VENDEDOR.value),
+    ("Venda para", CanalMovimentacao.VENDA_VENDEDOR.value),
+    ("Importação automática - NF", CanalMovimentacao.IMPORTACAO_NF.value),
+    ("Processamento automático - NF", CanalMovimentacao.IMPORTACAO_NF.value),
+    ("Entrada automática - NF", CanalMovimentacao.NF_AUTOMATICA.value),
+    ("Saída automática - NF", CanalMovimentacao.NF_AUTOMATICA.value),
+    ("NF ", CanalMovimentacao.NF_AUTOMATICA.value),
+    ("Orçamento #", CanalMovimentacao.ORCAMENTO.value),
+    ("Entrada referente à Ordem de Compra", CanalMovimentacao.ORDEM_COMPRA.value),
+    ("Contagem física", CanalMovimentacao.INVENTARIO.value),
+    ("🔄 REVERSÃO", CanalMovimentacao.REVERSAO.value),
+]
+
+# Canais considerados nas análises de vendas (vendedores / NF)
+CANAIS_ANALISE_VENDAS: List[str] = [
+    CanalMovimentacao.VENDA_VENDEDOR.value,
+    CanalMovimentacao.IMPORTACAO_NF.value
+]
+
 # Mensagens de erro padronizadas
 MENSAGENS_ERRO = {
     "RECURSO_NAO_ENCONTRADO": "{recurso} não encontrado(a).",
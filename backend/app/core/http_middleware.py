@@ -0,0 +1,60 @@
+"""
+Middleware ASGI de CORS e log enxuto das respostas com erro.
+
+Substitui o antigo `@app.middleware("http")` (BaseHTTPMiddleware), que lia o
+corpo inteiro de todo POST/PUT/PATCH com `await request.body()` para reenviá-lo
+ao handler: cada upload de NF/Excel ficava na memória antes mesmo do parsing
+do multipart. Aqui só a mensagem `http.response.start` é observada (status e
+cabeçalhos); o corpo da requisição e o da resposta passam direto.
+"""
+import traceback
+from typing import Sequence
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .logger import app_logger as logger
+
+METODOS_PERMITIDOS = "GET, POST, PUT, DELETE, OPTIONS, PATCH"
+CABECALHOS_PERMITIDOS = "Content-Type, Authorization, Accept, Origin, User-Agent, DNT, Cache-Control, X-Requested-With"
+CABECALHOS_EXPOSTOS = "Content-Disposition, Content-Type, Content-Length"
+
+
+class CorsELogMiddleware:
+    """Adiciona os cabeçalhos CORS a todas as respostas HTTP e registra status >= 400."""
+
+    def __init__(self, app: ASGIApp, allowed_origins: Sequence[str]):
+        self.app = app
+        self.allowed_origins = list(allowed_origins)
+
+    def _origem_permitida(self, origin: str | None) -> str:
+        if origin and origin in self.allowed_origins:
+            return origin
+        return self.allowed_origins[0] if self.allowed_origins else "*"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        allow_origin = self._origem_permitida(Headers(scope=scope).get("origin"))
+
+        async def send_com_cors(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers["Access-Control-Allow-Origin"] = allow_origin
+                headers["Access-Control-Allow-Credentials"] = "true"
+                headers["Access-Control-Allow-Methods"] = METODOS_PERMITIDOS
+                headers["Access-Control-Allow-Headers"] = CABECALHOS_PERMITIDOS
+                headers["Access-Control-Expose-Headers"] = CABECALHOS_EXPOSTOS
+
+                if message["status"] >= 400:
+                    logger.warning(f"{scope['method']} {scope['path']} -> {message['status']}")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_com_cors)
+        except Exception as e:
+            logger.error(f"Erro ao processar requisição: {str(e)}")
+            logger.error(traceback.format_exc())
+            raise
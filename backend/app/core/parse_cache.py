@@ -0,0 +1,219 @@
+"""
+Cache dos resultados de parsing de NFs (PDF/XML) pelo hash SHA256 do conteúdo.
+
+A mesma NF costuma ser enviada mais de uma vez (preview e depois confirmação,
+reenvio após correções, lotes repetidos). Com o hash do arquivo, o texto
+extraído do PDF, os dados de cabeçalho e as linhas de produto são reaproveitados
+sem rodar pdfplumber/regex/XML de novo.
+
+- Memória: LRU limitado a PARSE_CACHE_MAX_ITENS entradas.
+- Disco (opcional, PARSE_CACHE_DIR): sobrevive a reinícios; as entradas mais
+  antigas são removidas quando passam de PARSE_CACHE_DISCO_MAX_ARQUIVOS.
+
+Só entram no cache funções determinísticas do conteúdo (sem banco de dados).
+Os extratores engolem exceções e devolvem texto vazio ou `produtos` vazio; por
+isso resultados vazios ou com 'erro' não são guardados (`_cacheavel`) — uma
+falha transitória não fica presa ao hash do arquivo.
+Ao alterar um extrator, incremente VERSAO_CACHE para descartar os resultados
+antigos.
+"""
+import copy
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from app.core.config import settings
+from app.core.parse_executor import parse_executor
+
+logger = logging.getLogger(__name__)
+
+VERSAO_CACHE = 2
+
+
+def _cacheavel(valor: Any) -> bool:
+    """False para resultados que podem ser uma falha engolida pelo extrator."""
+    if valor is None:
+        return False
+    if isinstance(valor, str):
+        return bool(valor.strip())
+    if isinstance(valor, (list, tuple)):
+        return len(valor) > 0
+    if isinstance(valor, dict):
+        if valor.get('erro'):
+            return False
+        if 'produtos' in valor and not valor['produtos']:
+            return False
+    return True
+
+
+def hash_conteudo(conteudo: bytes) -> str:
+    """SHA256 do conteúdo do arquivo (mesmo hash de arquivos_processados)."""
+    return hashlib.sha256(conteudo).hexdigest()
+
+
+class ParseCache:
+    """LRU em memória (com espelho opcional em disco) dos resultados de parsing."""
+
+    def __init__(self, max_itens: int, diretorio: Optional[str] = None, max_arquivos_disco: int = 5000):
+        self.max_itens = max(0, max_itens)
+        self.diretorio = diretorio
+        self.max_arquivos_disco = max(1, max_arquivos_disco)
+        self._itens: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._acertos = 0
+        self._falhas = 0
+        self._gravacoes_disco = 0
+        if self.diretorio:
+            os.makedirs(self.diretorio, exist_ok=True)
+
+    @staticmethod
+    def _chave(tipo: str, hash_arquivo: str) -> str:
+        return f"v{VERSAO_CACHE}_{tipo}_{hash_arquivo}"
+
+    def _caminho_disco(self, chave: str) -> str:
+        return os.path.join(self.diretorio, f"{chave}.pkl")
+
+    def obter(self, tipo: str, hash_arquivo: Optional[str]) -> Optional[Any]:
+        """Resultado em cache (cópia) ou None."""
+        if not hash_arquivo:
+            return None
+        chave = self._chave(tipo, hash_arquivo)
+        with self._lock:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                self._acertos += 1
+                return copy.deepcopy(self._itens[chave])
+
+        valor = self._ler_disco(chave)
+        with self._lock:
+            if valor is None:
+                self._falhas += 1
+                return None
+            self._acertos += 1
+            self._guardar_memoria(chave, valor)
+        return copy.deepcopy(valor)
+
+    def guardar(self, tipo: str, hash_arquivo: Optional[str], valor: Any) -> None:
+        if not hash_arquivo or not _cacheavel(valor):
+            return
+        chave = self._chave(tipo, hash_arquivo)
+        # Cópia: quem chamou continua livre para alterar o próprio resultado
+        valor = copy.deepcopy(valor)
+        with self._lock:
+            self._guardar_memoria(chave, valor)
+        self._gravar_disco(chave, valor)
+
+    def obter_ou_calcular(self, tipo: str, hash_arquivo: Optional[str], calcular: Callable[[], Any]) -> Any:
+        """Versão síncrona (usada dentro dos serviços): calcula e guarda em caso de falha no cache (se `_cacheavel`)."""
+        valor = self.obter(tipo, hash_arquivo)
+        if valor is None:
+            valor = calcular()
+            self.guardar(tipo, hash_arquivo, valor)
+        return valor
+
+    async def executar_parse(
+        self,
+        tipo: str,
+        hash_arquivo: Optional[str],
+        funcao: Callable[..., Any],
+        *args,
+        aguardar_vaga: bool = False
+    ) -> Any:
+        """
+        Executa `funcao` no pool de processos do parse_executor, a menos que o
+        resultado para este conteúdo já esteja em cache.
+        """
+        valor = self.obter(tipo, hash_arquivo)
+        if valor is not None:
+            return valor
+        if aguardar_vaga:
+            valor = await parse_executor.executar_parse_aguardando(funcao, *args)
+        else:
+            valor = await parse_executor.executar_parse(funcao, *args)
+        self.guardar(tipo, hash_arquivo, valor)
+        return valor
+
+    def limpar(self) -> None:
+        """Descarta o cache em memória (o disco expira pela versão/limite de arquivos)."""
+        with self._lock:
+            self._itens.clear()
+
+    def estatisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "itens_memoria": len(self._itens),
+                "max_itens": self.max_itens,
+                "acertos": self._acertos,
+                "falhas": self._falhas,
+                "disco": self.diretorio,
+            }
+
+    def _guardar_memoria(self, chave: str, valor: Any) -> None:
+        # Chamado com self._lock adquirido
+        if self.max_itens == 0:
+            return
+        self._itens[chave] = valor
+        self._itens.move_to_end(chave)
+        while len(self._itens) > self.max_itens:
+            self._itens.popitem(last=False)
+
+    def _ler_disco(self, chave: str) -> Optional[Any]:
+        if not self.diretorio:
+            return None
+        caminho = self._caminho_disco(chave)
+        try:
+            with open(caminho, "rb") as arquivo:
+                return pickle.load(arquivo)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"⚠️ Entrada inválida no cache de parsing ({caminho}): {e}")
+            return None
+
+    def _gravar_disco(self, chave: str, valor: Any) -> None:
+        if not self.diretorio:
+            return
+        try:
+            # Grava em arquivo temporário e renomeia: leitores nunca veem arquivo pela metade
+            descritor, temporario = tempfile.mkstemp(dir=self.diretorio, suffix=".tmp")
+            with os.fdopen(descritor, "wb") as arquivo:
+                pickle.dump(valor, arquivo, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporario, self._caminho_disco(chave))
+        except Exception as e:
+            logger.warning(f"⚠️ Não foi possível gravar o cache de parsing em disco: {e}")
+            return
+
+        with self._lock:
+            self._gravacoes_disco += 1
+            podar = self._gravacoes_disco % 100 == 0
+        if podar:
+            self._podar_disco()
+
+    def _podar_disco(self) -> None:
+        """Remove as entradas mais antigas do disco além de max_arquivos_disco."""
+        try:
+            entradas = [
+                entrada for entrada in os.scandir(self.diretorio)
+                if entrada.is_file() and entrada.name.endswith(".pkl")
+            ]
+            excesso = len(entradas) - self.max_arquivos_disco
+            if excesso <= 0:
+                return
+            entradas.sort(key=lambda entrada: entrada.stat().st_mtime)
+            for entrada in entradas[:excesso]:
+                os.unlink(entrada.path)
+        except Exception as e:
+            logger.warning(f"⚠️ Erro ao limpar o cache de parsing em disco: {e}")
+
+
+# Instância global usada pelos routers e serviços de NF
+parse_cache = ParseCache(
+    max_itens=settings.PARSE_CACHE_MAX_ITENS,
+    diretorio=settings.PARSE_CACHE_DIR,
+    max_arquivos_disco=settings.PARSE_CACHE_DISCO_MAX_ARQUIVOS
+)
@@ -0,0 +1,157 @@
+"""
+Executor de parsing de arquivos enviados (PDF, XML, Excel) fora do event loop.
+
+Os endpoints de upload são `async def`; extrair texto com pdfplumber/PyPDF2 ou
+rodar as consultas síncronas do SQLAlchemy diretamente neles trava todas as
+outras requisições do worker. Este módulo oferece dois pools:
+
+- um pool de PROCESSOS para a extração CPU-bound (a função e seus argumentos
+  precisam ser serializáveis: funções de módulo recebendo caminho/bytes);
+- um pool de THREADS para o trabalho de banco (sessão síncrona do SQLAlchemy).
+
+A fila do pool de processos é limitada: com PARSE_QUEUE_LIMIT arquivos já em
+extração/espera, novos uploads recebem 503 em vez de acumular memória.
+"""
+import asyncio
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException, status
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# True nos processos do pool de parsing (ver `em_worker_parse`)
+_em_worker_parse = False
+
+
+def _inicializar_worker_parse() -> None:
+    global _em_worker_parse
+    _em_worker_parse = True
+
+
+def em_worker_parse() -> bool:
+    """
+    True se o código está rodando em um processo do pool de parsing. Nesses
+    processos o paralelismo já vem do pool; pools internos (ex.: páginas de PDF
+    em app.utils.pdf_texto) não devem ser criados.
+    """
+    return _em_worker_parse
+
+
+class ParseExecutor:
+    """Pools (processos para parsing, threads para banco) criados sob demanda."""
+
+    def __init__(self, processos: int, limite_fila: int, threads_db: int):
+        self.processos = max(0, processos)
+        self.limite_fila = max(1, limite_fila)
+        self.threads_db = max(1, threads_db)
+        self._vagas = threading.BoundedSemaphore(self.limite_fila)
+        self._lock = threading.Lock()
+        self._pool_processos: Optional[ProcessPoolExecutor] = None
+        self._pool_db: Optional[ThreadPoolExecutor] = None
+
+    def _obter_pool_db(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool_db is None:
+                self._pool_db = ThreadPoolExecutor(
+                    max_workers=self.threads_db,
+                    thread_name_prefix="parse-db"
+                )
+            return self._pool_db
+
+    def _obter_pool_parse(self) -> Executor:
+        # PARSE_PROCESS_POOL_SIZE=0 desativa o pool de processos (parsing roda no pool de threads)
+        if self.processos == 0:
+            return self._obter_pool_db()
+        with self._lock:
+            if self._pool_processos is None:
+                # spawn: os workers não herdam conexões do pool do SQLAlchemy nem locks do processo pai
+                self._pool_processos = ProcessPoolExecutor(
+                    max_workers=self.processos,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_inicializar_worker_parse
+                )
+                logger.info(f"✓ Pool de parsing iniciado ({self.processos} processos, fila máx. {self.limite_fila})")
+            return self._pool_processos
+
+    def _descartar_pool_processos(self, quebrado: Optional[Executor] = None) -> None:
+        """
+        Finaliza o pool de processos atual. Com `quebrado`, só descarta se ele
+        ainda for o pool atual: outra requisição pode já ter recriado o pool, e
+        o novo (saudável) não deve ser encerrado nem ter suas tarefas canceladas.
+        """
+        with self._lock:
+            if quebrado is not None and quebrado is not self._pool_processos:
+                return
+            pool, self._pool_processos = self._pool_processos, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def executar_parse(self, funcao: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Executa a extração CPU-bound no pool de processos e aguarda o resultado.
+        Gera HTTPException 503 se a fila de parsing estiver cheia.
+        """
+        if not self._vagas.acquire(blocking=False):
+            logger.warning(f"⚠️ Fila de parsing cheia ({self.limite_fila}); upload recusado")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Muitos arquivos sendo processados no momento. Tente novamente em alguns segundos.",
+                headers={"Retry-After": "5"}
+            )
+        return await self._executar_com_vaga(funcao, *args, **kwargs)
+
+    async def executar_parse_aguardando(self, funcao: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Igual a executar_parse, mas espera uma vaga na fila em vez de gerar 503.
+        Usado por jobs em segundo plano (ex.: importação de NFs em lote).
+        """
+        while not self._vagas.acquire(blocking=False):
+            await asyncio.sleep(0.5)
+        return await self._executar_com_vaga(funcao, *args, **kwargs)
+
+    async def _executar_com_vaga(self, funcao: Callable[..., Any], *args, **kwargs) -> Any:
+        # A vaga da fila já foi reservada pelo chamador e é liberada aqui
+        pool = None
+        try:
+            loop = asyncio.get_running_loop()
+            pool = self._obter_pool_parse()
+            return await loop.run_in_executor(pool, partial(funcao, *args, **kwargs))
+        except BrokenProcessPool:
+            # Um worker morreu (ex.: PDF que derruba a biblioteca); recria o pool na próxima chamada
+            logger.error("Pool de parsing quebrado; será recriado")
+            self._descartar_pool_processos(pool)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Falha no processo de leitura do arquivo. Tente novamente."
+            )
+        finally:
+            self._vagas.release()
+
+    async def executar_db(self, funcao: Callable[..., Any], *args, **kwargs) -> Any:
+        """Executa trabalho síncrono de banco no pool de threads e aguarda o resultado."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._obter_pool_db(), partial(funcao, *args, **kwargs))
+
+    def encerrar(self) -> None:
+        """Finaliza os pools (shutdown da aplicação)."""
+        self._descartar_pool_processos()
+        with self._lock:
+            pool_db, self._pool_db = self._pool_db, None
+        if pool_db is not None:
+            pool_db.shutdown(wait=True)
+
+
+# Instância global usada pelos routers de upload
+parse_executor = ParseExecutor(
+    processos=settings.PARSE_PROCESS_POOL_SIZE,
+    limite_fila=settings.PARSE_QUEUE_LIMIT,
+    threads_db=settings.PARSE_DB_THREADS
+)
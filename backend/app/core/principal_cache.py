@@ -0,0 +1,32 @@
+"""
+Cache em memória do usuário autenticado (principal) por e-mail do token.
+
+Toda rota autenticada decodificava o JWT e buscava o usuário no banco antes de
+qualquer regra de negócio. Para as rotas que só precisam de id, empresa_id e
+perfil, o principal fica em cache por PRINCIPAL_CACHE_TTL_SEGUNDOS.
+
+O grupo do cache (app/core/cache_versionado.py) é o e-mail: `invalidar` é
+chamado por crud/usuario.py ao criar/alterar usuário (e-mail antigo e novo, na
+troca de e-mail).
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+from app.core.cache_versionado import CacheVersionado
+from app.core.config import settings
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Identidade mínima do usuário autenticado (sem sessão do banco)."""
+    id: int
+    email: str
+    empresa_id: int
+    perfil: Optional[str]
+
+
+# Instância global usada por app/dependencies.py e crud/usuario.py
+principal_cache: CacheVersionado[Principal] = CacheVersionado(
+    ttl_segundos=settings.PRINCIPAL_CACHE_TTL_SEGUNDOS,
+    max_itens=settings.PRINCIPAL_CACHE_MAX_ITENS
+)
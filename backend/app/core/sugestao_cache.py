@@ -0,0 +1,19 @@
+"""
+Cache em memória das sugestões de compra globais baseadas em clientes
+(ClientePurchaseSuggestionService.get_global_purchase_suggestions).
+
+O grupo do cache (app/core/cache_versionado.py) é a empresa e a chave é o
+dias_analise pedido. `invalidar(empresa_id)` é chamado ao alterar as regras de
+sugestão (PUT /admin/regras-sugestao-compra). Novas vendas aparecem no máximo
+após SUGESTAO_CLIENTES_CACHE_TTL_SEGUNDOS.
+"""
+from typing import Any, Dict
+
+from app.core.cache_versionado import CacheVersionado
+from app.core.config import settings
+
+# Instância global usada por ClientePurchaseSuggestionService e routers/admin.py
+sugestao_clientes_cache: CacheVersionado[Dict[str, Any]] = CacheVersionado(
+    ttl_segundos=settings.SUGESTAO_CLIENTES_CACHE_TTL_SEGUNDOS,
+    max_itens=settings.SUGESTAO_CLIENTES_CACHE_MAX_ITENS
+)
@@ -2,10 +2,12 @@
 
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, desc
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
 from typing import List, Dict, Any, Optional
 from ..db import models
 from ..schemas import produto as schemas_produto
+from ..services.demanda_snapshot_service import DemandaSnapshotService
 
 
 def calcular_estoque_minimo_por_demanda(
@@ -42,14 +44,25 @@ def calcular_estoque_minimo_por_demanda(
     # Data limite para análise
     data_limite = datetime.now() - timedelta(days=dias_analise)
     
-    # Busca todas as saídas (vendas) do produto no período
-    saidas = db.query(models.MovimentacaoEstoque).filter(
-        models.MovimentacaoEstoque.produto_id == produto_id,
-        models.MovimentacaoEstoque.tipo_movimentacao == "SAIDA",
-        models.MovimentacaoEstoque.data_movimentacao >= data_limite
-    ).all()
+    # Saídas (vendas) do produto no período, a partir do snapshot diário de demanda
+    resumo = DemandaSnapshotService(db).resumo_por_produto(
+        empresa_id, data_limite.date(), [produto_id]
+    )
     
-    if not saidas:
+    return _analisar_estoque_minimo(
+        produto, resumo.get(produto_id), dias_analise, dias_lead_time, margem_seguranca
+    )
+
+
+def _analisar_estoque_minimo(
+    produto: models.Produto,
+    demanda: Optional[Dict[str, Any]],
+    dias_analise: int,
+    dias_lead_time: int,
+    margem_seguranca: float
+) -> Dict[str, Any]:
+    """Monta a análise de estoque mínimo de um produto a partir do resumo de demanda."""
+    if not demanda or demanda['numero_vendas'] == 0:
         return {
             "produto_nome": produto.nome,
             "estoque_atual": produto.quantidade_em_estoque,
@@ -62,21 +75,10 @@ def calcular_estoque_minimo_por_demanda(
         }
     
     # Calcula estatísticas de demanda
-    total_vendido = sum(saida.quantidade for saida in saidas)
+    total_vendido = demanda['total_saida']
     demanda_media_diaria = total_vendido / dias_analise
-    
-    # Agrupa vendas por dia para calcular variabilidade
-    vendas_por_dia = {}
-    for saida in saidas:
-        data_str = saida.data_movimentacao.date().isoformat()
-        if data_str not in vendas_por_dia:
-            vendas_por_dia[data_str] = 0
-        vendas_por_dia[data_str] += saida.quantidade
-    
-    dias_com_vendas = len(vendas_por_dia)
-    
-    # Calcula demanda máxima diária
-    demanda_maxima_diaria = max(vendas_por_dia.values()) if vendas_por_dia else 0
+    dias_com_vendas = demanda['dias_com_vendas']
+    demanda_maxima_diaria = demanda['demanda_maxima_diaria']
     
     # Fórmula do estoque mínimo: (Demanda média diária * Lead time) * Margem de segurança
     estoque_minimo_calculado = (demanda_media_diaria * dias_lead_time) * margem_seguranca
@@ -118,14 +120,19 @@ def analisar_todos_produtos_estoque_minimo(
         models.Produto.empresa_id == empresa_id
     ).all()
     
+    # Demanda de todos os produtos com uma única leitura do snapshot
+    data_limite = datetime.now() - timedelta(days=dias_analise)
+    resumo = DemandaSnapshotService(db).resumo_por_produto(empresa_id, data_limite.date())
+    
     resultados = []
     
     for produto in produtos:
-        analise = calcular_estoque_minimo_por_demanda(
-            db=db,
-            produto_id=produto.id,
-            empresa_id=empresa_id,
-            dias_analise=dias_analise
+        analise = _analisar_estoque_minimo(
+            produto,
+            resumo.get(produto.id),
+            dias_analise,
+            dias_lead_time=7,
+            margem_seguranca=1.2
         )
         resultados.append(analise)
     
@@ -150,30 +157,32 @@ def obter_produtos_alta_rotatividade(
     
     data_limite = datetime.now() - timedelta(days=dias)
     
-    # Query para somar as saídas por produto
-    resultado = db.query(
-        models.Produto.id,
-        models.Produto.nome,
-        models.Produto.codigo,
-        models.Produto.quantidade_em_estoque,
-        models.Produto.estoque_minimo,
-        func.sum(models.MovimentacaoEstoque.quantidade).label('total_vendido')
-    ).join(
-        models.MovimentacaoEstoque,
-        models.Produto.id == models.MovimentacaoEstoque.produto_id
-    ).filter(
-        models.Produto.empresa_id == empresa_id,
-        models.MovimentacaoEstoque.tipo_movimentacao == "SAIDA",
-        models.MovimentacaoEstoque.data_movimentacao >= data_limite
-    ).group_by(
-        models.Produto.id,
-        models.Produto.nome,
-        models.Produto.codigo,
-        models.Produto.quantidade_em_estoque,
-        models.Produto.estoque_minimo
-    ).order_by(
-        desc('total_vendido')
-    ).limit(limite).all()
+    # Soma das saídas por produto a partir do snapshot diário de demanda
+    resumo = DemandaSnapshotService(db).resumo_por_produto(empresa_id, data_limite.date())
+    mais_vendidos = sorted(
+        ((produto_id, dados['total_saida']) for produto_id, dados in resumo.items() if dados['numero_vendas'] > 0),
+        key=lambda item: item[1],
+        reverse=True
+    )[:limite]
+    
+    produtos = {
+        p.id: p for p in db.query(models.Produto).filter(
+            models.Produto.id.in_([produto_id for produto_id, _ in mais_vendidos])
+        ).all()
+    } if mais_vendidos else {}
+    
+    resultado = [
+        SimpleNamespace(
+            id=produto_id,
+            nome=produtos[produto_id].nome,
+            codigo=produtos[produto_id].codigo,
+            quantidade_em_estoque=produtos[produto_id].quantidade_em_estoque,
+            estoque_minimo=produtos[produto_id].estoque_minimo,
+            total_vendido=total_vendido
+        )
+        for produto_id, total_vendido in mais_vendidos
+        if produto_id in produtos
+    ]
     
     produtos_alta_rotatividade = []
     
@@ -206,35 +215,38 @@ def obter_produtos_sem_movimento(
     """
     
     data_limite = datetime.now() - timedelta(days=dias)
+    snapshot = DemandaSnapshotService(db)
     
-    # Subquery para produtos com movimento no período
-    produtos_com_movimento = db.query(
-        models.MovimentacaoEstoque.produto_id
-    ).filter(
-        models.MovimentacaoEstoque.tipo_movimentacao == "SAIDA",
-        models.MovimentacaoEstoque.data_movimentacao >= data_limite
-    ).subquery()
+    # Produtos com vendas no período (snapshot diário de demanda)
+    resumo = snapshot.resumo_por_produto(empresa_id, data_limite.date())
+    produtos_com_movimento = {
+        produto_id for produto_id, dados in resumo.items() if dados['numero_vendas'] > 0
+    }
     
     # Produtos sem movimento
-    produtos_sem_movimento = db.query(models.Produto).filter(
-        models.Produto.empresa_id == empresa_id,
-        ~models.Produto.id.in_(produtos_com_movimento)
-    ).all()
+    produtos_sem_movimento = [
+        produto for produto in db.query(models.Produto).filter(
+            models.Produto.empresa_id == empresa_id
+        ).all()
+        if produto.id not in produtos_com_movimento
+    ]
+    
+    # Dia da última saída de cada produto, em uma única leitura
+    ultimas_saidas = snapshot.ultima_movimentacao_por_produto(
+        empresa_id,
+        somente_saidas=True,
+        produto_ids=[produto.id for produto in produtos_sem_movimento]
+    ) if produtos_sem_movimento else {}
     
     resultado = []
+    hoje = date.today()
     
     for produto in produtos_sem_movimento:
-        # Busca a última movimentação de saída
-        ultima_saida = db.query(models.MovimentacaoEstoque).filter(
-            models.MovimentacaoEstoque.produto_id == produto.id,
-            models.MovimentacaoEstoque.tipo_movimentacao == "SAIDA"
-        ).order_by(
-            desc(models.MovimentacaoEstoque.data_movimentacao)
-        ).first()
+        ultima_saida = ultimas_saidas.get(produto.id)
         
         dias_sem_movimento = None
         if ultima_saida:
-            dias_sem_movimento = (datetime.now() - ultima_saida.data_movimentacao).days
+            dias_sem_movimento = (hoje - ultima_saida).days
         
         resultado.append({
             "produto_id": produto.id,
@@ -243,7 +255,7 @@ def obter_produtos_sem_movimento(
             "estoque_atual": produto.quantidade_em_estoque,
             "valor_estoque": produto.quantidade_em_estoque * (produto.preco_custo or 0),
             "dias_sem_movimento": dias_sem_movimento,
-            "ultima_venda": ultima_saida.data_movimentacao.isoformat() if ultima_saida else None
+            "ultima_venda": ultima_saida.isoformat() if ultima_saida else None
         })
     
     # Ordena por valor de estoque (maior primeiro)
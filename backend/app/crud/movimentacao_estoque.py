@@ -1,9 +1,9 @@
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import text, inspect
+from sqlalchemy import text
 from fastapi import HTTPException, status
 from ..schemas import movimentacao_estoque as schemas_movimentacao
 from ..db import models
-from ..db.connection import engine
+from ..db.schema_capabilities import schema_capabilities
 from datetime import datetime, timedelta
 from typing import List, Optional
 from ..services.stock_service import StockService
@@ -17,6 +17,8 @@ def create_movimentacao_estoque(db: Session, movimentacao: schemas_movimentacao.
     origem = getattr(movimentacao, 'origem', None)
     motivo_movimentacao = getattr(movimentacao, 'motivo_movimentacao', None)
     observacao_motivo = getattr(movimentacao, 'observacao_motivo', None)
+    nota_fiscal = getattr(movimentacao, 'nota_fiscal', None)
+    chave_acesso = getattr(movimentacao, 'chave_acesso', None)
     
     produto_atualizado = StockService.update_stock_transactionally(
         db=db,
@@ -28,7 +30,9 @@ def create_movimentacao_estoque(db: Session, movimentacao: schemas_movimentacao.
         origem=origem,
         observacao=movimentacao.observacao,
         motivo_movimentacao=motivo_movimentacao,
-        observacao_motivo=observacao_motivo
+        observacao_motivo=observacao_motivo,
+        nota_fiscal=nota_fiscal,
+        chave_acesso=chave_acesso
     )
     
     return produto_atualizado
@@ -49,14 +53,8 @@ def get_movimentacoes_by_produto_id(db: Session, produto_id: int, empresa_id: in
 def get_recent_movimentacoes(db: Session, empresa_id: int, days: int = 30):
     data_limite = datetime.now() - timedelta(days=days)
     
-    # Verificar se as colunas de reversão existem
-    try:
-        inspector = inspect(engine)
-        columns = [col['name'] for col in inspector.get_columns('movimentacoes_estoque')]
-        colunas_reversao_existem = 'reversao_de_id' in columns
-    except Exception as e:
-        logger.warning(f"⚠️ Erro ao verificar colunas: {e}. Assumindo que não existem.")
-        colunas_reversao_existem = False
+    # Verificar se as colunas de reversão existem (registro carregado no startup)
+    colunas_reversao_existem = schema_capabilities.colunas_reversao_existem
     
     # Se as colunas não existem, usar query SQL direta
     if not colunas_reversao_existem:
@@ -13,6 +13,8 @@ from app.core.exceptions import BusinessRuleException, NotFoundError, OrcamentoS
 from app.core.constants import OrcamentoStatus, OrigemMovimentacao, TipoMovimentacao
 from app.core.logger import orcamento_logger
 from app.services.historico_vendas_service import HistoricoVendasService
+from app.services.vendas_mensais_service import VendasMensaisService
+from app.services.vendas_unificadas_service import VendasUnificadasService
 from app.crud import produto as crud_produto
 
 def create_orcamento(db: Session, orcamento_in: schemas_orcamento.OrcamentoCreate, vendedor_id: int, empresa_id: int) -> models.Orcamento:
@@ -539,11 +541,12 @@ def _salvar_historico_vendas(
     """
     try:
         historico_service = HistoricoVendasService(db)
+        historicos = []
         
         for item in orcamento.itens:
             valor_total = item.quantidade * item.preco_unitario_congelado
             
-            historico_service.salvar_historico_venda(
+            historico = historico_service.salvar_historico_venda(
                 vendedor_id=usuario_id,
                 cliente_id=orcamento.cliente_id,
                 produto_id=item.produto_id,
@@ -554,6 +557,10 @@ def _salvar_historico_vendas(
                 valor_total=valor_total,
                 data_venda=orcamento.data_criacao
             )
+            historicos.append(historico)
+        
+        # Read model de vendas a clientes (ignora orçamentos que já têm NF)
+        VendasUnificadasService(db).registrar_historicos_venda(historicos)
         
         # Não faz commit aqui - será feito no final junto com as outras operações
         db.flush()
@@ -651,6 +658,9 @@ def confirmar_orcamento(
         # 4. Atualizar status para FINALIZADO
         _atualizar_status_finalizado(db, orcamento)
         
+        # 4.5. Somar as vendas lançadas ao cubo mensal de vendas
+        VendasMensaisService(db).atualizar_apos_lancamento()
+        
         # 5. Retornar orçamento atualizado
         orcamento_atualizado = get_orcamento_by_id(db, orcamento_id)
         
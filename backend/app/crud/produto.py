@@ -1,12 +1,64 @@
 # backend/app/crud/produto.py
 
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
 from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, List, Set
 import time
 import uuid
 from ..schemas import produto as schemas_produto
 from ..db import models
 
+
+def _sincronizar_indice_similaridade(db_produto: models.Produto):
+    """Atualiza o índice de similaridade de produtos após criação/alteração."""
+    # Import local para evitar import circular (o serviço importa este módulo)
+    from ..services.product_similarity import product_similarity_service
+    product_similarity_service.atualizar_produto(db_produto)
+
+
+_INDICE_PENDENTES = 'produtos_indice_similaridade_pendentes'
+
+
+def _aplicar_indice_pendentes(session: Session):
+    from ..services.product_similarity import product_similarity_service
+    for produto in session.info.pop(_INDICE_PENDENTES, {}).values():
+        product_similarity_service.atualizar_produto(produto)
+
+
+def _descartar_indice_pendentes(session: Session):
+    session.info.pop(_INDICE_PENDENTES, None)
+
+
+def _sincronizar_indice_apos_commit(db: Session, db_produto: models.Produto):
+    """
+    Agenda a atualização do índice de similaridade para depois do commit da
+    transação do chamador; se ela for desfeita, o produto não entra no índice.
+    """
+    if not event.contains(db, 'after_commit', _aplicar_indice_pendentes):
+        event.listen(db, 'after_commit', _aplicar_indice_pendentes)
+        event.listen(db, 'after_rollback', _descartar_indice_pendentes)
+    # Cópia dos campos indexados: após o commit os atributos do objeto expiram
+    db.info.setdefault(_INDICE_PENDENTES, {})[db_produto.id] = SimpleNamespace(
+        id=db_produto.id,
+        empresa_id=db_produto.empresa_id,
+        nome=db_produto.nome,
+        codigo=db_produto.codigo,
+        categoria=db_produto.categoria,
+        unidade_medida=db_produto.unidade_medida,
+        preco_venda=db_produto.preco_venda,
+        descricao=db_produto.descricao
+    )
+
+
+def _remover_do_indice_similaridade(produto_id: int, empresa_id: int):
+    """Remove um produto excluído do índice de similaridade de produtos."""
+    from ..services.product_similarity import product_similarity_service
+    product_similarity_service.remover_produto(produto_id, empresa_id)
+
+
 def get_produtos(db: Session, empresa_id: int):
     """Busca todos os produtos de uma empresa."""
     return db.query(models.Produto).filter(models.Produto.empresa_id == empresa_id).all()
@@ -27,6 +79,7 @@ def create_produto(db: Session, produto: schemas_produto.ProdutoCreate, empresa_
     db.add(db_produto)
     db.commit()
     db.refresh(db_produto)
+    _sincronizar_indice_similaridade(db_produto)
     return db_produto
 
 # --- NOVA FUNÇÃO DE UPDATE ---
@@ -47,6 +100,7 @@ def update_produto(db: Session, produto_id: int, produto_data: schemas_produto.P
 
     db.commit()
     db.refresh(db_produto)
+    _sincronizar_indice_similaridade(db_produto)
     return db_produto
 
 # --- NOVA FUNÇÃO DE DELETE ---
@@ -76,6 +130,7 @@ def delete_produto(db: Session, produto_id: int, empresa_id: int):
 
     db.delete(db_produto)
     db.commit()
+    _remover_do_indice_similaridade(produto_id, empresa_id)
     return db_produto
 
 
@@ -91,6 +146,7 @@ def update_produto_by_nome(db: Session, nome: str, estoque: int, data_validade,
 
     db.commit()
     db.refresh(produto)
+    _sincronizar_indice_similaridade(produto)
     return produto
 
 def create_or_update_produto(db: Session, produto_data: schemas_produto.ProdutoCreate, empresa_id: int):
@@ -128,8 +184,48 @@ def create_or_update_produto(db: Session, produto_data: schemas_produto.ProdutoC
 
     db.commit()
     db.refresh(db_produto)
+    _sincronizar_indice_similaridade(db_produto)
     return db_produto
 
+def upsert_produtos_em_lote(db: Session, registros: List[Dict[str, Any]], empresa_id: int) -> Set[str]:
+    """
+    Cria/atualiza vários produtos com um único INSERT ... ON CONFLICT (codigo) DO UPDATE
+    (mesmo efeito de create_or_update_produto para cada registro) e faz commit.
+
+    O código é único na tabela inteira: um código que já pertence a outra empresa
+    não é alterado e fica fora do retorno.
+
+    Args:
+        registros: dicionários com as colunas de ProdutoCreate (códigos sem repetição)
+
+    Returns:
+        Códigos gravados
+    """
+    if not registros:
+        return set()
+
+    tabela = models.Produto.__table__
+    stmt = pg_insert(tabela).values([{**registro, "empresa_id": empresa_id} for registro in registros])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[tabela.c.codigo],
+        set_={coluna: stmt.excluded[coluna] for coluna in registros[0] if coluna != "codigo"},
+        where=tabela.c.empresa_id == stmt.excluded.empresa_id
+    ).returning(
+        tabela.c.id, tabela.c.nome, tabela.c.codigo, tabela.c.categoria,
+        tabela.c.unidade_medida, tabela.c.preco_venda, tabela.c.descricao, tabela.c.empresa_id
+    )
+
+    try:
+        gravados = db.execute(stmt).all()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    for produto in gravados:
+        _sincronizar_indice_similaridade(produto)
+    return {produto.codigo for produto in gravados}
+
 def criar_produto_personalizado(
     db: Session,
     nome: str,
@@ -184,4 +280,5 @@ def criar_produto_personalizado(
     db.add(db_produto)
     db.flush()  # Usa flush em vez de commit para manter transação
     db.refresh(db_produto)
+    _sincronizar_indice_apos_commit(db, db_produto)
     return db_produto
\ No newline at end of file
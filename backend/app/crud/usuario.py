@@ -6,6 +6,7 @@ from app.schemas import usuario as schemas_usuario
 
 # Importa as funções de segurança necessárias do local correto.
 from app.core.hashing import get_password_hash, verify_password
+from app.core.principal_cache import principal_cache
 
 def get_user_by_email(db: Session, email: str) -> models.Usuario | None:
     """Busca um usuário pelo e-mail."""
@@ -26,6 +27,7 @@ def create_user(db: Session, user_in: schemas_usuario.UsuarioCreate, empresa_id:
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    principal_cache.invalidar(db_user.email)
     return db_user
 
 def authenticate_user(db: Session, email: str, password: str) -> models.Usuario | None:
@@ -71,6 +73,8 @@ def update_user_profile(
         if existing_user and existing_user.id != user_id:
             raise ValueError("E-mail já está em uso por outro usuário")
     
+    email_anterior = user.email
+
     # Atualizar campos fornecidos
     if user_update.nome is not None:
         user.nome = user_update.nome
@@ -81,6 +85,8 @@ def update_user_profile(
     
     db.commit()
     db.refresh(user)
+    # O token antigo (sub = e-mail anterior) não pode continuar resolvendo pelo cache
+    principal_cache.invalidar(email_anterior, user.email)
     return user
 
 def update_user_password(
@@ -104,4 +110,5 @@ def update_user_password(
     user.hashed_password = get_password_hash(nova_senha)
     db.commit()
     db.refresh(user)
+    principal_cache.invalidar(user.email)
     return user
\ No newline at end of file
@@ -281,8 +281,469 @@ def create_regras_sugestao_compra_table():
         logger.error(f"Erro ao criar tabela regras_sugestao_compra: {e}")
 
 
+def create_estatisticas_preco_produto_table():
+    """
+    Cria a tabela estatisticas_preco_produto se não existir e a popula a partir
+    de historico_preco_produto (mesmo cálculo de `manage.py rebuild-price-stats`).
+    """
+    try:
+        with engine.connect() as connection:
+            result = connection.execute(text("""
+                SELECT EXISTS (
+                    SELECT FROM information_schema.tables
+                    WHERE table_schema = 'public' AND table_name = 'estatisticas_preco_produto'
+                );
+            """))
+            if result.scalar():
+                logger.info("✓ Tabela estatisticas_preco_produto já existe")
+                return
+            logger.info("Criando tabela estatisticas_preco_produto...")
+            connection.execute(text("""
+                CREATE TABLE estatisticas_preco_produto (
+                    produto_id INTEGER NOT NULL REFERENCES produtos(id),
+                    empresa_id INTEGER NOT NULL REFERENCES empresas(id),
+                    preco_maior DOUBLE PRECISION NOT NULL,
+                    preco_menor DOUBLE PRECISION NOT NULL,
+                    soma_precos DOUBLE PRECISION NOT NULL DEFAULT 0,
+                    total_vendas INTEGER NOT NULL DEFAULT 0,
+                    atualizado_em TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (produto_id, empresa_id)
+                );
+            """))
+            connection.execute(text("""
+                INSERT INTO estatisticas_preco_produto
+                    (produto_id, empresa_id, preco_maior, preco_menor, soma_precos, total_vendas)
+                SELECT produto_id, empresa_id, MAX(preco_unitario), MIN(preco_unitario),
+                       SUM(preco_unitario), COUNT(id)
+                FROM historico_preco_produto
+                GROUP BY produto_id, empresa_id;
+            """))
+            connection.commit()
+            logger.info("✓ Tabela estatisticas_preco_produto criada e populada com sucesso!")
+    except Exception as e:
+        logger.error(f"Erro ao criar tabela estatisticas_preco_produto: {e}")
+
+
+def create_registros_processados_incremental_table():
+    """
+    Cria a tabela com os ids já somados pelos jobs incrementais acima da posição
+    de cada um (snapshot de demanda e cubo mensal de vendas).
+    """
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("""
+                CREATE TABLE IF NOT EXISTS registros_processados_incremental (
+                    consumidor VARCHAR(50) NOT NULL,
+                    registro_id INTEGER NOT NULL,
+                    processado_em TIMESTAMP WITH TIME ZONE NOT NULL,
+                    PRIMARY KEY (consumidor, registro_id)
+                );
+            """))
+            connection.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_registros_processados_consumidor_data
+                ON registros_processados_incremental(consumidor, processado_em);
+            """))
+            connection.commit()
+            logger.info("✓ Tabela registros_processados_incremental verificada/criada")
+    except Exception as e:
+        logger.error(f"Erro ao criar tabela registros_processados_incremental: {e}")
+
+
+def create_demanda_snapshot_tables():
+    """
+    Cria as tabelas do snapshot diário de demanda se não existirem.
+    O preenchimento é feito pelo job (`manage.py refresh-demand-snapshot`);
+    enquanto ele não roda, as consultas leem direto de movimentacoes_estoque.
+    """
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("""
+                CREATE TABLE IF NOT EXISTS demanda_diaria_produto (
+                    produto_id INTEGER NOT NULL REFERENCES produtos(id),
+                    data DATE NOT NULL,
+                    empresa_id INTEGER NOT NULL REFERENCES empresas(id),
+                    quantidade_saida DOUBLE PRECISION NOT NULL DEFAULT 0,
+                    quantidade_entrada DOUBLE PRECISION NOT NULL DEFAULT 0,
+                    quantidade_entrada_compra DOUBLE PRECISION NOT NULL DEFAULT 0,
+                    numero_vendas INTEGER NOT NULL DEFAULT 0,
+                    maior_saida DOUBLE PRECISION NOT NULL DEFAULT 0,
+                    soma_quadrados_saida DOUBLE PRECISION NOT NULL DEFAULT 0,
+                    PRIMARY KEY (produto_id, data)
+                );
+            """))
+            connection.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_demanda_diaria_empresa_data
+                ON demanda_diaria_produto(empresa_id, data);
+            """))
+            connection.execute(text("""
+                CREATE TABLE IF NOT EXISTS demanda_snapshot_controle (
+                    id INTEGER PRIMARY KEY,
+                    ultima_movimentacao_id INTEGER NOT NULL DEFAULT 0,
+                    atualizado_em TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                );
+            """))
+            connection.commit()
+            logger.info("✓ Tabelas do snapshot de demanda verificadas/criadas")
+    except Exception as e:
+        logger.error(f"Erro ao criar tabelas do snapshot de demanda: {e}")
+
+
+def create_vendas_unificadas_table():
+    """
+    Cria a tabela vendas_unificadas se não existir e a popula a partir de
+    historico_preco_produto (NF-e) e historico_vendas_cliente (orçamentos sem NF),
+    o mesmo cálculo de `manage.py rebuild-unified-sales`.
+    """
+    try:
+        with engine.connect() as connection:
+            result = connection.execute(text("""
+                SELECT EXISTS (
+                    SELECT FROM information_schema.tables
+                    WHERE table_schema = 'public' AND table_name = 'vendas_unificadas'
+                );
+            """))
+            if result.scalar():
+                logger.info("✓ Tabela vendas_unificadas já existe")
+                return
+            logger.info("Criando tabela vendas_unificadas...")
+            connection.execute(text("""
+                CREATE TABLE vendas_unificadas (
+                    id SERIAL PRIMARY KEY,
+                    empresa_id INTEGER NOT NULL REFERENCES empresas(id),
+                    cliente_id INTEGER NOT NULL REFERENCES clientes(id),
+                    produto_id INTEGER NOT NULL REFERENCES produtos(id),
+                    vendedor_id INTEGER REFERENCES usuarios(id),
+                    origem VARCHAR(20) NOT NULL,
+                    nota_fiscal VARCHAR,
+                    orcamento_id INTEGER REFERENCES orcamentos(id),
+                    historico_preco_id INTEGER REFERENCES historico_preco_produto(id),
+                    historico_venda_id INTEGER REFERENCES historico_vendas_cliente(id),
+                    quantidade DOUBLE PRECISION NOT NULL,
+                    preco_unitario DOUBLE PRECISION NOT NULL,
+                    valor_total DOUBLE PRECISION NOT NULL,
+                    data_venda TIMESTAMP WITH TIME ZONE NOT NULL
+                );
+            """))
+            connection.execute(text("""
+                CREATE INDEX idx_vendas_unificadas_empresa_data
+                ON vendas_unificadas(empresa_id, data_venda);
+            """))
+            connection.execute(text("""
+                CREATE INDEX idx_vendas_unificadas_empresa_cliente_data
+                ON vendas_unificadas(empresa_id, cliente_id, data_venda);
+            """))
+            connection.execute(text("""
+                CREATE INDEX idx_vendas_unificadas_orcamento
+                ON vendas_unificadas(orcamento_id);
+            """))
+            connection.execute(text("""
+                INSERT INTO vendas_unificadas
+                    (empresa_id, cliente_id, produto_id, vendedor_id, origem, nota_fiscal, orcamento_id,
+                     historico_preco_id, historico_venda_id, quantidade, preco_unitario, valor_total, data_venda)
+                SELECT hp.empresa_id, hp.cliente_id, hp.produto_id, NULL, 'NF', hp.nota_fiscal, NULL,
+                       hp.id, NULL, hp.quantidade, hp.preco_unitario, hp.valor_total, hp.data_venda
+                FROM historico_preco_produto hp
+                WHERE hp.nota_fiscal IS NOT NULL AND hp.cliente_id IS NOT NULL AND hp.data_venda IS NOT NULL
+                UNION ALL
+                SELECT hvc.empresa_id, hvc.cliente_id, hvc.produto_id, hvc.vendedor_id, 'ORCAMENTO', NULL, hvc.orcamento_id,
+                       NULL, hvc.id, hvc.quantidade_vendida, hvc.preco_unitario_vendido, hvc.valor_total, hvc.data_venda
+                FROM historico_vendas_cliente hvc
+                JOIN orcamentos o ON o.id = hvc.orcamento_id
+                WHERE o.numero_nf IS NULL OR o.numero_nf = '';
+            """))
+            connection.commit()
+            logger.info("✓ Tabela vendas_unificadas criada e populada com sucesso!")
+    except Exception as e:
+        logger.error(f"Erro ao criar tabela vendas_unificadas: {e}")
+
+
+def create_vendas_mensais_tables():
+    """
+    Cria as tabelas do cubo mensal de vendas se não existirem.
+    O preenchimento é feito nos lançamentos e pelo job (`manage.py refresh-sales-cube`);
+    enquanto ele não roda, as consultas leem direto das tabelas de origem.
+    """
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("""
+                CREATE TABLE IF NOT EXISTS vendas_mensais (
+                    empresa_id INTEGER NOT NULL REFERENCES empresas(id),
+                    ano INTEGER NOT NULL,
+                    mes INTEGER NOT NULL,
+                    fonte VARCHAR(20) NOT NULL,
+                    produto_id INTEGER NOT NULL,
+                    vendedor_id INTEGER NOT NULL DEFAULT 0,
+                    cliente_id INTEGER NOT NULL DEFAULT 0,
+                    quantidade DOUBLE PRECISION NOT NULL DEFAULT 0,
+                    valor DOUBLE PRECISION NOT NULL DEFAULT 0,
+                    numero_registros INTEGER NOT NULL DEFAULT 0,
+                    dias_com_venda INTEGER NOT NULL DEFAULT 0,
+                    ultima_venda TIMESTAMP WITH TIME ZONE,
+                    PRIMARY KEY (empresa_id, ano, mes, fonte, produto_id, vendedor_id, cliente_id)
+                );
+            """))
+            connection.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_vendas_mensais_empresa_fonte_periodo
+                ON vendas_mensais(empresa_id, fonte, ano, mes);
+            """))
+            connection.execute(text("""
+                CREATE TABLE IF NOT EXISTS vendas_mensais_controle (
+                    id INTEGER PRIMARY KEY,
+                    ultima_movimentacao_id INTEGER NOT NULL DEFAULT 0,
+                    ultima_venda_unificada_id INTEGER NOT NULL DEFAULT 0,
+                    atualizado_em TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                );
+            """))
+            connection.commit()
+            logger.info("✓ Tabelas do cubo mensal de vendas verificadas/criadas")
+    except Exception as e:
+        logger.error(f"Erro ao criar tabelas do cubo mensal de vendas: {e}")
+
+
+def create_importacao_nf_lote_tables():
+    """Cria as tabelas dos jobs de importação de NFs em lote se não existirem."""
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("""
+                CREATE TABLE IF NOT EXISTS importacoes_nf_lote (
+                    id SERIAL PRIMARY KEY,
+                    empresa_id INTEGER NOT NULL REFERENCES empresas(id),
+                    usuario_id INTEGER NOT NULL REFERENCES usuarios(id),
+                    tipo_movimentacao VARCHAR(10),
+                    status VARCHAR(20) NOT NULL DEFAULT 'PENDENTE',
+                    total_arquivos INTEGER NOT NULL DEFAULT 0,
+                    arquivos_concluidos INTEGER NOT NULL DEFAULT 0,
+                    arquivos_com_erro INTEGER NOT NULL DEFAULT 0,
+                    arquivos_duplicados INTEGER NOT NULL DEFAULT 0,
+                    data_criacao TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    data_inicio TIMESTAMP WITH TIME ZONE,
+                    data_conclusao TIMESTAMP WITH TIME ZONE
+                );
+            """))
+            connection.execute(text("""
+                ALTER TABLE importacoes_nf_lote ADD COLUMN IF NOT EXISTS processado_por VARCHAR(100);
+            """))
+            connection.execute(text("""
+                ALTER TABLE importacoes_nf_lote ADD COLUMN IF NOT EXISTS heartbeat_em TIMESTAMP WITH TIME ZONE;
+            """))
+            connection.execute(text("""
+                ALTER TABLE importacoes_nf_lote ADD COLUMN IF NOT EXISTS diretorio VARCHAR;
+            """))
+            connection.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_importacao_lote_empresa_data
+                ON importacoes_nf_lote(empresa_id, data_criacao);
+            """))
+            connection.execute(text("""
+                CREATE TABLE IF NOT EXISTS importacoes_nf_arquivo (
+                    id SERIAL PRIMARY KEY,
+                    lote_id INTEGER NOT NULL REFERENCES importacoes_nf_lote(id) ON DELETE CASCADE,
+                    nome_arquivo VARCHAR NOT NULL,
+                    tipo_arquivo VARCHAR(3) NOT NULL,
+                    hash_arquivo VARCHAR(64) NOT NULL,
+                    status VARCHAR(20) NOT NULL DEFAULT 'PENDENTE',
+                    nota_fiscal VARCHAR(50),
+                    preview JSON,
+                    erro VARCHAR,
+                    data_processamento TIMESTAMP WITH TIME ZONE
+                );
+            """))
+            connection.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_importacao_arquivo_lote
+                ON importacoes_nf_arquivo(lote_id, id);
+            """))
+            connection.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_importacao_arquivo_hash
+                ON importacoes_nf_arquivo(hash_arquivo);
+            """))
+            connection.commit()
+            logger.info("✓ Tabelas de importação de NFs em lote verificadas/criadas")
+    except Exception as e:
+        logger.error(f"Erro ao criar tabelas de importação de NFs em lote: {e}")
+
+
+def create_movimentacoes_indexes():
+    """Cria índices de consulta em movimentacoes_estoque se não existirem."""
+    try:
+        with engine.connect() as connection:
+            # Keyset (data_movimentacao, id) usado na paginação do histórico geral
+            connection.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_movimentacao_data_id
+                ON movimentacoes_estoque(data_movimentacao, id);
+            """))
+            connection.commit()
+            logger.info("✓ Índices de movimentacoes_estoque verificados/criados")
+    except Exception as e:
+        logger.error(f"Erro ao criar índices de movimentacoes_estoque: {e}")
+
+
+def create_preenchimentos_concluidos_table():
+    """
+    Cria a tabela que registra os preenchimentos de dados (backfills) de startup
+    concluídos, para que um preenchimento interrompido seja retomado no próximo startup.
+    """
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("""
+                CREATE TABLE IF NOT EXISTS preenchimentos_concluidos (
+                    nome VARCHAR(100) PRIMARY KEY,
+                    concluido_em TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                );
+            """))
+            connection.commit()
+    except Exception as e:
+        logger.error(f"Erro ao criar tabela preenchimentos_concluidos: {e}")
+
+
+def _preenchimento_concluido(nome: str) -> bool:
+    with engine.connect() as connection:
+        return connection.execute(
+            text("SELECT EXISTS (SELECT 1 FROM preenchimentos_concluidos WHERE nome = :nome)"),
+            {'nome': nome}
+        ).scalar()
+
+
+def _marcar_preenchimento_concluido(nome: str) -> None:
+    with engine.connect() as connection:
+        connection.execute(
+            text("INSERT INTO preenchimentos_concluidos (nome) VALUES (:nome) ON CONFLICT (nome) DO NOTHING"),
+            {'nome': nome}
+        )
+        connection.commit()
+
+
+def create_movimentacoes_nota_fiscal_columns():
+    """
+    Adiciona nota_fiscal/chave_acesso em movimentacoes_estoque (com índices) se
+    não existirem e preenche as movimentações antigas a partir de observacao
+    (mesmo cálculo de `manage.py backfill-movement-nf`). O preenchimento só é
+    marcado como concluído ao terminar; se falhar, é retomado no próximo startup.
+    """
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("ALTER TABLE movimentacoes_estoque ADD COLUMN IF NOT EXISTS nota_fiscal VARCHAR(50);"))
+            connection.execute(text("ALTER TABLE movimentacoes_estoque ADD COLUMN IF NOT EXISTS chave_acesso VARCHAR(44);"))
+            connection.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_movimentacao_nota_fiscal
+                ON movimentacoes_estoque(nota_fiscal, tipo_movimentacao, data_movimentacao);
+            """))
+            connection.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_movimentacao_chave_acesso
+                ON movimentacoes_estoque(chave_acesso);
+            """))
+            connection.commit()
+            logger.info("✓ Colunas nota_fiscal/chave_acesso de movimentacoes_estoque verificadas/criadas")
+
+        if not _preenchimento_concluido('movimentacoes_nota_fiscal'):
+            from app.db.connection import SessionLocal
+            from app.services.stock_service import StockService
+
+            db = SessionLocal()
+            try:
+                total = StockService.preencher_nota_fiscal_movimentacoes(db)
+                logger.info(f"✓ nota_fiscal preenchida em {total} movimentações existentes")
+            finally:
+                db.close()
+            _marcar_preenchimento_concluido('movimentacoes_nota_fiscal')
+    except Exception as e:
+        logger.error(f"Erro ao criar/preencher colunas de nota fiscal em movimentacoes_estoque: {e}")
+
+
+def create_movimentacoes_canal_column():
+    """
+    Adiciona movimentacoes_estoque.canal (com índices das análises de vendas) se
+    não existir e classifica pela observação as movimentações ainda sem canal
+    (mesmo cálculo de `manage.py backfill-movement-canal`). Roda em todo startup
+    em que restarem linhas com canal NULL: elas ficariam fora das análises de vendas.
+    """
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("ALTER TABLE movimentacoes_estoque ADD COLUMN IF NOT EXISTS canal VARCHAR(30);"))
+            # Índice parcial (vazio após o preenchimento) para a verificação abaixo e os lotes do UPDATE
+            connection.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_movimentacao_canal_nulo
+                ON movimentacoes_estoque(id) WHERE canal IS NULL;
+            """))
+            connection.commit()
+            sem_canal = connection.execute(text(
+                "SELECT EXISTS (SELECT 1 FROM movimentacoes_estoque WHERE canal IS NULL)"
+            )).scalar()
+
+        if sem_canal:
+            from app.db.connection import SessionLocal
+            from app.services.stock_service import StockService
+
+            db = SessionLocal()
+            try:
+                total = StockService.preencher_canal_movimentacoes(db)
+                logger.info(f"✓ canal preenchido em {total} movimentações existentes")
+            finally:
+                db.close()
+
+        # Índices criados depois do preenchimento (o UPDATE em massa não precisa mantê-los)
+        with engine.connect() as connection:
+            connection.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_movimentacao_produto_tipo_canal_data
+                ON movimentacoes_estoque(produto_id, tipo_movimentacao, canal, data_movimentacao);
+            """))
+            connection.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_movimentacao_vendas_canal_data
+                ON movimentacoes_estoque(data_movimentacao, produto_id)
+                WHERE tipo_movimentacao = 'SAIDA' AND canal IN ('VENDA_VENDEDOR', 'IMPORTACAO_NF');
+            """))
+            connection.commit()
+            logger.info("✓ Coluna canal de movimentacoes_estoque verificada/criada")
+    except Exception as e:
+        logger.error(f"Erro ao criar/preencher coluna canal em movimentacoes_estoque: {e}")
+
+
+def create_produtos_search_indexes():
+    """
+    Cria o índice btree (empresa_id, nome) e os índices trigram (pg_trgm) para a
+    busca por nome/código de produtos (ILIKE '%termo%') usada na tela de orçamento/vendas.
+    Cada parte roda em sua transação: sem permissão para criar a extensão, o
+    índice btree é criado mesmo assim.
+    """
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_produtos_empresa_nome
+                ON produtos(empresa_id, nome);
+            """))
+            connection.commit()
+            logger.info("✓ Índice idx_produtos_empresa_nome verificado/criado")
+    except Exception as e:
+        logger.error(f"Erro ao criar índice idx_produtos_empresa_nome: {e}")
+
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm;"))
+            connection.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_produtos_nome_trgm
+                ON produtos USING gin (nome gin_trgm_ops);
+            """))
+            connection.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_produtos_codigo_trgm
+                ON produtos USING gin (codigo gin_trgm_ops);
+            """))
+            connection.commit()
+            logger.info("✓ Índices trigram de busca de produtos verificados/criados")
+    except Exception as e:
+        logger.error(f"Erro ao criar índices trigram de produtos (pg_trgm pode não estar disponível): {e}")
+
+
 def create_all_missing_tables():
     """Cria todas as tabelas faltantes necessárias."""
     create_historico_preco_produto_table()
+    create_estatisticas_preco_produto_table()
     create_reversao_columns_and_tables()
+    create_movimentacoes_indexes()
+    create_preenchimentos_concluidos_table()
+    create_movimentacoes_nota_fiscal_columns()
+    create_movimentacoes_canal_column()
+    create_registros_processados_incremental_table()
+    create_demanda_snapshot_tables()
+    create_vendas_unificadas_table()
+    create_vendas_mensais_tables()
+    create_importacao_nf_lote_tables()
+    create_produtos_search_indexes()
     create_regras_sugestao_compra_table()
\ No newline at end of file
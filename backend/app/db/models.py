@@ -2,8 +2,8 @@
 
 from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Float, Date, Enum, Index, UniqueConstraint
 from sqlalchemy.dialects.postgresql import JSON
-from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.orm import relationship, validates
+from sqlalchemy.sql import func, text
 from .connection import Base
 from datetime import datetime
 
@@ -93,6 +93,14 @@ class MovimentacaoEstoque(Base):
     data_reversao = Column(DateTime(timezone=True), nullable=True)
     revertida_por_id = Column(Integer, ForeignKey("usuarios.id"), nullable=True)
     
+    # Referência estruturada da NF de origem (antes só existia dentro de observacao)
+    nota_fiscal = Column(String(50), nullable=True)
+    chave_acesso = Column(String(44), nullable=True)
+    
+    # Canal de origem (app de vendedores, importação de NF, manual...), derivado da observação.
+    # Usado nos filtros das análises de vendas no lugar de ILIKE sobre observacao.
+    canal = Column(String(30), nullable=True, default='MANUAL')
+    
     produto_id = Column(Integer, ForeignKey("produtos.id"), nullable=False)
     usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
 
@@ -104,6 +112,29 @@ class MovimentacaoEstoque(Base):
     # Self-referencing relationship para reversões
     reversao_de = relationship("MovimentacaoEstoque", remote_side=[id], foreign_keys=[reversao_de_id], backref="reversoes")
 
+    @validates('observacao')
+    def _classificar_canal(self, _chave, observacao):
+        # Toda gravação pelo ORM (StockService, routers, CRUD) recalcula o canal junto com a observação
+        from app.services.stock_service import classificar_canal_movimentacao
+        self.canal = classificar_canal_movimentacao(observacao)
+        return observacao
+
+    __table_args__ = (
+        # Paginação por cursor (keyset) do histórico geral
+        Index('idx_movimentacao_data_id', 'data_movimentacao', 'id'),
+        # Detecção de duplicatas e reversão em massa por NF
+        Index('idx_movimentacao_nota_fiscal', 'nota_fiscal', 'tipo_movimentacao', 'data_movimentacao'),
+        Index('idx_movimentacao_chave_acesso', 'chave_acesso'),
+        # Análises de vendas: tendência por produto e período por canal
+        Index('idx_movimentacao_produto_tipo_canal_data', 'produto_id', 'tipo_movimentacao', 'canal', 'data_movimentacao'),
+        Index(
+            'idx_movimentacao_vendas_canal_data', 'data_movimentacao', 'produto_id',
+            postgresql_where=text("tipo_movimentacao = 'SAIDA' AND canal IN ('VENDA_VENDEDOR', 'IMPORTACAO_NF')")
+        ),
+        # Movimentações ainda sem canal (preenchimento no startup)
+        Index('idx_movimentacao_canal_nulo', 'id', postgresql_where=text("canal IS NULL")),
+    )
+
 
 class VendaHistorica(Base):
     __tablename__ = "vendas_historicas"
@@ -319,6 +350,135 @@ class HistoricoPrecoProduto(Base):
     cliente_id = Column(Integer, ForeignKey("clientes.id"), nullable=True)
     cliente = relationship("Cliente")
 
+class EstatisticaPrecoProduto(Base):
+    """
+    Estatísticas agregadas de preço por produto/empresa, mantidas a cada
+    inserção em historico_preco_produto (preço médio = soma_precos / total_vendas).
+    """
+    __tablename__ = "estatisticas_preco_produto"
+
+    produto_id = Column(Integer, ForeignKey("produtos.id"), primary_key=True)
+    empresa_id = Column(Integer, ForeignKey("empresas.id"), primary_key=True)
+
+    preco_maior = Column(Float, nullable=False)
+    preco_menor = Column(Float, nullable=False)
+    soma_precos = Column(Float, nullable=False, default=0)
+    total_vendas = Column(Integer, nullable=False, default=0)
+    atualizado_em = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class DemandaDiariaProduto(Base):
+    """
+    Snapshot diário de movimentações por produto, preenchido incrementalmente
+    a partir de movimentacoes_estoque (ver DemandaSnapshotService).
+    """
+    __tablename__ = "demanda_diaria_produto"
+
+    produto_id = Column(Integer, ForeignKey("produtos.id"), primary_key=True)
+    data = Column(Date, primary_key=True)
+    empresa_id = Column(Integer, ForeignKey("empresas.id"), nullable=False)
+
+    quantidade_saida = Column(Float, nullable=False, default=0)
+    quantidade_entrada = Column(Float, nullable=False, default=0)
+    quantidade_entrada_compra = Column(Float, nullable=False, default=0)  # Entradas com origem COMPRA
+    numero_vendas = Column(Integer, nullable=False, default=0)  # Quantidade de movimentações de saída
+    maior_saida = Column(Float, nullable=False, default=0)  # Maior saída individual do dia
+    soma_quadrados_saida = Column(Float, nullable=False, default=0)  # Para desvio padrão por venda
+
+    __table_args__ = (
+        Index('idx_demanda_diaria_empresa_data', 'empresa_id', 'data'),
+    )
+
+class RegistroProcessadoIncremental(Base):
+    """
+    Ids já somados por um job incremental acima da posição gravada no seu
+    controle (ver app/services/posicao_incremental.py).
+    """
+    __tablename__ = "registros_processados_incremental"
+
+    consumidor = Column(String(50), primary_key=True)  # DEMANDA_DIARIA, VENDAS_MENSAIS_<FONTE>
+    registro_id = Column(Integer, primary_key=True)
+    processado_em = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index('idx_registros_processados_consumidor_data', 'consumidor', 'processado_em'),
+    )
+
+class DemandaSnapshotControle(Base):
+    """
+    Posição do job do snapshot de demanda: todas as movimentações com id <= ultima_movimentacao_id
+    já foram somadas (as acima dela ficam em registros_processados_incremental).
+    """
+    __tablename__ = "demanda_snapshot_controle"
+
+    id = Column(Integer, primary_key=True)
+    ultima_movimentacao_id = Column(Integer, nullable=False, default=0)
+    atualizado_em = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class VendaUnificada(Base):
+    """
+    Vendas a clientes unificadas: NF-e (historico_preco_produto com NF e cliente) e
+    orçamentos finalizados sem NF vinculada (historico_vendas_cliente), uma linha por item.
+    Mantida nos lançamentos (ver VendasUnificadasService).
+    """
+    __tablename__ = "vendas_unificadas"
+
+    id = Column(Integer, primary_key=True, index=True)
+    empresa_id = Column(Integer, ForeignKey("empresas.id"), nullable=False)
+    cliente_id = Column(Integer, ForeignKey("clientes.id"), nullable=False)
+    produto_id = Column(Integer, ForeignKey("produtos.id"), nullable=False)
+    vendedor_id = Column(Integer, ForeignKey("usuarios.id"), nullable=True)
+    origem = Column(String(20), nullable=False)  # NF ou ORCAMENTO
+    nota_fiscal = Column(String, nullable=True)
+    orcamento_id = Column(Integer, ForeignKey("orcamentos.id"), nullable=True)
+    historico_preco_id = Column(Integer, ForeignKey("historico_preco_produto.id"), nullable=True)
+    historico_venda_id = Column(Integer, ForeignKey("historico_vendas_cliente.id"), nullable=True)
+
+    quantidade = Column(Float, nullable=False)
+    preco_unitario = Column(Float, nullable=False)
+    valor_total = Column(Float, nullable=False)
+    data_venda = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index('idx_vendas_unificadas_empresa_data', 'empresa_id', 'data_venda'),
+        Index('idx_vendas_unificadas_empresa_cliente_data', 'empresa_id', 'cliente_id', 'data_venda'),
+        Index('idx_vendas_unificadas_orcamento', 'orcamento_id'),
+    )
+
+class VendaMensal(Base):
+    """
+    Cubo mensal de vendas (empresa × mês × produto × vendedor × cliente), preenchido
+    incrementalmente a partir das movimentações e históricos (ver VendasMensaisService).
+    vendedor_id/cliente_id = 0 quando a fonte não tem a dimensão.
+    """
+    __tablename__ = "vendas_mensais"
+
+    empresa_id = Column(Integer, ForeignKey("empresas.id"), primary_key=True)
+    ano = Column(Integer, primary_key=True)
+    mes = Column(Integer, primary_key=True)
+    fonte = Column(String(20), primary_key=True)  # MOVIMENTACAO ou VENDAS_UNIFICADAS
+    produto_id = Column(Integer, primary_key=True)
+    vendedor_id = Column(Integer, primary_key=True, default=0)
+    cliente_id = Column(Integer, primary_key=True, default=0)
+
+    quantidade = Column(Float, nullable=False, default=0)
+    valor = Column(Float, nullable=False, default=0)  # Valor vendido (0 para MOVIMENTACAO, que não tem preço)
+    numero_registros = Column(Integer, nullable=False, default=0)
+    dias_com_venda = Column(Integer, nullable=False, default=0)  # Bit (dia - 1) ligado para cada dia com venda
+    ultima_venda = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index('idx_vendas_mensais_empresa_fonte_periodo', 'empresa_id', 'fonte', 'ano', 'mes'),
+    )
+
+class VendasMensaisControle(Base):
+    """Posição (último id somado de cada fonte) do cubo mensal de vendas."""
+    __tablename__ = "vendas_mensais_controle"
+
+    id = Column(Integer, primary_key=True)
+    ultima_movimentacao_id = Column(Integer, nullable=False, default=0)
+    ultima_venda_unificada_id = Column(Integer, nullable=False, default=0)
+    atualizado_em = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
 class OrdemDeCompra(Base):
     __tablename__ = "ordens_compra"
     id = Column(Integer, primary_key=True, index=True)
@@ -585,6 +745,62 @@ class ArquivoProcessado(Base):
     )
 
 
+class ImportacaoNFLote(Base):
+    """Job de importação de NFs (PDF/XML) em lote, processado em segundo plano."""
+    __tablename__ = "importacoes_nf_lote"
+
+    id = Column(Integer, primary_key=True, index=True)
+    empresa_id = Column(Integer, ForeignKey("empresas.id"), nullable=False)
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
+    tipo_movimentacao = Column(String(10), nullable=True)  # None = auto-detectar (XML)
+    status = Column(String(20), nullable=False, default="PENDENTE")  # PENDENTE, PROCESSANDO, CONCLUIDO, INTERROMPIDO
+
+    # Progresso
+    total_arquivos = Column(Integer, nullable=False, default=0)
+    arquivos_concluidos = Column(Integer, nullable=False, default=0)
+    arquivos_com_erro = Column(Integer, nullable=False, default=0)
+    arquivos_duplicados = Column(Integer, nullable=False, default=0)
+
+    data_criacao = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    data_inicio = Column(DateTime(timezone=True), nullable=True)
+    data_conclusao = Column(DateTime(timezone=True), nullable=True)
+
+    # Processo que processa o lote ("host:pid") e seu último sinal de vida
+    processado_por = Column(String(100), nullable=True)
+    heartbeat_em = Column(DateTime(timezone=True), nullable=True)
+    # Diretório temporário (no host do dono) com os arquivos ainda não processados
+    diretorio = Column(String, nullable=True)
+
+    arquivos = relationship("ImportacaoNFArquivo", back_populates="lote", order_by="ImportacaoNFArquivo.id")
+
+    __table_args__ = (
+        Index('idx_importacao_lote_empresa_data', 'empresa_id', 'data_criacao'),
+    )
+
+
+class ImportacaoNFArquivo(Base):
+    """Arquivo de um lote de importação de NFs, com o preview gerado pelo worker."""
+    __tablename__ = "importacoes_nf_arquivo"
+
+    id = Column(Integer, primary_key=True, index=True)
+    lote_id = Column(Integer, ForeignKey("importacoes_nf_lote.id", ondelete="CASCADE"), nullable=False)
+    nome_arquivo = Column(String, nullable=False)
+    tipo_arquivo = Column(String(3), nullable=False)  # PDF ou XML
+    hash_arquivo = Column(String(64), nullable=False)  # SHA256 do conteúdo
+    status = Column(String(20), nullable=False, default="PENDENTE")  # PENDENTE, PROCESSANDO, CONCLUIDO, ERRO, DUPLICADO, CONFIRMADO
+    nota_fiscal = Column(String(50), nullable=True)
+    preview = Column(JSON, nullable=True)
+    erro = Column(String, nullable=True)
+    data_processamento = Column(DateTime(timezone=True), nullable=True)
+
+    lote = relationship("ImportacaoNFLote", back_populates="arquivos")
+
+    __table_args__ = (
+        Index('idx_importacao_arquivo_lote', 'lote_id', 'id'),
+        Index('idx_importacao_arquivo_hash', 'hash_arquivo'),
+    )
+
+
 class RegrasSugestaoCompra(Base):
     """Regras de negócio por empresa para sugestão de compra (quando comprar, lead time, cobertura, etc.)."""
     __tablename__ = "regras_sugestao_compra"
@@ -597,4 +813,10 @@ class RegrasSugestaoCompra(Base):
     margem_seguranca = Column(Float, nullable=False, default=1.2)
     margem_adicional_cobertura = Column(Float, nullable=False, default=1.15)
     dias_antecedencia_cliente = Column(Integer, nullable=False, default=7)
-    empresa = relationship("Empresa")
\ No newline at end of file
+    empresa = relationship("Empresa")
+
+class PreenchimentoConcluido(Base):
+    """Preenchimentos de dados (backfills) do startup já concluídos (ver create_missing_tables)."""
+    __tablename__ = "preenchimentos_concluidos"
+    nome = Column(String(100), primary_key=True)
+    concluido_em = Column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,81 @@
+"""
+Registro das capacidades do schema do banco de dados.
+
+Algumas colunas/tabelas (ex.: colunas de reversão em movimentacoes_estoque,
+tabela arquivos_processados) podem não existir em bancos ainda não migrados.
+Em vez de consultar o information_schema a cada requisição, o schema é
+inspecionado uma única vez no startup (após create_all_missing_tables) e
+pode ser recarregado pelo router admin depois de uma migração.
+"""
+import logging
+import threading
+from typing import Dict, Set
+
+from sqlalchemy import inspect
+
+from app.db.connection import engine
+
+logger = logging.getLogger(__name__)
+
+COLUNAS_REVERSAO = {"reversao_de_id", "revertida", "data_reversao", "revertida_por_id"}
+
+
+class SchemaCapabilities:
+    """Tabelas e colunas existentes no banco, carregadas uma vez e mantidas em memória."""
+
+    def __init__(self):
+        self._tabelas: Dict[str, Set[str]] = {}
+        self._carregado = False
+        self._lock = threading.Lock()
+
+    def refresh(self) -> None:
+        """Inspeciona o banco e atualiza o registro (startup e após migrações)."""
+        with self._lock:
+            try:
+                inspector = inspect(engine)
+                colunas_por_tabela = inspector.get_multi_columns()
+                self._tabelas = {
+                    tabela: {col["name"] for col in colunas}
+                    for (_schema, tabela), colunas in colunas_por_tabela.items()
+                }
+                logger.info(f"✓ Capacidades do schema carregadas ({len(self._tabelas)} tabelas)")
+            except Exception as e:
+                logger.warning(f"⚠️ Erro ao inspecionar schema: {e}. Assumindo schema sem colunas opcionais.")
+                self._tabelas = {}
+            self._carregado = True
+
+    def _garantir_carregado(self) -> None:
+        # Scripts e jobs que não passam pelo lifespan carregam sob demanda
+        if not self._carregado:
+            self.refresh()
+
+    def has_table(self, tabela: str) -> bool:
+        self._garantir_carregado()
+        return tabela in self._tabelas
+
+    def has_column(self, tabela: str, coluna: str) -> bool:
+        self._garantir_carregado()
+        return coluna in self._tabelas.get(tabela, set())
+
+    @property
+    def colunas_reversao_existem(self) -> bool:
+        """True se movimentacoes_estoque já possui as colunas de reversão."""
+        self._garantir_carregado()
+        return COLUNAS_REVERSAO.issubset(self._tabelas.get("movimentacoes_estoque", set()))
+
+    @property
+    def tabela_arquivos_processados_existe(self) -> bool:
+        return self.has_table("arquivos_processados")
+
+    def resumo(self) -> Dict[str, object]:
+        """Resumo das capacidades, usado pelo router admin."""
+        self._garantir_carregado()
+        return {
+            "total_tabelas": len(self._tabelas),
+            "colunas_reversao_existem": self.colunas_reversao_existem,
+            "tabela_arquivos_processados_existe": self.tabela_arquivos_processados_existe,
+        }
+
+
+# Instância global do registro
+schema_capabilities = SchemaCapabilities()
@@ -6,6 +6,7 @@ from sqlalchemy.orm import Session
 
 # Importa dos novos módulos de core
 from app.core.config import settings
+from app.core.principal_cache import Principal, principal_cache
 
 # Importa dos outros módulos da aplicação
 from app.db import models
@@ -23,39 +24,77 @@ def create_access_token(data: dict) -> str:
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> models.Usuario:
-    """
-    Decodifica o token JWT e retorna o usuário do banco de dados correspondente.
-    Esta é a dependência principal para proteger rotas.
-    """
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    credentials_exception = HTTPException(
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def _email_do_token(token: str) -> str:
+    """Decodifica o token JWT e retorna o e-mail (sub); HTTP 401 se inválido."""
+    import logging
+    logger = logging.getLogger(__name__)
+    
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         email: str | None = payload.get("sub")
         if email is None:
             logger.error("Email não encontrado no payload do token")
-            raise credentials_exception
+            raise _credentials_exception()
     except JWTError as e:
         logger.error(f"Erro ao decodificar token JWT: {str(e)}")
-        raise credentials_exception
+        raise _credentials_exception()
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Erro inesperado ao validar token: {str(e)}")
-        raise credentials_exception
+        raise _credentials_exception()
+    return email
 
+
+def _buscar_usuario(db: Session, email: str) -> models.Usuario:
+    """Usuário do banco pelo e-mail do token; atualiza o cache de principal."""
+    import logging
+    logger = logging.getLogger(__name__)
+
+    # Versão lida antes da consulta: uma alteração concorrente invalida o que for gravado aqui
+    versao = principal_cache.versao(email)
     user = crud_usuario.get_user_by_email(db, email=email)
     if user is None:
         logger.error(f"Usuário não encontrado no banco de dados: {email}")
-        raise credentials_exception
+        raise _credentials_exception()
+    principal_cache.guardar(user.email, _principal_do_usuario(user), versao)
     return user
 
 
+def _principal_do_usuario(user: models.Usuario) -> Principal:
+    return Principal(id=user.id, email=user.email, empresa_id=user.empresa_id, perfil=user.perfil)
+
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> models.Usuario:
+    """
+    Decodifica o token JWT e retorna o usuário do banco de dados correspondente.
+    Esta é a dependência principal para proteger rotas.
+    """
+    return _buscar_usuario(db, _email_do_token(token))
+
+
+def get_current_principal(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Principal:
+    """
+    Como get_current_user, mas retorna apenas id, email, empresa_id e perfil.
+    Para rotas que não usam o objeto ORM: o principal vem do cache em memória
+    e o banco só é consultado quando a entrada expira ou o usuário é alterado.
+    """
+    email = _email_do_token(token)
+    principal = principal_cache.obter(email)
+    if principal is not None:
+        return principal
+    return _principal_do_usuario(_buscar_usuario(db, email))
+
+
 def get_current_vendedor(
     current_user: models.Usuario = Depends(get_current_user)
 ) -> models.Usuario:
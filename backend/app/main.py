@@ -7,13 +7,17 @@ from app.routers import (
     auth, empresas, produtos, movimentacoes, upload_excel,
     dashboard_kpis, invoice_processing,
     fornecedores, ordens_compra, clientes_v2, minimum_stock, vendas, orcamentos, produtos_mais_vendidos, reports, compras,
-    fichas_tecnicas, concorrentes, propostas_detalhadas, visitas, clientes_compras, entrada, admin
+    fichas_tecnicas, concorrentes, propostas_detalhadas, visitas, clientes_compras, entrada, admin, importacao_nf
 )
 
 from app.create_superuser import create_initial_superuser
 from app.core.error_handler import register_exception_handlers
+from app.core.http_middleware import CorsELogMiddleware
 from app.core.logger import app_logger
+from app.core.parse_executor import parse_executor
 from app.db.create_missing_tables import create_all_missing_tables
+from app.db.schema_capabilities import schema_capabilities
+from app.utils.pdf_texto import encerrar_pool_paginas
 from contextlib import asynccontextmanager
 import logging
 import os
@@ -31,6 +35,13 @@ async def lifespan(app: FastAPI):
     logger.info("Verificando e criando tabelas faltantes...")
     create_all_missing_tables()
     
+    # Registrar colunas/tabelas existentes (evita inspecionar o schema a cada requisição)
+    schema_capabilities.refresh()
+    
+    # Lotes de importação de NFs que estavam em andamento quando o servidor parou
+    from app.services.nf_importacao_lote_service import NFImportacaoLoteService
+    NFImportacaoLoteService.marcar_lotes_interrompidos()
+    
     # Criar superusuário inicial
     create_initial_superuser()
     logger.info("Superusuário criado/verificado com sucesso")
@@ -38,6 +49,8 @@ async def lifespan(app: FastAPI):
     yield
     # Shutdown
     logger.info("Encerrando aplicação...")
+    parse_executor.encerrar()
+    encerrar_pool_paginas()
 
 app = FastAPI(
     title="Higiplas System API",
@@ -90,6 +103,8 @@ app.add_middleware(
 app.include_router(auth.router, prefix="/users", tags=["Usuários e Autenticação"])
 app.include_router(empresas.router, prefix="/empresas", tags=["Empresas"])
 app.include_router(produtos.router, tags=["Produtos"])
+# Antes de movimentacoes: GET /movimentacoes/{produto_id} capturaria /movimentacoes/importacao-lote
+app.include_router(importacao_nf.router, tags=["Importação de NFs em Lote"])
 app.include_router(movimentacoes.router, prefix="/movimentacoes", tags=["Movimentações de Estoque"])
 app.include_router(entrada.router, prefix="/api", tags=["Entrada de Estoque"])
 app.include_router(vendas.router)
@@ -150,36 +165,6 @@ async def options_handler(request: Request):
 # Isso substitui os handlers antigos por versões mais robustas
 register_exception_handlers(app)
 
-# Middleware para CORS e log enxuto (evitar flood em produção)
-@app.middleware("http")
-async def add_cors_and_log(request: Request, call_next):
-    # Capturar body apenas para reenviar ao handler (POST/PUT/PATCH)
-    if request.method in ["POST", "PUT", "PATCH"]:
-        body = await request.body()
-        if body:
-            async def receive():
-                return {"type": "http.request", "body": body}
-            request._receive = receive
-
-    try:
-        response = await call_next(request)
-
-        origin = request.headers.get("origin")
-        if origin and origin in allowed_origins:
-            response.headers["Access-Control-Allow-Origin"] = origin
-            response.headers["Access-Control-Allow-Credentials"] = "true"
-        else:
-            response.headers["Access-Control-Allow-Origin"] = allowed_origins[0] if allowed_origins else "*"
-            response.headers["Access-Control-Allow-Credentials"] = "true"
-        response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS, PATCH"
-        response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, Accept, Origin, User-Agent, DNT, Cache-Control, X-Requested-With"
-        response.headers["Access-Control-Expose-Headers"] = "Content-Disposition, Content-Type, Content-Length"
-
-        if response.status_code >= 400:
-            logger.warning(f"{request.method} {request.url.path} -> {response.status_code}")
-        return response
-    except Exception as e:
-        logger.error(f"Erro ao processar requisição: {str(e)}")
-        import traceback
-        logger.error(traceback.format_exc())
-        raise
+# Middleware para CORS e log enxuto (evitar flood em produção).
+# ASGI puro: não lê o corpo da requisição, então uploads seguem em streaming até o handler
+app.add_middleware(CorsELogMiddleware, allowed_origins=allowed_origins)
@@ -5,6 +5,7 @@ from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from ..db.connection import engine, get_db
+from ..db.schema_capabilities import schema_capabilities
 from app.dependencies import get_current_user
 from ..db import models
 import logging
@@ -158,6 +159,7 @@ async def aplicar_migracao_reversao(
                 """))
                 
                 trans.commit()
+                schema_capabilities.refresh()
                 
                 logger.info("✅ Migração aplicada com sucesso!")
                 
@@ -189,6 +191,95 @@ async def aplicar_migracao_reversao(
         )
 
 
+@router.get("/schema-capabilities", response_model=dict)
+def get_schema_capabilities(
+    current_user: models.Usuario = Depends(get_current_user)
+):
+    """Retorna o registro de capacidades do schema carregado no startup."""
+    if current_user.perfil not in ['ADMIN', 'GERENTE']:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Apenas administradores podem consultar o schema"
+        )
+    return schema_capabilities.resumo()
+
+
+@router.post("/schema-capabilities/refresh", response_model=dict)
+def refresh_schema_capabilities(
+    current_user: models.Usuario = Depends(get_current_user)
+):
+    """
+    Recarrega o registro de capacidades do schema após uma migração manual.
+    Cada worker mantém o próprio registro; os demais recarregam no próximo restart.
+    """
+    if current_user.perfil not in ['ADMIN', 'GERENTE']:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Apenas administradores podem recarregar o schema"
+        )
+    schema_capabilities.refresh()
+    logger.info("🔄 Capacidades do schema recarregadas")
+    return {"sucesso": True, **schema_capabilities.resumo()}
+
+
+@router.post("/demanda-snapshot/atualizar", response_model=dict)
+def atualizar_demanda_snapshot(
+    reconstruir: bool = False,
+    db: Session = Depends(get_db),
+    current_user: models.Usuario = Depends(get_current_user)
+):
+    """
+    Executa o job do snapshot diário de demanda (incremental a partir da última
+    movimentação processada, ou reconstrução completa com reconstruir=true).
+    """
+    if current_user.perfil not in ['ADMIN', 'GERENTE']:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Apenas administradores podem atualizar o snapshot de demanda"
+        )
+    from app.services.demanda_snapshot_service import DemandaSnapshotService
+
+    service = DemandaSnapshotService(db)
+    try:
+        resultado = service.reconstruir() if reconstruir else service.atualizar_incremental()
+    except Exception as e:
+        logger.error(f"Erro ao atualizar snapshot de demanda: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro ao atualizar snapshot de demanda: {str(e)}"
+        )
+    return {"sucesso": True, **resultado}
+
+
+@router.post("/vendas-mensais/atualizar", response_model=dict)
+def atualizar_vendas_mensais(
+    reconstruir: bool = False,
+    db: Session = Depends(get_db),
+    current_user: models.Usuario = Depends(get_current_user)
+):
+    """
+    Executa o job do cubo mensal de vendas (incremental a partir do último id
+    de cada fonte, ou reconstrução completa com reconstruir=true).
+    """
+    if current_user.perfil not in ['ADMIN', 'GERENTE']:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Apenas administradores podem atualizar o cubo mensal de vendas"
+        )
+    from app.services.vendas_mensais_service import VendasMensaisService
+
+    service = VendasMensaisService(db)
+    try:
+        resultado = service.reconstruir() if reconstruir else service.atualizar_incremental()
+    except Exception as e:
+        logger.error(f"Erro ao atualizar cubo mensal de vendas: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro ao atualizar cubo mensal de vendas: {str(e)}"
+        )
+    return {"sucesso": True, **resultado}
+
+
 # --- Regras de sugestão de compra (admin) ---
 class RegrasSugestaoCompraSchema(BaseModel):
     lead_time_dias: int = 7
@@ -265,6 +356,8 @@ def put_regras_sugestao_compra(
     regras.dias_antecedencia_cliente = body.dias_antecedencia_cliente
     db.commit()
     db.refresh(regras)
+    from app.core.sugestao_cache import sugestao_clientes_cache
+    sugestao_clientes_cache.invalidar(regras.empresa_id)
     return {
         "empresa_id": regras.empresa_id,
         "lead_time_dias": regras.lead_time_dias,
@@ -5,12 +5,13 @@ Endpoints para histórico de compras, produtos mais comprados e sugestões.
 
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import text
 from typing import Dict, Any, List
 from ..db.connection import get_db
 from ..dependencies import get_current_user
 from ..db import models
 from ..services.cliente_purchase_suggestion_service import ClientePurchaseSuggestionService
+from ..services.vendas_mensais_service import FONTE_VENDAS_UNIFICADAS, VendasMensaisService, contar_dias
+from ..services.vendas_unificadas_service import ORIGEM_NF
 
 router = APIRouter(
     prefix="/clientes",
@@ -169,67 +170,48 @@ def get_visao_geral_clientes(
         data_limite = datetime.now() - timedelta(days=dias)
         empresa_id = current_user.empresa_id
 
-        # Unificar HPP (NF-e) e HVC (orçamentos): incluir clientes com compras em qualquer fonte.
-        # Evitar duplicar venda quando orçamento já tem NF (mesma venda em HPP e HVC).
-        query = """
-            WITH vendas_nf AS (
-                SELECT hp.cliente_id, hp.produto_id, hp.valor_total, hp.data_venda, hp.nota_fiscal
-                FROM historico_preco_produto hp
-                WHERE hp.empresa_id = :empresa_id AND hp.data_venda >= :data_limite
-                  AND hp.nota_fiscal IS NOT NULL AND hp.cliente_id IS NOT NULL
-            ),
-            vendas_orcamento AS (
-                SELECT hvc.cliente_id, hvc.produto_id, hvc.valor_total, hvc.data_venda
-                FROM historico_vendas_cliente hvc
-                LEFT JOIN orcamentos o ON o.id = hvc.orcamento_id AND o.numero_nf IS NOT NULL AND o.numero_nf != ''
-                WHERE hvc.empresa_id = :empresa_id AND hvc.data_venda >= :data_limite AND o.id IS NULL
-            ),
-            vendas_unificado AS (
-                SELECT cliente_id, produto_id, valor_total, data_venda FROM vendas_nf
-                UNION ALL
-                SELECT cliente_id, produto_id, valor_total, data_venda FROM vendas_orcamento
-            ),
-            agregado AS (
-                SELECT v.cliente_id,
-                    COUNT(DISTINCT v.produto_id) AS produtos_unicos,
-                    MAX(v.data_venda) AS ultima_compra,
-                    COALESCE(SUM(v.valor_total), 0) AS valor_total_compras
-                FROM vendas_unificado v
-                GROUP BY v.cliente_id
-            ),
-            total_notas AS (
-                SELECT hp.cliente_id, COUNT(DISTINCT hp.nota_fiscal) AS total_notas
-                FROM historico_preco_produto hp
-                WHERE hp.empresa_id = :empresa_id AND hp.data_venda >= :data_limite
-                  AND hp.nota_fiscal IS NOT NULL AND hp.cliente_id IS NOT NULL
-                GROUP BY hp.cliente_id
-            )
-            SELECT c.id AS cliente_id, c.razao_social AS cliente_nome, c.cnpj,
-                COALESCE(tn.total_notas, 0) AS total_notas,
-                a.produtos_unicos,
-                a.ultima_compra,
-                a.valor_total_compras
-            FROM clientes c
-            JOIN agregado a ON c.id = a.cliente_id
-            LEFT JOIN total_notas tn ON c.id = tn.cliente_id
-            WHERE c.empresa_id = :empresa_id
-            ORDER BY a.valor_total_compras DESC NULLS LAST
-        """
-        result = db.execute(
-            text(query),
-            {'empresa_id': empresa_id, 'data_limite': data_limite}
-        )
-        clientes_data = []
-        for row in result:
-            clientes_data.append({
-                'cliente_id': row.cliente_id,
-                'cliente_nome': row.cliente_nome,
-                'cnpj': row.cnpj,
-                'total_notas': row.total_notas or 0,
-                'produtos_unicos': row.produtos_unicos or 0,
-                'ultima_compra': row.ultima_compra.isoformat() if row.ultima_compra else None,
-                'valor_total_compras': float(row.valor_total_compras) if row.valor_total_compras else 0
+        # Vendas unificadas (NF-e + orçamentos sem NF linkada) a partir do cubo mensal
+        celulas = VendasMensaisService(db).celulas(empresa_id, [FONTE_VENDAS_UNIFICADAS], data_limite)
+        agregado: Dict[int, Dict[str, Any]] = {}
+        for (_fonte, _ano, _mes, produto_id, _vendedor, cliente_id), valores in celulas.items():
+            dados = agregado.setdefault(cliente_id, {
+                'produtos': set(),
+                'ultima_compra': None,
+                'valor_total_compras': 0.0
             })
+            dados['produtos'].add(produto_id)
+            dados['valor_total_compras'] += valores['valor']
+            ultima = valores['ultima_venda']
+            if ultima is not None and (dados['ultima_compra'] is None or ultima > dados['ultima_compra']):
+                dados['ultima_compra'] = ultima
+
+        clientes_data = []
+        if agregado:
+            # Notas distintas não são somáveis por mês/produto: contadas direto em vendas_unificadas
+            venda = models.VendaUnificada
+            total_notas = dict(
+                db.query(venda.cliente_id, func.count(func.distinct(venda.nota_fiscal))).filter(
+                    venda.empresa_id == empresa_id,
+                    venda.data_venda >= data_limite,
+                    venda.origem == ORIGEM_NF
+                ).group_by(venda.cliente_id).all()
+            )
+            clientes = db.query(models.Cliente.id, models.Cliente.razao_social, models.Cliente.cnpj).filter(
+                models.Cliente.empresa_id == empresa_id,
+                models.Cliente.id.in_(list(agregado))
+            ).all()
+            for cliente in clientes:
+                dados = agregado[cliente.id]
+                clientes_data.append({
+                    'cliente_id': cliente.id,
+                    'cliente_nome': cliente.razao_social,
+                    'cnpj': cliente.cnpj,
+                    'total_notas': total_notas.get(cliente.id, 0),
+                    'produtos_unicos': len(dados['produtos']),
+                    'ultima_compra': dados['ultima_compra'].isoformat() if dados['ultima_compra'] else None,
+                    'valor_total_compras': float(dados['valor_total_compras'])
+                })
+            clientes_data.sort(key=lambda c: c['valor_total_compras'], reverse=True)
         
         return {
             'periodo_dias': dias,
@@ -260,47 +242,33 @@ def get_resultados_mensais_clientes(
             end = datetime(ano, mes + 1, 1)
         empresa_id = current_user.empresa_id
 
-        # Agregar por cliente a partir de HPP (NF) e HVC (orçamentos sem NF)
-        query = text("""
-            WITH vendas_nf AS (
-                SELECT hp.cliente_id, hp.produto_id, hp.valor_total, hp.quantidade, hp.data_venda
-                FROM historico_preco_produto hp
-                WHERE hp.empresa_id = :empresa_id AND hp.data_venda >= :start AND hp.data_venda < :end
-                  AND hp.nota_fiscal IS NOT NULL AND hp.cliente_id IS NOT NULL
-            ),
-            vendas_orc AS (
-                SELECT hvc.cliente_id, hvc.produto_id, hvc.valor_total, hvc.quantidade_vendida AS quantidade, hvc.data_venda
-                FROM historico_vendas_cliente hvc
-                LEFT JOIN orcamentos o ON o.id = hvc.orcamento_id AND o.numero_nf IS NOT NULL AND o.numero_nf != ''
-                WHERE hvc.empresa_id = :empresa_id AND hvc.data_venda >= :start AND hvc.data_venda < :end AND o.id IS NULL
-            ),
-            unificado AS (
-                SELECT cliente_id, produto_id, valor_total, quantidade, data_venda FROM vendas_nf
-                UNION ALL
-                SELECT cliente_id, produto_id, valor_total, quantidade, data_venda FROM vendas_orc
-            )
-            SELECT u.cliente_id,
-                c.razao_social AS cliente_nome,
-                c.cnpj,
-                COUNT(DISTINCT u.data_venda::date) AS num_pedidos,
-                COALESCE(SUM(u.valor_total), 0) AS valor_total,
-                COUNT(DISTINCT u.produto_id) AS produtos_unicos
-            FROM unificado u
-            JOIN clientes c ON c.id = u.cliente_id AND c.empresa_id = :empresa_id
-            GROUP BY u.cliente_id, c.razao_social, c.cnpj
-            ORDER BY valor_total DESC
-        """)
-        result = db.execute(query, {"empresa_id": empresa_id, "start": start, "end": end})
+        # Agregar por cliente a partir do cubo mensal (vendas unificadas: NF-e + orçamentos sem NF)
+        celulas = VendasMensaisService(db).celulas(empresa_id, [FONTE_VENDAS_UNIFICADAS], start, end)
+        agregado: Dict[int, Dict[str, Any]] = {}
+        for (_fonte, _ano, _mes, produto_id, _vendedor, cliente_id), valores in celulas.items():
+            dados = agregado.setdefault(cliente_id, {'produtos': set(), 'dias_com_venda': 0, 'valor_total': 0.0})
+            dados['produtos'].add(produto_id)
+            dados['valor_total'] += valores['valor']
+            # Pedidos = dias distintos com venda no mês
+            dados['dias_com_venda'] |= valores['dias_com_venda']
+
         clientes = []
-        for row in result:
-            clientes.append({
-                "cliente_id": row.cliente_id,
-                "cliente_nome": row.cliente_nome,
-                "cnpj": row.cnpj,
-                "num_pedidos": row.num_pedidos or 0,
-                "valor_total": float(row.valor_total or 0),
-                "produtos_unicos": row.produtos_unicos or 0,
-            })
+        if agregado:
+            registros = db.query(models.Cliente.id, models.Cliente.razao_social, models.Cliente.cnpj).filter(
+                models.Cliente.empresa_id == empresa_id,
+                models.Cliente.id.in_(list(agregado))
+            ).all()
+            for cliente in registros:
+                dados = agregado[cliente.id]
+                clientes.append({
+                    "cliente_id": cliente.id,
+                    "cliente_nome": cliente.razao_social,
+                    "cnpj": cliente.cnpj,
+                    "num_pedidos": contar_dias(dados['dias_com_venda']),
+                    "valor_total": float(dados['valor_total']),
+                    "produtos_unicos": len(dados['produtos']),
+                })
+            clientes.sort(key=lambda c: c["valor_total"], reverse=True)
         return {"ano": ano, "mes": mes, "clientes": clientes}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar resultados mensais: {str(e)}")
@@ -302,7 +302,7 @@ def obter_kpis_cliente(
 @router.get("/kpis/ranking", summary="Ranking de clientes por diferentes métricas")
 def obter_ranking_clientes(
     metrica: str = Query("total_vendido", description="Métrica para ranking: total_vendido, ticket_medio, frequencia"),
-    limite: int = Query(10, description="Número de clientes no ranking"),
+    limite: int = Query(10, ge=1, description="Número de clientes no ranking"),
     dias_periodo: int = Query(90, description="Período de análise em dias"),
     db: Session = Depends(get_db),
     current_user: models.Usuario = Depends(get_current_user)
@@ -315,43 +315,18 @@ def obter_ranking_clientes(
         empresa_id = _resolve_empresa_id(db, current_user)
         kpi_service = ClienteKPIService(db)
         
-        # Obter todos os clientes da empresa que têm histórico
-        from datetime import datetime, timedelta
-        data_limite = datetime.now() - timedelta(days=dias_periodo)
-        
-        clientes_com_historico = db.query(
-            models.HistoricoVendaCliente.cliente_id
-        ).filter(
-            models.HistoricoVendaCliente.empresa_id == empresa_id,
-            models.HistoricoVendaCliente.data_venda >= data_limite
-        ).distinct().all()
-        
-        rankings = []
-        for cliente_tuple in clientes_com_historico:
-            cliente_id = cliente_tuple.cliente_id
-            kpis = kpi_service.calcular_todos_kpis(cliente_id, dias_periodo)
-            
-            if kpis and 'erro' not in kpis:
-                cliente = db.query(models.Cliente).filter(models.Cliente.id == cliente_id).first()
-                if cliente:
-                    rankings.append({
-                        'cliente_id': cliente_id,
-                        'cliente_nome': cliente.razao_social,
-                        **kpis
-                    })
-        
-        # Ordenar por métrica
-        if metrica == 'total_vendido':
-            rankings.sort(key=lambda x: x.get('total_vendido', 0), reverse=True)
-        elif metrica == 'ticket_medio':
-            rankings.sort(key=lambda x: x.get('ticket_medio', 0) or 0, reverse=True)
-        elif metrica == 'frequencia':
-            rankings.sort(key=lambda x: x.get('frequencia_compras_dias', 999) or 999)
+        # KPIs de todos os clientes em consultas agrupadas, top-N ordenado no banco
+        rankings = kpi_service.calcular_ranking_kpis(
+            empresa_id=empresa_id,
+            metrica=metrica,
+            limite=limite,
+            dias_periodo=dias_periodo
+        )
         
         return {
             'metrica': metrica,
             'periodo_dias': dias_periodo,
-            'ranking': rankings[:limite]
+            'ranking': rankings
         }
         
     except Exception as e:
@@ -471,5 +446,8 @@ def _resolve_empresa_id(db: Session, usuario: models.Usuario) -> int:
     db.add(usuario)
     db.commit()
     db.refresh(usuario)
+    # Principal em cache ainda tem empresa_id vazio
+    from app.core.principal_cache import principal_cache
+    principal_cache.invalidar(usuario.email)
 
     return usuario.empresa_id
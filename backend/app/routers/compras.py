@@ -106,6 +106,7 @@ def obter_kpis_compras(
     """
     Retorna todos os KPIs de compras calculados em tempo real.
     Inclui: curva ABC, eficiência de compras, estoque parado, etc.
+    A curva ABC fica em cache por alguns minutos por (empresa, período).
     """
     try:
         kpi_service = ComprasKPIService(db)
@@ -290,18 +291,15 @@ def get_relatorio_completo_sugestoes(
         
         # Top clientes que compram os produtos sugeridos
         top_clientes_por_produto = {}
-        for s in suggestions[:10]:  # Top 10 produtos
-            analise_produto = analytics_service.analisar_padroes_produto_por_cliente(
-                produto_id=s['produto_id'],
-                empresa_id=current_user.empresa_id,
-                dias_analise=days_analysis
-            )
-            
-            top_clientes = sorted(
-                analise_produto.get('clientes', []),
-                key=lambda x: x.get('total_valor', 0),
-                reverse=True
-            )[:3]  # Top 3 clientes por produto
+        top_produtos = suggestions[:10]  # Top 10 produtos
+        analises_produto = analytics_service.analisar_padroes_produtos_por_cliente_lote(
+            produto_ids=[s['produto_id'] for s in top_produtos],
+            empresa_id=current_user.empresa_id,
+            dias_analise=days_analysis,
+            limite_clientes=3  # Top 3 clientes por produto
+        )
+        for s in top_produtos:
+            top_clientes = analises_produto[s['produto_id']]['clientes']
             
             top_clientes_por_produto[s['produto_id']] = {
                 'produto_nome': s['produto_nome'],
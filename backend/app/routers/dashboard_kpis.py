@@ -4,14 +4,15 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func
 from app.db.connection import get_db
 from app.db import models
-from app.dependencies import get_current_user
+from app.core.principal_cache import Principal
+from app.dependencies import get_current_principal
 
 router = APIRouter(prefix="/kpis", tags=["Dashboard KPIs"])
 
 @router.get("/")
 def get_dashboard_kpis(
     db: Session = Depends(get_db),
-    current_user: models.Usuario = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     try:
         empresa_id = current_user.empresa_id
@@ -4,28 +4,24 @@ from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
 from sqlalchemy.orm import Session
 from typing import List, Dict, Any
 from ..db import models
-import tempfile
 import os
-import hashlib
 from datetime import datetime
 # Removido: from app.utils.pdf_extractor_melhorado import extrair_produtos_inteligente_entrada_melhorado
-from app.utils.product_matcher import find_product_by_code_or_name
+from app.utils.product_matcher import ProductMatcher
+from app.utils.upload_arquivos import ler_inicio_arquivo, salvar_upload_temporario
 from app.services.nf_xml_processor_service import NFXMLProcessorService
 
-from ..crud import movimentacao_estoque as crud_movimentacao
-from ..schemas import movimentacao_estoque as schemas_movimentacao
+from ..services.stock_service import StockService
 from ..schemas import produto as schemas_produto
 from ..db.connection import get_db, engine
+from ..db.schema_capabilities import schema_capabilities
+from ..core.parse_executor import parse_executor
+from ..core.parse_cache import parse_cache
 from app.dependencies import get_current_user
 import logging
 
 logger = logging.getLogger(__name__)
 
-
-def calcular_hash_arquivo(conteudo: bytes) -> str:
-    """Calcula o hash SHA256 do conteúdo do arquivo"""
-    return hashlib.sha256(conteudo).hexdigest()
-
 router = APIRouter(
     prefix="/entrada",
     tags=["Entrada de Estoque"],
@@ -61,20 +57,18 @@ async def processar_pdf_entrada(
         print(f"DEBUG: Iniciando processamento do arquivo de entrada {arquivo.filename}")
         
         # Salvar arquivo temporariamente
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            content = await arquivo.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+        temp_file_path, hash_arquivo = await salvar_upload_temporario(arquivo, '.pdf')
         
         print(f"DEBUG: Arquivo salvo temporariamente em: {temp_file_path}")
         
-        # Extrair dados do PDF (delegando para versão antiga e funcional)
-        dados_pdf = extrair_dados_pdf_entrada(temp_file_path)
+        # Extrair dados do PDF (delegando para versão antiga e funcional) no pool de processos
+        try:
+            dados_pdf = await parse_cache.executar_parse('pdf_entrada', hash_arquivo, extrair_dados_pdf_entrada, temp_file_path)
+        finally:
+            # Limpar arquivo temporário
+            os.unlink(temp_file_path)
         print(f"DEBUG: Dados extraídos do PDF: {dados_pdf}")
         
-        # Limpar arquivo temporário
-        os.unlink(temp_file_path)
-        
         if not dados_pdf.get('produtos'):
             return {
                 "sucesso": True,
@@ -90,84 +84,92 @@ async def processar_pdf_entrada(
                 "total_produtos_pdf": 0
             }
         
-        produtos_processados = []
-        produtos_nao_encontrados = []
-        movimentacoes_criadas = 0
-        
-        # Processar cada produto encontrado no PDF
-        for produto_pdf in dados_pdf['produtos']:
-            print(f"DEBUG: Processando produto: {produto_pdf}")
-            
-            codigo = produto_pdf.get('codigo')
-            descricao = produto_pdf.get('descricao', '')
-            
-            # Buscar produto no sistema pelo código ou nome
-            produto_sistema, metodo_busca, score = find_product_by_code_or_name(
-                db, codigo, descricao, current_user.empresa_id
-            )
+        def registrar_entradas():
+            produtos_processados = []
+            produtos_nao_encontrados = []
+            movimentacoes_criadas = 0
             
-            if produto_sistema and metodo_busca == 'nome':
-                print(f"DEBUG: Produto encontrado por nome: {descricao} → {produto_sistema.nome} (score: {score:.2f})")
+            # Buscar todos os produtos da NF no sistema (código ou nome) em uma única passada
+            matcher = ProductMatcher(db, current_user.empresa_id)
+            associacoes = matcher.match_batch(dados_pdf['produtos'])
             
-            if produto_sistema:
-                try:
-                    # Criar movimentação de entrada
-                    movimentacao_data = schemas_movimentacao.MovimentacaoEstoqueCreate(
-                        produto_id=produto_sistema.id,
-                        tipo_movimentacao="ENTRADA",
-                        quantidade=float(produto_pdf.get('quantidade', 0)),
-                        observacao=f"Entrada automática - NF {dados_pdf.get('nota_fiscal', 'N/A')} - {arquivo.filename}"
-                    )
-                    
-                    produto_atualizado = crud_movimentacao.create_movimentacao_estoque(
-                        db=db,
-                        movimentacao=movimentacao_data,
-                        usuario_id=current_user.id,
-                        empresa_id=current_user.empresa_id
-                    )
-                    
-                    produtos_processados.append({
-                        "codigo": produto_pdf.get('codigo'),
-                        "nome": produto_sistema.nome,
-                        "quantidade_entrada": produto_pdf.get('quantidade'),
-                        "estoque_anterior": produto_sistema.estoque_atual,
-                        "estoque_atual": produto_atualizado.estoque_atual
-                    })
-                    
-                    movimentacoes_criadas += 1
-                    print(f"DEBUG: Movimentação criada para produto {produto_sistema.nome}")
-                    
-                except Exception as e:
-                    print(f"DEBUG: Erro ao criar movimentação para produto {produto_sistema.nome}: {e}")
+            # Separar os produtos encontrados; as entradas são lançadas em um único lote
+            encontrados = []
+            for produto_pdf, (produto_sistema, metodo_busca, score) in zip(dados_pdf['produtos'], associacoes):
+                print(f"DEBUG: Processando produto: {produto_pdf}")
+                
+                descricao = produto_pdf.get('descricao', '')
+                
+                if produto_sistema and metodo_busca == 'nome':
+                    print(f"DEBUG: Produto encontrado por nome: {descricao} → {produto_sistema.nome} (score: {score:.2f})")
+                
+                if produto_sistema:
+                    encontrados.append((produto_pdf, produto_sistema.nome, {
+                        "produto_id": produto_sistema.id,
+                        "tipo_movimentacao": "ENTRADA",
+                        "quantidade": float(produto_pdf.get('quantidade') or 0),
+                        "observacao": f"Entrada automática - NF {dados_pdf.get('nota_fiscal', 'N/A')} - {arquivo.filename}",
+                        "nota_fiscal": dados_pdf.get('nota_fiscal'),
+                        "chave_acesso": dados_pdf.get('chave_acesso')
+                    }))
+                else:
+                    print(f"DEBUG: Produto não encontrado no sistema: {produto_pdf.get('codigo')}")
                     produtos_nao_encontrados.append({
                         "codigo": produto_pdf.get('codigo'),
                         "descricao": produto_pdf.get('descricao', 'N/A'),
                         "quantidade": produto_pdf.get('quantidade'),
-                        "erro": f"Erro ao processar: {str(e)}"
+                        "erro": "Produto não cadastrado no sistema"
                     })
-            else:
-                print(f"DEBUG: Produto não encontrado no sistema: {produto_pdf.get('codigo')}")
-                produtos_nao_encontrados.append({
-                    "codigo": produto_pdf.get('codigo'),
-                    "descricao": produto_pdf.get('descricao', 'N/A'),
-                    "quantidade": produto_pdf.get('quantidade'),
-                    "erro": "Produto não cadastrado no sistema"
-                })
-        
-        return {
-            "sucesso": True,
-            "arquivo": arquivo.filename,
-            "tipo": "ENTRADA",
-            "nota_fiscal": dados_pdf.get('nota_fiscal'),
-            "data_emissao": dados_pdf.get('data_emissao'),
-            "fornecedor": dados_pdf.get('fornecedor'),
-            "cnpj_fornecedor": dados_pdf.get('cnpj_fornecedor'),
-            "movimentacoes_criadas": movimentacoes_criadas,
-            "produtos_processados": produtos_processados,
-            "produtos_nao_encontrados": produtos_nao_encontrados,
-            "total_produtos_pdf": len(dados_pdf['produtos'])
-        }
+            
+            if encontrados:
+                lancamentos = StockService.post_stock_batch(
+                    db=db,
+                    itens=[lancamento for _, _, lancamento in encontrados],
+                    usuario_id=current_user.id,
+                    empresa_id=current_user.empresa_id,
+                    parcial=True
+                )
+                
+                for (produto_pdf, produto_nome, _), lancamento in zip(encontrados, lancamentos):
+                    if lancamento['sucesso']:
+                        produtos_processados.append({
+                            "codigo": produto_pdf.get('codigo'),
+                            "nome": produto_nome,
+                            "quantidade_entrada": produto_pdf.get('quantidade'),
+                            "estoque_anterior": lancamento['estoque_antes'],
+                            "estoque_atual": lancamento['estoque_depois']
+                        })
+                        movimentacoes_criadas += 1
+                        print(f"DEBUG: Movimentação criada para produto {produto_nome}")
+                    else:
+                        print(f"DEBUG: Erro ao criar movimentação para produto {produto_nome}: {lancamento['erro']}")
+                        produtos_nao_encontrados.append({
+                            "codigo": produto_pdf.get('codigo'),
+                            "descricao": produto_pdf.get('descricao', 'N/A'),
+                            "quantidade": produto_pdf.get('quantidade'),
+                            "erro": f"Erro ao processar: {lancamento['erro']}"
+                        })
+            
+            return {
+                "sucesso": True,
+                "arquivo": arquivo.filename,
+                "tipo": "ENTRADA",
+                "nota_fiscal": dados_pdf.get('nota_fiscal'),
+                "data_emissao": dados_pdf.get('data_emissao'),
+                "fornecedor": dados_pdf.get('fornecedor'),
+                "cnpj_fornecedor": dados_pdf.get('cnpj_fornecedor'),
+                "movimentacoes_criadas": movimentacoes_criadas,
+                "produtos_processados": produtos_processados,
+                "produtos_nao_encontrados": produtos_nao_encontrados,
+                "total_produtos_pdf": len(dados_pdf['produtos'])
+            }
         
+        # Associação de produtos e lançamentos no pool de threads de banco
+        return await parse_executor.executar_db(registrar_entradas)
+
+    except HTTPException:
+        # 503 da fila de parsing cheia e erros HTTP de registrar_entradas
+        raise
     except Exception as e:
         print(f"DEBUG: Erro geral no processamento: {e}")
         # Limpar arquivo temporário em caso de erro
@@ -230,61 +232,57 @@ async def processar_xml_entrada(
     try:
         logger.info(f"Iniciando processamento do arquivo XML de entrada: {arquivo.filename}")
         
-        # Salvar arquivo temporariamente e validar conteúdo
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xml') as temp_file:
-            content = await arquivo.read()
-            
-            # Validar se o conteúdo é realmente um XML
-            if not content or len(content) == 0:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="O arquivo enviado está vazio"
-                )
-            
-            # Verificar se o conteúdo começa com XML válido
-            content_str = content.decode('utf-8', errors='ignore')[:200]  # Primeiros 200 caracteres
-            if not ('<?xml' in content_str or '<nfeProc' in content_str or '<NFe' in content_str):
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="O arquivo não é um XML de NF-e válido. Certifique-se de enviar apenas arquivos XML de Nota Fiscal Eletrônica (NF-e)."
-                )
-            
-            # 🛡️ PROTEÇÃO CONTRA ARQUIVO DUPLICADO - Verificar se este arquivo já foi processado
-            # Verificar se a tabela existe antes de usar
-            from sqlalchemy import inspect, text
-            try:
-                inspector = inspect(engine)
-                tabelas = [table['name'] for table in inspector.get_table_names()]
-                tabela_existe = 'arquivos_processados' in tabelas
-                
-                if tabela_existe:
-                    hash_arquivo = calcular_hash_arquivo(content)
-                    arquivo_existente = db.query(models.ArquivoProcessado).filter(
+        # Salvar arquivo temporariamente (em blocos) e validar conteúdo
+        temp_file_path, hash_arquivo = await salvar_upload_temporario(arquivo, '.xml')
+        
+        # Validar se o conteúdo é realmente um XML
+        if os.path.getsize(temp_file_path) == 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="O arquivo enviado está vazio"
+            )
+        
+        # Verificar se o conteúdo começa com XML válido
+        content_str = ler_inicio_arquivo(temp_file_path, 200).decode('utf-8', errors='ignore')  # Primeiros 200 bytes
+        if not ('<?xml' in content_str or '<nfeProc' in content_str or '<NFe' in content_str):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="O arquivo não é um XML de NF-e válido. Certifique-se de enviar apenas arquivos XML de Nota Fiscal Eletrônica (NF-e)."
+            )
+
+        # 🛡️ PROTEÇÃO CONTRA ARQUIVO DUPLICADO - Verificar se este arquivo já foi processado
+        # Verificar se a tabela existe antes de usar (registro carregado no startup)
+        try:
+            if schema_capabilities.tabela_arquivos_processados_existe:
+                arquivo_existente = await parse_executor.executar_db(
+                    lambda: db.query(models.ArquivoProcessado).filter(
                         models.ArquivoProcessado.hash_arquivo == hash_arquivo,
                         models.ArquivoProcessado.empresa_id == current_user.empresa_id
                     ).first()
-                    
-                    if arquivo_existente:
-                        logger.warning(f"⚠️ Tentativa de processar arquivo duplicado: {arquivo.filename} (hash: {hash_arquivo[:16]}...)")
-                        raise HTTPException(
-                            status_code=status.HTTP_409_CONFLICT,
-                            detail=f"⚠️ ARQUIVO JÁ PROCESSADO! Este arquivo ({arquivo.filename}) já foi processado em {arquivo_existente.data_processamento.strftime('%d/%m/%Y às %H:%M')}. Para evitar duplicatas, não é possível processar o mesmo arquivo novamente."
-                        )
-            except Exception as e:
-                logger.warning(f"⚠️ Não foi possível verificar arquivo duplicado (tabela pode não existir ainda): {e}")
-                # Continua o processamento mesmo se não conseguir verificar
-            
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+                )
+
+                if arquivo_existente:
+                    logger.warning(f"⚠️ Tentativa de processar arquivo duplicado: {arquivo.filename} (hash: {hash_arquivo[:16]}...)")
+                    raise HTTPException(
+                        status_code=status.HTTP_409_CONFLICT,
+                        detail=f"⚠️ ARQUIVO JÁ PROCESSADO! Este arquivo ({arquivo.filename}) já foi processado em {arquivo_existente.data_processamento.strftime('%d/%m/%Y às %H:%M')}. Para evitar duplicatas, não é possível processar o mesmo arquivo novamente."
+                    )
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.warning(f"⚠️ Não foi possível verificar arquivo duplicado (tabela pode não existir ainda): {e}")
+            # Continua o processamento mesmo se não conseguir verificar
         
         logger.info(f"Arquivo XML salvo temporariamente em: {temp_file_path}")
         
-        # Processar XML usando o serviço
+        # Processar XML usando o serviço (parsing e consultas no pool de threads de banco)
         xml_processor = NFXMLProcessorService(db)
-        dados_nf = xml_processor.processar_nf_xml(
+        dados_nf = await parse_executor.executar_db(
+            xml_processor.processar_nf_xml,
             caminho_xml=temp_file_path,
             tipo_movimentacao="ENTRADA",
-            empresa_id_override=current_user.empresa_id
+            empresa_id_override=current_user.empresa_id,
+            hash_conteudo=hash_arquivo
         )
         
         logger.info(f"XML processado com sucesso. Total de produtos: {dados_nf.get('total_produtos', 0)}")
@@ -349,6 +347,14 @@ async def processar_xml_entrada(
             "produtos": produtos_formatados
         }
         
+    except HTTPException:
+        # Validações (400/409) e fila de parsing cheia (503) mantêm o status
+        if temp_file_path and os.path.exists(temp_file_path):
+            try:
+                os.unlink(temp_file_path)
+            except:
+                pass
+        raise
     except Exception as e:
         logger.error(f"Erro ao processar XML de entrada: {str(e)}", exc_info=True)
         
@@ -387,6 +393,7 @@ async def confirmar_entrada_xml(
         produtos_processados = []
         erros = []
         
+        itens = []
         for produto_conf in produtos_confirmados:
             produto_id = produto_conf.get('produto_id')
             quantidade = produto_conf.get('quantidade', 0)
@@ -394,52 +401,46 @@ async def confirmar_entrada_xml(
             if not produto_id or quantidade <= 0:
                 continue
             
-            try:
-                # Buscar produto para pegar estoque atual
-                produto_sistema = db.query(models.Produto).filter(
-                    models.Produto.id == produto_id,
-                    models.Produto.empresa_id == current_user.empresa_id
-                ).first()
-                
-                if not produto_sistema:
-                    erros.append({
-                        "produto_id": produto_id,
-                        "erro": "Produto não encontrado no sistema"
-                    })
-                    continue
-                
-                # Criar movimentação de entrada
-                movimentacao_data = schemas_movimentacao.MovimentacaoEstoqueCreate(
-                    produto_id=produto_id,
-                    tipo_movimentacao="ENTRADA",
-                    quantidade=float(quantidade),
-                    observacao=f"Entrada XML - NF {nota_fiscal}"
-                )
-                
-                produto_atualizado = crud_movimentacao.create_movimentacao_estoque(
-                    db=db,
-                    movimentacao=movimentacao_data,
-                    usuario_id=current_user.id,
-                    empresa_id=current_user.empresa_id
-                )
-                
-                produtos_processados.append({
-                    "produto_id": produto_id,
-                    "nome": produto_sistema.nome,
-                    "quantidade_entrada": quantidade,
-                    "estoque_anterior": produto_sistema.quantidade_em_estoque,
-                    "estoque_atual": produto_atualizado.quantidade_em_estoque
-                })
-                
-                movimentacoes_criadas += 1
-                logger.info(f"Movimentação criada: {produto_sistema.nome} +{quantidade}")
-                
-            except Exception as e:
-                logger.error(f"Erro ao criar movimentação para produto {produto_id}: {e}")
+            itens.append({
+                "produto_id": produto_id,
+                "tipo_movimentacao": "ENTRADA",
+                "quantidade": float(quantidade),
+                "observacao": f"Entrada XML - NF {nota_fiscal}",
+                "nota_fiscal": nota_fiscal
+            })
+        
+        # Todas as entradas da NF em uma única transação
+        lancamentos = StockService.post_stock_batch(
+            db=db,
+            itens=itens,
+            usuario_id=current_user.id,
+            empresa_id=current_user.empresa_id,
+            parcial=True
+        )
+        
+        for lancamento in lancamentos:
+            if not lancamento['sucesso']:
+                erro = lancamento['erro']
+                if lancamento['status_code'] == status.HTTP_404_NOT_FOUND:
+                    erro = "Produto não encontrado no sistema"
+                logger.error(f"Erro ao criar movimentação para produto {lancamento['produto_id']}: {erro}")
                 erros.append({
-                    "produto_id": produto_id,
-                    "erro": str(e)
+                    "produto_id": lancamento['produto_id'],
+                    "erro": erro
                 })
+                continue
+            
+            produto_nome = lancamento['produto_nome']
+            produtos_processados.append({
+                "produto_id": lancamento['produto_id'],
+                "nome": produto_nome,
+                "quantidade_entrada": lancamento['quantidade'],
+                "estoque_anterior": lancamento['estoque_antes'],
+                "estoque_atual": lancamento['estoque_depois']
+            })
+            
+            movimentacoes_criadas += 1
+            logger.info(f"Movimentação criada: {produto_nome} +{lancamento['quantidade']}")
         
         return {
             "sucesso": True,
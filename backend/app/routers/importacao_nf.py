@@ -0,0 +1,134 @@
+# backend/app/routers/importacao_nf.py
+
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Query
+from sqlalchemy.orm import Session
+from typing import List, Dict, Any, Optional
+from ..db import models
+from ..db.connection import get_db
+from ..core.config import settings
+from ..core.parse_executor import parse_executor
+from ..services.nf_importacao_lote_service import NFImportacaoLoteService
+from ..utils.upload_arquivos import salvar_upload_temporario
+from app.dependencies import get_current_user
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix="/movimentacoes/importacao-lote",
+    tags=["Importação de NFs em Lote"],
+    responses={404: {"description": "Não encontrado"}},
+)
+
+
+@router.post(
+    "",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=Dict[str, Any],
+    summary="Inicia a importação de várias NFs (PDF/XML) em segundo plano",
+    description="Recebe vários arquivos de NF, devolve o id do lote e processa os previews em segundo plano. Acompanhe pelo GET /movimentacoes/importacao-lote/{lote_id}."
+)
+async def criar_importacao_lote(
+    arquivos: List[UploadFile] = File(..., description="Arquivos PDF ou XML das notas fiscais"),
+    tipo_movimentacao: Optional[str] = Form(None, description="ENTRADA ou SAIDA (obrigatório para PDF; XML auto-detecta)"),
+    db: Session = Depends(get_db),
+    current_user: models.Usuario = Depends(get_current_user)
+):
+    """Registra o lote de NFs e agenda o processamento; não espera os previews."""
+
+    if not arquivos:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Nenhum arquivo foi enviado"
+        )
+
+    if len(arquivos) > settings.NF_LOTE_MAX_ARQUIVOS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Máximo de {settings.NF_LOTE_MAX_ARQUIVOS} arquivos por lote"
+        )
+
+    if tipo_movimentacao and tipo_movimentacao not in ['ENTRADA', 'SAIDA']:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Tipo de movimentação deve ser ENTRADA ou SAIDA"
+        )
+
+    for arquivo in arquivos:
+        nome = arquivo.filename or ""
+        extensao = os.path.splitext(nome.lower())[1]
+        if extensao not in ('.pdf', '.xml'):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Arquivo '{nome}': apenas PDF ou XML são aceitos"
+            )
+        if extensao == '.pdf' and not tipo_movimentacao:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Informe o tipo de movimentação (ENTRADA ou SAIDA) para importar PDFs"
+            )
+
+    # Cada arquivo é gravado em disco em blocos (sem manter o lote inteiro em memória)
+    arquivos_salvos = []
+    try:
+        for arquivo in arquivos:
+            nome = arquivo.filename or ""
+            extensao = os.path.splitext(nome.lower())[1]
+            caminho, hash_arquivo = await salvar_upload_temporario(arquivo, extensao, settings.MAX_UPLOAD_SIZE)
+            arquivos_salvos.append((nome, caminho, hash_arquivo))
+            if os.path.getsize(caminho) == 0:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"O arquivo '{nome}' está vazio"
+                )
+
+        lote = await parse_executor.executar_db(
+            NFImportacaoLoteService.criar_lote,
+            db,
+            arquivos_salvos,
+            tipo_movimentacao,
+            current_user.id,
+            current_user.empresa_id
+        )
+    finally:
+        # Os pendentes já foram movidos para o diretório do lote; sobram duplicados e os de lotes recusados
+        for _nome, caminho, _hash_arquivo in arquivos_salvos:
+            if os.path.exists(caminho):
+                os.unlink(caminho)
+
+    if lote['arquivos_pendentes']:
+        NFImportacaoLoteService.iniciar_processamento(lote['lote_id'])
+
+    return {
+        **lote,
+        'url_progresso': f"/movimentacoes/importacao-lote/{lote['lote_id']}"
+    }
+
+
+@router.get(
+    "",
+    response_model=List[Dict[str, Any]],
+    summary="Lista os lotes de importação recentes da empresa"
+)
+def listar_importacoes_lote(
+    limite: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current_user: models.Usuario = Depends(get_current_user)
+):
+    return NFImportacaoLoteService.listar_lotes(db, current_user.empresa_id, limite)
+
+
+@router.get(
+    "/{lote_id}",
+    response_model=Dict[str, Any],
+    summary="Progresso e previews de um lote de importação",
+    description="Status do lote e de cada arquivo. Com incluir_preview=true, inclui o preview gerado de cada NF (mesmo formato do preview individual), pronto para /movimentacoes/confirmar-movimentacoes."
+)
+def obter_importacao_lote(
+    lote_id: int,
+    incluir_preview: bool = Query(False, description="Incluir o preview de cada arquivo"),
+    db: Session = Depends(get_db),
+    current_user: models.Usuario = Depends(get_current_user)
+):
+    return NFImportacaoLoteService.obter_progresso(db, lote_id, current_user.empresa_id, incluir_preview)
@@ -1,26 +1,34 @@
 # backend/app/routers/movimentacoes.py
 
 # Adicionamos 'Body' às importações do FastAPI
-from fastapi import APIRouter, Depends, HTTPException, status, Body, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, status, Body, UploadFile, File, Form, Query
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, case, tuple_
 from typing import List, Dict, Any, Optional
 from ..db import models
-from ..services.stock_service import StockService
+from ..services.stock_service import StockService, normalizar_nota_fiscal
+from ..services.estatisticas_preco_service import EstatisticasPrecoService
+from ..services.vendas_unificadas_service import VendasUnificadasService
+import base64
 import json
 import os
-import tempfile
-import pdfplumber
 import re
 from datetime import datetime, timezone
 from app.utils.pdf_extractor_melhorado import extrair_produtos_inteligente_entrada_melhorado
+from app.utils.nf_linhas import extrair_itens_danfe
+from app.utils.pdf_texto import extrair_texto
+from app.utils.upload_arquivos import salvar_upload_temporario
 
 from ..crud import movimentacao_estoque as crud_movimentacao
 from ..schemas import movimentacao_estoque as schemas_movimentacao
 from ..schemas import produto as schemas_produto
 from ..schemas import usuario as schemas_usuario
 from ..db.connection import get_db, engine
+from ..db.schema_capabilities import schema_capabilities
+from ..core.parse_executor import parse_executor
+from ..core.parse_cache import parse_cache
+from app.core.config import settings
 from app.dependencies import get_current_user, get_current_operador, get_admin_user
 import logging
 # Serviço de similaridade importado dinamicamente quando necessário
@@ -116,11 +124,19 @@ def ajuste_inventario(
     resultados = []
     erros = []
     movimentacoes_criadas = 0
-    for item in body.itens:
-        produto = db.query(models.Produto).filter(
-            models.Produto.id == item.produto_id,
+
+    # Uma consulta para todos os produtos contados; os ajustes são lançados em um único lote
+    produtos = {
+        produto.id: produto
+        for produto in db.query(models.Produto).filter(
+            models.Produto.id.in_({item.produto_id for item in body.itens}),
             models.Produto.empresa_id == empresa_id
-        ).first()
+        ).all()
+    }
+
+    ajustes = []
+    for item in body.itens:
+        produto = produtos.get(item.produto_id)
         if not produto:
             erros.append({"produto_id": item.produto_id, "erro": "Produto não encontrado ou não pertence à empresa."})
             continue
@@ -136,43 +152,46 @@ def ajuste_inventario(
                 "acao": "nenhuma"
             })
             continue
+        if diff > 0:
+            observacao = f"Contagem física (inventário): ajuste +{diff} para alinhar ao físico ({item.quantidade_fisica})"
+        else:
+            observacao = f"Contagem física (inventário): ajuste -{abs(diff)} para alinhar ao físico ({item.quantidade_fisica})"
+        resultados.append(None)  # preenchido após o lançamento, mantendo a ordem dos itens
+        ajustes.append((len(resultados) - 1, item, produto.nome, estoque_atual, diff, {
+            "produto_id": item.produto_id,
+            "quantidade": abs(diff),
+            "tipo_movimentacao": "ENTRADA" if diff > 0 else "SAIDA",
+            "origem": "CORRECAO_MANUAL",
+            "observacao": observacao
+        }))
+
+    if ajustes:
         try:
-            if diff > 0:
-                StockService.update_stock_transactionally(
-                    db=db,
-                    produto_id=item.produto_id,
-                    quantidade=diff,
-                    tipo_movimentacao="ENTRADA",
-                    usuario_id=usuario_id,
-                    empresa_id=empresa_id,
-                    origem="CORRECAO_MANUAL",
-                    observacao=f"Contagem física (inventário): ajuste +{diff} para alinhar ao físico ({item.quantidade_fisica})"
-                )
-            else:
-                StockService.update_stock_transactionally(
-                    db=db,
-                    produto_id=item.produto_id,
-                    quantidade=abs(diff),
-                    tipo_movimentacao="SAIDA",
-                    usuario_id=usuario_id,
-                    empresa_id=empresa_id,
-                    origem="CORRECAO_MANUAL",
-                    observacao=f"Contagem física (inventário): ajuste -{abs(diff)} para alinhar ao físico ({item.quantidade_fisica})"
-                )
+            lancamentos = StockService.post_stock_batch(
+                db=db,
+                itens=[lancamento for *_, lancamento in ajustes],
+                usuario_id=usuario_id,
+                empresa_id=empresa_id,
+                parcial=True
+            )
+        except HTTPException as e:
+            lancamentos = [{"sucesso": False, "erro": e.detail}] * len(ajustes)
+
+        for (posicao, item, produto_nome, estoque_atual, diff, _), lancamento in zip(ajustes, lancamentos):
+            if not lancamento["sucesso"]:
+                erros.append({"produto_id": item.produto_id, "erro": lancamento["erro"]})
+                continue
             movimentacoes_criadas += 1
-            resultados.append({
+            resultados[posicao] = {
                 "produto_id": item.produto_id,
-                "produto_nome": produto.nome,
+                "produto_nome": produto_nome,
                 "estoque_atual": estoque_atual,
                 "quantidade_fisica": item.quantidade_fisica,
                 "diferenca": diff,
                 "acao": "ENTRADA" if diff > 0 else "SAIDA",
-                "novo_estoque": item.quantidade_fisica
-            })
-        except HTTPException as e:
-            erros.append({"produto_id": item.produto_id, "erro": e.detail})
-        except Exception as e:
-            erros.append({"produto_id": item.produto_id, "erro": str(e)})
+                "novo_estoque": lancamento["estoque_depois"]
+            }
+        resultados = [resultado for resultado in resultados if resultado is not None]
     return {
         "sucesso": True,
         "movimentacoes_criadas": movimentacoes_criadas,
@@ -181,138 +200,128 @@ def ajuste_inventario(
     }
 
 
+def _encode_cursor_historico(data_movimentacao: datetime, movimentacao_id: int) -> str:
+    """Gera o cursor opaco (keyset data_movimentacao, id) da próxima página."""
+    raw = json.dumps({"d": data_movimentacao.isoformat(), "i": movimentacao_id})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor_historico(cursor: str):
+    """Decodifica o cursor gerado por _encode_cursor_historico."""
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+        return datetime.fromisoformat(raw["d"]), int(raw["i"])
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cursor de paginação inválido"
+        )
+
+
 @router.get(
     "/historico-geral",
     response_model=Dict[str, Any],
     summary="Lista o histórico geral de movimentações",
-    description="Retorna todas as movimentações de estoque da empresa, com filtros opcionais por tipo e termo de busca."
+    description=(
+        "Retorna as movimentações de estoque da empresa, da mais recente para a mais antiga, "
+        "com filtros opcionais por tipo e termo de busca. A paginação é por cursor: envie o "
+        "`proximo_cursor` retornado em `paginacao` para obter a página seguinte. "
+        "As estatísticas consideram todas as movimentações que atendem aos filtros."
+    )
 )
 def read_historico_geral(
     tipo: str = None,
     search: str = None,
+    limit: int = Query(settings.DEFAULT_PAGE_SIZE, ge=1, le=settings.MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="Cursor retornado pela página anterior"),
     db: Session = Depends(get_db),
     current_user: models.Usuario = Depends(get_current_user)
 ):
+    cursor_data = _decode_cursor_historico(cursor) if cursor else None
+    Mov = models.MovimentacaoEstoque
+
     try:
-        # Verificar se as colunas de reversão existem antes de fazer a query
-        from sqlalchemy import inspect, text
-        
-        try:
-            # Verificar se a coluna reversao_de_id existe
-            inspector = inspect(engine)
-            columns = [col['name'] for col in inspector.get_columns('movimentacoes_estoque')]
-            colunas_reversao_existem = 'reversao_de_id' in columns
-        except Exception as e:
-            logger.warning(f"⚠️ Erro ao verificar colunas: {e}. Assumindo que não existem.")
-            colunas_reversao_existem = False
-        
-        # Construir query SQL dinâmica baseada nos filtros
-        where_clauses = ["p.empresa_id = :empresa_id"]
-        params = {'empresa_id': current_user.empresa_id}
+        # Filtros comuns à página e às estatísticas
+        filtros = [models.Produto.empresa_id == current_user.empresa_id]
         
         if tipo and tipo != "TODOS":
-            where_clauses.append("me.tipo_movimentacao = :tipo")
-            params['tipo'] = tipo
+            filtros.append(Mov.tipo_movimentacao == tipo)
         
         if search:
-            where_clauses.append("(p.nome ILIKE :search OR me.observacao ILIKE :search)")
-            params['search'] = f"%{search}%"
-        
-        where_sql = " AND ".join(where_clauses)
-        
-        # Query SQL que só busca colunas que existem
-        sql_query = text(f"""
-            SELECT 
-                me.id, me.tipo_movimentacao, me.quantidade, me.observacao,
-                me.data_movimentacao, me.origem, me.quantidade_antes, me.quantidade_depois,
-                me.status, me.aprovado_por_id, me.data_aprovacao, me.motivo_rejeicao,
-                me.motivo_movimentacao, me.observacao_motivo, me.dados_antes_edicao,
-                me.dados_depois_edicao, me.produto_id, me.usuario_id
-            FROM movimentacoes_estoque me
-            JOIN produtos p ON p.id = me.produto_id
-            WHERE {where_sql}
-            ORDER BY me.data_movimentacao DESC
-        """)
-        
-        result = db.execute(sql_query, params)
-        rows = result.fetchall()
-        
-        # Converter para objetos MovimentacaoEstoque
-        movimentacoes = []
-        for row in rows:
-            mov = models.MovimentacaoEstoque()
-            mov.id = row[0]
-            mov.tipo_movimentacao = row[1]
-            mov.quantidade = row[2]
-            mov.observacao = row[3]
-            mov.data_movimentacao = row[4]
-            mov.origem = row[5]
-            mov.quantidade_antes = row[6]
-            mov.quantidade_depois = row[7]
-            mov.status = row[8]
-            mov.aprovado_por_id = row[9]
-            mov.data_aprovacao = row[10]
-            mov.motivo_rejeicao = row[11]
-            mov.motivo_movimentacao = row[12]
-            mov.observacao_motivo = row[13]
-            mov.dados_antes_edicao = row[14]
-            mov.dados_depois_edicao = row[15]
-            mov.produto_id = row[16]
-            mov.usuario_id = row[17]
-            
-            # Adicionar campos de reversão se existirem
-            if colunas_reversao_existem:
-                try:
-                    mov.revertida = getattr(mov, 'revertida', False)
-                    mov.reversao_de_id = getattr(mov, 'reversao_de_id', None)
-                    mov.data_reversao = getattr(mov, 'data_reversao', None)
-                    mov.revertida_por_id = getattr(mov, 'revertida_por_id', None)
-                except:
-                    mov.revertida = False
-                    mov.reversao_de_id = None
-                    mov.data_reversao = None
-                    mov.revertida_por_id = None
-            else:
-                mov.revertida = False
-                mov.reversao_de_id = None
-                mov.data_reversao = None
-                mov.revertida_por_id = None
-            
-            movimentacoes.append(mov)
+            filtros.append(
+                models.Produto.nome.ilike(f"%{search}%") | Mov.observacao.ilike(f"%{search}%")
+            )
         
-        # Calcular estatísticas
-        total_entradas = sum(m.quantidade for m in movimentacoes if m.tipo_movimentacao == "ENTRADA")
-        total_saidas = sum(m.quantidade for m in movimentacoes if m.tipo_movimentacao == "SAIDA")
+        # Estatísticas calculadas no banco sobre todo o conjunto filtrado
+        estatisticas = db.query(
+            func.count(Mov.id).label("total_movimentacoes"),
+            func.coalesce(func.sum(case((Mov.tipo_movimentacao == "ENTRADA", Mov.quantidade), else_=0)), 0).label("total_entradas"),
+            func.coalesce(func.sum(case((Mov.tipo_movimentacao == "SAIDA", Mov.quantidade), else_=0)), 0).label("total_saidas"),
+        ).join(models.Produto, models.Produto.id == Mov.produto_id).filter(*filtros).one()
+        
+        # Página atual: keyset em (data_movimentacao, id), com produto e usuário na mesma query
+        query = db.query(
+            Mov.id, Mov.tipo_movimentacao, Mov.quantidade, Mov.observacao,
+            Mov.data_movimentacao, Mov.origem, Mov.quantidade_antes, Mov.quantidade_depois,
+            Mov.produto_id,
+            models.Produto.nome.label("produto_nome"),
+            models.Produto.codigo.label("produto_codigo"),
+            models.Produto.quantidade_em_estoque.label("estoque_atual"),
+            models.Usuario.nome.label("usuario_nome"),
+        ).join(
+            models.Produto, models.Produto.id == Mov.produto_id
+        ).outerjoin(
+            models.Usuario, models.Usuario.id == Mov.usuario_id
+        ).filter(*filtros)
+        
+        if cursor_data:
+            query = query.filter(tuple_(Mov.data_movimentacao, Mov.id) < tuple_(*cursor_data))
+        
+        rows = query.order_by(
+            Mov.data_movimentacao.desc(), Mov.id.desc()
+        ).limit(limit + 1).all()
+        
+        tem_mais = len(rows) > limit
+        rows = [row._mapping for row in rows[:limit]]
+        
+        movimentacoes_formatadas = [
+            {
+                "id": row["id"],
+                "produto_id": row["produto_id"],
+                "produto_nome": row["produto_nome"],
+                "produto_codigo": row["produto_codigo"] or "",
+                "tipo_movimentacao": row["tipo_movimentacao"],
+                "quantidade": row["quantidade"],
+                "quantidade_antes": row["quantidade_antes"],
+                "quantidade_depois": row["quantidade_depois"],
+                "origem": row["origem"],
+                "estoque_atual": row["estoque_atual"] or 0,
+                "data_movimentacao": row["data_movimentacao"].isoformat(),
+                "observacao": row["observacao"],
+                "usuario_nome": row["usuario_nome"] or "Usuário não encontrado"
+            }
+            for row in rows
+        ]
         
-        # Formatar resposta
-        movimentacoes_formatadas = []
-        for mov in movimentacoes:
-            produto = db.query(models.Produto).filter(models.Produto.id == mov.produto_id).first()
-            usuario = db.query(models.Usuario).filter(models.Usuario.id == mov.usuario_id).first()
-            
-            movimentacoes_formatadas.append({
-                "id": mov.id,
-                "produto_id": mov.produto_id,
-                "produto_nome": produto.nome if produto else "Produto não encontrado",
-                "produto_codigo": produto.codigo if produto else "",
-                "tipo_movimentacao": mov.tipo_movimentacao,
-                "quantidade": mov.quantidade,
-                "quantidade_antes": mov.quantidade_antes,
-                "quantidade_depois": mov.quantidade_depois,
-                "origem": mov.origem,
-                "estoque_atual": produto.quantidade_em_estoque if produto else 0,
-                "data_movimentacao": mov.data_movimentacao.isoformat(),
-                "observacao": mov.observacao,
-                "usuario_nome": usuario.nome if usuario else "Usuário não encontrado"
-            })
+        proximo_cursor = None
+        if tem_mais and rows:
+            proximo_cursor = _encode_cursor_historico(rows[-1]["data_movimentacao"], rows[-1]["id"])
+        
+        total_entradas = estatisticas.total_entradas
+        total_saidas = estatisticas.total_saidas
         
         return {
             "movimentacoes": movimentacoes_formatadas,
             "estatisticas": {
-                "total_movimentacoes": len(movimentacoes),
+                "total_movimentacoes": estatisticas.total_movimentacoes,
                 "total_entradas": total_entradas,
                 "total_saidas": total_saidas,
                 "saldo_liquido": total_entradas - total_saidas
+            },
+            "paginacao": {
+                "limit": limit,
+                "tem_mais": tem_mais,
+                "proximo_cursor": proximo_cursor
             }
         }
         
@@ -358,18 +367,20 @@ async def buscar_produtos_similares(
         min_similarity=min_similarity
     )
     
-    # Mapear incluindo estoque_atual
+    # Mapear incluindo estoque_atual (uma única consulta para todos os resultados)
+    estoques = dict(
+        db.query(models.Produto.id, models.Produto.quantidade_em_estoque).filter(
+            models.Produto.id.in_([p['id'] for p in produtos_similares]),
+            models.Produto.empresa_id == empresa_id
+        ).all()
+    ) if produtos_similares else {}
     similares_mapeados = []
     for p in produtos_similares:
-        prod_db = db.query(models.Produto).filter(
-            models.Produto.id == p['id'],
-            models.Produto.empresa_id == empresa_id
-        ).first()
         similares_mapeados.append({
             'produto_id': p['id'],
             'nome': p['nome'],
             'codigo': p['codigo'],
-            'estoque_atual': getattr(prod_db, 'quantidade_em_estoque', 0) if prod_db else 0,
+            'estoque_atual': estoques.get(p['id']) or 0,
             'score_similaridade': p['similarity_score'],
             'categoria': p.get('categoria', ''),
             'unidade_medida': p.get('unidade_medida', ''),
@@ -420,68 +431,73 @@ async def preview_pdf_movimentacao(
         print(f"DEBUG: Iniciando preview do arquivo {arquivo.filename}")
         
         # Salvar arquivo temporariamente
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            content = await arquivo.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+        temp_file_path, hash_arquivo = await salvar_upload_temporario(arquivo, '.pdf')
         
         print(f"DEBUG: Arquivo salvo temporariamente em {temp_file_path}")
         
-        # Usar novo serviço de processamento de NF
-        from ..services.nf_processor_service import NFProcessorService
-        nf_service = NFProcessorService(db)
+        # Extração do texto no pool de processos (fora do event loop)
+        from ..services.nf_processor_service import NFProcessorService, extrair_texto_pdf
+        try:
+            texto_pdf = await parse_cache.executar_parse('pdf_texto', hash_arquivo, extrair_texto_pdf, temp_file_path)
+        finally:
+            os.unlink(temp_file_path)
         
-        # Processar NF usando o serviço integrado
         # Para SAÍDAS, sempre usar a empresa do usuário logado
         # Para ENTRADAS, tentar identificar automaticamente (pode ser de fornecedor diferente)
         empresa_id_override = current_user.empresa_id if tipo_movimentacao == 'SAIDA' else None
         
-        resultado = nf_service.processar_nf_pdf(
-            caminho_pdf=temp_file_path,
-            tipo_movimentacao=tipo_movimentacao,
-            vendedor_id=vendedor_id,
-            orcamento_id=orcamento_id,
-            usuario_id=current_user.id,
-            empresa_id_override=empresa_id_override,
-            nome_arquivo_original=arquivo.filename  # Passar nome original para detecção
-        )
-        
-        # Limpar arquivo temporário
-        os.unlink(temp_file_path)
-        
-        # Buscar lista de vendedores para seleção (se NF de saída)
-        vendedores_disponiveis = []
-        if tipo_movimentacao == 'SAIDA':
-            vendedores = db.query(models.Usuario).filter(
-                models.Usuario.empresa_id == resultado['empresa_id'],
-                models.Usuario.perfil.ilike('%VENDEDOR%'),
-                models.Usuario.is_active == True
-            ).all()
-            vendedores_disponiveis = [
-                {
-                    'id': v.id,
-                    'nome': v.nome,
-                    'email': v.email
-                }
-                for v in vendedores
-            ]
-        
-        # Buscar lista de orçamentos recentes do cliente (se cliente identificado)
-        orcamentos_disponiveis = []
-        if tipo_movimentacao == 'SAIDA' and resultado.get('cliente_id'):
-            orcamentos = db.query(models.Orcamento).filter(
-                models.Orcamento.cliente_id == resultado['cliente_id'],
-                models.Orcamento.status.in_(['RASCUNHO', 'ENVIADO', 'APROVADO'])
-            ).order_by(models.Orcamento.data_criacao.desc()).limit(10).all()
-            orcamentos_disponiveis = [
-                {
-                    'id': o.id,
-                    'numero': f"#{o.id}",
-                    'data_criacao': o.data_criacao.isoformat() if o.data_criacao else None,
-                    'status': o.status
-                }
-                for o in orcamentos
-            ]
+        def montar_preview():
+            # Processar NF usando o serviço integrado
+            nf_service = NFProcessorService(db)
+            resultado = nf_service.processar_nf_pdf(
+                caminho_pdf=temp_file_path,
+                tipo_movimentacao=tipo_movimentacao,
+                vendedor_id=vendedor_id,
+                orcamento_id=orcamento_id,
+                usuario_id=current_user.id,
+                empresa_id_override=empresa_id_override,
+                nome_arquivo_original=arquivo.filename,  # Passar nome original para detecção
+                texto_pdf=texto_pdf,
+                hash_conteudo=hash_arquivo
+            )
+            
+            # Buscar lista de vendedores para seleção (se NF de saída)
+            vendedores_disponiveis = []
+            if tipo_movimentacao == 'SAIDA':
+                vendedores = db.query(models.Usuario).filter(
+                    models.Usuario.empresa_id == resultado['empresa_id'],
+                    models.Usuario.perfil.ilike('%VENDEDOR%'),
+                    models.Usuario.is_active == True
+                ).all()
+                vendedores_disponiveis = [
+                    {
+                        'id': v.id,
+                        'nome': v.nome,
+                        'email': v.email
+                    }
+                    for v in vendedores
+                ]
+            
+            # Buscar lista de orçamentos recentes do cliente (se cliente identificado)
+            orcamentos_disponiveis = []
+            if tipo_movimentacao == 'SAIDA' and resultado.get('cliente_id'):
+                orcamentos = db.query(models.Orcamento).filter(
+                    models.Orcamento.cliente_id == resultado['cliente_id'],
+                    models.Orcamento.status.in_(['RASCUNHO', 'ENVIADO', 'APROVADO'])
+                ).order_by(models.Orcamento.data_criacao.desc()).limit(10).all()
+                orcamentos_disponiveis = [
+                    {
+                        'id': o.id,
+                        'numero': f"#{o.id}",
+                        'data_criacao': o.data_criacao.isoformat() if o.data_criacao else None,
+                        'status': o.status
+                    }
+                    for o in orcamentos
+                ]
+            return resultado, vendedores_disponiveis, orcamentos_disponiveis
+        
+        # Consultas e criação de cliente no pool de threads de banco
+        resultado, vendedores_disponiveis, orcamentos_disponiveis = await parse_executor.executar_db(montar_preview)
         
         # Formatar resposta
         return {
@@ -627,18 +643,18 @@ async def confirmar_movimentacoes(
             )
         
         # 🛡️ PROTEÇÃO CONTRA DUPLICATAS - Verificar se esta NF já foi processada
-        if nota_fiscal and arquivo:
+        if normalizar_nota_fiscal(nota_fiscal) and arquivo:
             # Verificar se há movimentações recentes (últimos 30 minutos) com a mesma NF
             from datetime import timedelta
             limite_tempo = datetime.now() - timedelta(minutes=30)
             
-            # Buscar movimentações recentes que mencionam esta NF na observação
+            # Buscar movimentações recentes desta NF (índice nota_fiscal, tipo, data)
             movimentacoes_recentes = db.query(models.MovimentacaoEstoque).join(
                 models.Produto
             ).filter(
                 models.Produto.empresa_id == empresa_id,
+                models.MovimentacaoEstoque.nota_fiscal == normalizar_nota_fiscal(nota_fiscal),
                 models.MovimentacaoEstoque.tipo_movimentacao == tipo_movimentacao,
-                models.MovimentacaoEstoque.observacao.like(f'%NF {nota_fiscal}%'),
                 models.MovimentacaoEstoque.data_movimentacao >= limite_tempo
             ).all()
             
@@ -660,6 +676,7 @@ async def confirmar_movimentacoes(
             'cliente_id': dados.get('cliente_id'),
             'vendedor_id': dados.get('vendedor_id'),
             'orcamento_id': dados.get('orcamento_id'),
+            'chave_acesso': dados.get('chave_acesso'),
             'produtos_confirmados': produtos_confirmados
         }
         
@@ -672,6 +689,23 @@ async def confirmar_movimentacoes(
             usuario_id=current_user.id
         )
         
+        # NF vinda de um lote de importação: registra o arquivo como processado (deduplicação)
+        importacao_arquivo_id = dados.get('importacao_arquivo_id')
+        if importacao_arquivo_id:
+            from ..services.nf_importacao_lote_service import NFImportacaoLoteService
+            try:
+                NFImportacaoLoteService.registrar_arquivo_confirmado(
+                    db,
+                    arquivo_id=importacao_arquivo_id,
+                    empresa_id=empresa_id,
+                    usuario_id=current_user.id,
+                    tipo_movimentacao=tipo_movimentacao,
+                    total_movimentacoes=resultado['movimentacoes_criadas']
+                )
+            except Exception as e:
+                db.rollback()
+                logger.warning(f"⚠️ Não foi possível registrar o arquivo {importacao_arquivo_id} do lote como processado: {e}")
+        
         # Processar códigos sincronizados se houver (mantendo compatibilidade)
         codigos_sincronizados = []
         for produto_data in produtos_confirmados:
@@ -856,102 +890,106 @@ async def processar_pdf_entrada(
         print(f"DEBUG: Iniciando processamento do arquivo de entrada {arquivo.filename}")
         
         # Salvar arquivo temporariamente
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            content = await arquivo.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+        temp_file_path, hash_arquivo = await salvar_upload_temporario(arquivo, '.pdf')
         
         print(f"DEBUG: Arquivo salvo temporariamente em {temp_file_path}")
         
-        # Extrair dados do PDF de entrada
+        # Extrair dados do PDF de entrada (pool de processos, fora do event loop)
         print(f"DEBUG: Iniciando extração de dados do PDF de entrada")
-        dados_extraidos = extrair_dados_pdf_entrada(temp_file_path)
+        try:
+            dados_extraidos = await parse_cache.executar_parse('pdf_entrada', hash_arquivo, extrair_dados_pdf_entrada, temp_file_path)
+        finally:
+            # Limpar arquivo temporário
+            os.unlink(temp_file_path)
         print(f"DEBUG: Dados extraídos: {dados_extraidos}")
         
-        # Limpar arquivo temporário
-        os.unlink(temp_file_path)
-        
         if not dados_extraidos or not dados_extraidos.get('produtos'):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Não foi possível extrair dados válidos do PDF de entrada"
             )
         
-        # Processar movimentações de entrada
-        movimentacoes_criadas = []
-        produtos_nao_encontrados = []
-        
-        for produto_data in dados_extraidos['produtos']:
-            codigo = produto_data.get('codigo')
-            quantidade = produto_data.get('quantidade', 0)
-            
-            if not codigo or quantidade <= 0:
-                continue
+        def registrar_movimentacoes():
+            # Processar movimentações de entrada
+            movimentacoes_criadas = []
+            produtos_nao_encontrados = []
             
-            # Buscar produto pelo código
-            produto = db.query(models.Produto).filter(
-                models.Produto.codigo == str(codigo),
-                models.Produto.empresa_id == current_user.empresa_id
-            ).first()
-            
-            if not produto:
-                produtos_nao_encontrados.append({
-                    'codigo': codigo,
-                    'descricao': produto_data.get('descricao', 'N/A')
-                })
-                continue
-            
-            # Criar movimentação de entrada
-            observacao = f"Entrada automática - NF {dados_extraidos.get('nota_fiscal', 'N/A')} - Fornecedor: {dados_extraidos.get('fornecedor', 'N/A')}"
-            
-            movimentacao_data = schemas_movimentacao.MovimentacaoEstoqueCreate(
-                produto_id=produto.id,
-                tipo_movimentacao='ENTRADA',
-                quantidade=quantidade,
-                observacao=observacao
-            )
-            
-            try:
-                produto_atualizado = crud_movimentacao.create_movimentacao_estoque(
-                    db=db,
-                    movimentacao=movimentacao_data,
-                    usuario_id=current_user.id,
-                    empresa_id=current_user.empresa_id
+            for produto_data in dados_extraidos['produtos']:
+                codigo = produto_data.get('codigo')
+                quantidade = produto_data.get('quantidade', 0)
+                
+                if not codigo or quantidade <= 0:
+                    continue
+                
+                # Buscar produto pelo código
+                produto = db.query(models.Produto).filter(
+                    models.Produto.codigo == str(codigo),
+                    models.Produto.empresa_id == current_user.empresa_id
+                ).first()
+                
+                if not produto:
+                    produtos_nao_encontrados.append({
+                        'codigo': codigo,
+                        'descricao': produto_data.get('descricao', 'N/A')
+                    })
+                    continue
+                
+                # Criar movimentação de entrada
+                observacao = f"Entrada automática - NF {dados_extraidos.get('nota_fiscal', 'N/A')} - Fornecedor: {dados_extraidos.get('fornecedor', 'N/A')}"
+                
+                movimentacao_data = schemas_movimentacao.MovimentacaoEstoqueCreate(
+                    produto_id=produto.id,
+                    tipo_movimentacao='ENTRADA',
+                    quantidade=quantidade,
+                    observacao=observacao,
+                    nota_fiscal=dados_extraidos.get('nota_fiscal'),
+                    chave_acesso=dados_extraidos.get('chave_acesso')
                 )
                 
-                movimentacoes_criadas.append({
-                    'produto_id': produto.id,
-                    'codigo': codigo,
-                    'nome': produto.nome,
-                    'quantidade': quantidade,
-                    'estoque_anterior': produto_atualizado.quantidade_em_estoque - quantidade,
-                    'estoque_atual': produto_atualizado.quantidade_em_estoque
-                })
-            except Exception as e:
-                produtos_nao_encontrados.append({
-                    'codigo': codigo,
-                    'descricao': produto_data.get('descricao', 'N/A'),
-                    'erro': str(e)
-                })
-        
-        return {
-            'sucesso': True,
-            'mensagem': f"PDF de entrada processado com sucesso! {len(movimentacoes_criadas)} movimentações criadas.",
-            'arquivo': arquivo.filename,
-            'tipo': 'ENTRADA',
-            'tipo_movimentacao': 'ENTRADA',
-            'nota_fiscal': dados_extraidos.get('nota_fiscal'),
-            'data_emissao': dados_extraidos.get('data_emissao'),
-            'fornecedor': dados_extraidos.get('fornecedor'),
-            'cnpj_fornecedor': dados_extraidos.get('cnpj_fornecedor'),
-            'movimentacoes_criadas': len(movimentacoes_criadas),
-            'produtos_atualizados': [f"{item['codigo']} - {item['nome']}" for item in movimentacoes_criadas],
-            'detalhes': {
-                'produtos_processados': movimentacoes_criadas,
-                'produtos_nao_encontrados': produtos_nao_encontrados,
-                'total_produtos_pdf': len(dados_extraidos['produtos'])
+                try:
+                    produto_atualizado = crud_movimentacao.create_movimentacao_estoque(
+                        db=db,
+                        movimentacao=movimentacao_data,
+                        usuario_id=current_user.id,
+                        empresa_id=current_user.empresa_id
+                    )
+                    
+                    movimentacoes_criadas.append({
+                        'produto_id': produto.id,
+                        'codigo': codigo,
+                        'nome': produto.nome,
+                        'quantidade': quantidade,
+                        'estoque_anterior': produto_atualizado.quantidade_em_estoque - quantidade,
+                        'estoque_atual': produto_atualizado.quantidade_em_estoque
+                    })
+                except Exception as e:
+                    produtos_nao_encontrados.append({
+                        'codigo': codigo,
+                        'descricao': produto_data.get('descricao', 'N/A'),
+                        'erro': str(e)
+                    })
+            
+            return {
+                'sucesso': True,
+                'mensagem': f"PDF de entrada processado com sucesso! {len(movimentacoes_criadas)} movimentações criadas.",
+                'arquivo': arquivo.filename,
+                'tipo': 'ENTRADA',
+                'tipo_movimentacao': 'ENTRADA',
+                'nota_fiscal': dados_extraidos.get('nota_fiscal'),
+                'data_emissao': dados_extraidos.get('data_emissao'),
+                'fornecedor': dados_extraidos.get('fornecedor'),
+                'cnpj_fornecedor': dados_extraidos.get('cnpj_fornecedor'),
+                'movimentacoes_criadas': len(movimentacoes_criadas),
+                'produtos_atualizados': [f"{item['codigo']} - {item['nome']}" for item in movimentacoes_criadas],
+                'detalhes': {
+                    'produtos_processados': movimentacoes_criadas,
+                    'produtos_nao_encontrados': produtos_nao_encontrados,
+                    'total_produtos_pdf': len(dados_extraidos['produtos'])
+                }
             }
-        }
+        
+        # Consultas e lançamentos no pool de threads de banco
+        return await parse_executor.executar_db(registrar_movimentacoes)
         
     except HTTPException as he:
         print(f"DEBUG: HTTPException capturada: {he.status_code} - {he.detail}")
@@ -1011,158 +1049,166 @@ async def processar_pdf_movimentacao(
         print(f"DEBUG: Iniciando processamento do arquivo {arquivo.filename}")
         
         # Salvar arquivo temporariamente
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            content = await arquivo.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+        temp_file_path, hash_arquivo = await salvar_upload_temporario(arquivo, '.pdf')
         
         print(f"DEBUG: Arquivo salvo temporariamente em {temp_file_path}")
         
-        # Extrair dados do PDF
+        # Extrair dados do PDF (pool de processos, fora do event loop)
         print(f"DEBUG: Iniciando extração de dados do PDF")
         if tipo_movimentacao == 'ENTRADA':
-            dados_extraidos = extrair_dados_pdf_entrada(temp_file_path)
+            tipo_cache, extrator = 'pdf_entrada', extrair_dados_pdf_entrada
         else:
-            dados_extraidos = extrair_dados_pdf(temp_file_path)
+            tipo_cache, extrator = 'pdf_movimentacao', extrair_dados_pdf
+        try:
+            dados_extraidos = await parse_cache.executar_parse(tipo_cache, hash_arquivo, extrator, temp_file_path)
+        finally:
+            # Limpar arquivo temporário
+            os.unlink(temp_file_path)
         print(f"DEBUG: Dados extraídos: {dados_extraidos}")
         
-        # Limpar arquivo temporário
-        os.unlink(temp_file_path)
-        
         if not dados_extraidos or not dados_extraidos.get('produtos'):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Não foi possível extrair dados válidos do PDF"
             )
         
-        # Processar movimentações
-        movimentacoes_criadas = []
-        produtos_nao_encontrados = []
-        
-        for produto_data in dados_extraidos['produtos']:
-            codigo = produto_data.get('codigo')
-            quantidade = produto_data.get('quantidade', 0)
-            descricao = produto_data.get('descricao', '')
-            
-            if not codigo or quantidade <= 0:
-                continue
+        def registrar_movimentacoes():
+            # Processar movimentações
+            movimentacoes_criadas = []
+            produtos_nao_encontrados = []
             
-            # Buscar produto pelo código
-            produto = db.query(models.Produto).filter(
-                models.Produto.codigo == str(codigo),
-                models.Produto.empresa_id == current_user.empresa_id
-            ).first()
-            
-            if not produto:
-                # Buscar produtos similares por nome para auxiliar associação posterior
-                produtos_similares = similarity_service.find_similar_products(
-                    search_name=descricao,
-                    db=db,
-                    empresa_id=current_user.empresa_id,
-                    limit=5,
-                    min_similarity=30
-                ) if descricao else []
-                # Mapear incluindo estoque_atual e renomear score para score_similaridade
-                similares_mapeados = []
-                for p in produtos_similares:
-                    prod_db = db.query(models.Produto).filter(
-                        models.Produto.id == p['id'],
-                        models.Produto.empresa_id == current_user.empresa_id
-                    ).first()
-                    similares_mapeados.append({
-                        'produto_id': p['id'],
-                        'nome': p['nome'],
-                        'codigo': p['codigo'],
-                        'estoque_atual': getattr(prod_db, 'quantidade_em_estoque', 0) if prod_db else 0,
-                        'score_similaridade': p['similarity_score'],
-                        'categoria': p.get('categoria', ''),
-                        'unidade_medida': p.get('unidade_medida', ''),
-                        'preco_venda': p.get('preco_venda', 0)
+            for produto_data in dados_extraidos['produtos']:
+                codigo = produto_data.get('codigo')
+                quantidade = produto_data.get('quantidade', 0)
+                descricao = produto_data.get('descricao', '')
+                
+                if not codigo or quantidade <= 0:
+                    continue
+                
+                # Buscar produto pelo código
+                produto = db.query(models.Produto).filter(
+                    models.Produto.codigo == str(codigo),
+                    models.Produto.empresa_id == current_user.empresa_id
+                ).first()
+                
+                if not produto:
+                    # Buscar produtos similares por nome para auxiliar associação posterior
+                    produtos_similares = similarity_service.find_similar_products(
+                        search_name=descricao,
+                        db=db,
+                        empresa_id=current_user.empresa_id,
+                        limit=5,
+                        min_similarity=30
+                    ) if descricao else []
+                    # Mapear incluindo estoque_atual e renomear score para score_similaridade
+                    estoques = dict(
+                        db.query(models.Produto.id, models.Produto.quantidade_em_estoque).filter(
+                            models.Produto.id.in_([p['id'] for p in produtos_similares]),
+                            models.Produto.empresa_id == current_user.empresa_id
+                        ).all()
+                    ) if produtos_similares else {}
+                    similares_mapeados = []
+                    for p in produtos_similares:
+                        similares_mapeados.append({
+                            'produto_id': p['id'],
+                            'nome': p['nome'],
+                            'codigo': p['codigo'],
+                            'estoque_atual': estoques.get(p['id']) or 0,
+                            'score_similaridade': p['similarity_score'],
+                            'categoria': p.get('categoria', ''),
+                            'unidade_medida': p.get('unidade_medida', ''),
+                            'preco_venda': p.get('preco_venda', 0)
+                        })
+                    produtos_nao_encontrados.append({
+                        'codigo': codigo,
+                        'descricao': descricao or 'N/A',
+                        'produtos_similares': similares_mapeados
                     })
-                produtos_nao_encontrados.append({
-                    'codigo': codigo,
-                    'descricao': descricao or 'N/A',
-                    'produtos_similares': similares_mapeados
-                })
-                continue
-            
-            # Criar movimentação
-            observacao = f"Processamento automático - NF {dados_extraidos.get('nota_fiscal', 'N/A')} - {produto_data.get('descricao', '')}"
-            
-            movimentacao_data = schemas_movimentacao.MovimentacaoEstoqueCreate(
-                produto_id=produto.id,
-                tipo_movimentacao=tipo_movimentacao,
-                quantidade=quantidade,
-                observacao=observacao
-            )
-            
-            try:
-                produto_atualizado = crud_movimentacao.create_movimentacao_estoque(
-                    db=db,
-                    movimentacao=movimentacao_data,
-                    usuario_id=current_user.id,
-                    empresa_id=current_user.empresa_id
+                    continue
+                
+                # Criar movimentação
+                observacao = f"Processamento automático - NF {dados_extraidos.get('nota_fiscal', 'N/A')} - {produto_data.get('descricao', '')}"
+                
+                movimentacao_data = schemas_movimentacao.MovimentacaoEstoqueCreate(
+                    produto_id=produto.id,
+                    tipo_movimentacao=tipo_movimentacao,
+                    quantidade=quantidade,
+                    observacao=observacao,
+                    nota_fiscal=dados_extraidos.get('nota_fiscal'),
+                    chave_acesso=dados_extraidos.get('chave_acesso')
                 )
                 
-                # Se for SAÍDA (venda), salvar preço no histórico
-                if tipo_movimentacao == 'SAIDA' and produto_data.get('valor_unitario'):
-                    valor_unitario = produto_data.get('valor_unitario')
-                    valor_total = produto_data.get('valor_total', valor_unitario * quantidade)
+                try:
+                    produto_atualizado = crud_movimentacao.create_movimentacao_estoque(
+                        db=db,
+                        movimentacao=movimentacao_data,
+                        usuario_id=current_user.id,
+                        empresa_id=current_user.empresa_id
+                    )
                     
-                    # Buscar cliente se houver CNPJ na NF
-                    cliente_id = None
-                    if dados_extraidos.get('cnpj_cliente'):
-                        cliente = db.query(models.Cliente).filter(
-                            models.Cliente.cnpj == dados_extraidos.get('cnpj_cliente'),
-                            models.Cliente.empresa_id == current_user.empresa_id
-                        ).first()
-                        if cliente:
-                            cliente_id = cliente.id
+                    # Se for SAÍDA (venda), salvar preço no histórico
+                    if tipo_movimentacao == 'SAIDA' and produto_data.get('valor_unitario'):
+                        valor_unitario = produto_data.get('valor_unitario')
+                        valor_total = produto_data.get('valor_total', valor_unitario * quantidade)
+                        
+                        # Buscar cliente se houver CNPJ na NF
+                        cliente_id = None
+                        if dados_extraidos.get('cnpj_cliente'):
+                            cliente = db.query(models.Cliente).filter(
+                                models.Cliente.cnpj == dados_extraidos.get('cnpj_cliente'),
+                                models.Cliente.empresa_id == current_user.empresa_id
+                            ).first()
+                            if cliente:
+                                cliente_id = cliente.id
+                        
+                        # Criar registro de histórico de preço
+                        historico_preco = models.HistoricoPrecoProduto(
+                            produto_id=produto.id,
+                            preco_unitario=valor_unitario,
+                            quantidade=quantidade,
+                            valor_total=valor_total,
+                            nota_fiscal=dados_extraidos.get('nota_fiscal'),
+                            empresa_id=current_user.empresa_id,
+                            cliente_id=cliente_id
+                        )
+                        EstatisticasPrecoService.registrar_historico(db, historico_preco)
+                        VendasUnificadasService(db).registrar_historicos_preco([historico_preco])
+                        db.commit()
                     
-                    # Criar registro de histórico de preço
-                    historico_preco = models.HistoricoPrecoProduto(
-                        produto_id=produto.id,
-                        preco_unitario=valor_unitario,
-                        quantidade=quantidade,
-                        valor_total=valor_total,
-                        nota_fiscal=dados_extraidos.get('nota_fiscal'),
-                        empresa_id=current_user.empresa_id,
-                        cliente_id=cliente_id
-                    )
-                    db.add(historico_preco)
-                    db.commit()
-                
-                movimentacoes_criadas.append({
-                    'produto_id': produto.id,
-                    'codigo': codigo,
-                    'nome': produto.nome,
-                    'quantidade': quantidade,
-                    'estoque_anterior': produto_atualizado.quantidade_em_estoque - (quantidade if tipo_movimentacao == 'ENTRADA' else -quantidade),
-                    'estoque_atual': produto_atualizado.quantidade_em_estoque
-                })
-            except Exception as e:
-                produtos_nao_encontrados.append({
-                    'codigo': codigo,
-                    'descricao': produto_data.get('descricao', 'N/A'),
-                    'erro': str(e)
-                })
-        
-        return {
-            'sucesso': True,
-            'mensagem': f'PDF processado com sucesso! {len(movimentacoes_criadas)} movimentações criadas.',
-            'movimentacoes_criadas': len(movimentacoes_criadas),
-            'produtos_atualizados': [f"{item['codigo']} - {item['nome']}" for item in movimentacoes_criadas],
-            'tipo_movimentacao': tipo_movimentacao,
-            'detalhes': {
-                'arquivo': arquivo.filename,
-                'nota_fiscal': dados_extraidos.get('nota_fiscal'),
-                'data_emissao': dados_extraidos.get('data_emissao'),
-                'cliente': dados_extraidos.get('cliente'),
-                'produtos_processados': movimentacoes_criadas,
-                'produtos_nao_encontrados': produtos_nao_encontrados,
-                'total_produtos_pdf': len(dados_extraidos['produtos'])
+                    movimentacoes_criadas.append({
+                        'produto_id': produto.id,
+                        'codigo': codigo,
+                        'nome': produto.nome,
+                        'quantidade': quantidade,
+                        'estoque_anterior': produto_atualizado.quantidade_em_estoque - (quantidade if tipo_movimentacao == 'ENTRADA' else -quantidade),
+                        'estoque_atual': produto_atualizado.quantidade_em_estoque
+                    })
+                except Exception as e:
+                    produtos_nao_encontrados.append({
+                        'codigo': codigo,
+                        'descricao': produto_data.get('descricao', 'N/A'),
+                        'erro': str(e)
+                    })
+            
+            return {
+                'sucesso': True,
+                'mensagem': f'PDF processado com sucesso! {len(movimentacoes_criadas)} movimentações criadas.',
+                'movimentacoes_criadas': len(movimentacoes_criadas),
+                'produtos_atualizados': [f"{item['codigo']} - {item['nome']}" for item in movimentacoes_criadas],
+                'tipo_movimentacao': tipo_movimentacao,
+                'detalhes': {
+                    'arquivo': arquivo.filename,
+                    'nota_fiscal': dados_extraidos.get('nota_fiscal'),
+                    'data_emissao': dados_extraidos.get('data_emissao'),
+                    'cliente': dados_extraidos.get('cliente'),
+                    'produtos_processados': movimentacoes_criadas,
+                    'produtos_nao_encontrados': produtos_nao_encontrados,
+                    'total_produtos_pdf': len(dados_extraidos['produtos'])
+                }
             }
-        }
+        
+        # Consultas e lançamentos no pool de threads de banco
+        return await parse_executor.executar_db(registrar_movimentacoes)
         
     except HTTPException as he:
         print(f"DEBUG: HTTPException capturada: {he.status_code} - {he.detail}")
@@ -1215,23 +1261,23 @@ async def preview_xml_movimentacao(
     
     try:
         # Salvar arquivo temporariamente
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xml') as temp_file:
-            content = await arquivo.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+        temp_file_path, hash_arquivo = await salvar_upload_temporario(arquivo, '.xml')
         
-        # Processar XML
+        # Processar XML (parsing e consultas no pool de threads de banco)
         from ..services.nf_xml_processor_service import NFXMLProcessorService
         xml_service = NFXMLProcessorService(db)
         
-        resultado = xml_service.processar_nf_xml(
-            caminho_xml=temp_file_path,
-            tipo_movimentacao=tipo_movimentacao,
-            empresa_id_override=current_user.empresa_id
-        )
-        
-        # Limpar arquivo temporário
-        os.unlink(temp_file_path)
+        try:
+            resultado = await parse_executor.executar_db(
+                xml_service.processar_nf_xml,
+                caminho_xml=temp_file_path,
+                tipo_movimentacao=tipo_movimentacao,
+                empresa_id_override=current_user.empresa_id,
+                hash_conteudo=hash_arquivo
+            )
+        finally:
+            # Limpar arquivo temporário
+            os.unlink(temp_file_path)
         
         return {
             'sucesso': True,
@@ -1297,84 +1343,87 @@ async def processar_xml_movimentacao(
     
     try:
         # Salvar arquivo temporariamente
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xml') as temp_file:
-            content = await arquivo.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+        temp_file_path, hash_arquivo = await salvar_upload_temporario(arquivo, '.xml')
         
-        # Processar XML
-        from ..services.nf_xml_processor_service import NFXMLProcessorService
-        xml_service = NFXMLProcessorService(db)
-        
-        resultado_preview = xml_service.processar_nf_xml(
-            caminho_xml=temp_file_path,
-            tipo_movimentacao=tipo_movimentacao,
-            empresa_id_override=current_user.empresa_id
-        )
-        
-        # Preparar dados para confirmação
-        produtos_confirmados = []
-        for produto in resultado_preview['produtos']:
-            if produto.get('encontrado') and produto.get('produto_id'):
-                produtos_confirmados.append({
-                    'produto_id': produto['produto_id'],
-                    'quantidade': produto['quantidade'],
-                    'valor_unitario': produto.get('valor_unitario', 0),
-                    'valor_total': produto.get('valor_total', 0),
-                    'codigo_nf': produto.get('codigo', ''),
-                    'descricao_nf': produto.get('descricao', '')
-                })
-        
-        if not produtos_confirmados:
+        def processar_e_registrar():
+            # Processar XML
+            from ..services.nf_xml_processor_service import NFXMLProcessorService
+            xml_service = NFXMLProcessorService(db)
+            
+            resultado_preview = xml_service.processar_nf_xml(
+                caminho_xml=temp_file_path,
+                tipo_movimentacao=tipo_movimentacao,
+                empresa_id_override=current_user.empresa_id,
+                hash_conteudo=hash_arquivo
+            )
+            
+            # Preparar dados para confirmação
+            produtos_confirmados = []
+            for produto in resultado_preview['produtos']:
+                if produto.get('encontrado') and produto.get('produto_id'):
+                    produtos_confirmados.append({
+                        'produto_id': produto['produto_id'],
+                        'quantidade': produto['quantidade'],
+                        'valor_unitario': produto.get('valor_unitario', 0),
+                        'valor_total': produto.get('valor_total', 0),
+                        'codigo_nf': produto.get('codigo', ''),
+                        'descricao_nf': produto.get('descricao', '')
+                    })
+            
+            if not produtos_confirmados:
+                os.unlink(temp_file_path)
+                return {
+                    'sucesso': False,
+                    'mensagem': 'Nenhum produto encontrado no sistema para processar.',
+                    'produtos_nao_encontrados': resultado_preview['produtos_nao_encontrados']
+                }
+            
+            # Confirmar processamento usando o serviço existente
+            from ..services.nf_processor_service import NFProcessorService
+            nf_service = NFProcessorService(db)
+            
+            dados_confirmacao = {
+                'nota_fiscal': resultado_preview['nota_fiscal'],
+                'tipo_movimentacao': resultado_preview['tipo_movimentacao'],
+                'empresa_id': resultado_preview['empresa_id'],
+                'cliente_id': resultado_preview.get('cliente_id'),
+                'cnpj_cliente': resultado_preview.get('cnpj_cliente'),
+                'cliente': resultado_preview.get('cliente'),
+                'vendedor_id': vendedor_id,
+                'orcamento_id': orcamento_id,
+                'chave_acesso': resultado_preview.get('chave_acesso'),
+                'produtos_confirmados': produtos_confirmados
+            }
+            
+            resultado = nf_service.confirmar_processamento(
+                dados_confirmacao=dados_confirmacao,
+                usuario_id=current_user.id
+            )
+            
+            # Limpar arquivo temporário
             os.unlink(temp_file_path)
+            
             return {
-                'sucesso': False,
-                'mensagem': 'Nenhum produto encontrado no sistema para processar.',
-                'produtos_nao_encontrados': resultado_preview['produtos_nao_encontrados']
+                'sucesso': True,
+                'mensagem': f'XML processado com sucesso! {resultado["movimentacoes_criadas"]} movimentações criadas.',
+                'movimentacoes_criadas': resultado['movimentacoes_criadas'],
+                'historicos_vendas': resultado.get('historicos_vendas', 0),
+                'tipo_movimentacao': resultado_preview['tipo_movimentacao'],
+                'nota_fiscal': resultado_preview['nota_fiscal'],
+                'chave_acesso': resultado_preview.get('chave_acesso'),
+                'data_emissao': resultado_preview['data_emissao'],
+                'cliente': resultado_preview.get('cliente'),
+                'cnpj_cliente': resultado_preview.get('cnpj_cliente'),
+                'detalhes': {
+                    'arquivo': arquivo.filename,
+                    'produtos_processados': len(produtos_confirmados),
+                    'produtos_nao_encontrados': len(resultado_preview['produtos_nao_encontrados']),
+                    'total_produtos_xml': resultado_preview['total_produtos']
+                }
             }
         
-        # Confirmar processamento usando o serviço existente
-        from ..services.nf_processor_service import NFProcessorService
-        nf_service = NFProcessorService(db)
-        
-        dados_confirmacao = {
-            'nota_fiscal': resultado_preview['nota_fiscal'],
-            'tipo_movimentacao': resultado_preview['tipo_movimentacao'],
-            'empresa_id': resultado_preview['empresa_id'],
-            'cliente_id': resultado_preview.get('cliente_id'),
-            'cnpj_cliente': resultado_preview.get('cnpj_cliente'),
-            'cliente': resultado_preview.get('cliente'),
-            'vendedor_id': vendedor_id,
-            'orcamento_id': orcamento_id,
-            'produtos_confirmados': produtos_confirmados
-        }
-        
-        resultado = nf_service.confirmar_processamento(
-            dados_confirmacao=dados_confirmacao,
-            usuario_id=current_user.id
-        )
-        
-        # Limpar arquivo temporário
-        os.unlink(temp_file_path)
-        
-        return {
-            'sucesso': True,
-            'mensagem': f'XML processado com sucesso! {resultado["movimentacoes_criadas"]} movimentações criadas.',
-            'movimentacoes_criadas': resultado['movimentacoes_criadas'],
-            'historicos_vendas': resultado.get('historicos_vendas', 0),
-            'tipo_movimentacao': resultado_preview['tipo_movimentacao'],
-            'nota_fiscal': resultado_preview['nota_fiscal'],
-            'chave_acesso': resultado_preview.get('chave_acesso'),
-            'data_emissao': resultado_preview['data_emissao'],
-            'cliente': resultado_preview.get('cliente'),
-            'cnpj_cliente': resultado_preview.get('cnpj_cliente'),
-            'detalhes': {
-                'arquivo': arquivo.filename,
-                'produtos_processados': len(produtos_confirmados),
-                'produtos_nao_encontrados': len(resultado_preview['produtos_nao_encontrados']),
-                'total_produtos_xml': resultado_preview['total_produtos']
-            }
-        }
+        # Parsing do XML, consultas e lançamentos no pool de threads de banco
+        return await parse_executor.executar_db(processar_e_registrar)
         
     except HTTPException:
         raise
@@ -1631,10 +1680,8 @@ def extrair_dados_pdf_entrada(caminho_pdf: str) -> Dict[str, Any]:
     }
     
     try:
-        with pdfplumber.open(caminho_pdf) as pdf:
-            texto_completo = ""
-            for page in pdf.pages:
-                texto_completo += page.extract_text() or ""
+        # Entrada: produtos podem continuar em todas as páginas, sem parada antecipada
+        texto_completo = extrair_texto(caminho_pdf, separador="")
         
         print(f"DEBUG: Texto extraído ({len(texto_completo)} caracteres)")
         
@@ -1767,10 +1814,8 @@ def extrair_dados_pdf(caminho_pdf: str) -> Dict[str, Any]:
     }
     
     try:
-        with pdfplumber.open(caminho_pdf) as pdf:
-            texto_completo = ""
-            for page in pdf.pages:
-                texto_completo += page.extract_text() or ""
+        # A lista de produtos termina em "Dados Adicionais": as páginas seguintes não são lidas
+        texto_completo = extrair_texto(caminho_pdf, parar_em=('Dados Adicionais',), separador="")
         
         print(f"DEBUG: Texto extraído ({len(texto_completo)} caracteres)")
         
@@ -1827,52 +1872,11 @@ def extrair_dados_pdf(caminho_pdf: str) -> Dict[str, Any]:
             dados['valor_total'] = float(valor_str)
             print(f"DEBUG: Valor total encontrado: {dados['valor_total']}")
         
-        # Extrair produtos - padrão da tabela de produtos
-        linhas = texto_completo.split('\n')
-        produtos = []
-        
-        # Procurar pela seção "Dados dos Produtos"
-        inicio_produtos = False
-        for i, linha in enumerate(linhas):
-            if 'Dados dos Produtos' in linha:
-                inicio_produtos = True
-                continue
-            
-            if inicio_produtos and 'Dados Adicionais' in linha:
-                break
-                
-            if inicio_produtos:
-                # Padrão: 1 297 SUPORTE LT S/ CABO C/ PINCA P/ FIBRA (NOBRE) 96039000 0102 5102 UN 1,0000 19,1400 0,00 19,14
-                produto_match = re.match(r'^(\d+)\s+(\d+)\s+(.+?)\s+(\d{8})\s+\d{4}\s+\d{4}\s+(\w+)\s+([\d,]+)\s+([\d,]+)\s+[\d,]+\s+([\d,]+)', linha)
-                
-                if produto_match:
-                    try:
-                        item = int(produto_match.group(1))
-                        codigo = produto_match.group(2)
-                        descricao = produto_match.group(3).strip()
-                        ncm = produto_match.group(4)
-                        unidade = produto_match.group(5)
-                        quantidade = float(produto_match.group(6).replace(',', '.'))
-                        valor_unitario = float(produto_match.group(7).replace(',', '.'))
-                        valor_total = float(produto_match.group(8).replace(',', '.'))
-                        
-                        produto = {
-                            'item': item,
-                            'codigo': codigo,
-                            'descricao': descricao,
-                            'ncm': ncm,
-                            'unidade': unidade,
-                            'quantidade': quantidade,
-                            'valor_unitario': valor_unitario,
-                            'valor_total': valor_total
-                        }
-                        
-                        produtos.append(produto)
-                        print(f"DEBUG: Produto encontrado: {codigo} - {descricao} - Qtd: {quantidade}")
-                        
-                    except (ValueError, IndexError) as e:
-                        print(f"DEBUG: Erro ao processar linha de produto: {linha} - Erro: {e}")
-                        continue
+        # Extrair produtos - tabela "Dados dos Produtos" (gramática em app.utils.nf_linhas)
+        # Padrão: 1 297 SUPORTE LT S/ CABO C/ PINCA P/ FIBRA (NOBRE) 96039000 0102 5102 UN 1,0000 19,1400 0,00 19,14
+        produtos = extrair_itens_danfe(texto_completo)
+        for produto in produtos:
+            print(f"DEBUG: Produto encontrado: {produto['codigo']} - {produto['descricao']} - Qtd: {produto['quantidade']}")
         
         dados['produtos'] = produtos
         print(f"DEBUG: Extração concluída. Produtos encontrados: {len(produtos)}")
@@ -2029,8 +2033,8 @@ async def reverter_movimentacoes_em_massa(
     """
     
     try:
-        # Extrair parâmetros do body
-        nota_fiscal = dados.get('nota_fiscal')
+        # Extrair parâmetros do body ('N/A' ou vazio não é um critério de NF)
+        nota_fiscal = normalizar_nota_fiscal(dados.get('nota_fiscal'))
         data_inicio = dados.get('data_inicio')
         data_fim = dados.get('data_fim')
         tipo_movimentacao = dados.get('tipo_movimentacao')
@@ -2060,7 +2064,7 @@ async def reverter_movimentacoes_em_massa(
         # Aplicar filtros
         if nota_fiscal:
             query = query.filter(
-                models.MovimentacaoEstoque.observacao.ilike(f'%NF {nota_fiscal}%')
+                models.MovimentacaoEstoque.nota_fiscal == nota_fiscal
             )
         
         if tipo_movimentacao:
@@ -2082,16 +2086,9 @@ async def reverter_movimentacoes_em_massa(
             except:
                 pass
         
-        # Verificar se as colunas de reversão existem antes de fazer a query
-        from sqlalchemy import inspect, text
-        
-        try:
-            inspector = inspect(engine)
-            columns = [col['name'] for col in inspector.get_columns('movimentacoes_estoque')]
-            colunas_reversao_existem = 'reversao_de_id' in columns
-        except Exception as e:
-            logger.warning(f"⚠️ Erro ao verificar colunas: {e}. Assumindo que não existem.")
-            colunas_reversao_existem = False
+        # Verificar se as colunas de reversão existem (registro carregado no startup)
+        from sqlalchemy import text
+        colunas_reversao_existem = schema_capabilities.colunas_reversao_existem
         
         # Se as colunas não existem, usar query SQL direta para evitar erro
         if not colunas_reversao_existem:
@@ -2100,8 +2097,12 @@ async def reverter_movimentacoes_em_massa(
             params = {'empresa_id': empresa_id or current_user.empresa_id}
             
             if nota_fiscal:
-                where_clauses.append("me.observacao ILIKE :nota_fiscal")
-                params['nota_fiscal'] = f'%NF {nota_fiscal}%'
+                if schema_capabilities.has_column("movimentacoes_estoque", "nota_fiscal"):
+                    where_clauses.append("me.nota_fiscal = :nota_fiscal")
+                    params['nota_fiscal'] = nota_fiscal
+                else:
+                    where_clauses.append("me.observacao ILIKE :nota_fiscal")
+                    params['nota_fiscal'] = f'%NF {nota_fiscal}%'
             
             if tipo_movimentacao:
                 where_clauses.append("me.tipo_movimentacao = :tipo_movimentacao")
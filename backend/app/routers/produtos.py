@@ -13,7 +13,8 @@ from ..crud import produto as crud_produto
 from ..db.connection import get_db
 from ..schemas import produto as schemas_produto
 from ..schemas import usuario as schemas_usuario
-from app.dependencies import get_current_user
+from app.core.principal_cache import Principal
+from app.dependencies import get_current_principal
 from sqlalchemy import func, case, or_
 from ..services.purchase_suggestion_service import PurchaseSuggestionService
 
@@ -29,7 +30,7 @@ router = APIRouter(
 @router.get("/", response_model=List[schemas_produto.Produto], summary="Listar todos os produtos")
 def read_all_produtos(
     db: Session = Depends(get_db), 
-    current_user: models.Usuario = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """Retorna uma lista de todos os produtos da empresa do usuário logado."""
     return crud_produto.get_produtos(db=db, empresa_id=current_user.empresa_id)
@@ -38,7 +39,7 @@ def read_all_produtos(
 @router.get("/baixo-estoque/", response_model=List[schemas_produto.Produto], summary="Listar produtos com estoque baixo")
 def read_low_stock_produtos(
     db: Session = Depends(get_db), 
-    current_user: models.Usuario = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """
     Retorna uma lista de produtos onde a quantidade em estoque é menor ou igual ao estoque mínimo.
@@ -83,7 +84,7 @@ def read_low_stock_produtos(
 def buscar_produtos(
     q: str,
     db: Session = Depends(get_db),
-    current_user: models.Usuario = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """
     Busca produtos por nome ou código.
@@ -116,7 +117,7 @@ def buscar_produtos(
 @router.get("/download/excel", response_description="Retorna um arquivo Excel com todos os produtos", summary="Exportar produtos para Excel")
 def download_produtos_excel(
     db: Session = Depends(get_db),
-    current_user: models.Usuario = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """
     Busca todos os produtos da empresa do usuário logado e os retorna
@@ -177,7 +178,7 @@ def download_produtos_excel(
 def read_one_produto(
     produto_id: int, 
     db: Session = Depends(get_db), 
-    current_user: models.Usuario = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """
     Retorna os dados de um produto específico.
@@ -193,7 +194,7 @@ def read_one_produto(
 def create_produto(
     produto: schemas_produto.ProdutoCreate, 
     db: Session = Depends(get_db), 
-    current_user: models.Usuario = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """Cria um novo produto associado à empresa do usuário logado."""
     return crud_produto.create_produto(db=db, produto=produto, empresa_id=current_user.empresa_id)
@@ -203,7 +204,7 @@ def update_produto_endpoint(
     produto_id: int, 
     produto: schemas_produto.ProdutoUpdate, 
     db: Session = Depends(get_db), 
-    current_user: models.Usuario = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """Atualiza os dados de um produto existente."""
     updated_produto = crud_produto.update_produto(db=db, produto_id=produto_id, produto_data=produto, empresa_id=current_user.empresa_id)
@@ -215,7 +216,7 @@ def update_produto_endpoint(
 def delete_produto_endpoint(
     produto_id: int, 
     db: Session = Depends(get_db), 
-    current_user: models.Usuario = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """Deleta um produto do banco de dados."""
     try:
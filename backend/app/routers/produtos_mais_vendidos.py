@@ -6,15 +6,19 @@ Utiliza dados de MovimentacaoEstoque para cálculos em tempo real
 
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func, desc, and_, extract, or_
+from sqlalchemy import func, desc, and_, or_
 from typing import List, Optional
 from datetime import datetime, date, timedelta, timezone
 from collections import defaultdict
 
 from ..db.connection import get_db
-from ..dependencies import get_current_user
+from ..db.schema_capabilities import schema_capabilities
+from ..core.constants import CANAIS_ANALISE_VENDAS, PREFIXOS_CANAL_MOVIMENTACAO
+from ..core.principal_cache import Principal
+from ..dependencies import get_current_principal
 from ..db import models
 from ..schemas import produtos_mais_vendidos as schemas
+from ..services.vendas_mensais_service import FONTE_MOVIMENTACAO, VendasMensaisService
 
 router = APIRouter(
     prefix="/produtos-mais-vendidos",
@@ -25,19 +29,6 @@ router = APIRouter(
 # Inclui: VENDA (vendas e orçamentos confirmados), DEVOLUCAO, COMPRA, OUTRO
 ORIGENS_AUTOMATICAS = ['VENDA', 'DEVOLUCAO', 'COMPRA', 'OUTRO']
 
-# Observações padrão que caracterizam vendas realizadas pelo aplicativo de vendedores
-OBSERVACOES_VENDA_PADRAO = [
-    "Venda Operador",
-    "Venda realizada pelo vendedor",
-    "Venda para"
-]
-
-# Observações padrão utilizadas para baixas automáticas a partir de notas fiscais importadas
-OBSERVACOES_NF_PADRAO = [
-    "Importação automática - NF",
-    "Processamento automático - NF"
-]
-
 
 def _status_confirmado_expression():
     """Garante que apenas movimentações confirmadas (ou legadas sem status) sejam consideradas."""
@@ -47,12 +38,16 @@ def _status_confirmado_expression():
     )
 
 
-def _observacao_permitida_expression():
-    """Filtra apenas movimentações que tenham observações padronizadas (vendedores / NF)."""
+def _canal_vendas_expression():
+    """Filtra apenas movimentações dos canais de vendas (app de vendedores / importação de NF)."""
+    if schema_capabilities.has_column("movimentacoes_estoque", "canal"):
+        return models.MovimentacaoEstoque.canal.in_(CANAIS_ANALISE_VENDAS)
+    # Banco ainda sem a coluna canal: filtro antigo pelo prefixo da observação
     observacao_col = func.coalesce(models.MovimentacaoEstoque.observacao, "")
     condicoes = [
-        observacao_col.ilike(f"{pattern}%")
-        for pattern in (OBSERVACOES_VENDA_PADRAO + OBSERVACOES_NF_PADRAO)
+        observacao_col.ilike(f"{prefixo}%")
+        for prefixo, canal in PREFIXOS_CANAL_MOVIMENTACAO
+        if canal in CANAIS_ANALISE_VENDAS
     ]
     return or_(*condicoes)
 
@@ -65,7 +60,7 @@ def get_produtos_mais_vendidos(
     ordenar_por: str = Query("quantidade", description="Ordenar por: 'quantidade', 'valor', 'frequencia'"),
     vendedor_id: Optional[int] = Query(None, description="Filtrar por vendedor específico"),
     db: Session = Depends(get_db),
-    current_user: models.Usuario = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """
     Retorna os produtos mais vendidos baseado no histórico real de movimentações de SAÍDA.
@@ -83,7 +78,7 @@ def get_produtos_mais_vendidos(
         fim = datetime.now()
         inicio = fim - timedelta(days=periodo_dias)
 
-    allowed_observacoes = _observacao_permitida_expression()
+    canal_vendas = _canal_vendas_expression()
     status_confirmado = _status_confirmado_expression()
 
     # Query base para movimentações de SAÍDA automáticas
@@ -113,7 +108,7 @@ def get_produtos_mais_vendidos(
                 models.MovimentacaoEstoque.origem.is_(None)  # Incluir movimentações antigas sem origem definida
             ),
             status_confirmado,
-            allowed_observacoes
+            canal_vendas
         )
     )
 
@@ -224,63 +219,54 @@ def get_tendencias_vendas(
     produto_id: Optional[int] = Query(None, description="ID do produto específico"),
     periodo_meses: int = Query(6, description="Período em meses para análise de tendências"),
     db: Session = Depends(get_db),
-    current_user: models.Usuario = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """
     Retorna tendências de vendas por mês para análise de sazonalidade.
     Considera apenas movimentações automáticas (exclui correções manuais).
     """
 
-    fim = datetime.now()
-    inicio = fim - timedelta(days=periodo_meses * 30)
+    inicio = datetime.now() - timedelta(days=periodo_meses * 30)
 
-    # Query para dados mensais (apenas movimentações automáticas)
+    # Quantidade mensal por produto a partir do cubo mensal de vendas (mesmos filtros:
+    # saídas automáticas, confirmadas, dos canais de vendas)
     # Nota: Calculamos quantidade_mensal primeiro, depois multiplicamos pelo preço atual
     # Isso evita distorções se o preço mudou ao longo do tempo
-    allowed_observacoes = _observacao_permitida_expression()
-    status_confirmado = _status_confirmado_expression()
-
-    query = db.query(
-        extract('year', models.MovimentacaoEstoque.data_movimentacao).label('ano'),
-        extract('month', models.MovimentacaoEstoque.data_movimentacao).label('mes'),
-        models.Produto.nome.label('produto_nome'),
-        models.Produto.preco_venda.label('preco_atual'),
-        func.sum(models.MovimentacaoEstoque.quantidade).label('quantidade_mensal')
-    ).join(
-        models.Produto, models.MovimentacaoEstoque.produto_id == models.Produto.id
-    ).filter(
-        and_(
-            models.MovimentacaoEstoque.tipo_movimentacao == 'SAIDA',
-            models.MovimentacaoEstoque.data_movimentacao >= inicio,
-            models.MovimentacaoEstoque.data_movimentacao <= fim,
-            models.Produto.empresa_id == current_user.empresa_id,
-            # Filtrar apenas movimentações automáticas
-            or_(
-                models.MovimentacaoEstoque.origem.in_(ORIGENS_AUTOMATICAS),
-                models.MovimentacaoEstoque.origem.is_(None)  # Incluir movimentações antigas sem origem definida
-            ),
-            status_confirmado,
-            allowed_observacoes
-        )
+    celulas = VendasMensaisService(db).celulas(
+        current_user.empresa_id, [FONTE_MOVIMENTACAO], inicio, produto_id=produto_id
     )
+    quantidade_por_mes = defaultdict(float)
+    for (_fonte, ano, mes, produto, _vendedor, _cliente), valores in celulas.items():
+        quantidade_por_mes[(ano, mes, produto)] += valores['quantidade']
+
+    produtos = {}
+    produto_ids = {produto for _ano, _mes, produto in quantidade_por_mes}
+    if produto_ids:
+        produtos = {
+            produto.id: produto
+            for produto in db.query(models.Produto.id, models.Produto.nome, models.Produto.preco_venda).filter(
+                models.Produto.id.in_(produto_ids)
+            )
+        }
 
-    if produto_id:
-        query = query.filter(models.MovimentacaoEstoque.produto_id == produto_id)
-
-    query = query.group_by('ano', 'mes', models.Produto.nome, models.Produto.preco_venda).order_by('ano', 'mes')
-
-    resultados = query.all()
+    # Agrupar por mês, nome e preço atual do produto
+    quantidade_mensal = defaultdict(float)
+    for (ano, mes, produto), quantidade in quantidade_por_mes.items():
+        if produto in produtos:
+            quantidade_mensal[(ano, mes, produtos[produto].nome, produtos[produto].preco_venda)] += quantidade
 
     # Processar dados mensais
     tendencias_mensais = []
-    for resultado in resultados:
-        mes_ano = f"{int(resultado.ano)}-{int(resultado.mes):02d}"
+    for (ano, mes, produto_nome, preco_atual), quantidade in sorted(
+        quantidade_mensal.items(), key=lambda item: (item[0][0], item[0][1], item[0][2] or '')
+    ):
+        mes_ano = f"{ano}-{mes:02d}"
         # Calcular valor usando quantidade total * preço atual
-        valor_mensal = float(resultado.quantidade_mensal * resultado.preco_atual)
+        valor_mensal = float(quantidade * preco_atual)
         tendencia = schemas.TendenciaMensal(
             mes_ano=mes_ano,
-            produto_nome=resultado.produto_nome,
-            quantidade_vendida=resultado.quantidade_mensal,
+            produto_nome=produto_nome,
+            quantidade_vendida=quantidade,
             valor_vendido=valor_mensal
         )
         tendencias_mensais.append(tendencia)
@@ -295,63 +281,45 @@ def get_tendencias_vendas(
 def get_comparativo_vendedores(
     periodo_dias: int = Query(30, description="Período em dias para comparação"),
     db: Session = Depends(get_db),
-    current_user: models.Usuario = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """
     Compara performance de vendedores nos produtos mais vendidos.
     Considera apenas movimentações automáticas (exclui correções manuais).
     """
 
-    fim = datetime.now()
-    inicio = fim - timedelta(days=periodo_dias)
-
-    allowed_observacoes = _observacao_permitida_expression()
-    status_confirmado = _status_confirmado_expression()
+    inicio = datetime.now() - timedelta(days=periodo_dias)
 
-    # Query para comparativo de vendedores
+    # Quantidade e número de saídas por vendedor/produto a partir do cubo mensal de vendas
     # Nota: Agrupamos por produto primeiro para calcular valor corretamente
-    query = db.query(
-        models.Usuario.nome.label('vendedor_nome'),
-        models.Usuario.id.label('vendedor_id'),
-        models.MovimentacaoEstoque.produto_id,
-        models.Produto.preco_venda.label('preco_produto'),
-        func.sum(models.MovimentacaoEstoque.quantidade).label('quantidade_produto'),
-        func.count(models.MovimentacaoEstoque.id).label('num_movimentacoes')
-    ).join(
-        models.Usuario, models.MovimentacaoEstoque.usuario_id == models.Usuario.id
-    ).join(
-        models.Produto, models.MovimentacaoEstoque.produto_id == models.Produto.id
-    ).filter(
-        and_(
-            models.MovimentacaoEstoque.tipo_movimentacao == 'SAIDA',
-            models.MovimentacaoEstoque.data_movimentacao >= inicio,
-            models.MovimentacaoEstoque.data_movimentacao <= fim,
-            models.Produto.empresa_id == current_user.empresa_id,
-            # Filtrar apenas movimentações automáticas
-            or_(
-                models.MovimentacaoEstoque.origem.in_(ORIGENS_AUTOMATICAS),
-                models.MovimentacaoEstoque.origem.is_(None)  # Incluir movimentações antigas sem origem definida
-            ),
-            status_confirmado,
-            allowed_observacoes
+    celulas = VendasMensaisService(db).celulas(current_user.empresa_id, [FONTE_MOVIMENTACAO], inicio)
+    por_vendedor_produto = defaultdict(lambda: {'quantidade': 0.0, 'numero_registros': 0})
+    for (_fonte, _ano, _mes, produto, vendedor, _cliente), valores in celulas.items():
+        dados = por_vendedor_produto[(vendedor, produto)]
+        dados['quantidade'] += valores['quantidade']
+        dados['numero_registros'] += valores['numero_registros']
+
+    vendedores = {}
+    precos = {}
+    if por_vendedor_produto:
+        vendedor_ids = {vendedor for vendedor, _produto in por_vendedor_produto}
+        produto_ids = {produto for _vendedor, produto in por_vendedor_produto}
+        vendedores = dict(
+            db.query(models.Usuario.id, models.Usuario.nome).filter(models.Usuario.id.in_(vendedor_ids)).all()
+        )
+        precos = dict(
+            db.query(models.Produto.id, models.Produto.preco_venda).filter(models.Produto.id.in_(produto_ids)).all()
         )
-    ).group_by(
-        models.Usuario.nome, 
-        models.Usuario.id,
-        models.MovimentacaoEstoque.produto_id,
-        models.Produto.preco_venda
-    )
-
-    resultados = query.all()
 
     # Agrupar resultados por vendedor e calcular totais
     vendedores_dict = {}
-    for resultado in resultados:
-        vendedor_id = resultado.vendedor_id
+    for (vendedor_id, produto), dados in por_vendedor_produto.items():
+        if vendedor_id not in vendedores or produto not in precos:
+            continue
         if vendedor_id not in vendedores_dict:
             vendedores_dict[vendedor_id] = {
                 'vendedor_id': vendedor_id,
-                'vendedor_nome': resultado.vendedor_nome,
+                'vendedor_nome': vendedores[vendedor_id],
                 'total_quantidade': 0,
                 'total_valor': 0.0,
                 'produtos_diferentes': set(),
@@ -359,11 +327,11 @@ def get_comparativo_vendedores(
             }
         
         # Calcular valor: quantidade do produto * preço atual
-        valor_produto = float(resultado.quantidade_produto * resultado.preco_produto)
-        vendedores_dict[vendedor_id]['total_quantidade'] += resultado.quantidade_produto
+        valor_produto = float(dados['quantidade'] * precos[produto])
+        vendedores_dict[vendedor_id]['total_quantidade'] += dados['quantidade']
         vendedores_dict[vendedor_id]['total_valor'] += valor_produto
-        vendedores_dict[vendedor_id]['produtos_diferentes'].add(resultado.produto_id)
-        vendedores_dict[vendedor_id]['numero_vendas'] += resultado.num_movimentacoes
+        vendedores_dict[vendedor_id]['produtos_diferentes'].add(produto)
+        vendedores_dict[vendedor_id]['numero_vendas'] += dados['numero_registros']
 
     # Converter para lista de schemas
     comparativo = []
@@ -4,10 +4,10 @@ from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
 from sqlalchemy.orm import Session
 from typing import List, Dict, Any
 from ..db import models
-import tempfile
 import os
 from datetime import datetime
-from app.utils.product_matcher import find_product_by_code_or_name
+from app.utils.product_matcher import ProductMatcher
+from app.utils.upload_arquivos import salvar_upload_temporario
 
 from ..crud import movimentacao_estoque as crud_movimentacao
 from ..schemas import movimentacao_estoque as schemas_movimentacao
@@ -55,10 +55,7 @@ async def processar_pdf_saida(
         print(f"DEBUG: Iniciando processamento do arquivo de saída {arquivo.filename}")
         
         # Salvar arquivo temporariamente
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            content = await arquivo.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+        temp_file_path, _hash_arquivo = await salvar_upload_temporario(arquivo, '.pdf')
         
         print(f"DEBUG: Arquivo salvo temporariamente em: {temp_file_path}")
         
@@ -90,18 +87,16 @@ async def processar_pdf_saida(
         produtos_sem_estoque = []
         movimentacoes_criadas = 0
         
+        # Buscar todos os produtos da NF no sistema (código ou nome) em uma única passada
+        matcher = ProductMatcher(db, current_user.empresa_id)
+        associacoes = matcher.match_batch(dados_pdf['produtos'])
+        
         # Processar cada produto encontrado no PDF
-        for produto_pdf in dados_pdf['produtos']:
+        for produto_pdf, (produto_sistema, metodo_busca, score) in zip(dados_pdf['produtos'], associacoes):
             print(f"DEBUG: Processando produto: {produto_pdf}")
             
-            codigo = produto_pdf.get('codigo')
             descricao = produto_pdf.get('descricao', '')
             
-            # Buscar produto no sistema pelo código ou nome
-            produto_sistema, metodo_busca, score = find_product_by_code_or_name(
-                db, codigo, descricao, current_user.empresa_id
-            )
-            
             if produto_sistema and metodo_busca == 'nome':
                 print(f"DEBUG: Produto encontrado por nome: {descricao} → {produto_sistema.nome} (score: {score:.2f})")
             
@@ -125,7 +120,9 @@ async def processar_pdf_saida(
                         produto_id=produto_sistema.id,
                         tipo_movimentacao="SAIDA",
                         quantidade=quantidade_saida,
-                        observacao=f"Saída automática - NF {dados_pdf.get('nota_fiscal', 'N/A')} - {arquivo.filename}"
+                        observacao=f"Saída automática - NF {dados_pdf.get('nota_fiscal', 'N/A')} - {arquivo.filename}",
+                        nota_fiscal=dados_pdf.get('nota_fiscal'),
+                        chave_acesso=dados_pdf.get('chave_acesso')
                     )
                     
                     produto_atualizado = crud_movimentacao.create_movimentacao_estoque(
@@ -11,9 +11,19 @@ from ..crud import produto as crud_produto
 from ..schemas import produto as schemas_produto
 from ..schemas import usuario as schemas_usuario
 from app.dependencies import get_current_user
+from app.core.parse_executor import parse_executor
+from app.utils.upload_arquivos import salvar_upload_temporario
+from typing import Any, Dict, List, Tuple, Union
+import logging
+import os
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Produtos por comando INSERT ... ON CONFLICT
+TAMANHO_LOTE_UPSERT = 1000
+
 
 def parse_float_br(value) -> float:
     """
@@ -60,6 +70,123 @@ def parse_float_br(value) -> float:
     
     return float(str_value)
 
+def parse_float_br_serie(serie: pd.Series) -> pd.Series:
+    """
+    parse_float_br aplicado à coluna inteira (operações vetorizadas do pandas).
+    Valores vazios ficam NA; textos que não são número também ficam NA (o
+    chamador trata como erro da linha).
+    """
+    numeros = pd.to_numeric(serie, errors="coerce")
+    texto = serie.astype("string").str.strip()
+    virgula = texto.str.rfind(",")
+    ponto = texto.str.rfind(".")
+
+    # 1.234,56 (vírgula decimal) / 1,234.56 (ponto decimal) / 15,75
+    brasileiro = (virgula >= 0) & (virgula > ponto)
+    internacional = (virgula >= 0) & (ponto > virgula)
+    convertido = texto.mask(brasileiro, texto.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+    convertido = convertido.mask(internacional, texto.str.replace(",", "", regex=False))
+    convertido = pd.to_numeric(convertido, errors="coerce")
+
+    resultado = numeros.where(numeros.notna(), convertido).astype("Float64")
+    # Texto vazio vale 0, como em parse_float_br
+    return resultado.mask(texto.eq("").fillna(False), 0.0)
+
+
+def ler_planilha(origem: Union[bytes, str]) -> pd.DataFrame:
+    """Lê a planilha enviada, em bytes ou caminho do arquivo (roda no pool de processos do parse_executor)."""
+    # Substitui valores vazios por None para evitar erros com NaN
+    df = pd.read_excel(BytesIO(origem) if isinstance(origem, bytes) else origem).fillna(value=pd.NA)
+    # Garante que os nomes das colunas estão em minúsculo para facilitar a busca
+    df.columns = df.columns.str.lower()
+    return df
+
+
+# Colunas obrigatórias para criar/atualizar um produto.
+COLUNAS_OBRIGATORIAS = ("codigo", "nome", "categoria", "preco_venda", "unidade_medida")
+
+
+def preparar_produtos(df: pd.DataFrame) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Valida e converte as linhas da planilha com operações por coluna.
+
+    Returns:
+        (registros prontos para o upsert, mensagens de erro por linha).
+        Cada registro leva 'linha' (número da linha no Excel) além das colunas do produto.
+    """
+    # Linhas completamente vazias são ignoradas
+    df = df.dropna(how="all")
+    erros = pd.Series(pd.NA, index=df.index, dtype="object")
+
+    def marcar_erro(mascara: pd.Series, mensagem: str) -> None:
+        # Mantém o primeiro erro encontrado em cada linha
+        novos = mascara.fillna(False).astype(bool) & erros.isna()
+        erros[novos] = mensagem
+
+    def coluna(nome: str) -> pd.Series:
+        if nome in df.columns:
+            return df[nome]
+        return pd.Series(pd.NA, index=df.index, dtype="object")
+
+    for nome in COLUNAS_OBRIGATORIAS:
+        marcar_erro(df[nome].isna(), f"A coluna obrigatória '{nome}' está vazia.")
+
+    preco_venda = parse_float_br_serie(df["preco_venda"])
+    marcar_erro(df["preco_venda"].notna() & preco_venda.isna(), "Valor inválido na coluna 'preco_venda'.")
+    preco_custo = parse_float_br_serie(coluna("preco_custo"))
+    marcar_erro(coluna("preco_custo").notna() & preco_custo.isna(), "Valor inválido na coluna 'preco_custo'.")
+
+    inteiros = {}
+    for nome in ("estoque", "estoque_minimo"):
+        valores = pd.to_numeric(coluna(nome), errors="coerce")
+        marcar_erro(coluna(nome).notna() & valores.isna(), f"Valor inválido na coluna '{nome}'.")
+        # Como int() do valor da planilha: trunca as casas decimais; vazio = 0
+        inteiros[nome] = valores.fillna(0).astype("float64").astype("int64")
+
+    data_validade = pd.to_datetime(coluna("data_validade"), errors="coerce", format="mixed")
+    marcar_erro(coluna("data_validade").notna() & data_validade.isna(), "Data inválida na coluna 'data_validade'.")
+
+    validas = erros.isna()
+    linhas = pd.Series(df.index + 2, index=df.index)
+
+    mensagens = [
+        f"Erro na linha {linha} (Produto código: '{codigo}'): {mensagem}"
+        for linha, codigo, mensagem in zip(
+            linhas[~validas],
+            df.loc[~validas, "codigo"].astype("object").where(df.loc[~validas, "codigo"].notna(), "N/A"),
+            erros[~validas]
+        )
+    ]
+
+    descricao = coluna("descricao")
+    tabela = pd.DataFrame({
+        "linha": linhas[validas],
+        "codigo": df.loc[validas, "codigo"].astype("object").map(str),
+        "nome": df.loc[validas, "nome"].astype("object").map(str),
+        "categoria": df.loc[validas, "categoria"].astype("object").map(str),
+        "preco_venda": preco_venda[validas].astype("float64"),
+        "unidade_medida": df.loc[validas, "unidade_medida"].astype("object").map(str),
+        "quantidade_em_estoque": inteiros["estoque"][validas],
+        "descricao": descricao[validas].astype("object").map(str, na_action="ignore"),
+        "preco_custo": preco_custo[validas].astype("object"),
+        "estoque_minimo": inteiros["estoque_minimo"][validas],
+        "data_validade": data_validade[validas].dt.date.astype("object"),
+    })
+    # NA/NaT -> None para o banco
+    tabela = tabela.astype("object").where(tabela.notna(), None)
+    return tabela.to_dict("records"), mensagens
+
+
+def ler_produtos_planilha(origem: Union[bytes, str]) -> Dict[str, Any]:
+    """Lê e valida a planilha de produtos (pool de processos do parse_executor)."""
+    df = ler_planilha(origem)
+    faltando = [nome for nome in COLUNAS_OBRIGATORIAS if nome not in df.columns]
+    if faltando:
+        return {"colunas_faltando": faltando}
+    registros, erros = preparar_produtos(df)
+    return {"colunas_faltando": [], "total_linhas": len(df), "registros": registros, "erros": erros}
+
+
 @router.post("/upload-excel", status_code=status.HTTP_200_OK)
 async def upload_excel_file(
     file: UploadFile = File(...),
@@ -69,87 +196,79 @@ async def upload_excel_file(
     if not file.filename.endswith((".xls", ".xlsx")):
         raise HTTPException(status_code=400, detail="Arquivo deve ser Excel (.xls ou .xlsx)")
 
-    contents = await file.read()
+    # Gravado em disco em blocos: o processo de leitura recebe só o caminho
+    caminho_planilha, _hash_arquivo = await salvar_upload_temporario(file, os.path.splitext(file.filename)[1])
     try:
-        # Substitui valores vazios por None para evitar erros com NaN
-        df = pd.read_excel(contents).fillna(value=pd.NA)
-        # Garante que os nomes das colunas estão em minúsculo para facilitar a busca
-        df.columns = df.columns.str.lower()
+        # Leitura, validação e conversão das colunas no pool de processos
+        planilha = await parse_executor.executar_parse(ler_produtos_planilha, caminho_planilha)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Erro ao ler Excel: {str(e)}")
+    finally:
+        os.unlink(caminho_planilha)
 
-    # Colunas obrigatórias para criar/atualizar um produto.
-    required_cols = {"codigo", "nome", "categoria", "preco_venda", "unidade_medida"}
-    if not required_cols.issubset(df.columns):
-        raise HTTPException(status_code=400, detail=f"O Excel deve conter as colunas: {', '.join(required_cols)}")
+    if planilha["colunas_faltando"]:
+        raise HTTPException(status_code=400, detail=f"O Excel deve conter as colunas: {', '.join(COLUNAS_OBRIGATORIAS)}")
 
-    # --- INÍCIO DA SEÇÃO DE DEPURAÇÃO ---
-    print("--- INICIANDO PROCESSAMENTO DE UPLOAD ---")
-    print(f"Arquivo recebido: {file.filename}")
-    print(f"Total de linhas encontradas no Excel: {len(df)}")
-    # --- FIM DA SEÇÃO DE DEPURAÇÃO ---
-
-    erros = []
-    processados = 0
+    registros = planilha["registros"]
+    erros = list(planilha["erros"])
+    logger.info(
+        f"Upload de produtos '{file.filename}': {planilha['total_linhas']} linhas, "
+        f"{len(registros)} válidas, {len(erros)} com erro"
+    )
 
-    for index, row in df.iterrows():
-        # --- DEPURAÇÃO DENTRO DO LOOP ---
-        print("\n" + "="*50)
-        print(f"[DEBUG] Processando linha do Excel nº: {index + 2}")
-        print(f"[DEBUG] DADOS DA LINHA BRUTA:\n{row.to_dict()}")
-        # --- FIM DA DEPURAÇÃO DENTRO DO LOOP ---
+    def importar_linhas():
+        processados = 0
 
-        try:
-            # Validação para pular linhas completamente vazias
-            if row.isnull().all():
-                print("[DEBUG] Linha vazia detectada. Pulando...")
+        for inicio in range(0, len(registros), TAMANHO_LOTE_UPSERT):
+            lote = registros[inicio:inicio + TAMANHO_LOTE_UPSERT]
+            # Mesmo código repetido na planilha: vale a última linha (como nos upserts linha a linha)
+            ultimos = {registro["codigo"]: registro for registro in lote}
+            try:
+                gravados = crud_produto.upsert_produtos_em_lote(
+                    db,
+                    [{chave: valor for chave, valor in registro.items() if chave != "linha"} for registro in ultimos.values()],
+                    current_user.empresa_id
+                )
+            except Exception as e:
+                # Lote recusado pelo banco: refaz linha a linha para apontar qual linha falhou
+                db.rollback()
+                logger.warning(f"⚠️ Upsert em lote de produtos falhou ({e}); processando o lote linha a linha")
+                processados += _importar_linha_a_linha(db, lote, current_user.empresa_id, erros)
                 continue
 
-            # Validação para garantir que os campos obrigatórios não são nulos na linha atual
-            for col in required_cols:
-                if pd.isna(row.get(col)):
-                    raise ValueError(f"A coluna obrigatória '{col}' está vazia.")
+            for registro in lote:
+                if registro["codigo"] in gravados:
+                    processados += 1
+                else:
+                    erros.append(
+                        f"Erro na linha {registro['linha']} (Produto código: '{registro['codigo']}'): "
+                        "o código já está cadastrado em outra empresa."
+                    )
+
+        logger.info(f"✓ Upload de produtos concluído: {processados} processados, {len(erros)} erros")
+
+        if erros:
+            return {"message": f"{processados} produtos processados com erros. Verifique o log do servidor para detalhes.", "processados": processados, "erros": erros}
+
+        return {"message": "Todos os produtos foram processados com sucesso!", "processados": processados}
+
+    # Upsert em lote no pool de threads de banco
+    return await parse_executor.executar_db(importar_linhas)
 
-            # Constrói o objeto do produto a partir da linha do Excel
+
+def _importar_linha_a_linha(db: Session, lote: List[Dict[str, Any]], empresa_id: int, erros: List[str]) -> int:
+    """Caminho antigo (um upsert por linha), usado só quando o lote inteiro é recusado."""
+    processados = 0
+    for registro in lote:
+        try:
             produto_data = schemas_produto.ProdutoCreate(
-                codigo=str(row["codigo"]),
-                nome=str(row["nome"]),
-                categoria=str(row["categoria"]),
-                preco_venda=parse_float_br(row["preco_venda"]),
-                unidade_medida=str(row["unidade_medida"]),
-                quantidade_em_estoque=int(row.get("estoque")) if pd.notna(row.get("estoque")) else 0,
-                # Campos opcionais com tratamento para valores nulos (NA)
-                descricao=str(row.get("descricao")) if pd.notna(row.get("descricao")) else None,
-                preco_custo=parse_float_br(row.get("preco_custo")) if pd.notna(row.get("preco_custo")) else None,
-                estoque_minimo=int(row.get("estoque_minimo")) if pd.notna(row.get("estoque_minimo")) else 0,
-                data_validade=pd.to_datetime(row.get("data_validade")).date() if pd.notna(row.get("data_validade")) else None,
+                **{chave: valor for chave, valor in registro.items() if chave != "linha"}
             )
-            
-            print(f"[DEBUG] Objeto Pydantic criado com sucesso. Enviando para o CRUD...")
-            
-            # Chama a função "upsert"
-            crud_produto.create_or_update_produto(db=db, produto_data=produto_data, empresa_id=current_user.empresa_id)
+            crud_produto.create_or_update_produto(db=db, produto_data=produto_data, empresa_id=empresa_id)
             processados += 1
-            print(f"[DEBUG] Linha {index + 2} processada com SUCESSO. (Total processados: {processados})")
-
         except Exception as e:
-            error_message = f"Erro na linha {index + 2} (Produto código: '{row.get('codigo', 'N/A')}'): {str(e)}"
-            print(f"[ERRO] {error_message}")
-            erros.append(error_message)
-
-    # --- DEPURAÇÃO FINAL ---
-    print("\n" + "="*50)
-    print("--- FIM DO PROCESSAMENTO DO ARQUIVO ---")
-    print(f"Total de produtos processados com sucesso: {processados}")
-    print(f"Total de erros encontrados: {len(erros)}")
-    if erros:
-        print("Resumo dos erros:")
-        for err in erros:
-            print(f"  - {err}")
-    print("="*50)
-    # --- FIM DA DEPURAÇÃO FINAL ---
-
-    if erros:
-        return {"message": f"{processados} produtos processados com erros. Verifique o log do servidor para detalhes.", "processados": processados, "erros": erros}
-
-    return {"message": "Todos os produtos foram processados com sucesso!", "processados": processados}
\ No newline at end of file
+            db.rollback()
+            erros.append(f"Erro na linha {registro['linha']} (Produto código: '{registro['codigo']}'): {str(e)}")
+    return processados
@@ -4,19 +4,25 @@ Router para o módulo de vendas mobile
 Focado em operações rápidas para vendedores de rua
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 from sqlalchemy import func, desc
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime, date, timedelta
+import logging
 
+from ..core.config import settings
 from ..db.connection import get_db
+from ..db.schema_capabilities import schema_capabilities
 from ..dependencies import get_current_user
 from ..db import models
 from ..schemas import vendas as schemas
+from ..services.estatisticas_preco_service import EstatisticasPrecoService
 
 OBSERVACAO_VENDA_OPERADOR = "Venda Operador"
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(
     prefix="/vendas",
     tags=["Vendas Mobile"]
@@ -119,58 +125,97 @@ def busca_rapida_clientes(
 
 # ============= PRODUTOS DISPONÍVEIS =============
 
+ESTATISTICAS_PRECO_VAZIAS = {
+    'preco_maior': None,
+    'preco_medio': None,
+    'preco_menor': None,
+    'total_vendas': 0
+}
+
+
+def calcular_estatisticas_preco_lote(produto_ids: List[int], empresa_id: int, db: Session) -> Dict[int, dict]:
+    """
+    Retorna as estatísticas de preço (maior, médio, menor e total de vendas) de
+    vários produtos. Lê a tabela materializada estatisticas_preco_produto e, se
+    ela ainda não existir, agrega o histórico de preços em uma única consulta.
+
+    Produtos sem histórico não aparecem no dicionário retornado.
+    """
+    if not produto_ids:
+        return {}
+
+    if schema_capabilities.has_table('estatisticas_preco_produto'):
+        try:
+            return EstatisticasPrecoService.obter_lote(db, produto_ids, empresa_id)
+        except Exception as e:
+            logger.debug(f"Erro ao ler estatísticas de preço materializadas: {str(e)}")
+            db.rollback()
+            return {}
+
+    if not schema_capabilities.has_table('historico_preco_produto'):
+        return {}
+
+    try:
+        linhas = db.query(
+            models.HistoricoPrecoProduto.produto_id,
+            func.max(models.HistoricoPrecoProduto.preco_unitario),
+            func.avg(models.HistoricoPrecoProduto.preco_unitario),
+            func.min(models.HistoricoPrecoProduto.preco_unitario),
+            func.count(models.HistoricoPrecoProduto.id)
+        ).filter(
+            models.HistoricoPrecoProduto.produto_id.in_(produto_ids),
+            models.HistoricoPrecoProduto.empresa_id == empresa_id
+        ).group_by(models.HistoricoPrecoProduto.produto_id).all()
+    except Exception as e:
+        logger.debug(f"Erro ao calcular estatísticas de preço em lote: {str(e)}")
+        db.rollback()
+        return {}
+
+    return {
+        produto_id: {
+            'preco_maior': preco_maior,
+            'preco_medio': float(preco_medio) if preco_medio is not None else None,
+            'preco_menor': preco_menor,
+            'total_vendas': total_vendas
+        }
+        for produto_id, preco_maior, preco_medio, preco_menor, total_vendas in linhas
+    }
+
+
 def calcular_estatisticas_preco(produto_id: int, empresa_id: int, db: Session) -> dict:
     """Calcula estatísticas de preços de um produto baseado no histórico de vendas"""
+    return calcular_estatisticas_preco_lote([produto_id], empresa_id, db).get(
+        produto_id, dict(ESTATISTICAS_PRECO_VAZIAS)
+    )
+
+
+def buscar_precos_cliente_lote(cliente_id: int, produto_ids: List[int], db: Session) -> Dict[int, models.PrecoClienteProduto]:
+    """Busca, com uma única consulta, o range de preços do cliente para vários produtos."""
+    if not produto_ids:
+        return {}
     try:
-        # Verificar se a tabela existe (pode não existir ainda se a migration não foi executada)
-        historico = db.query(models.HistoricoPrecoProduto).filter(
-            models.HistoricoPrecoProduto.produto_id == produto_id,
-            models.HistoricoPrecoProduto.empresa_id == empresa_id
+        precos = db.query(models.PrecoClienteProduto).filter(
+            models.PrecoClienteProduto.cliente_id == cliente_id,
+            models.PrecoClienteProduto.produto_id.in_(produto_ids)
         ).all()
-        
-        if not historico:
-            return {
-                'preco_maior': None,
-                'preco_medio': None,
-                'preco_menor': None,
-                'total_vendas': 0
-            }
-        
-        precos = [h.preco_unitario for h in historico]
-        
-        return {
-            'preco_maior': max(precos),
-            'preco_medio': sum(precos) / len(precos),
-            'preco_menor': min(precos),
-            'total_vendas': len(historico)
-        }
     except Exception as e:
-        # Se a tabela não existir ou houver qualquer erro, retornar valores vazios
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.debug(f"Erro ao calcular estatísticas de preço (tabela pode não existir): {str(e)}")
-        return {
-            'preco_maior': None,
-            'preco_medio': None,
-            'preco_menor': None,
-            'total_vendas': 0
-        }
+        logger.warning(f"Erro ao buscar preços do cliente {cliente_id}: {str(e)}")
+        db.rollback()
+        return {}
+    return {preco.produto_id: preco for preco in precos}
+
 
 @router.get("/produtos/disponiveis", response_model=List[schemas.ProdutoVenda])
 def listar_produtos_venda(
     busca: Optional[str] = None,
     categoria: Optional[str] = None,
     cliente_id: Optional[int] = None,  # Novo parâmetro para buscar range de preços do cliente
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=settings.MAX_PAGE_SIZE, description="Tamanho da página (sem limite se omitido)"),
     db: Session = Depends(get_db),
     current_user: models.Usuario = Depends(get_current_user)
 ):
     empresa_id = _resolve_empresa_id(db, current_user)
-    
-    # Debug temporário
-    import logging
-    logger = logging.getLogger(__name__)
-    if cliente_id:
-        logger.info(f"[DEBUG] Buscando produtos com cliente_id={cliente_id}")
 
     query = db.query(models.Produto).filter(
         models.Produto.empresa_id == empresa_id,
@@ -179,52 +224,43 @@ def listar_produtos_venda(
     )
     
     if busca:
+        # Atendido pelos índices trigram (pg_trgm) de produtos.nome/codigo
         termo_busca = f"%{busca}%"
         query = query.filter(
             (models.Produto.nome.ilike(termo_busca)) |
             (models.Produto.codigo.ilike(termo_busca))
-
-
         )
     
     if categoria:
         query = query.filter(models.Produto.categoria == categoria)
     
-    produtos = query.order_by(models.Produto.nome).all()
+    query = query.order_by(models.Produto.nome, models.Produto.id).offset(skip)
+    if limit:
+        query = query.limit(limit)
+    produtos = query.all()
+    
+    # Estatísticas e ranges do cliente para a página inteira: uma consulta agregada cada
+    produto_ids = [p.id for p in produtos]
+    estatisticas_por_produto = calcular_estatisticas_preco_lote(produto_ids, empresa_id, db)
+    precos_cliente = buscar_precos_cliente_lote(cliente_id, produto_ids, db) if cliente_id else {}
     
     resultado = []
     for p in produtos:
         try:
-            # Calcular estatísticas de preço
-            estatisticas_dict = calcular_estatisticas_preco(p.id, empresa_id, db)
-            # Sempre criar o objeto de estatísticas, mesmo que os valores sejam None
-            estatisticas = schemas.EstatisticasPreco(**estatisticas_dict)
+            estatisticas = schemas.EstatisticasPreco(
+                **estatisticas_por_produto.get(p.id, ESTATISTICAS_PRECO_VAZIAS)
+            )
             
-            # Buscar range de preços do cliente se cliente_id foi fornecido
             preco_cliente = None
-            if cliente_id:
-                try:
-                    preco_cliente_produto = db.query(models.PrecoClienteProduto).filter(
-                        models.PrecoClienteProduto.cliente_id == cliente_id,
-                        models.PrecoClienteProduto.produto_id == p.id
-                    ).first()
-                    
-                    if preco_cliente_produto:
-                        preco_cliente = schemas.PrecoClienteRange(
-                            minimo=preco_cliente_produto.preco_minimo,
-                            maximo=preco_cliente_produto.preco_maximo,
-                            medio=preco_cliente_produto.preco_medio,
-                            ultimo=preco_cliente_produto.preco_padrao,
-                            total_vendas=preco_cliente_produto.total_vendas or 0
-                        )
-                        logger.info(f"[DEBUG] Produto {p.id} tem range: min={preco_cliente.minimo}, max={preco_cliente.maximo}")
-                    else:
-                        logger.info(f"[DEBUG] Produto {p.id} NÃO tem range para cliente {cliente_id}")
-                except Exception as e:
-                    # Se houver erro ao buscar preço do cliente, apenas logar e continuar
-                    import logging
-                    logger = logging.getLogger(__name__)
-                    logger.warning(f"Erro ao buscar preço do cliente {cliente_id} para produto {p.id}: {str(e)}")
+            preco_cliente_produto = precos_cliente.get(p.id)
+            if preco_cliente_produto:
+                preco_cliente = schemas.PrecoClienteRange(
+                    minimo=preco_cliente_produto.preco_minimo,
+                    maximo=preco_cliente_produto.preco_maximo,
+                    medio=preco_cliente_produto.preco_medio,
+                    ultimo=preco_cliente_produto.preco_padrao,
+                    total_vendas=preco_cliente_produto.total_vendas or 0
+                )
             
             produto_venda = schemas.ProdutoVenda(
                 id=p.id,
@@ -238,25 +274,11 @@ def listar_produtos_venda(
                 preco_cliente=preco_cliente
             )
             
-            # Debug temporário - contar produtos com preco_cliente
-            if cliente_id and preco_cliente:
-                logger.info(f"[DEBUG] Produto {p.id} ({p.nome}) retornado com preco_cliente: min={preco_cliente.minimo}, max={preco_cliente.maximo}")
-            
             resultado.append(produto_venda)
         except Exception as e:
-            # Se houver erro ao calcular estatísticas, retornar produto com estatísticas vazias
-            import logging
-            logger = logging.getLogger(__name__)
+            # Se houver erro ao montar as estatísticas, retornar produto com estatísticas vazias
             logger.warning(f"Erro ao calcular estatísticas para produto {p.id}: {str(e)}")
             
-            # Criar estatísticas vazias em caso de erro
-            estatisticas_vazias = schemas.EstatisticasPreco(
-                preco_maior=None,
-                preco_medio=None,
-                preco_menor=None,
-                total_vendas=0
-            )
-            
             produto_venda = schemas.ProdutoVenda(
                 id=p.id,
                 nome=p.nome,
@@ -265,16 +287,14 @@ def listar_produtos_venda(
                 estoque_disponivel=p.quantidade_em_estoque,
                 categoria=p.categoria,
                 unidade_medida=p.unidade_medida,
-                estatisticas_preco=estatisticas_vazias,
+                estatisticas_preco=schemas.EstatisticasPreco(**ESTATISTICAS_PRECO_VAZIAS),
                 preco_cliente=None  # Adicionar campo preco_cliente mesmo em caso de erro
             )
             
             resultado.append(produto_venda)
     
-    # Debug final - resumo
     if cliente_id:
-        produtos_com_range = [p for p in resultado if p.preco_cliente]
-        logger.info(f"[DEBUG] Total de produtos retornados: {len(resultado)}, com range de preços: {len(produtos_com_range)}")
+        logger.debug(f"Produtos retornados: {len(resultado)}, com range de preços do cliente: {len(precos_cliente)}")
     
     return resultado
     
@@ -385,5 +405,8 @@ def _resolve_empresa_id(db: Session, usuario: models.Usuario) -> int:
     db.add(usuario)
     db.commit()
     db.refresh(usuario)
+    # Principal em cache ainda tem empresa_id vazio
+    from app.core.principal_cache import principal_cache
+    principal_cache.invalidar(usuario.email)
 
     return usuario.empresa_id
@@ -29,6 +29,8 @@ class MovimentacaoEstoqueCreate(MovimentacaoEstoqueBase):
     tipo_movimentacao: str
     motivo_movimentacao: Optional[MotivoMovimentacao] = None
     observacao_motivo: Optional[str] = None
+    nota_fiscal: Optional[str] = None
+    chave_acesso: Optional[str] = None
 
     @validator('tipo_movimentacao')
     def tipo_deve_ser_valido(cls, v):
@@ -98,6 +100,8 @@ class MovimentacaoEstoqueResponse(MovimentacaoEstoqueBase):
     motivo_rejeicao: Optional[str] = None
     motivo_movimentacao: Optional[MotivoMovimentacao] = None
     observacao_motivo: Optional[str] = None
+    nota_fiscal: Optional[str] = None
+    chave_acesso: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -143,50 +143,98 @@ class ClienteAnalyticsService:
         Returns:
             Dicionário com análise por cliente
         """
+        return self.analisar_padroes_produtos_por_cliente_lote(
+            [produto_id], empresa_id, dias_analise
+        )[produto_id]
+    
+    def analisar_padroes_produtos_por_cliente_lote(
+        self,
+        produto_ids: List[int],
+        empresa_id: int,
+        dias_analise: int = 90,
+        limite_clientes: Optional[int] = None
+    ) -> Dict[int, Dict[str, Any]]:
+        """
+        Mesma análise de analisar_padroes_produto_por_cliente para vários produtos,
+        com uma única consulta ao histórico de vendas (já com os dados do cliente).
+        
+        Args:
+            produto_ids: IDs dos produtos
+            empresa_id: ID da empresa
+            dias_analise: Período de análise em dias
+            limite_clientes: Se informado, mantém apenas os N clientes de maior valor
+            
+        Returns:
+            Dicionário produto_id -> análise por cliente
+        """
         data_limite = datetime.now() - timedelta(days=dias_analise)
         
-        # Buscar histórico de vendas do produto
-        vendas = self.db.query(models.HistoricoVendaCliente).filter(
-            models.HistoricoVendaCliente.produto_id == produto_id,
-            models.HistoricoVendaCliente.empresa_id == empresa_id,
-            models.HistoricoVendaCliente.data_venda >= data_limite
-        ).order_by(models.HistoricoVendaCliente.data_venda.desc()).all()
+        vendas = []
+        if produto_ids:
+            vendas = self.db.query(
+                models.HistoricoVendaCliente.produto_id,
+                models.HistoricoVendaCliente.cliente_id,
+                models.HistoricoVendaCliente.quantidade_vendida,
+                models.HistoricoVendaCliente.valor_total,
+                models.HistoricoVendaCliente.data_venda,
+                models.Cliente.id.label('cliente_existe'),
+                models.Cliente.razao_social,
+                models.Cliente.cnpj
+            ).outerjoin(
+                models.Cliente, models.Cliente.id == models.HistoricoVendaCliente.cliente_id
+            ).filter(
+                models.HistoricoVendaCliente.produto_id.in_(produto_ids),
+                models.HistoricoVendaCliente.empresa_id == empresa_id,
+                models.HistoricoVendaCliente.data_venda >= data_limite
+            ).order_by(models.HistoricoVendaCliente.data_venda.desc()).all()
         
-        # Agrupar por cliente
-        clientes_vendas = defaultdict(lambda: {
-            'total_quantidade': 0,
-            'total_valor': 0,
-            'num_vendas': 0,
-            'datas': []
-        })
+        # Agrupar por produto e cliente
+        vendas_por_produto = defaultdict(lambda: {'total_vendido': 0, 'total_valor': 0, 'clientes': {}})
+        dados_clientes = {}
         
         for venda in vendas:
-            cliente_id = venda.cliente_id
-            clientes_vendas[cliente_id]['total_quantidade'] += venda.quantidade_vendida
-            clientes_vendas[cliente_id]['total_valor'] += venda.valor_total
-            clientes_vendas[cliente_id]['num_vendas'] += 1
-            clientes_vendas[cliente_id]['datas'].append(venda.data_venda)
+            produto = vendas_por_produto[venda.produto_id]
+            produto['total_vendido'] += venda.quantidade_vendida
+            produto['total_valor'] += venda.valor_total
+            
+            dados = produto['clientes'].setdefault(venda.cliente_id, {
+                'total_quantidade': 0,
+                'total_valor': 0,
+                'num_vendas': 0,
+                'datas': []
+            })
+            dados['total_quantidade'] += venda.quantidade_vendida
+            dados['total_valor'] += venda.valor_total
+            dados['num_vendas'] += 1
+            dados['datas'].append(venda.data_venda)
+            if venda.cliente_existe is not None:
+                dados_clientes[venda.cliente_id] = (venda.razao_social, venda.cnpj)
         
-        # Criar lista de clientes que compram o produto
-        clientes_produto = []
-        for cliente_id, dados in sorted(
-            clientes_vendas.items(),
-            key=lambda x: x[1]['total_valor'],
-            reverse=True
-        ):
-            cliente = self.db.query(models.Cliente).filter(
-                models.Cliente.id == cliente_id
-            ).first()
+        resultado = {}
+        for produto_id in produto_ids:
+            produto = vendas_por_produto.get(produto_id, {'total_vendido': 0, 'total_valor': 0, 'clientes': {}})
             
-            if cliente:
+            # Criar lista de clientes que compram o produto
+            clientes_produto = []
+            for cliente_id, dados in sorted(
+                produto['clientes'].items(),
+                key=lambda x: x[1]['total_valor'],
+                reverse=True
+            ):
+                if cliente_id not in dados_clientes:
+                    continue
+                if limite_clientes is not None and len(clientes_produto) >= limite_clientes:
+                    break
+                
+                razao_social, cnpj = dados_clientes[cliente_id]
                 frequencia = self._calcular_frequencia_media(dados['datas'])
                 ultima_compra = max(dados['datas']) if dados['datas'] else None
                 dias_ultima_compra = (datetime.now() - ultima_compra).days if ultima_compra else None
                 
                 clientes_produto.append({
                     'cliente_id': cliente_id,
-                    'cliente_nome': cliente.razao_social,
-                    'cnpj': cliente.cnpj,
+                    'cliente_nome': razao_social,
+                    'cnpj': cnpj,
                     'total_quantidade': dados['total_quantidade'],
                     'total_valor': dados['total_valor'],
                     'num_vendas': dados['num_vendas'],
@@ -195,20 +243,17 @@ class ClienteAnalyticsService:
                     'dias_ultima_compra': dias_ultima_compra,
                     'tendencia': self._calcular_tendencia_cliente_produto(dados['datas'])
                 })
+            
+            resultado[produto_id] = {
+                'produto_id': produto_id,
+                'total_vendido': produto['total_vendido'],
+                'total_valor': produto['total_valor'],
+                'clientes_unicos': len(produto['clientes']),
+                'clientes': clientes_produto,
+                'periodo_analise_dias': dias_analise
+            }
         
-        # Estatísticas gerais
-        total_vendido = sum(v.quantidade_vendida for v in vendas)
-        total_valor = sum(v.valor_total for v in vendas)
-        clientes_unicos = len(clientes_vendas)
-        
-        return {
-            'produto_id': produto_id,
-            'total_vendido': total_vendido,
-            'total_valor': total_valor,
-            'clientes_unicos': clientes_unicos,
-            'clientes': clientes_produto,
-            'periodo_analise_dias': dias_analise
-        }
+        return resultado
     
     def _calcular_frequencia_media(self, datas: List[datetime]) -> Optional[float]:
         """Calcula frequência média de compra em dias."""
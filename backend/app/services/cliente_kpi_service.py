@@ -5,10 +5,10 @@ Serviço para cálculo de KPIs de clientes.
 Utilizado para análise de comportamento, previsão de demanda e estratégias de crescimento.
 """
 
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from typing import List, Dict, Any, Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, and_
+from sqlalchemy import func, desc, and_, case, cast, select, Float
 import logging
 
 from ..db import models
@@ -16,6 +16,13 @@ from ..db import models
 logger = logging.getLogger(__name__)
 
 
+def _para_data(valor) -> date:
+    # func.date devolve date no Postgres e string ISO no SQLite
+    if isinstance(valor, str):
+        return date.fromisoformat(valor[:10])
+    return valor
+
+
 class ClienteKPIService:
     """Serviço para calcular KPIs de clientes."""
     
@@ -283,3 +290,155 @@ class ClienteKPIService:
                 'erro': str(e)
             }
 
+    def calcular_ranking_kpis(
+        self,
+        empresa_id: int,
+        metrica: str = 'total_vendido',
+        limite: int = 10,
+        dias_periodo: int = 90
+    ) -> List[Dict[str, Any]]:
+        """
+        Calcula os KPIs de todos os clientes da empresa em uma consulta agrupada
+        e retorna os `limite` primeiros pela métrica, com a ordenação no banco.
+        
+        Mesmos campos de calcular_todos_kpis (mais cliente_nome). A frequência
+        média entre compras é (última data - primeira data) / (datas distintas - 1),
+        equivalente à média das diferenças entre datas consecutivas.
+        
+        Args:
+            empresa_id: ID da empresa
+            metrica: total_vendido, ticket_medio ou frequencia
+            limite: Número de clientes no ranking
+            dias_periodo: Período em dias para análise (padrão: 90 dias)
+        
+        Returns:
+            Lista de clientes ordenada pela métrica
+        """
+        data_limite = datetime.now() - timedelta(days=dias_periodo)
+        historico = models.HistoricoVendaCliente
+        
+        dia = func.date(historico.data_venda)
+        total_vendido = func.sum(historico.valor_total)
+        numero_pedidos = func.count(func.distinct(historico.orcamento_id))
+        datas_distintas = func.count(func.distinct(dia))
+        primeira_data = func.min(dia)
+        ultima_data = func.max(dia)
+        
+        ticket_medio = total_vendido / func.nullif(numero_pedidos, 0)
+        frequencia = case(
+            (datas_distintas >= 2, cast(ultima_data - primeira_data, Float) / (datas_distintas - 1)),
+            else_=None
+        )
+        
+        if metrica == 'total_vendido':
+            ordem = [desc(total_vendido), models.Cliente.id]
+        elif metrica == 'ticket_medio':
+            ordem = [desc(func.coalesce(ticket_medio, 0)), models.Cliente.id]
+        elif metrica == 'frequencia':
+            ordem = [func.coalesce(frequencia, 999), models.Cliente.id]
+        else:
+            ordem = [models.Cliente.id]
+        
+        linhas = self.db.query(
+            models.Cliente.id.label('cliente_id'),
+            models.Cliente.razao_social,
+            total_vendido.label('total_vendido'),
+            numero_pedidos.label('numero_pedidos'),
+            datas_distintas.label('datas_distintas'),
+            primeira_data.label('primeira_data'),
+            ultima_data.label('ultima_data')
+        ).join(
+            models.Cliente, models.Cliente.id == historico.cliente_id
+        ).filter(
+            historico.empresa_id == empresa_id,
+            historico.data_venda >= data_limite
+        ).group_by(
+            models.Cliente.id, models.Cliente.razao_social
+        ).order_by(*ordem).limit(limite).all()
+        
+        produtos_por_cliente = self._produtos_mais_comprados_lote(
+            [linha.cliente_id for linha in linhas], empresa_id, limite=10, dias_periodo=dias_periodo
+        )
+        data_calculo = datetime.now().isoformat()
+        
+        ranking = []
+        for linha in linhas:
+            total = float(linha.total_vendido or 0)
+            frequencia_dias = None
+            if linha.datas_distintas >= 2:
+                intervalo = (_para_data(linha.ultima_data) - _para_data(linha.primeira_data)).days
+                frequencia_dias = round(intervalo / (linha.datas_distintas - 1), 1)
+            
+            ranking.append({
+                'cliente_id': linha.cliente_id,
+                'cliente_nome': linha.razao_social,
+                'periodo_dias': dias_periodo,
+                'total_vendido': total,
+                'numero_pedidos': linha.numero_pedidos,
+                'ticket_medio': round(total / linha.numero_pedidos, 2) if linha.numero_pedidos else None,
+                'frequencia_compras_dias': frequencia_dias,
+                'produtos_mais_comprados': produtos_por_cliente.get(linha.cliente_id, []),
+                'data_calculo': data_calculo
+            })
+        
+        return ranking
+    
+    def _produtos_mais_comprados_lote(
+        self,
+        cliente_ids: List[int],
+        empresa_id: int,
+        limite: int = 10,
+        dias_periodo: int = 90
+    ) -> Dict[int, List[Dict[str, Any]]]:
+        """
+        Produtos mais comprados de vários clientes em uma consulta, com o
+        top-N por cliente resolvido no banco (ROW_NUMBER() OVER).
+        """
+        if not cliente_ids:
+            return {}
+        
+        data_limite = datetime.now() - timedelta(days=dias_periodo)
+        historico = models.HistoricoVendaCliente
+        quantidade_total = func.sum(historico.quantidade_vendida)
+        
+        por_produto = select(
+            historico.cliente_id,
+            historico.produto_id,
+            quantidade_total.label('quantidade_total'),
+            func.max(historico.data_venda).label('ultima_compra'),
+            func.count(historico.orcamento_id.distinct()).label('numero_pedidos'),
+            func.row_number().over(
+                partition_by=historico.cliente_id,
+                order_by=(desc(quantidade_total), historico.produto_id)
+            ).label('posicao')
+        ).where(
+            historico.cliente_id.in_(cliente_ids),
+            historico.empresa_id == empresa_id,
+            historico.data_venda >= data_limite
+        ).group_by(
+            historico.cliente_id, historico.produto_id
+        ).subquery()
+        
+        linhas = self.db.execute(
+            select(
+                por_produto,
+                models.Produto.nome,
+                models.Produto.codigo
+            ).join(
+                models.Produto, models.Produto.id == por_produto.c.produto_id
+            ).where(
+                por_produto.c.posicao <= limite
+            ).order_by(por_produto.c.cliente_id, por_produto.c.posicao)
+        ).all()
+        
+        produtos: Dict[int, List[Dict[str, Any]]] = {}
+        for linha in linhas:
+            produtos.setdefault(linha.cliente_id, []).append({
+                'produto_id': linha.produto_id,
+                'produto_nome': linha.nome,
+                'produto_codigo': linha.codigo,
+                'quantidade_total': int(linha.quantidade_total),
+                'ultima_compra': linha.ultima_compra.isoformat() if linha.ultima_compra else None,
+                'numero_pedidos': linha.numero_pedidos
+            })
+        return produtos
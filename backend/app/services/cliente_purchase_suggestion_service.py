@@ -1,15 +1,17 @@
 """
 Serviço de sugestões de compra baseado em padrões de compra dos clientes.
-Analisa histórico de NF-e e orçamentos confirmados (HistoricoVendaCliente) para identificar padrões e sugerir compras.
+Analisa as vendas a clientes (read model vendas_unificadas: NF-e + orçamentos confirmados sem NF)
+para identificar padrões e sugerir compras.
 """
 
 from typing import Dict, List, Any, Optional, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import func, text
+from sqlalchemy import and_, case, func, text
 from datetime import datetime, timedelta
 from collections import defaultdict
 import logging
 
+from ..core.sugestao_cache import sugestao_clientes_cache
 from ..db import models
 from .regras_sugestao_service import get_regras_empresa
 
@@ -23,7 +25,7 @@ def _linha_compra(produto_id: int, quantidade: float, valor_total: float, data_v
 class ClientePurchaseSuggestionService:
     """
     Serviço para sugerir compras baseadas no histórico de compras dos clientes.
-    Usa HistoricoPrecoProduto (NF-e) e HistoricoVendaCliente (orçamentos confirmados), evitando duplicar quando o orçamento já tem NF.
+    Lê vendas_unificadas, que já junta NF-e e orçamentos confirmados sem duplicar quando o orçamento tem NF.
     """
     
     def __init__(self, db: Session):
@@ -32,29 +34,19 @@ class ClientePurchaseSuggestionService:
     def _get_historico_unificado_cliente(
         self, cliente_id: int, empresa_id: int, data_limite: datetime
     ) -> List[Tuple[int, float, float, datetime, float]]:
-        """Unifica HPP (NF-e) e HVC (orçamentos sem NF linkada) para um cliente. Retorna lista (produto_id, quantidade, valor_total, data_venda, preco_unitario)."""
-        linhas = []
-        # HPP (NF-e verificadas)
-        for h in self.db.query(models.HistoricoPrecoProduto).filter(
-            models.HistoricoPrecoProduto.cliente_id == cliente_id,
-            models.HistoricoPrecoProduto.empresa_id == empresa_id,
-            models.HistoricoPrecoProduto.data_venda >= data_limite,
-            models.HistoricoPrecoProduto.nota_fiscal.isnot(None)
-        ).all():
-            linhas.append(_linha_compra(h.produto_id, float(h.quantidade), float(h.valor_total), h.data_venda, float(h.preco_unitario)))
-        # HVC: orçamentos que ainda não têm NF linkada (evita duplicar com HPP)
-        hvc_query = self.db.query(models.HistoricoVendaCliente).join(
-            models.Orcamento, models.Orcamento.id == models.HistoricoVendaCliente.orcamento_id
+        """Vendas do cliente no período (read model vendas_unificadas). Retorna lista (produto_id, quantidade, valor_total, data_venda, preco_unitario)."""
+        venda = models.VendaUnificada
+        rows = self.db.query(
+            venda.produto_id, venda.quantidade, venda.valor_total, venda.data_venda, venda.preco_unitario
         ).filter(
-            models.HistoricoVendaCliente.cliente_id == cliente_id,
-            models.HistoricoVendaCliente.empresa_id == empresa_id,
-            models.HistoricoVendaCliente.data_venda >= data_limite,
-            (models.Orcamento.numero_nf.is_(None)) | (models.Orcamento.numero_nf == "")
-        )
-        for h in hvc_query.all():
-            q = getattr(h, 'quantidade_vendida', None) or 0
-            linhas.append(_linha_compra(h.produto_id, float(q), float(h.valor_total), h.data_venda, float(h.preco_unitario_vendido)))
-        return linhas
+            venda.cliente_id == cliente_id,
+            venda.empresa_id == empresa_id,
+            venda.data_venda >= data_limite
+        ).all()
+        return [
+            _linha_compra(r.produto_id, float(r.quantidade or 0), float(r.valor_total), r.data_venda, float(r.preco_unitario))
+            for r in rows
+        ]
     
     def get_purchase_suggestions_for_cliente(
         self,
@@ -64,7 +56,7 @@ class ClientePurchaseSuggestionService:
     ) -> Dict[str, Any]:
         """
         Retorna sugestões de compra baseadas no histórico de um cliente específico.
-        Usa NF-e (HistoricoPrecoProduto) e orçamentos confirmados (HistoricoVendaCliente).
+        Usa as vendas unificadas (NF-e e orçamentos confirmados sem NF).
         """
         data_limite = datetime.now() - timedelta(days=dias_analise)
         historico_linhas = self._get_historico_unificado_cliente(cliente_id, empresa_id, data_limite)
@@ -317,100 +309,79 @@ class ClientePurchaseSuggestionService:
         Retorna sugestões de compra baseadas em TODOS os clientes.
         Produtos que são comprados frequentemente por múltiplos clientes.
         Usa regras da tabela regras_sugestao_compra da empresa.
+        O resultado fica em cache por (empresa, dias_analise, versão das regras); não o altere.
         """
-        regras = get_regras_empresa(self.db, empresa_id)
-        dias_analise = dias_analise if dias_analise is not None else regras["dias_analise"]
-        data_limite = datetime.now() - timedelta(days=dias_analise)
+        cache_chave = dias_analise
+        versao = sugestao_clientes_cache.versao(empresa_id)
+        em_cache = sugestao_clientes_cache.obter(empresa_id, cache_chave)
+        if em_cache is not None:
+            return em_cache
         
-        # Unificar HPP (NF-e) e HVC (orçamentos sem NF linkada) para toda a empresa
-        produtos_comprados = defaultdict(lambda: {
-            'total_quantidade': 0,
-            'total_valor': 0,
-            'num_compras': 0,
-            'clientes_unicos': set(),
-            'datas': [],
-            'linhas_30': []  # (quantidade, data_venda) para demanda últimos 30 dias
-        })
+        if dias_analise is None:
+            dias_analise = get_regras_empresa(self.db, empresa_id)["dias_analise"]
+        data_limite = datetime.now() - timedelta(days=dias_analise)
         limite_30 = datetime.now() - timedelta(days=30)
-        # HPP (NF-e verificadas)
-        for h in self.db.query(models.HistoricoPrecoProduto).filter(
-            models.HistoricoPrecoProduto.empresa_id == empresa_id,
-            models.HistoricoPrecoProduto.data_venda >= data_limite,
-            models.HistoricoPrecoProduto.cliente_id.isnot(None),
-            models.HistoricoPrecoProduto.nota_fiscal.isnot(None)
-        ).all():
-            produto_id = h.produto_id
-            q = float(h.quantidade)
-            produtos_comprados[produto_id]['total_quantidade'] += q
-            produtos_comprados[produto_id]['total_valor'] += float(h.valor_total)
-            produtos_comprados[produto_id]['num_compras'] += 1
-            produtos_comprados[produto_id]['clientes_unicos'].add(h.cliente_id)
-            produtos_comprados[produto_id]['datas'].append(h.data_venda)
-            if h.data_venda >= limite_30:
-                produtos_comprados[produto_id]['linhas_30'].append((q, h.data_venda))
-        # HVC (orçamentos sem NF linkada)
-        hvc_query = self.db.query(models.HistoricoVendaCliente).join(
-            models.Orcamento, models.Orcamento.id == models.HistoricoVendaCliente.orcamento_id
+        
+        # Vendas a clientes da empresa (NF-e + orçamentos sem NF linkada, já unificados),
+        # agregadas por produto no banco
+        venda = models.VendaUnificada
+        produto = models.Produto
+        linhas = self.db.query(
+            produto.id.label('produto_id'),
+            produto.nome,
+            produto.codigo,
+            produto.quantidade_em_estoque,
+            produto.preco_custo,
+            func.count(func.distinct(venda.cliente_id)).label('num_clientes'),
+            func.count().label('num_compras'),
+            func.sum(venda.quantidade).label('total_quantidade'),
+            func.coalesce(
+                func.sum(case((venda.data_venda >= limite_30, venda.quantidade), else_=0)), 0
+            ).label('demanda_30_dias')
+        ).join(
+            produto, and_(produto.id == venda.produto_id, produto.empresa_id == empresa_id)
         ).filter(
-            models.HistoricoVendaCliente.empresa_id == empresa_id,
-            models.HistoricoVendaCliente.data_venda >= data_limite,
-            (models.Orcamento.numero_nf.is_(None)) | (models.Orcamento.numero_nf == "")
-        )
-        for h in hvc_query.all():
-            produto_id = h.produto_id
-            q = float(getattr(h, 'quantidade_vendida', None) or 0)
-            produtos_comprados[produto_id]['total_quantidade'] += q
-            produtos_comprados[produto_id]['total_valor'] += float(h.valor_total)
-            produtos_comprados[produto_id]['num_compras'] += 1
-            produtos_comprados[produto_id]['clientes_unicos'].add(h.cliente_id)
-            produtos_comprados[produto_id]['datas'].append(h.data_venda)
-            if h.data_venda >= limite_30:
-                produtos_comprados[produto_id]['linhas_30'].append((q, h.data_venda))
+            venda.empresa_id == empresa_id,
+            venda.data_venda >= data_limite
+        ).group_by(
+            produto.id, produto.nome, produto.codigo, produto.quantidade_em_estoque, produto.preco_custo
+        ).order_by(
+            func.count(func.distinct(venda.cliente_id)).desc(), func.count().desc(), produto.id
+        ).all()
         
         # Criar sugestões
         sugestoes = []
-        for produto_id, dados in produtos_comprados.items():
-            produto = self.db.query(models.Produto).filter(
-                models.Produto.id == produto_id,
-                models.Produto.empresa_id == empresa_id
-            ).first()
-            
-            if not produto:
-                continue
-            
-            # Apenas produtos comprados por pelo menos 1 cliente
-            if len(dados['clientes_unicos']) < 1:
-                continue
-            
-            quantidade_media = dados['total_quantidade'] / dados['num_compras'] if dados['num_compras'] > 0 else 0
-            estoque_atual = produto.quantidade_em_estoque or 0
-            demanda_30_dias = sum(q for q, _ in dados.get('linhas_30', []))
+        for row in linhas:
+            total_quantidade = float(row.total_quantidade or 0)
+            quantidade_media = total_quantidade / row.num_compras if row.num_compras > 0 else 0
+            estoque_atual = row.quantidade_em_estoque or 0
+            demanda_30_dias = float(row.demanda_30_dias)
             
             # Sugerir quantidade para cobrir 45 dias (demanda recente + margem)
             quantidade_sugerida = max(int(demanda_30_dias * 1.5), int(quantidade_media * 2))
             
             sugestoes.append({
-                'produto_id': produto_id,
-                'produto_nome': produto.nome or "Sem nome",
-                'codigo': produto.codigo or "",
-                'num_clientes_compram': len(dados['clientes_unicos']),
-                'num_compras_periodo': dados['num_compras'],
-                'quantidade_vendida_periodo': dados['total_quantidade'],
+                'produto_id': row.produto_id,
+                'produto_nome': row.nome or "Sem nome",
+                'codigo': row.codigo or "",
+                'num_clientes_compram': row.num_clientes,
+                'num_compras_periodo': row.num_compras,
+                'quantidade_vendida_periodo': total_quantidade,
                 'demanda_30_dias': demanda_30_dias,
                 'estoque_atual': estoque_atual,
                 'quantidade_sugerida': quantidade_sugerida,
-                'preco_custo': produto.preco_custo,
-                'valor_estimado': quantidade_sugerida * (produto.preco_custo or 0),
+                'preco_custo': row.preco_custo,
+                'valor_estimado': quantidade_sugerida * (row.preco_custo or 0),
                 'prioridade': 'ALTA' if estoque_atual < demanda_30_dias else 'MEDIA'
             })
         
-        sugestoes.sort(key=lambda x: (-x['num_clientes_compram'], -x['num_compras_periodo']))
-        
-        return {
+        resultado = {
             'periodo_analise_dias': dias_analise,
             'total_produtos': len(sugestoes),
             'sugestoes': sugestoes
         }
+        sugestao_clientes_cache.guardar(empresa_id, resultado, versao, chave=cache_chave)
+        return resultado
     
     def _calcular_frequencia(self, datas: List[datetime]) -> Optional[float]:
         """Calcula frequência média de compra em dias."""
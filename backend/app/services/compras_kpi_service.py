@@ -6,15 +6,25 @@ Focado em gestão de estoque, reposição e eficiência de compras.
 """
 
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, and_, case
+from sqlalchemy import func, desc, and_, case, select
 import logging
+import threading
+import time
 
 from ..db import models
+from .demanda_snapshot_service import DemandaSnapshotService
 
 logger = logging.getLogger(__name__)
 
+# Cache da curva ABC por (empresa_id, periodo_meses), por processo. Não é
+# invalidado nos lançamentos: a curva cobre meses de vendas e pode ficar até
+# ABC_CACHE_TTL_SEGUNDOS desatualizada.
+ABC_CACHE_TTL_SEGUNDOS = 300
+_abc_cache: Dict[Tuple[int, int], Tuple[float, List[Dict[str, Any]]]] = {}
+_abc_cache_lock = threading.Lock()
+
 
 class ComprasKPIService:
     """Serviço para calcular KPIs de compras."""
@@ -157,62 +167,82 @@ class ComprasKPIService:
     def calcular_abc_curva(
         self,
         empresa_id: int,
-        periodo_meses: int = 12
+        periodo_meses: int = 12,
+        usar_cache: bool = True
     ) -> List[Dict[str, Any]]:
         """
         Classifica produtos pela curva ABC baseada em vendas.
         
+        O percentual acumulado é calculado no banco com SUM() OVER, em uma única
+        consulta junto com os dados dos produtos e o valor total do estoque.
+        
         Args:
             empresa_id: ID da empresa
             periodo_meses: Período de análise em meses (padrão: 12)
+            usar_cache: Reaproveita o resultado de (empresa, período) calculado há menos de ABC_CACHE_TTL_SEGUNDOS
         
         Returns:
             Lista de produtos classificados (A, B, C)
         """
+        chave_cache = (empresa_id, periodo_meses)
+        if usar_cache:
+            with _abc_cache_lock:
+                em_cache = _abc_cache.get(chave_cache)
+            if em_cache and time.monotonic() - em_cache[0] < ABC_CACHE_TTL_SEGUNDOS:
+                return [dict(item) for item in em_cache[1]]
+        
         try:
             data_limite = datetime.now() - timedelta(days=periodo_meses * 30)
             
-            # Calcular vendas por produto
-            vendas_produtos = self.db.query(
+            # Vendas por produto e total geral do período (inclui produtos já excluídos)
+            valor_vendas = func.sum(models.HistoricoVendaCliente.valor_total)
+            vendas = select(
                 models.HistoricoVendaCliente.produto_id,
-                func.sum(models.HistoricoVendaCliente.valor_total).label('valor_total_vendas')
-            ).filter(
+                valor_vendas.label('valor_total_vendas'),
+                func.sum(valor_vendas).over().label('total_vendas')
+            ).where(
                 models.HistoricoVendaCliente.empresa_id == empresa_id,
                 models.HistoricoVendaCliente.data_venda >= data_limite
             ).group_by(
                 models.HistoricoVendaCliente.produto_id
-            ).order_by(desc('valor_total_vendas')).all()
+            ).subquery()
             
-            if not vendas_produtos:
-                return []
-            
-            # Calcular totais
-            total_vendas = sum(v.valor_total_vendas for v in vendas_produtos)
+            total_estoque_valor = select(
+                func.sum(models.Produto.quantidade_em_estoque * models.Produto.preco_venda)
+            ).where(
+                models.Produto.empresa_id == empresa_id
+            ).scalar_subquery()
+            
+            ordem = (desc(vendas.c.valor_total_vendas), models.Produto.id)
+            linhas = self.db.execute(
+                select(
+                    models.Produto.id,
+                    models.Produto.nome,
+                    models.Produto.codigo,
+                    models.Produto.quantidade_em_estoque,
+                    models.Produto.preco_venda,
+                    vendas.c.valor_total_vendas,
+                    vendas.c.total_vendas,
+                    func.sum(vendas.c.valor_total_vendas).over(
+                        order_by=ordem, rows=(None, 0)
+                    ).label('valor_acumulado'),
+                    total_estoque_valor.label('total_estoque_valor')
+                ).join(
+                    vendas, vendas.c.produto_id == models.Produto.id
+                ).order_by(*ordem)
+            ).all()
             
-            # Calcular percentuais acumulados e classificar
             produtos_classificados = []
-            acumulado = 0
             
-            for venda in vendas_produtos:
-                produto = self.db.query(models.Produto).filter(
-                    models.Produto.id == venda.produto_id
-                ).first()
-                
-                if not produto:
-                    continue
-                
-                percentual_vendas = (venda.valor_total_vendas / total_vendas) * 100
-                acumulado += percentual_vendas
+            for linha in linhas:
+                total_vendas = linha.total_vendas
+                percentual_vendas = (linha.valor_total_vendas / total_vendas) * 100
+                acumulado = (linha.valor_acumulado / total_vendas) * 100
                 
                 # Calcular percentual de estoque
-                estoque_valor = produto.quantidade_em_estoque * (produto.preco_venda or 0)
-                total_estoque_valor = self.db.query(
-                    func.sum(models.Produto.quantidade_em_estoque * models.Produto.preco_venda)
-                ).filter(
-                    models.Produto.empresa_id == empresa_id
-                ).scalar() or 1
-                
-                percentual_estoque = (estoque_valor / total_estoque_valor) * 100 if total_estoque_valor > 0 else 0
+                estoque_valor = linha.quantidade_em_estoque * (linha.preco_venda or 0)
+                total_estoque = linha.total_estoque_valor or 1
+                percentual_estoque = (estoque_valor / total_estoque) * 100 if total_estoque > 0 else 0
                 
                 # Classificação ABC
                 if acumulado <= 80:
@@ -223,17 +253,21 @@ class ComprasKPIService:
                     classificacao = 'C'
                 
                 produtos_classificados.append({
-                    'produto_id': produto.id,
-                    'produto_nome': produto.nome,
-                    'produto_codigo': produto.codigo,
+                    'produto_id': linha.id,
+                    'produto_nome': linha.nome,
+                    'produto_codigo': linha.codigo,
                     'classificacao': classificacao,
                     'percentual_vendas': round(percentual_vendas, 2),
                     'percentual_estoque': round(percentual_estoque, 2),
-                    'valor_total_vendas': float(venda.valor_total_vendas),
+                    'valor_total_vendas': float(linha.valor_total_vendas),
                     'percentual_acumulado': round(acumulado, 2)
                 })
             
-            return produtos_classificados
+            if usar_cache:
+                with _abc_cache_lock:
+                    _abc_cache[chave_cache] = (time.monotonic(), produtos_classificados)
+            
+            return [dict(item) for item in produtos_classificados]
             
         except Exception as e:
             logger.error(f"Erro ao calcular curva ABC: {str(e)}", exc_info=True)
@@ -270,15 +304,11 @@ class ComprasKPIService:
             
             produto_ids = [p.id for p in produtos_fornecedor]
             
-            # Calcular total de compras (entradas de estoque)
-            total_entradas = self.db.query(
-                func.sum(models.MovimentacaoEstoque.quantidade)
-            ).filter(
-                models.MovimentacaoEstoque.produto_id.in_(produto_ids),
-                models.MovimentacaoEstoque.tipo_movimentacao == 'ENTRADA',
-                models.MovimentacaoEstoque.origem == 'COMPRA',
-                models.MovimentacaoEstoque.data_movimentacao >= data_limite
-            ).scalar() or 0
+            # Calcular total de compras (entradas de estoque) pelo snapshot diário de demanda
+            resumo = DemandaSnapshotService(self.db).resumo_por_produto(
+                empresa_id, data_limite.date(), produto_ids
+            )
+            total_entradas = sum(dados['total_entrada_compra'] for dados in resumo.values())
             
             # Calcular número de ordens de compra
             numero_ordens = self.db.query(models.OrdemDeCompra).filter(
@@ -410,13 +440,15 @@ class ComprasKPIService:
             produtos_parados = []
             custo_total_parado = 0
             
+            # Dia da última movimentação de cada produto, em uma única leitura do snapshot
+            ultimas_movimentacoes = DemandaSnapshotService(self.db).ultima_movimentacao_por_produto(
+                empresa_id, produto_ids=[produto.id for produto in produtos]
+            ) if produtos else {}
+            
             for produto in produtos:
-                # Verificar última movimentação
-                ultima_movimentacao = self.db.query(models.MovimentacaoEstoque).filter(
-                    models.MovimentacaoEstoque.produto_id == produto.id
-                ).order_by(desc(models.MovimentacaoEstoque.data_movimentacao)).first()
+                ultima_movimentacao = ultimas_movimentacoes.get(produto.id)
                 
-                if not ultima_movimentacao or ultima_movimentacao.data_movimentacao < data_limite:
+                if not ultima_movimentacao or ultima_movimentacao < data_limite.date():
                     custo_produto_parado = produto.quantidade_em_estoque * (produto.preco_custo or 0)
                     custo_total_parado += custo_produto_parado
                     
@@ -426,7 +458,7 @@ class ComprasKPIService:
                         'produto_codigo': produto.codigo,
                         'quantidade_estoque': produto.quantidade_em_estoque,
                         'custo_total': round(custo_produto_parado, 2),
-                        'ultima_movimentacao': ultima_movimentacao.data_movimentacao.isoformat() if ultima_movimentacao else None
+                        'ultima_movimentacao': ultima_movimentacao.isoformat() if ultima_movimentacao else None
                     })
             
             return {
@@ -461,21 +493,11 @@ class ComprasKPIService:
         try:
             data_limite = datetime.now() - timedelta(days=periodo_meses * 30)
             
-            # Calcular produtos comprados (entradas) - filtrar por produtos da empresa
-            produto_ids_empresa = [
-                p.id for p in self.db.query(models.Produto.id).filter(
-                    models.Produto.empresa_id == empresa_id
-                ).all()
-            ]
-            
-            produtos_comprados = self.db.query(
-                func.count(func.distinct(models.MovimentacaoEstoque.produto_id))
-            ).filter(
-                models.MovimentacaoEstoque.tipo_movimentacao == 'ENTRADA',
-                models.MovimentacaoEstoque.origem == 'COMPRA',
-                models.MovimentacaoEstoque.produto_id.in_(produto_ids_empresa),
-                models.MovimentacaoEstoque.data_movimentacao >= data_limite
-            ).scalar() or 0
+            # Calcular produtos comprados (entradas) pelo snapshot diário de demanda da empresa
+            resumo = DemandaSnapshotService(self.db).resumo_por_produto(empresa_id, data_limite.date())
+            produtos_comprados = sum(
+                1 for dados in resumo.values() if dados['total_entrada_compra'] > 0
+            )
             
             # Calcular produtos vendidos
             produtos_vendidos = self.db.query(
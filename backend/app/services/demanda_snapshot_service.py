@@ -0,0 +1,378 @@
+"""
+Snapshot diário de demanda por produto (demanda_diaria_produto).
+
+Um job incremental (`manage.py refresh-demand-snapshot` ou
+POST /admin/demanda-snapshot/atualizar) agrega as movimentações ainda não
+somadas e soma os totais por produto/dia; a posição do job e a janela de
+segurança para commits fora de ordem ficam em PosicaoIncremental. As consultas
+de estoque mínimo, sugestão de compra e KPIs leem o snapshot e completam com as
+movimentações ainda não somadas, sem varrer todo o histórico.
+
+Quem edita uma movimentação já lançada chama `recalcular_movimentacoes` na
+mesma transação (StockService: edição de movimentações pendentes). Outras
+alterações de movimentações já somadas não são refletidas pelo job
+incremental; para isso existe a reconstrução completa (--rebuild).
+"""
+
+import logging
+import math
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import case, delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from ..db import models
+from ..db.schema_capabilities import schema_capabilities
+from .posicao_incremental import CONSUMIDOR_DEMANDA, PosicaoIncremental, travar_tabelas
+
+logger = logging.getLogger(__name__)
+
+CONTROLE_ID = 1
+
+COLUNAS_SNAPSHOT = [
+    'produto_id', 'data', 'empresa_id',
+    'quantidade_saida', 'quantidade_entrada', 'quantidade_entrada_compra',
+    'numero_vendas', 'maior_saida', 'soma_quadrados_saida'
+]
+
+
+def _para_data(valor) -> date:
+    # func.date devolve date no Postgres e string ISO no SQLite
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, str):
+        return date.fromisoformat(valor[:10])
+    return valor
+
+
+def _agregados_movimentacoes():
+    """SELECT com os totais por produto/dia das movimentações (sem filtros)."""
+    mov = models.MovimentacaoEstoque
+    saida = mov.tipo_movimentacao == 'SAIDA'
+    entrada = mov.tipo_movimentacao == 'ENTRADA'
+    dia = func.date(mov.data_movimentacao)
+    return select(
+        mov.produto_id,
+        dia.label('data'),
+        models.Produto.empresa_id,
+        func.sum(case((saida, mov.quantidade), else_=0)).label('quantidade_saida'),
+        func.sum(case((entrada, mov.quantidade), else_=0)).label('quantidade_entrada'),
+        func.sum(case((entrada & (mov.origem == 'COMPRA'), mov.quantidade), else_=0)).label('quantidade_entrada_compra'),
+        func.sum(case((saida, 1), else_=0)).label('numero_vendas'),
+        func.max(case((saida, mov.quantidade), else_=0)).label('maior_saida'),
+        func.sum(case((saida, mov.quantidade * mov.quantidade), else_=0)).label('soma_quadrados_saida'),
+    ).join(
+        models.Produto, models.Produto.id == mov.produto_id
+    ).where(
+        mov.data_movimentacao.isnot(None)
+    ).group_by(mov.produto_id, dia, models.Produto.empresa_id)
+
+
+def _novo_dia() -> Dict[str, float]:
+    return {
+        'quantidade_saida': 0.0,
+        'quantidade_entrada': 0.0,
+        'quantidade_entrada_compra': 0.0,
+        'numero_vendas': 0,
+        'maior_saida': 0.0,
+        'soma_quadrados_saida': 0.0,
+    }
+
+
+def _somar_dia(destino: Dict[str, float], linha) -> None:
+    destino['quantidade_saida'] += linha.quantidade_saida or 0
+    destino['quantidade_entrada'] += linha.quantidade_entrada or 0
+    destino['quantidade_entrada_compra'] += linha.quantidade_entrada_compra or 0
+    destino['numero_vendas'] += int(linha.numero_vendas or 0)
+    destino['maior_saida'] = max(destino['maior_saida'], linha.maior_saida or 0)
+    destino['soma_quadrados_saida'] += linha.soma_quadrados_saida or 0
+
+
+def desvio_padrao_amostral(soma: float, soma_quadrados: float, n: int) -> float:
+    """Desvio padrão amostral (mesmo do STDDEV do Postgres) a partir de somas."""
+    if n < 2:
+        return 0.0
+    variancia = (soma_quadrados - (soma * soma) / n) / (n - 1)
+    return math.sqrt(variancia) if variancia > 0 else 0.0
+
+
+class DemandaSnapshotService:
+    """Manutenção e leitura do snapshot diário de demanda por produto."""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    # ============= JOB =============
+
+    def _snapshot_disponivel(self) -> bool:
+        return schema_capabilities.has_table('demanda_diaria_produto')
+
+    def _posicao(self) -> PosicaoIncremental:
+        return PosicaoIncremental(self.db, CONSUMIDOR_DEMANDA, models.MovimentacaoEstoque.id)
+
+    def ultima_movimentacao_processada(self) -> int:
+        """Posição do job: movimentações com id <= este valor já estão no snapshot (0 se nunca executado)."""
+        if not self._snapshot_disponivel():
+            return 0
+        valor = self.db.query(models.DemandaSnapshotControle.ultima_movimentacao_id).filter(
+            models.DemandaSnapshotControle.id == CONTROLE_ID
+        ).scalar()
+        return valor or 0
+
+    def atualizar_incremental(self, tamanho_lote: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Soma ao snapshot as movimentações visíveis ainda não somadas (até
+        tamanho_lote, as de menor id primeiro) e avança a posição do job.
+        Na primeira execução faz a reconstrução completa.
+
+        A linha de controle é travada (FOR UPDATE) para que duas execuções
+        simultâneas não somem as mesmas movimentações duas vezes.
+        """
+        tabela = models.DemandaDiariaProduto.__table__
+        controle_tabela = models.DemandaSnapshotControle.__table__
+        posicao = self._posicao()
+
+        try:
+            self.db.execute(
+                pg_insert(controle_tabela)
+                .values(id=CONTROLE_ID, ultima_movimentacao_id=0)
+                .on_conflict_do_nothing(index_elements=[controle_tabela.c.id])
+            )
+            controle = self.db.query(models.DemandaSnapshotControle).filter(
+                models.DemandaSnapshotControle.id == CONTROLE_ID
+            ).with_for_update().one()
+            inicio = controle.ultima_movimentacao_id or 0
+
+            if not posicao.inicializada(inicio):
+                self.db.rollback()
+                return self.reconstruir()
+
+            linhas_afetadas = 0
+            marca = posicao.registrar_pendentes(inicio, tamanho_lote)
+            if marca is not None:
+                agregados = _agregados_movimentacoes().where(posicao.filtro_execucao(marca))
+                stmt = pg_insert(tabela).from_select(COLUNAS_SNAPSHOT, agregados)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[tabela.c.produto_id, tabela.c.data],
+                    set_={
+                        'quantidade_saida': tabela.c.quantidade_saida + stmt.excluded.quantidade_saida,
+                        'quantidade_entrada': tabela.c.quantidade_entrada + stmt.excluded.quantidade_entrada,
+                        'quantidade_entrada_compra': tabela.c.quantidade_entrada_compra + stmt.excluded.quantidade_entrada_compra,
+                        'numero_vendas': tabela.c.numero_vendas + stmt.excluded.numero_vendas,
+                        'maior_saida': func.greatest(tabela.c.maior_saida, stmt.excluded.maior_saida),
+                        'soma_quadrados_saida': tabela.c.soma_quadrados_saida + stmt.excluded.soma_quadrados_saida,
+                    }
+                )
+                linhas_afetadas = self.db.execute(stmt).rowcount
+
+            limite = posicao.avancar(inicio)
+            controle.ultima_movimentacao_id = limite
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+        logger.info(f"✓ Snapshot de demanda atualizado (posição {limite}, {linhas_afetadas} linhas)")
+        return {'processadas_ate': limite, 'linhas_afetadas': linhas_afetadas}
+
+    def reconstruir(self) -> Dict[str, Any]:
+        """
+        Recria todo o snapshot a partir de movimentacoes_estoque. A tabela de
+        origem fica travada contra novos lançamentos até o commit, para que o
+        maior id lido cubra todas as movimentações com id menor.
+        """
+        mov = models.MovimentacaoEstoque
+        try:
+            travar_tabelas(self.db, mov.__tablename__)
+            limite = self.db.query(func.max(mov.id)).scalar() or 0
+            self.db.execute(delete(models.DemandaDiariaProduto))
+            resultado = self.db.execute(
+                models.DemandaDiariaProduto.__table__.insert().from_select(
+                    COLUNAS_SNAPSHOT, _agregados_movimentacoes().where(mov.id <= limite)
+                )
+            )
+            self._posicao().limpar()
+            controle = self.db.get(models.DemandaSnapshotControle, CONTROLE_ID)
+            if controle is None:
+                self.db.add(models.DemandaSnapshotControle(id=CONTROLE_ID, ultima_movimentacao_id=limite))
+            else:
+                controle.ultima_movimentacao_id = limite
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+        logger.info(f"✓ Snapshot de demanda reconstruído até a movimentação {limite} ({resultado.rowcount} linhas)")
+        return {'processadas_ate': limite, 'linhas_afetadas': resultado.rowcount}
+
+    # ============= RECÁLCULO (na transação da edição) =============
+
+    def recalcular_movimentacoes(self, celulas: Iterable[Tuple[int, Any]]) -> None:
+        """
+        Refaz as linhas do snapshot de (produto_id, data_movimentacao) a partir
+        das movimentações, considerando apenas as já somadas: tira a contribuição
+        antiga de uma movimentação editada e soma a nova. Passe as células de
+        antes e de depois da edição. Não faz commit: roda na transação de quem
+        alterou as movimentações (que devem estar com flush).
+        """
+        produtos_por_dia: Dict[date, Set[int]] = defaultdict(set)
+        for produto_id, data_movimentacao in celulas:
+            if produto_id is not None and data_movimentacao is not None:
+                produtos_por_dia[_para_data(data_movimentacao)].add(produto_id)
+        if not produtos_por_dia or not self._snapshot_disponivel():
+            return
+
+        # Mesma trava do job: a posição não muda enquanto as células são refeitas
+        controle = self.db.query(models.DemandaSnapshotControle).filter(
+            models.DemandaSnapshotControle.id == CONTROLE_ID
+        ).with_for_update().one_or_none()
+        if controle is None:
+            return
+        somadas = self._posicao().filtro_somados(controle.ultima_movimentacao_id or 0)
+
+        mov = models.MovimentacaoEstoque
+        snapshot = models.DemandaDiariaProduto
+        for dia, produto_ids in produtos_por_dia.items():
+            self.db.execute(delete(snapshot).where(
+                snapshot.produto_id.in_(produto_ids),
+                snapshot.data == dia
+            ))
+            agregados = _agregados_movimentacoes().where(
+                somadas,
+                mov.produto_id.in_(produto_ids),
+                func.date(mov.data_movimentacao) == dia
+            )
+            self.db.execute(snapshot.__table__.insert().from_select(COLUNAS_SNAPSHOT, agregados))
+
+    # ============= LEITURA =============
+
+    def _filtro_nao_somadas(self) -> List:
+        """Condições das movimentações que ainda não estão no snapshot (todas, se ele não existe)."""
+        if not self._snapshot_disponivel():
+            return []
+        return self._posicao().filtro_nao_somados(self.ultima_movimentacao_processada())
+
+    def demanda_diaria(
+        self,
+        empresa_id: int,
+        data_inicio: date,
+        produto_ids: Optional[Iterable[int]] = None
+    ) -> Dict[Tuple[int, date], Dict[str, float]]:
+        """
+        Totais por (produto_id, dia) a partir de data_inicio: linhas do snapshot
+        somadas às movimentações ainda não processadas pelo job.
+        """
+        produto_ids = list(produto_ids) if produto_ids is not None else None
+        if produto_ids is not None and not produto_ids:
+            return {}
+
+        dias: Dict[Tuple[int, date], Dict[str, float]] = defaultdict(_novo_dia)
+        nao_somadas = self._filtro_nao_somadas()
+
+        if self._snapshot_disponivel():
+            snapshot = models.DemandaDiariaProduto
+            consulta = self.db.query(snapshot).filter(
+                snapshot.empresa_id == empresa_id,
+                snapshot.data >= data_inicio
+            )
+            if produto_ids is not None:
+                consulta = consulta.filter(snapshot.produto_id.in_(produto_ids))
+            for linha in consulta.all():
+                _somar_dia(dias[(linha.produto_id, linha.data)], linha)
+
+        # Movimentações ainda não somadas pelo job
+        mov = models.MovimentacaoEstoque
+        pendentes = _agregados_movimentacoes().where(
+            *nao_somadas,
+            models.Produto.empresa_id == empresa_id,
+            mov.data_movimentacao >= datetime.combine(data_inicio, datetime.min.time())
+        )
+        if produto_ids is not None:
+            pendentes = pendentes.where(mov.produto_id.in_(produto_ids))
+        for linha in self.db.execute(pendentes).all():
+            _somar_dia(dias[(linha.produto_id, _para_data(linha.data))], linha)
+
+        return dict(dias)
+
+    def resumo_por_produto(
+        self,
+        empresa_id: int,
+        data_inicio: date,
+        produto_ids: Optional[Iterable[int]] = None
+    ) -> Dict[int, Dict[str, Any]]:
+        """
+        Consolida a demanda diária por produto: totais de saída/entrada, número
+        de vendas, maior venda individual, soma dos quadrados (desvio padrão),
+        dias com vendas, demanda máxima diária e data da última venda.
+        """
+        resumo: Dict[int, Dict[str, Any]] = {}
+        for (produto_id, dia), valores in self.demanda_diaria(empresa_id, data_inicio, produto_ids).items():
+            dados = resumo.setdefault(produto_id, {
+                'total_saida': 0.0,
+                'total_entrada': 0.0,
+                'total_entrada_compra': 0.0,
+                'numero_vendas': 0,
+                'maior_saida': 0.0,
+                'soma_quadrados_saida': 0.0,
+                'dias_com_vendas': 0,
+                'demanda_maxima_diaria': 0.0,
+                'ultima_venda': None,
+            })
+            dados['total_saida'] += valores['quantidade_saida']
+            dados['total_entrada'] += valores['quantidade_entrada']
+            dados['total_entrada_compra'] += valores['quantidade_entrada_compra']
+            dados['numero_vendas'] += valores['numero_vendas']
+            dados['maior_saida'] = max(dados['maior_saida'], valores['maior_saida'])
+            dados['soma_quadrados_saida'] += valores['soma_quadrados_saida']
+            if valores['numero_vendas'] > 0:
+                dados['dias_com_vendas'] += 1
+                dados['demanda_maxima_diaria'] = max(dados['demanda_maxima_diaria'], valores['quantidade_saida'])
+                if dados['ultima_venda'] is None or dia > dados['ultima_venda']:
+                    dados['ultima_venda'] = dia
+        return resumo
+
+    def ultima_movimentacao_por_produto(
+        self,
+        empresa_id: int,
+        somente_saidas: bool = False,
+        produto_ids: Optional[List[int]] = None
+    ) -> Dict[int, date]:
+        """Data (dia) da última movimentação — ou da última saída — de cada produto."""
+        ultima: Dict[int, date] = {}
+
+        def registrar(produto_id: int, dia) -> None:
+            dia = _para_data(dia)
+            if dia is not None and (produto_id not in ultima or dia > ultima[produto_id]):
+                ultima[produto_id] = dia
+
+        nao_somadas = self._filtro_nao_somadas()
+        if self._snapshot_disponivel():
+            snapshot = models.DemandaDiariaProduto
+            consulta = self.db.query(snapshot.produto_id, func.max(snapshot.data)).filter(
+                snapshot.empresa_id == empresa_id
+            )
+            if somente_saidas:
+                consulta = consulta.filter(snapshot.numero_vendas > 0)
+            if produto_ids is not None:
+                consulta = consulta.filter(snapshot.produto_id.in_(produto_ids))
+            for produto_id, dia in consulta.group_by(snapshot.produto_id).all():
+                registrar(produto_id, dia)
+
+        mov = models.MovimentacaoEstoque
+        consulta = self.db.query(mov.produto_id, func.max(mov.data_movimentacao)).join(
+            models.Produto, models.Produto.id == mov.produto_id
+        ).filter(
+            *nao_somadas,
+            models.Produto.empresa_id == empresa_id
+        )
+        if somente_saidas:
+            consulta = consulta.filter(mov.tipo_movimentacao == 'SAIDA')
+        if produto_ids is not None:
+            consulta = consulta.filter(mov.produto_id.in_(produto_ids))
+        for produto_id, data_mov in consulta.group_by(mov.produto_id).all():
+            registrar(produto_id, data_mov)
+
+        return ultima
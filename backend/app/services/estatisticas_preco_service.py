@@ -0,0 +1,115 @@
+"""
+Serviço de estatísticas de preço por produto (maior, menor, médio e total de vendas).
+
+As estatísticas ficam materializadas em estatisticas_preco_produto e são
+atualizadas na mesma transação em que cada linha de historico_preco_produto é
+inserida, de modo que a leitura é uma busca por chave primária por produto.
+"""
+
+import logging
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from ..db import models
+
+logger = logging.getLogger(__name__)
+
+
+class EstatisticasPrecoService:
+    """Manutenção e leitura das estatísticas materializadas de preço."""
+
+    @staticmethod
+    def registrar_historico(db: Session, historico: models.HistoricoPrecoProduto) -> None:
+        """
+        Adiciona um registro de histórico de preço à sessão e atualiza
+        incrementalmente as estatísticas do produto (upsert atômico).
+
+        Não faz commit: o chamador confirma histórico e estatísticas juntos.
+        """
+        db.add(historico)
+
+        preco = float(historico.preco_unitario)
+        tabela = models.EstatisticaPrecoProduto.__table__
+        stmt = pg_insert(tabela).values(
+            produto_id=historico.produto_id,
+            empresa_id=historico.empresa_id,
+            preco_maior=preco,
+            preco_menor=preco,
+            soma_precos=preco,
+            total_vendas=1,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[tabela.c.produto_id, tabela.c.empresa_id],
+            set_={
+                'preco_maior': func.greatest(tabela.c.preco_maior, stmt.excluded.preco_maior),
+                'preco_menor': func.least(tabela.c.preco_menor, stmt.excluded.preco_menor),
+                'soma_precos': tabela.c.soma_precos + stmt.excluded.soma_precos,
+                'total_vendas': tabela.c.total_vendas + 1,
+                'atualizado_em': func.now(),
+            }
+        )
+        db.execute(stmt)
+
+    @staticmethod
+    def reconstruir(db: Session, empresa_id: Optional[int] = None) -> int:
+        """
+        Recalcula as estatísticas a partir de historico_preco_produto
+        (de uma empresa ou de todas). Retorna a quantidade de produtos gravados.
+        """
+        historico = models.HistoricoPrecoProduto
+        estatistica = models.EstatisticaPrecoProduto
+
+        remover = delete(estatistica)
+        agregados = select(
+            historico.produto_id,
+            historico.empresa_id,
+            func.max(historico.preco_unitario),
+            func.min(historico.preco_unitario),
+            func.sum(historico.preco_unitario),
+            func.count(historico.id),
+        ).group_by(historico.produto_id, historico.empresa_id)
+
+        if empresa_id is not None:
+            remover = remover.where(estatistica.empresa_id == empresa_id)
+            agregados = agregados.where(historico.empresa_id == empresa_id)
+
+        try:
+            db.execute(remover)
+            resultado = db.execute(
+                estatistica.__table__.insert().from_select(
+                    ['produto_id', 'empresa_id', 'preco_maior', 'preco_menor', 'soma_precos', 'total_vendas'],
+                    agregados
+                )
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        total = resultado.rowcount if resultado.rowcount is not None else 0
+        logger.info(f"✓ Estatísticas de preço reconstruídas ({total} produtos, empresa={empresa_id or 'todas'})")
+        return total
+
+    @staticmethod
+    def obter_lote(db: Session, produto_ids: List[int], empresa_id: int) -> Dict[int, dict]:
+        """Lê as estatísticas materializadas de vários produtos. Produtos sem vendas não aparecem."""
+        if not produto_ids:
+            return {}
+
+        linhas = db.query(models.EstatisticaPrecoProduto).filter(
+            models.EstatisticaPrecoProduto.produto_id.in_(produto_ids),
+            models.EstatisticaPrecoProduto.empresa_id == empresa_id
+        ).all()
+
+        return {
+            linha.produto_id: {
+                'preco_maior': linha.preco_maior,
+                'preco_medio': linha.soma_precos / linha.total_vendas if linha.total_vendas else None,
+                'preco_menor': linha.preco_menor,
+                'total_vendas': linha.total_vendas
+            }
+            for linha in linhas
+        }
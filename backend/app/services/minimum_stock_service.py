@@ -10,12 +10,14 @@ import os
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional
 from collections import defaultdict
+from types import SimpleNamespace
 from sqlalchemy.orm import Session
 from sqlalchemy import text, func
 import logging
 
 from ..db import models
 from ..db.connection import get_db
+from .demanda_snapshot_service import DemandaSnapshotService, desvio_padrao_amostral
 
 logger = logging.getLogger(__name__)
 
@@ -45,35 +47,36 @@ class MinimumStockService:
         # Data limite para análise
         data_limite = datetime.now() - timedelta(days=days_analysis)
         
-        # Query para buscar movimentações de saída por produto
-        query = text("""
-            SELECT 
-                p.id as produto_id,
-                p.nome as produto_nome,
-                p.codigo,
-                p.categoria,
-                p.estoque_minimo as estoque_minimo_atual,
-                p.quantidade_em_estoque,
-                p.preco_venda,
-                COALESCE(SUM(m.quantidade), 0) as total_vendido,
-                COUNT(m.id) as numero_vendas,
-                COALESCE(AVG(m.quantidade), 0) as media_por_venda,
-                COALESCE(MAX(m.quantidade), 0) as maior_venda,
-                COALESCE(STDDEV(m.quantidade), 0) as desvio_padrao
-            FROM produtos p
-            LEFT JOIN movimentacoes_estoque m ON p.id = m.produto_id 
-                AND m.tipo_movimentacao = 'SAIDA'
-                AND m.data_movimentacao >= :data_limite
-            WHERE p.empresa_id = :empresa_id
-            GROUP BY p.id, p.nome, p.codigo, p.categoria, p.estoque_minimo, 
-                     p.quantidade_em_estoque, p.preco_venda
-            ORDER BY total_vendido DESC
-        """)
+        # Saídas por produto a partir do snapshot diário de demanda
+        resumo = DemandaSnapshotService(self.db).resumo_por_produto(empresa_id, data_limite.date())
+        
+        produtos = self.db.query(models.Produto).filter(
+            models.Produto.empresa_id == empresa_id
+        ).all()
         
-        result = self.db.execute(query, {
-            'empresa_id': empresa_id,
-            'data_limite': data_limite
-        })
+        result = []
+        for produto in produtos:
+            dados = resumo.get(produto.id, {})
+            total_vendido = dados.get('total_saida', 0)
+            numero_vendas = dados.get('numero_vendas', 0)
+            media_por_venda = total_vendido / numero_vendas if numero_vendas else 0
+            result.append(SimpleNamespace(
+                produto_id=produto.id,
+                produto_nome=produto.nome,
+                codigo=produto.codigo,
+                categoria=produto.categoria,
+                estoque_minimo_atual=produto.estoque_minimo,
+                quantidade_em_estoque=produto.quantidade_em_estoque,
+                preco_venda=produto.preco_venda,
+                total_vendido=total_vendido,
+                numero_vendas=numero_vendas,
+                media_por_venda=media_por_venda,
+                maior_venda=dados.get('maior_saida', 0) if numero_vendas else 0,
+                desvio_padrao=desvio_padrao_amostral(
+                    total_vendido, dados.get('soma_quadrados_saida', 0), numero_vendas
+                )
+            ))
+        result.sort(key=lambda row: row.total_vendido, reverse=True)
         
         recommendations = []
         semanas_periodo = days_analysis / 7  # Converter dias para semanas
@@ -0,0 +1,566 @@
+"""
+Importação de NFs (PDF/XML) em lote, processada em segundo plano.
+
+O endpoint de upload grava os arquivos em um diretório temporário, registra o
+lote (importacoes_nf_lote) com um item por arquivo (importacoes_nf_arquivo) e
+devolve o id do lote. Um worker local (task asyncio no próprio processo)
+extrai o texto dos PDFs no pool de processos do parse_executor e faz a
+identificação de empresa/cliente/produtos no pool de threads de banco, alguns
+arquivos por vez. O preview de cada arquivo fica salvo no item e é consultado
+pelo endpoint de progresso; a confirmação continua sendo feita por
+/movimentacoes/confirmar-movimentacoes.
+
+Arquivos repetidos no lote ou já registrados em arquivos_processados (mesmo
+SHA256) são marcados como DUPLICADO e não são processados.
+
+Cada lote registra o processo que o processa (processado_por = "host:pid") e
+um sinal de vida (heartbeat_em) renovado a cada NF_LOTE_HEARTBEAT_SEGUNDOS. No
+startup, só são interrompidos os lotes cujo processo não existe mais ou que
+estão sem sinal de vida há mais de NF_LOTE_HEARTBEAT_EXPIRACAO_SEGUNDOS — os
+lotes de outras instâncias em execução continuam.
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import socket
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func, or_, update
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..core.parse_cache import parse_cache
+from ..core.parse_executor import parse_executor
+from ..db import models
+from ..db.connection import SessionLocal
+from ..db.schema_capabilities import schema_capabilities
+
+logger = logging.getLogger(__name__)
+
+STATUS_LOTE_ATIVOS = ('PENDENTE', 'PROCESSANDO')
+
+# Contador do lote incrementado conforme o status final de cada arquivo
+CONTADOR_POR_STATUS = {
+    'CONCLUIDO': 'arquivos_concluidos',
+    'ERRO': 'arquivos_com_erro',
+    'DUPLICADO': 'arquivos_duplicados',
+}
+
+# Referências às tasks em execução (o event loop guarda apenas referências fracas)
+_tarefas_lote: Set[asyncio.Task] = set()
+
+# Identificação deste processo em importacoes_nf_lote.processado_por
+HOST = socket.gethostname()
+INSTANCIA = f"{HOST}:{os.getpid()}"[:100]
+
+
+def _caminho_arquivo(diretorio: str, arquivo_id: int, tipo_arquivo: str) -> str:
+    return os.path.join(diretorio, f"{arquivo_id}.{tipo_arquivo.lower()}")
+
+
+def _agora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _processo_ausente(processado_por: Optional[str]) -> bool:
+    """
+    True se o dono do lote certamente não está mais em execução: um processo
+    deste host que não existe mais, ou este próprio processo (o lote é de uma
+    execução anterior com o mesmo pid, ex.: pid 1 em container). Donos em outros
+    hosts só expiram pelo heartbeat.
+    """
+    if not processado_por or ':' not in processado_por:
+        return False
+    host, pid = processado_por.rsplit(':', 1)
+    if host != HOST or not pid.isdigit():
+        return False
+    if int(pid) == os.getpid():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+
+class NFImportacaoLoteService:
+    """Criação, processamento em segundo plano e consulta dos lotes de importação de NFs."""
+
+    @staticmethod
+    def criar_lote(
+        db: Session,
+        arquivos: List[Tuple[str, str, str]],
+        tipo_movimentacao: Optional[str],
+        usuario_id: int,
+        empresa_id: int
+    ) -> Dict[str, Any]:
+        """
+        Registra o lote e grava em disco os arquivos que serão processados.
+
+        Args:
+            arquivos: Lista de (nome do arquivo, caminho temporário, SHA256); a extensão
+                do nome define PDF/XML. Os arquivos pendentes são movidos para o diretório
+                do lote; os demais continuam com quem chamou.
+            tipo_movimentacao: 'ENTRADA', 'SAIDA' ou None (auto-detectar, apenas XML)
+
+        Returns:
+            Resumo do lote criado (id, status, total de arquivos e duplicados)
+        """
+        hashes = [hash_arquivo for _nome, _caminho, hash_arquivo in arquivos]
+
+        # Arquivos já confirmados anteriormente (arquivos_processados)
+        ja_processados: Dict[str, datetime] = {}
+        if schema_capabilities.tabela_arquivos_processados_existe:
+            ja_processados = dict(
+                db.query(
+                    models.ArquivoProcessado.hash_arquivo,
+                    models.ArquivoProcessado.data_processamento
+                ).filter(
+                    models.ArquivoProcessado.hash_arquivo.in_(set(hashes)),
+                    models.ArquivoProcessado.empresa_id == empresa_id
+                ).all()
+            )
+
+        lote = models.ImportacaoNFLote(
+            empresa_id=empresa_id,
+            usuario_id=usuario_id,
+            tipo_movimentacao=tipo_movimentacao,
+            status='PENDENTE',
+            total_arquivos=len(arquivos),
+            arquivos_concluidos=0,
+            arquivos_com_erro=0,
+            arquivos_duplicados=0,
+            processado_por=INSTANCIA,
+            heartbeat_em=_agora()
+        )
+        db.add(lote)
+        db.flush()
+
+        itens = []
+        vistos: Dict[str, str] = {}
+        for nome, caminho_temporario, hash_arquivo in arquivos:
+            item = models.ImportacaoNFArquivo(
+                lote_id=lote.id,
+                nome_arquivo=nome,
+                tipo_arquivo='XML' if nome.lower().endswith('.xml') else 'PDF',
+                hash_arquivo=hash_arquivo,
+                status='PENDENTE'
+            )
+            if hash_arquivo in ja_processados:
+                data = ja_processados[hash_arquivo]
+                item.status = 'DUPLICADO'
+                item.erro = f"Arquivo já processado em {data.strftime('%d/%m/%Y às %H:%M')}" if data else "Arquivo já processado"
+            elif hash_arquivo in vistos:
+                item.status = 'DUPLICADO'
+                item.erro = f"Conteúdo idêntico ao arquivo {vistos[hash_arquivo]} deste lote"
+            else:
+                vistos[hash_arquivo] = nome
+            if item.status == 'DUPLICADO':
+                item.data_processamento = _agora()
+                lote.arquivos_duplicados += 1
+            itens.append((item, caminho_temporario))
+
+        db.add_all([item for item, _caminho in itens])
+        db.flush()
+
+        pendentes = [(item, caminho) for item, caminho in itens if item.status == 'PENDENTE']
+        if pendentes:
+            # Nome imprevisível, criado com permissão restrita ao usuário do processo
+            lote.diretorio = tempfile.mkdtemp(prefix=f"importacao_nf_lote_{lote.id}_")
+            for item, caminho in pendentes:
+                shutil.move(caminho, _caminho_arquivo(lote.diretorio, item.id, item.tipo_arquivo))
+        else:
+            lote.status = 'CONCLUIDO'
+            lote.data_conclusao = _agora()
+
+        db.commit()
+        logger.info(
+            f"✓ Lote de importação {lote.id} criado: {lote.total_arquivos} arquivos "
+            f"({lote.arquivos_duplicados} duplicados)"
+        )
+        return {
+            'lote_id': lote.id,
+            'status': lote.status,
+            'total_arquivos': lote.total_arquivos,
+            'arquivos_pendentes': len(pendentes),
+            'arquivos_duplicados': lote.arquivos_duplicados
+        }
+
+    @staticmethod
+    def iniciar_processamento(lote_id: int) -> None:
+        """Agenda o processamento do lote no event loop atual (chamado pelo endpoint de upload)."""
+        tarefa = asyncio.get_running_loop().create_task(NFImportacaoLoteService.processar_lote(lote_id))
+        _tarefas_lote.add(tarefa)
+        tarefa.add_done_callback(_tarefas_lote.discard)
+
+    @staticmethod
+    async def processar_lote(lote_id: int) -> None:
+        """Processa os arquivos pendentes do lote, NF_LOTE_ARQUIVOS_PARALELOS por vez."""
+        heartbeat = asyncio.get_running_loop().create_task(_manter_heartbeat(lote_id))
+        lote = None
+        try:
+            lote, pendentes = await parse_executor.executar_db(_iniciar_lote, lote_id)
+            semaforo = asyncio.Semaphore(max(1, settings.NF_LOTE_ARQUIVOS_PARALELOS))
+
+            async def processar(arquivo: Dict[str, Any]) -> None:
+                async with semaforo:
+                    await _processar_arquivo(lote, arquivo)
+
+            await asyncio.gather(*(processar(arquivo) for arquivo in pendentes))
+            await parse_executor.executar_db(_finalizar_lote, lote_id, 'CONCLUIDO')
+            logger.info(f"✓ Lote de importação {lote_id} concluído ({len(pendentes)} arquivos processados)")
+        except Exception as e:
+            logger.error(f"Erro no processamento do lote de importação {lote_id}: {e}", exc_info=True)
+            await parse_executor.executar_db(_finalizar_lote, lote_id, 'INTERROMPIDO')
+        finally:
+            heartbeat.cancel()
+            if lote and lote['diretorio']:
+                shutil.rmtree(lote['diretorio'], ignore_errors=True)
+
+    @staticmethod
+    def marcar_lotes_interrompidos() -> int:
+        """
+        Marca como INTERROMPIDO os lotes em andamento cujo processo parou: o
+        dono não existe mais (ver `_processo_ausente`) ou está sem heartbeat há
+        mais de NF_LOTE_HEARTBEAT_EXPIRACAO_SEGUNDOS (lotes sem heartbeat usam a
+        data de criação). Lotes de outras instâncias ativas não são tocados.
+        Chamado no startup.
+        """
+        if not schema_capabilities.has_table('importacoes_nf_lote'):
+            return 0
+        db = SessionLocal()
+        try:
+            donos = [
+                dono for (dono,) in db.query(models.ImportacaoNFLote.processado_por).filter(
+                    models.ImportacaoNFLote.status.in_(STATUS_LOTE_ATIVOS)
+                ).distinct().all()
+            ]
+            donos_ausentes = [dono for dono in donos if _processo_ausente(dono)]
+            limite = _agora() - timedelta(seconds=settings.NF_LOTE_HEARTBEAT_EXPIRACAO_SEGUNDOS)
+            ultimo_sinal = func.coalesce(models.ImportacaoNFLote.heartbeat_em, models.ImportacaoNFLote.data_criacao)
+
+            lotes = db.query(
+                models.ImportacaoNFLote.id, models.ImportacaoNFLote.processado_por, models.ImportacaoNFLote.diretorio
+            ).filter(
+                models.ImportacaoNFLote.status.in_(STATUS_LOTE_ATIVOS),
+                or_(
+                    models.ImportacaoNFLote.processado_por.in_(donos_ausentes),
+                    ultimo_sinal < limite
+                )
+            ).with_for_update(skip_locked=True).all()
+            if not lotes:
+                return 0
+            agora = _agora()
+            for lote_id, _dono, _diretorio in lotes:
+                interrompidos = db.execute(
+                    update(models.ImportacaoNFArquivo)
+                    .where(
+                        models.ImportacaoNFArquivo.lote_id == lote_id,
+                        models.ImportacaoNFArquivo.status == 'PENDENTE'
+                    )
+                    .values(status='ERRO', erro='Processamento interrompido (reinício do servidor)')
+                ).rowcount
+                db.execute(
+                    update(models.ImportacaoNFLote)
+                    .where(models.ImportacaoNFLote.id == lote_id)
+                    .values(
+                        status='INTERROMPIDO',
+                        data_conclusao=agora,
+                        arquivos_com_erro=models.ImportacaoNFLote.arquivos_com_erro + interrompidos
+                    )
+                )
+            db.commit()
+            # Os arquivos do lote ficam no diretório temporário do host do dono
+            for _lote_id, dono, diretorio in lotes:
+                if diretorio and (dono is None or dono.rsplit(':', 1)[0] == HOST):
+                    shutil.rmtree(diretorio, ignore_errors=True)
+            logger.warning(f"⚠️ {len(lotes)} lote(s) de importação de NFs marcados como interrompidos")
+            return len(lotes)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Erro ao marcar lotes de importação interrompidos: {e}")
+            return 0
+        finally:
+            db.close()
+
+    @staticmethod
+    def obter_progresso(db: Session, lote_id: int, empresa_id: int, incluir_preview: bool = False) -> Dict[str, Any]:
+        """Status do lote e de cada arquivo (com o preview gerado, se solicitado)."""
+        lote = db.query(models.ImportacaoNFLote).filter(
+            models.ImportacaoNFLote.id == lote_id,
+            models.ImportacaoNFLote.empresa_id == empresa_id
+        ).first()
+        if not lote:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Lote de importação não encontrado"
+            )
+
+        arquivos = []
+        for item in lote.arquivos:
+            arquivo = {
+                'id': item.id,
+                'nome_arquivo': item.nome_arquivo,
+                'tipo_arquivo': item.tipo_arquivo,
+                'status': item.status,
+                'nota_fiscal': item.nota_fiscal,
+                'erro': item.erro,
+                'data_processamento': item.data_processamento
+            }
+            if incluir_preview:
+                arquivo['preview'] = item.preview
+            arquivos.append(arquivo)
+
+        return {**_resumo_lote(lote), 'arquivos': arquivos}
+
+    @staticmethod
+    def listar_lotes(db: Session, empresa_id: int, limite: int = 20) -> List[Dict[str, Any]]:
+        """Lotes mais recentes da empresa (sem os arquivos)."""
+        lotes = db.query(models.ImportacaoNFLote).filter(
+            models.ImportacaoNFLote.empresa_id == empresa_id
+        ).order_by(models.ImportacaoNFLote.data_criacao.desc(), models.ImportacaoNFLote.id.desc()).limit(limite).all()
+        return [_resumo_lote(lote) for lote in lotes]
+
+    @staticmethod
+    def registrar_arquivo_confirmado(
+        db: Session,
+        arquivo_id: int,
+        empresa_id: int,
+        usuario_id: int,
+        tipo_movimentacao: str,
+        total_movimentacoes: int
+    ) -> None:
+        """
+        Após a confirmação das movimentações de um arquivo do lote, marca o item
+        como CONFIRMADO e registra o hash em arquivos_processados, para que o
+        mesmo arquivo seja detectado como duplicado em lotes futuros.
+        """
+        item = db.query(models.ImportacaoNFArquivo).join(models.ImportacaoNFLote).filter(
+            models.ImportacaoNFArquivo.id == arquivo_id,
+            models.ImportacaoNFLote.empresa_id == empresa_id
+        ).first()
+        if not item:
+            logger.warning(f"⚠️ Arquivo de importação {arquivo_id} não encontrado para registrar confirmação")
+            return
+
+        item.status = 'CONFIRMADO'
+        if schema_capabilities.tabela_arquivos_processados_existe:
+            ja_registrado = db.query(models.ArquivoProcessado.id).filter(
+                models.ArquivoProcessado.hash_arquivo == item.hash_arquivo
+            ).first()
+            if not ja_registrado:
+                total_produtos = len((item.preview or {}).get('produtos') or [])
+                db.add(models.ArquivoProcessado(
+                    nome_arquivo=item.nome_arquivo,
+                    hash_arquivo=item.hash_arquivo,
+                    nota_fiscal=item.nota_fiscal,
+                    tipo_arquivo=item.tipo_arquivo,
+                    tipo_movimentacao=tipo_movimentacao,
+                    usuario_id=usuario_id,
+                    empresa_id=empresa_id,
+                    total_produtos=total_produtos,
+                    total_movimentacoes=total_movimentacoes
+                ))
+        db.commit()
+
+
+def _resumo_lote(lote: models.ImportacaoNFLote) -> Dict[str, Any]:
+    finalizados = lote.arquivos_concluidos + lote.arquivos_com_erro + lote.arquivos_duplicados
+    return {
+        'lote_id': lote.id,
+        'status': lote.status,
+        'tipo_movimentacao': lote.tipo_movimentacao,
+        'total_arquivos': lote.total_arquivos,
+        'arquivos_concluidos': lote.arquivos_concluidos,
+        'arquivos_com_erro': lote.arquivos_com_erro,
+        'arquivos_duplicados': lote.arquivos_duplicados,
+        'arquivos_pendentes': max(0, lote.total_arquivos - finalizados),
+        'percentual': round(finalizados * 100 / lote.total_arquivos, 1) if lote.total_arquivos else 100.0,
+        'data_criacao': lote.data_criacao,
+        'data_inicio': lote.data_inicio,
+        'data_conclusao': lote.data_conclusao
+    }
+
+
+def _iniciar_lote(lote_id: int) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Marca o lote como PROCESSANDO e devolve seus dados e os arquivos pendentes."""
+    db = SessionLocal()
+    try:
+        lote = db.query(models.ImportacaoNFLote).filter(models.ImportacaoNFLote.id == lote_id).one()
+        lote.status = 'PROCESSANDO'
+        lote.data_inicio = _agora()
+        lote.processado_por = INSTANCIA
+        lote.heartbeat_em = lote.data_inicio
+        dados_lote = {
+            'id': lote.id,
+            'empresa_id': lote.empresa_id,
+            'usuario_id': lote.usuario_id,
+            'tipo_movimentacao': lote.tipo_movimentacao,
+            'diretorio': lote.diretorio
+        }
+        pendentes = [
+            {
+                'id': item.id,
+                'nome_arquivo': item.nome_arquivo,
+                'tipo_arquivo': item.tipo_arquivo,
+                'hash_arquivo': item.hash_arquivo
+            }
+            for item in lote.arquivos if item.status == 'PENDENTE'
+        ]
+        db.commit()
+        return dados_lote, pendentes
+    finally:
+        db.close()
+
+
+def _registrar_heartbeat(lote_id: int) -> None:
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(models.ImportacaoNFLote)
+            .where(
+                models.ImportacaoNFLote.id == lote_id,
+                models.ImportacaoNFLote.status.in_(STATUS_LOTE_ATIVOS)
+            )
+            .values(heartbeat_em=_agora())
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+async def _manter_heartbeat(lote_id: int) -> None:
+    """Renova o heartbeat do lote enquanto ele é processado (cancelada ao final)."""
+    intervalo = max(1, settings.NF_LOTE_HEARTBEAT_SEGUNDOS)
+    while True:
+        await asyncio.sleep(intervalo)
+        try:
+            await parse_executor.executar_db(_registrar_heartbeat, lote_id)
+        except Exception as e:
+            logger.warning(f"⚠️ Falha ao registrar heartbeat do lote de importação {lote_id}: {e}")
+
+
+async def _processar_arquivo(lote: Dict[str, Any], arquivo: Dict[str, Any]) -> None:
+    """Gera o preview de um arquivo do lote e registra o resultado (ou o erro)."""
+    from .nf_processor_service import extrair_texto_pdf
+
+    caminho = _caminho_arquivo(lote['diretorio'], arquivo['id'], arquivo['tipo_arquivo'])
+    try:
+        if arquivo['tipo_arquivo'] == 'PDF':
+            # Sem requisição aguardando: espera vaga na fila de parsing em vez de receber 503
+            texto_pdf = await parse_cache.executar_parse(
+                'pdf_texto', arquivo['hash_arquivo'], extrair_texto_pdf, caminho, aguardar_vaga=True
+            )
+            preview = await parse_executor.executar_db(_gerar_preview_pdf, lote, arquivo, caminho, texto_pdf)
+        else:
+            preview = await parse_executor.executar_db(_gerar_preview_xml, lote, arquivo, caminho)
+        await parse_executor.executar_db(_registrar_resultado, lote['id'], arquivo['id'], 'CONCLUIDO', preview, None)
+    except Exception as e:
+        erro = getattr(e, 'detail', None) or str(e)
+        logger.warning(f"⚠️ Erro ao processar {arquivo['nome_arquivo']} (lote {lote['id']}): {erro}")
+        await parse_executor.executar_db(_registrar_resultado, lote['id'], arquivo['id'], 'ERRO', None, erro)
+
+
+def _gerar_preview_pdf(lote: Dict[str, Any], arquivo: Dict[str, Any], caminho: str, texto_pdf: str) -> Dict[str, Any]:
+    from .nf_processor_service import NFProcessorService
+
+    tipo_movimentacao = lote['tipo_movimentacao']
+    db = SessionLocal()
+    try:
+        # Mesmas regras do /movimentacoes/preview-pdf: SAÍDA usa a empresa do usuário,
+        # ENTRADA identifica a empresa pelo documento
+        resultado = NFProcessorService(db).processar_nf_pdf(
+            caminho_pdf=caminho,
+            tipo_movimentacao=tipo_movimentacao,
+            usuario_id=lote['usuario_id'],
+            empresa_id_override=lote['empresa_id'] if tipo_movimentacao == 'SAIDA' else None,
+            nome_arquivo_original=arquivo['nome_arquivo'],
+            texto_pdf=texto_pdf,
+            hash_conteudo=arquivo['hash_arquivo']
+        )
+        return jsonable_encoder(resultado)
+    finally:
+        db.close()
+
+
+def _gerar_preview_xml(lote: Dict[str, Any], arquivo: Dict[str, Any], caminho: str) -> Dict[str, Any]:
+    from .nf_xml_processor_service import NFXMLProcessorService
+
+    db = SessionLocal()
+    try:
+        resultado = NFXMLProcessorService(db).processar_nf_xml(
+            caminho_xml=caminho,
+            tipo_movimentacao=lote['tipo_movimentacao'],
+            empresa_id_override=lote['empresa_id'],
+            hash_conteudo=arquivo['hash_arquivo']
+        )
+        return jsonable_encoder(resultado)
+    finally:
+        db.close()
+
+
+def _registrar_resultado(
+    lote_id: int,
+    arquivo_id: int,
+    status_arquivo: str,
+    preview: Optional[Dict[str, Any]],
+    erro: Optional[str]
+) -> None:
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(models.ImportacaoNFArquivo)
+            .where(models.ImportacaoNFArquivo.id == arquivo_id)
+            .values(
+                status=status_arquivo,
+                preview=preview,
+                nota_fiscal=(str(preview.get('nota_fiscal'))[:50] if preview and preview.get('nota_fiscal') else None),
+                erro=erro,
+                data_processamento=_agora()
+            )
+        )
+        # Incremento no banco: vários arquivos do lote terminam em paralelo
+        contador = getattr(models.ImportacaoNFLote, CONTADOR_POR_STATUS[status_arquivo])
+        db.execute(
+            update(models.ImportacaoNFLote)
+            .where(models.ImportacaoNFLote.id == lote_id)
+            .values({contador: contador + 1})
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _finalizar_lote(lote_id: int, status_lote: str) -> None:
+    db = SessionLocal()
+    try:
+        interrompidos = 0
+        if status_lote != 'CONCLUIDO':
+            interrompidos = db.execute(
+                update(models.ImportacaoNFArquivo)
+                .where(
+                    models.ImportacaoNFArquivo.lote_id == lote_id,
+                    models.ImportacaoNFArquivo.status == 'PENDENTE'
+                )
+                .values(status='ERRO', erro='Processamento do lote interrompido')
+            ).rowcount
+        db.execute(
+            update(models.ImportacaoNFLote)
+            .where(models.ImportacaoNFLote.id == lote_id)
+            .values(
+                status=status_lote,
+                data_conclusao=_agora(),
+                arquivos_com_erro=models.ImportacaoNFLote.arquivos_com_erro + interrompidos
+            )
+        )
+        db.commit()
+    finally:
+        db.close()
@@ -8,15 +8,20 @@ from typing import Dict, Any, Optional, List
 from sqlalchemy.orm import Session
 from datetime import datetime
 import re
-import pdfplumber
 import logging
 
+from app.core.parse_cache import parse_cache
 from app.db import models
 from app.services.empresa_service import EmpresaService
 from app.services.cliente_matcher_service import ClienteMatcherService
+from app.services.estatisticas_preco_service import EstatisticasPrecoService
+from app.services.vendas_mensais_service import VendasMensaisService
+from app.services.vendas_unificadas_service import VendasUnificadasService
 from app.utils.cnpj_utils import extrair_cnpj_texto, normalizar_cnpj
-from app.utils.product_matcher import find_product_by_code_or_name
+from app.utils.product_matcher import ProductMatcher
 from app.utils.pdf_extractor_melhorado import extrair_produtos_inteligente_entrada_melhorado
+from app.utils.nf_linhas import extrair_itens_danfe
+from app.utils.pdf_texto import MOTOR_PDFPLUMBER, MOTOR_PYPDF, extrair_texto
 
 logger = logging.getLogger(__name__)
 
@@ -37,6 +42,43 @@ def _is_nome_cliente_invalido(nome: str) -> bool:
     return any(nome_upper == inv or nome_upper.startswith(inv + " ") for inv in invalidos)
 
 
+def extrair_texto_pdf(caminho_pdf: str) -> str:
+    """
+    Extrai texto completo de um PDF usando múltiplas bibliotecas como fallback.
+
+    Função de módulo (sem sessão) para poder rodar no pool de processos do
+    parse_executor. As páginas são lidas em paralelo por app.utils.pdf_texto.
+    """
+    texto = ""
+    
+    # Tentar primeiro com pdfplumber (melhor para tabelas e texto estruturado)
+    try:
+        texto = extrair_texto(caminho_pdf, MOTOR_PDFPLUMBER)
+        if texto.strip():
+            logger.info(f"Texto extraído com pdfplumber: {len(texto)} caracteres")
+            return texto
+    except Exception as e:
+        logger.warning(f"Erro ao extrair texto com pdfplumber: {e}. Tentando PyPDF2...")
+    
+    # Fallback para PyPDF2/pypdf se pdfplumber falhar ou não retornar texto
+    try:
+        texto = extrair_texto(caminho_pdf, MOTOR_PYPDF)
+        if texto.strip():
+            logger.info(f"Texto extraído com PyPDF2/pypdf: {len(texto)} caracteres")
+            return texto
+    except ImportError as imp_err:
+        logger.warning(f"PyPDF2/pypdf não disponível: {imp_err}. Pulando fallback.")
+    except Exception as e2:
+        logger.warning(f"Erro ao extrair texto com PyPDF2/pypdf: {e2}")
+    
+    # Se nenhuma biblioteca conseguiu extrair texto, retornar string vazia
+    # (permitir processamento baseado em nome do arquivo ou outras heurísticas)
+    if not texto.strip():
+        logger.warning(f"Não foi possível extrair texto do PDF {caminho_pdf}. Retornando string vazia para permitir detecção por nome do arquivo.")
+    
+    return texto
+
+
 class NFProcessorService:
     """Serviço principal para processamento de Notas Fiscais."""
     
@@ -51,7 +93,9 @@ class NFProcessorService:
         orcamento_id: Optional[int] = None,
         usuario_id: int = None,
         empresa_id_override: Optional[int] = None,
-        nome_arquivo_original: Optional[str] = None
+        nome_arquivo_original: Optional[str] = None,
+        texto_pdf: Optional[str] = None,
+        hash_conteudo: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Processa um PDF de NF completo: extrai dados, identifica empresa,
@@ -64,6 +108,9 @@ class NFProcessorService:
             orcamento_id: ID do orçamento relacionado (opcional)
             usuario_id: ID do usuário que está processando
             empresa_id_override: Forçar empresa_id (usado quando já identificado)
+            texto_pdf: Texto já extraído do PDF (ex.: pelo parse_executor); se None, extrai aqui
+            hash_conteudo: SHA256 do arquivo; se informado, texto, cabeçalho e produtos
+                extraídos são lidos/gravados no parse_cache
             
         Returns:
             Dicionário com resultado do processamento
@@ -75,7 +122,12 @@ class NFProcessorService:
             nome_arquivo_para_deteccao = (nome_arquivo_original or os.path.basename(caminho_pdf)).upper()
             logger.info(f"Processando PDF: nome_original={nome_arquivo_original}, caminho={caminho_pdf}, nome_para_deteccao={nome_arquivo_para_deteccao}")
             
-            texto_completo = self._extrair_texto_pdf(caminho_pdf)
+            if texto_pdf is not None:
+                texto_completo = texto_pdf
+            else:
+                texto_completo = parse_cache.obter_ou_calcular(
+                    'pdf_texto', hash_conteudo, lambda: self._extrair_texto_pdf(caminho_pdf)
+                )
             logger.info(f"📄 Primeiros 1000 caracteres do texto extraído: {texto_completo[:1000] if texto_completo else 'VAZIO'}")
             
             # Se não conseguiu extrair texto, tentar detectar Delta Plástico pelo nome do arquivo
@@ -94,8 +146,15 @@ class NFProcessorService:
                     logger.error(f"✗ Não foi possível detectar Delta Plástico. nome_original='{nome_arquivo_original}', tem_delta={tem_delta}, tem_plast={tem_plast}")
                     raise ValueError(f"Não foi possível extrair texto do PDF '{nome_arquivo_original or nome_arquivo_para_deteccao}' e não foi possível identificar como Delta Plástico pelo nome do arquivo")
             
+            # Texto sintetizado a partir do nome do arquivo não é função do conteúdo: sem cache
+            hash_cache = None if texto_vazio else hash_conteudo
+            
             # 2. Extrair dados básicos da NF
-            dados_nf = self._extrair_dados_nf(texto_completo, tipo_movimentacao)
+            # (cache pelo hash do conteúdo: o texto é o mesmo, então o resultado também)
+            dados_nf = parse_cache.obter_ou_calcular(
+                f'nf_pdf_dados_{tipo_movimentacao}', hash_cache,
+                lambda: self._extrair_dados_nf(texto_completo, tipo_movimentacao)
+            )
             
             # 3. Identificar empresa pelo CNPJ emitente
             empresa_id = self._identificar_empresa(
@@ -136,9 +195,12 @@ class NFProcessorService:
             
             # 6. Extrair produtos
             if tipo_movimentacao == "ENTRADA":
-                produtos = extrair_produtos_inteligente_entrada_melhorado(texto_completo)
+                extrair_produtos = lambda: extrair_produtos_inteligente_entrada_melhorado(texto_completo)
             else:
-                produtos = self._extrair_produtos_saida(texto_completo)
+                extrair_produtos = lambda: self._extrair_produtos_saida(texto_completo)
+            produtos = parse_cache.obter_ou_calcular(
+                f'nf_pdf_produtos_{tipo_movimentacao}', hash_cache, extrair_produtos
+            )
             
             # 7. Processar produtos e criar preview
             preview = self._criar_preview_produtos(
@@ -186,6 +248,7 @@ class NFProcessorService:
                 - cliente_id: ID do cliente (para saída)
                 - vendedor_id: ID do vendedor (para saída)
                 - orcamento_id: ID do orçamento (opcional)
+                - chave_acesso: Chave de acesso da NF-e (opcional)
                 - produtos_confirmados: Lista de produtos a processar
             usuario_id: ID do usuário confirmando
             
@@ -193,8 +256,6 @@ class NFProcessorService:
             Dicionário com resultado do processamento
         """
         from app.services.stock_service import StockService
-        from app.crud import movimentacao_estoque as crud_movimentacao
-        from app.schemas import movimentacao_estoque as schemas_movimentacao
         
         produtos_confirmados = dados_confirmacao.get('produtos_confirmados', [])
         tipo_movimentacao = dados_confirmacao.get('tipo_movimentacao')
@@ -209,43 +270,51 @@ class NFProcessorService:
         
         movimentacoes_criadas = []
         historicos_vendas = []
+        historicos_preco = []
+        
+        produtos_validos = [
+            produto_data for produto_data in produtos_confirmados
+            if produto_data.get('produto_id') and produto_data.get('quantidade', 0) > 0
+        ]
         
-        for produto_data in produtos_confirmados:
+        observacao = f"NF {nota_fiscal} - Processamento automático"
+        if tipo_movimentacao == "SAIDA" and cliente_id:
+            cliente = self.db.query(models.Cliente).filter(
+                models.Cliente.id == cliente_id
+            ).first()
+            if cliente:
+                observacao += f" - Cliente: {cliente.razao_social}"
+        
+        # Todas as linhas da NF são lançadas em um único lote (tudo ou nada);
+        # o commit acontece no final, junto com os históricos de venda e preço
+        lancamentos = StockService.post_stock_batch(
+            db=self.db,
+            itens=[
+                {
+                    'produto_id': produto_data.get('produto_id'),
+                    'quantidade': produto_data.get('quantidade', 0),
+                    'tipo_movimentacao': tipo_movimentacao,
+                    'observacao': observacao,
+                    'nota_fiscal': nota_fiscal,
+                    'chave_acesso': dados_confirmacao.get('chave_acesso')
+                }
+                for produto_data in produtos_validos
+            ],
+            usuario_id=usuario_id,
+            empresa_id=empresa_id,
+            commit=False
+        )
+        
+        for produto_data, lancamento in zip(produtos_validos, lancamentos):
             produto_id = produto_data.get('produto_id')
             quantidade = produto_data.get('quantidade', 0)
             valor_unitario = produto_data.get('valor_unitario', 0)
             valor_total = produto_data.get('valor_total', 0)
             
-            if not produto_id or quantidade <= 0:
-                continue
-            
-            # Criar movimentação
-            observacao = f"NF {nota_fiscal} - Processamento automático"
-            if tipo_movimentacao == "SAIDA" and cliente_id:
-                cliente = self.db.query(models.Cliente).filter(
-                    models.Cliente.id == cliente_id
-                ).first()
-                if cliente:
-                    observacao += f" - Cliente: {cliente.razao_social}"
-            
-            movimentacao_data = schemas_movimentacao.MovimentacaoEstoqueCreate(
-                produto_id=produto_id,
-                tipo_movimentacao=tipo_movimentacao,
-                quantidade=quantidade,
-                observacao=observacao
-            )
-            
-            produto_atualizado = crud_movimentacao.create_movimentacao_estoque(
-                db=self.db,
-                movimentacao=movimentacao_data,
-                usuario_id=usuario_id,
-                empresa_id=empresa_id
-            )
-            
             movimentacoes_criadas.append({
                 'produto_id': produto_id,
                 'quantidade': quantidade,
-                'estoque_atual': produto_atualizado.quantidade_em_estoque
+                'estoque_atual': lancamento['estoque_depois']
             })
             
             # Para saída, criar histórico de venda e preço (SEMPRE quando houver cliente)
@@ -277,7 +346,8 @@ class NFProcessorService:
                         empresa_id=empresa_id,
                         cliente_id=cliente_id  # Vinculado via CNPJ
                     )
-                    self.db.add(historico_preco)
+                    EstatisticasPrecoService.registrar_historico(self.db, historico_preco)
+                    historicos_preco.append(historico_preco)
                     logger.info(f"Histórico de preço criado: Cliente {cliente_id}, Produto {produto_id}, NF {nota_fiscal}")
                     
                     # Criar HistoricoVendaCliente apenas se houver orcamento_id
@@ -299,6 +369,9 @@ class NFProcessorService:
                         historicos_vendas.append(historico_venda.id)
                         logger.info(f"Histórico de venda criado para cliente {cliente_id}, produto {produto_id}, NF {nota_fiscal}")
         
+        # Read model de vendas a clientes (HPP com NF e cliente)
+        VendasUnificadasService(self.db).registrar_historicos_preco(historicos_preco)
+        
         # Vincular orçamento à NF se fornecido
         if orcamento_id and tipo_movimentacao == "SAIDA":
             orcamento = self.db.query(models.Orcamento).filter(
@@ -306,10 +379,13 @@ class NFProcessorService:
             ).first()
             if orcamento:
                 orcamento.numero_nf = nota_fiscal
+                # As vendas do orçamento passam a contar pela NF
+                VendasUnificadasService(self.db).remover_vendas_orcamento(empresa_id, orcamento_id)
                 # Se status ainda é RASCUNHO ou ENVIADO, pode marcar como relacionado
                 logger.info(f"NF {nota_fiscal} vinculada ao orçamento {orcamento_id}")
         
         self.db.commit()
+        VendasMensaisService(self.db).atualizar_apos_lancamento()
         
         return {
             'sucesso': True,
@@ -320,52 +396,7 @@ class NFProcessorService:
     
     def _extrair_texto_pdf(self, caminho_pdf: str) -> str:
         """Extrai texto completo de um PDF usando múltiplas bibliotecas como fallback."""
-        texto = ""
-        
-        # Tentar primeiro com pdfplumber (melhor para tabelas e texto estruturado)
-        try:
-            with pdfplumber.open(caminho_pdf) as pdf:
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        texto += page_text + "\n"
-            if texto.strip():
-                logger.info(f"Texto extraído com pdfplumber: {len(texto)} caracteres")
-                return texto
-        except Exception as e:
-            logger.warning(f"Erro ao extrair texto com pdfplumber: {e}. Tentando PyPDF2...")
-        
-        # Fallback para PyPDF2/pypdf se pdfplumber falhar ou não retornar texto
-        try:
-            # Tentar importar PyPDF2 (versões antigas) ou pypdf (versões novas)
-            try:
-                from pypdf import PdfReader
-            except ImportError:
-                try:
-                    import PyPDF2
-                    PdfReader = PyPDF2.PdfReader
-                except ImportError:
-                    raise ImportError("Nem pypdf nem PyPDF2 estão disponíveis")
-            
-            reader = PdfReader(caminho_pdf)
-            for page in reader.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    texto += page_text + "\n"
-            if texto.strip():
-                logger.info(f"Texto extraído com PyPDF2/pypdf: {len(texto)} caracteres")
-                return texto
-        except ImportError as imp_err:
-            logger.warning(f"PyPDF2/pypdf não disponível: {imp_err}. Pulando fallback.")
-        except Exception as e2:
-            logger.warning(f"Erro ao extrair texto com PyPDF2/pypdf: {e2}")
-        
-        # Se nenhuma biblioteca conseguiu extrair texto, retornar string vazia
-        # (permitir processamento baseado em nome do arquivo ou outras heurísticas)
-        if not texto.strip():
-            logger.warning(f"Não foi possível extrair texto do PDF {caminho_pdf}. Retornando string vazia para permitir detecção por nome do arquivo.")
-        
-        return texto
+        return extrair_texto_pdf(caminho_pdf)
     
     def _extrair_dados_nf(
         self,
@@ -600,42 +631,7 @@ class NFProcessorService:
     
     def _extrair_produtos_saida(self, texto_completo: str) -> List[Dict[str, Any]]:
         """Extrai produtos de uma NF de saída."""
-        produtos = []
-        linhas = texto_completo.split('\n')
-        
-        # Buscar seção de produtos
-        inicio_produtos = False
-        for linha in linhas:
-            if 'Dados dos Produtos' in linha or 'DADOS DOS PRODUTOS' in linha:
-                inicio_produtos = True
-                continue
-            
-            if inicio_produtos and ('Dados Adicionais' in linha or 'DADOS ADICIONAIS' in linha):
-                break
-            
-            if inicio_produtos:
-                # Padrão: ITEM CÓDIGO DESCRIÇÃO NCM CST CFOP UN QTD VALOR_UNIT VALOR_TOTAL
-                match = re.match(
-                    r'^(\d+)\s+(\d+)\s+(.+?)\s+(\d{8})\s+\d{4}\s+\d{4}\s+(\w+)\s+([\d,]+)\s+([\d,]+)\s+[\d,]*\s*([\d,]+)',
-                    linha.strip()
-                )
-                
-                if match:
-                    try:
-                        produtos.append({
-                            'item': int(match.group(1)),
-                            'codigo': match.group(2),
-                            'descricao': match.group(3).strip(),
-                            'ncm': match.group(4),
-                            'unidade': match.group(5),
-                            'quantidade': float(match.group(6).replace(',', '.')),
-                            'valor_unitario': float(match.group(7).replace(',', '.')),
-                            'valor_total': float(match.group(8).replace(',', '.'))
-                        })
-                    except (ValueError, IndexError):
-                        continue
-        
-        return produtos
+        return extrair_itens_danfe(texto_completo)
     
     def _criar_preview_produtos(
         self,
@@ -647,22 +643,17 @@ class NFProcessorService:
         produtos_encontrados = []
         produtos_nao_encontrados = []
         
-        for produto_data in produtos:
+        # Associa todos os itens da NF em uma única passada sobre o catálogo
+        matcher = ProductMatcher(self.db, empresa_id)
+        associacoes = matcher.match_batch(produtos, threshold=0.5)
+        
+        for produto_data, (produto_encontrado, metodo, score) in zip(produtos, associacoes):
             codigo = produto_data.get('codigo')
             descricao = produto_data.get('descricao', '')
             quantidade = produto_data.get('quantidade', 0)
             valor_unitario = produto_data.get('valor_unitario', 0)
             valor_total = produto_data.get('valor_total', 0)
             
-            # Buscar produto no banco
-            produto_encontrado, metodo, score = find_product_by_code_or_name(
-                self.db,
-                codigo or '',
-                descricao,
-                empresa_id,
-                threshold=0.5
-            )
-            
             produto_info = {
                 'codigo': codigo,
                 'descricao': descricao,
@@ -1,13 +1,14 @@
 # /backend/app/services/pdf_processor.py
 
-import PyPDF2
 import json
-import re
 from typing import Dict, List, Any, Optional
 from datetime import datetime, date
 import os
 from pathlib import Path
 
+from app.utils.nf_linhas import PADRAO_ITEM_RELATORIO, separar_linha_relatorio
+from app.utils.pdf_texto import MOTOR_PYPDF, extrair_texto
+
 class PDFSalesProcessor:
     """Processador de PDFs de vendas para extrair dados históricos."""
     
@@ -24,12 +25,8 @@ class PDFSalesProcessor:
     def extract_text_from_pdf(self, pdf_path: str) -> str:
         """Extrai texto de um arquivo PDF."""
         try:
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                return text
+            # Páginas lidas em paralelo; PyPDF2 mantém o layout esperado por parse_sales_data
+            return extrair_texto(pdf_path, MOTOR_PYPDF)
         except Exception as e:
             print(f"Erro ao extrair texto do PDF {pdf_path}: {e}")
             return ""
@@ -48,7 +45,7 @@ class PDFSalesProcessor:
                 continue
             
             # Identifica linha de item (formato: "Item: X - NOME DO PRODUTO")
-            item_match = re.match(r'Item:\s*(\d+)\s*-\s*(.+)', line)
+            item_match = PADRAO_ITEM_RELATORIO.match(line)
             if item_match:
                 current_item = {
                     'codigo': item_match.group(1),
@@ -88,19 +85,8 @@ class PDFSalesProcessor:
             # Primeiro elemento é o código do cliente
             codigo_cliente = parts[0]
             
-            # Encontra onde começam os valores numéricos (da direita para esquerda)
-            numeric_values = []
-            cliente_parts = []
-            
-            # Processa da direita para esquerda para identificar valores numéricos
-            for i in range(len(parts) - 1, 0, -1):  # Pula o código do cliente (índice 0)
-                part = parts[i]
-                if re.match(r'^-?\d+[,.]\d+$', part):  # Inclui valores negativos
-                    numeric_values.insert(0, float(part.replace(',', '.')))
-                else:
-                    # Resto são partes do nome do cliente
-                    cliente_parts = parts[1:i+1]
-                    break
+            # Valores numéricos no fim da linha (inclui negativos); o resto é o nome do cliente
+            cliente_parts, numeric_values = separar_linha_relatorio(parts)
             
             if len(numeric_values) >= 5:  # quantidade, custo, vendido, lucro, percentual
                 quantidade = numeric_values[0]
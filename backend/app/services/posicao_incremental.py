@@ -0,0 +1,140 @@
+"""
+Posição dos jobs incrementais que somam linhas por id (snapshot de demanda,
+cubo mensal de vendas).
+
+Guardar só o maior id somado perde linhas: com dois lançamentos simultâneos, o
+que recebeu o id menor pode fazer commit depois que o job já passou do id
+maior, e `id > posicao` nunca mais o encontra. Por isso cada consumidor tem:
+
+- a posição (coluna do controle do job): todos os ids <= posição já foram
+  somados ou nunca vão existir (transação desfeita);
+- os ids somados acima da posição, em registros_processados_incremental.
+
+Cada execução soma as linhas visíveis acima da posição que ainda não estão
+registradas, registra esses ids e só então avança a posição até o maior id
+registrado há mais de INCREMENTAL_JANELA_SEGURANCA_MINUTOS — supõe-se que
+nenhuma transação de lançamento dure mais que a janela. As leituras completam
+o snapshot com as linhas que não estão somadas (`filtro_nao_somados`).
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy import and_, delete, exists, func, literal, or_, select, text
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..db import models
+
+CONSUMIDOR_DEMANDA = 'DEMANDA_DIARIA'
+
+
+def consumidor_vendas_mensais(fonte: str) -> str:
+    return f'VENDAS_MENSAIS_{fonte}'
+
+
+def travar_tabelas(db: Session, *tabelas: str) -> None:
+    """
+    Trava as tabelas de origem em modo SHARE até o fim da transação (Postgres):
+    espera os lançamentos em andamento e bloqueia novos, para que o maior id
+    lido por uma reconstrução cubra todas as linhas com id menor.
+    """
+    if db.get_bind().dialect.name != 'postgresql':
+        return
+    for tabela in tabelas:
+        db.execute(text(f"LOCK TABLE {tabela} IN SHARE MODE"))
+
+
+class PosicaoIncremental:
+    """Ids já somados por um consumidor acima da sua posição (janela de segurança)."""
+
+    def __init__(self, db: Session, consumidor: str, id_col):
+        self.db = db
+        self.consumidor = consumidor
+        self.id_col = id_col
+
+    def _registrado(self):
+        registro = models.RegistroProcessadoIncremental
+        return exists().where(
+            registro.consumidor == self.consumidor,
+            registro.registro_id == self.id_col
+        )
+
+    def filtro_nao_somados(self, posicao: int) -> List:
+        """Condições das linhas da origem que ainda não estão no snapshot."""
+        return [self.id_col > posicao, ~self._registrado()]
+
+    def filtro_somados(self, posicao: int):
+        """Condição das linhas da origem que já estão no snapshot."""
+        return or_(self.id_col <= posicao, self._registrado())
+
+    def inicializada(self, posicao: int) -> bool:
+        """False se o consumidor nunca somou nada (posição 0 e nenhum id registrado)."""
+        if posicao:
+            return True
+        registro = models.RegistroProcessadoIncremental
+        return self.db.query(
+            exists().where(registro.consumidor == self.consumidor)
+        ).scalar()
+
+    def registrar_pendentes(self, posicao: int, tamanho_lote: Optional[int] = None) -> Optional[datetime]:
+        """
+        Registra os ids visíveis ainda não somados (os menores primeiro, até
+        tamanho_lote). Devolve a marca desta execução para `filtro_execucao`,
+        ou None se não havia nada pendente. Não faz commit.
+        """
+        marca = datetime.now(timezone.utc)
+        pendentes = select(
+            literal(self.consumidor), self.id_col, literal(marca)
+        ).where(*self.filtro_nao_somados(posicao)).order_by(self.id_col)
+        if tamanho_lote:
+            pendentes = pendentes.limit(tamanho_lote)
+        resultado = self.db.execute(
+            models.RegistroProcessadoIncremental.__table__.insert().from_select(
+                ['consumidor', 'registro_id', 'processado_em'], pendentes
+            )
+        )
+        return marca if resultado.rowcount else None
+
+    def filtro_execucao(self, marca: datetime):
+        """Condição das linhas registradas na execução `marca` (as que ela deve somar)."""
+        registro = models.RegistroProcessadoIncremental
+        return self.id_col.in_(
+            select(registro.registro_id).where(
+                registro.consumidor == self.consumidor,
+                registro.processado_em == marca
+            )
+        )
+
+    def avancar(self, posicao: int) -> int:
+        """
+        Avança a posição até o maior id registrado há mais que a janela, sem
+        passar de uma linha visível ainda não somada, e descarta os registros
+        que ficaram abaixo dela. Não faz commit.
+        """
+        registro = models.RegistroProcessadoIncremental
+        limite_tempo = datetime.now(timezone.utc) - timedelta(minutes=settings.INCREMENTAL_JANELA_SEGURANCA_MINUTOS)
+        nova = self.db.query(func.max(registro.registro_id)).filter(
+            registro.consumidor == self.consumidor,
+            registro.processado_em < limite_tempo
+        ).scalar()
+        if nova is None or nova <= posicao:
+            return posicao
+
+        menor_pendente = self.db.execute(
+            select(func.min(self.id_col)).where(*self.filtro_nao_somados(posicao))
+        ).scalar()
+        if menor_pendente is not None:
+            nova = min(nova, menor_pendente - 1)
+        if nova <= posicao:
+            return posicao
+
+        self.db.execute(delete(registro).where(
+            and_(registro.consumidor == self.consumidor, registro.registro_id <= nova)
+        ))
+        return nova
+
+    def limpar(self) -> None:
+        """Descarta os ids registrados (reconstrução completa). Não faz commit."""
+        registro = models.RegistroProcessadoIncremental
+        self.db.execute(delete(registro).where(registro.consumidor == self.consumidor))
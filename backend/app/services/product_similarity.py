@@ -1,116 +1,243 @@
-from typing import List, Dict, Any, Optional
+from collections import Counter
+from typing import List, Dict, Any, Optional, Set
 from fuzzywuzzy import fuzz, process
 from sqlalchemy.orm import Session
 from app.db.connection import get_db
 from app.crud.produto import get_produtos
 import re
+import threading
+import time
+
+# Palavras ignoradas na extração de palavras-chave
+STOP_WORDS = {'DE', 'DA', 'DO', 'COM', 'SEM', 'PARA', 'EM', 'NA', 'NO', 'E', 'OU'}
+
+# Quantidade máxima de candidatos avaliados pelos scorers do fuzzywuzzy por busca
+MAX_CANDIDATOS = 150
+
+# Tempo máximo de vida do índice de uma empresa. Garante que alterações feitas
+# por outros workers (que não passam pelos hooks deste processo) apareçam.
+INDICE_TTL_SEGUNDOS = 600
+
+
+def _normalizar(text: str) -> str:
+    """Normaliza texto para comparação (maiúsculas, sem caracteres especiais)."""
+    if not text:
+        return ""
+    normalized = re.sub(r'[^A-Za-z0-9\s]', ' ', text.upper())
+    return ' '.join(normalized.split())
+
+
+def _trigramas(normalized: str) -> Set[str]:
+    """Gera os trigramas de cada palavra (com borda) de um texto já normalizado."""
+    grams = set()
+    for token in normalized.split():
+        padded = f" {token} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+class _IndiceEmpresa:
+    """
+    Índice invertido de trigramas dos produtos de uma empresa.
+
+    Mantém os registros de produto já normalizados e permite atualização
+    incremental (inclusão, alteração e remoção de um produto).
+    """
+
+    def __init__(self):
+        self.produtos: Dict[int, Dict[str, Any]] = {}
+        self.nomes_normalizados: Dict[int, str] = {}
+        self.palavras_chave: Dict[int, List[str]] = {}
+        self.trigramas_produto: Dict[int, Set[str]] = {}
+        self.postings: Dict[str, Set[int]] = {}
+        self.criado_em = time.monotonic()
+
+    def adicionar(self, product: Dict[str, Any]) -> None:
+        produto_id = product['id']
+        if produto_id in self.produtos:
+            self.remover(produto_id)
+
+        normalized = _normalizar(product['nome'])
+        grams = _trigramas(normalized)
+
+        self.produtos[produto_id] = product
+        self.nomes_normalizados[produto_id] = normalized
+        self.palavras_chave[produto_id] = [
+            word for word in normalized.split() if len(word) > 2 and word not in STOP_WORDS
+        ]
+        self.trigramas_produto[produto_id] = grams
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(produto_id)
+
+    def remover(self, produto_id: int) -> None:
+        if produto_id not in self.produtos:
+            return
+        for gram in self.trigramas_produto.pop(produto_id, set()):
+            ids = self.postings.get(gram)
+            if ids is not None:
+                ids.discard(produto_id)
+                if not ids:
+                    del self.postings[gram]
+        del self.produtos[produto_id]
+        self.nomes_normalizados.pop(produto_id, None)
+        self.palavras_chave.pop(produto_id, None)
+
+    def candidatos(self, normalized_search: str, limit: int = MAX_CANDIDATOS) -> List[int]:
+        """
+        Retorna os ids dos produtos que compartilham trigramas com a busca,
+        ordenados pela quantidade de trigramas em comum.
+        """
+        if len(self.produtos) <= limit:
+            return list(self.produtos.keys())
+
+        contagem: Counter = Counter()
+        for gram in _trigramas(normalized_search):
+            ids = self.postings.get(gram)
+            if ids:
+                contagem.update(ids)
+
+        if len(contagem) <= limit:
+            return list(contagem.keys())
+        return [produto_id for produto_id, _ in contagem.most_common(limit)]
+
+    def expirado(self) -> bool:
+        return time.monotonic() - self.criado_em > INDICE_TTL_SEGUNDOS
+
 
 class ProductSimilarityService:
     """Serviço para busca de produtos por similaridade de nomes"""
-    
+
     def __init__(self):
-        self.products_cache = None
-        self.product_names_cache = None
-    
+        self._indices: Dict[int, _IndiceEmpresa] = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _produto_para_dict(p) -> Dict[str, Any]:
+        return {
+            'id': p.id,
+            'nome': p.nome,
+            'codigo': p.codigo,
+            'categoria': p.categoria,
+            'unidade_medida': p.unidade_medida,
+            'preco_venda': float(p.preco_venda) if p.preco_venda else 0,
+            'descricao': p.descricao
+        }
+
+    def _get_indice(self, db: Session, empresa_id: int) -> _IndiceEmpresa:
+        """Retorna o índice da empresa, construindo-o a partir do banco se necessário."""
+        with self._lock:
+            indice = self._indices.get(empresa_id)
+            if indice is not None and not indice.expirado():
+                return indice
+
+            indice = _IndiceEmpresa()
+            for p in get_produtos(db, empresa_id):
+                indice.adicionar(self._produto_para_dict(p))
+            self._indices[empresa_id] = indice
+            return indice
+
     def _load_products(self, db: Session, empresa_id: int) -> List[Dict[str, Any]]:
         """Carrega todos os produtos do banco de dados para uma empresa específica"""
-        # Cache por empresa_id para evitar problemas com múltiplas empresas
-        if not hasattr(self, '_cache_by_empresa'):
-            self._cache_by_empresa = {}
-        
-        if empresa_id not in self._cache_by_empresa:
-            produtos = get_produtos(db, empresa_id)
-            self._cache_by_empresa[empresa_id] = [
-                {
-                    'id': p.id,
-                    'nome': p.nome,
-                    'codigo': p.codigo,
-                    'categoria': p.categoria,
-                    'unidade_medida': p.unidade_medida,
-                    'preco_venda': float(p.preco_venda) if p.preco_venda else 0,
-                    'descricao': p.descricao
-                }
-                for p in produtos
-            ]
-        
-        return self._cache_by_empresa[empresa_id]
-    
+        return list(self._get_indice(db, empresa_id).produtos.values())
+
+    def atualizar_produto(self, produto) -> None:
+        """
+        Atualiza incrementalmente o índice após criação ou alteração de um produto.
+        Se o índice da empresa ainda não foi construído, nada é feito.
+        """
+        with self._lock:
+            indice = self._indices.get(produto.empresa_id)
+            if indice is not None:
+                indice.adicionar(self._produto_para_dict(produto))
+
+    def remover_produto(self, produto_id: int, empresa_id: int) -> None:
+        """Remove um produto do índice da empresa após sua exclusão."""
+        with self._lock:
+            indice = self._indices.get(empresa_id)
+            if indice is not None:
+                indice.remover(produto_id)
+
     def _normalize_text(self, text: str) -> str:
         """Normaliza texto para comparação"""
-        if not text:
-            return ""
-        
-        # Remove caracteres especiais e converte para maiúsculo
-        normalized = re.sub(r'[^A-Za-z0-9\s]', ' ', text.upper())
-        # Remove espaços extras
-        normalized = ' '.join(normalized.split())
-        
-        return normalized
-    
+        return _normalizar(text)
+
     def _extract_keywords(self, text: str) -> List[str]:
         """Extrai palavras-chave importantes do texto"""
         normalized = self._normalize_text(text)
         words = normalized.split()
-        
+
         # Remove palavras muito pequenas ou comuns
-        stop_words = {'DE', 'DA', 'DO', 'COM', 'SEM', 'PARA', 'EM', 'NA', 'NO', 'E', 'OU'}
-        keywords = [word for word in words if len(word) > 2 and word not in stop_words]
-        
+        keywords = [word for word in words if len(word) > 2 and word not in STOP_WORDS]
+
         return keywords
-    
+
     def find_similar_products(
-        self, 
-        search_name: str, 
+        self,
+        search_name: str,
         db: Session,
         empresa_id: int,
         limit: int = 10,
         min_similarity: int = 60
     ) -> List[Dict[str, Any]]:
         """Encontra produtos similares baseado no nome"""
-        
-        products = self._load_products(db, empresa_id)
-        
-        if not search_name or not products:
+
+        if not search_name:
             return []
-        
+
+        indice = self._get_indice(db, empresa_id)
+        with self._lock:
+            if not indice.produtos:
+                return []
+            # Busca por código só percorre os códigos quando o termo é numérico
+            products = list(indice.produtos.values()) if search_name.strip().isdigit() else []
+            # O índice de trigramas restringe a avaliação fuzzy aos produtos candidatos
+            candidatos = [
+                (indice.produtos[produto_id], indice.nomes_normalizados[produto_id], indice.palavras_chave[produto_id])
+                for produto_id in indice.candidatos(_normalizar(search_name))
+            ]
+
         # Normaliza o termo de busca
         normalized_search = self._normalize_text(search_name)
         search_keywords = self._extract_keywords(search_name)
-        
+
         # Se não há palavras-chave, retornar vazio
         if not search_keywords:
             return []
-        
+
         # Lista para armazenar resultados com scores
         results = []
-        
+
         # Também buscar por código se o termo de busca for numérico
-        search_by_code = search_name.strip().isdigit()
-        
-        for product in products:
-            product_name = product['nome']
-            product_code = str(product.get('codigo', ''))
-            
-            # Busca exata por código tem prioridade
-            if search_by_code and product_code == search_name.strip():
-                results.append({
-                    **product,
-                    'similarity_score': 100.0,
-                    'match_details': {'exact_code_match': True}
-                })
-                continue
-            
-            # Busca parcial por código
-            if search_by_code and search_name.strip() in product_code:
-                results.append({
-                    **product,
-                    'similarity_score': 95.0,
-                    'match_details': {'partial_code_match': True}
-                })
+        search_term = search_name.strip()
+        search_by_code = search_term.isdigit()
+        code_matched_ids = set()
+
+        if search_by_code:
+            for product in products:
+                product_code = str(product.get('codigo', ''))
+
+                # Busca exata por código tem prioridade
+                if product_code == search_term:
+                    results.append({
+                        **product,
+                        'similarity_score': 100.0,
+                        'match_details': {'exact_code_match': True}
+                    })
+                    code_matched_ids.add(product['id'])
+                # Busca parcial por código
+                elif search_term in product_code:
+                    results.append({
+                        **product,
+                        'similarity_score': 95.0,
+                        'match_details': {'partial_code_match': True}
+                    })
+                    code_matched_ids.add(product['id'])
+
+        for product, normalized_product, product_keywords in candidatos:
+            if product['id'] in code_matched_ids:
                 continue
-            
-            normalized_product = self._normalize_text(product_name)
-            
+
             # Calcula diferentes tipos de similaridade
             scores = {
                 'ratio': fuzz.ratio(normalized_search, normalized_product),
@@ -118,12 +245,11 @@ class ProductSimilarityService:
                 'token_sort_ratio': fuzz.token_sort_ratio(normalized_search, normalized_product),
                 'token_set_ratio': fuzz.token_set_ratio(normalized_search, normalized_product)
             }
-            
+
             # Score baseado em palavras-chave
-            product_keywords = self._extract_keywords(product_name)
             keyword_matches = sum(1 for kw in search_keywords if kw in product_keywords)
             keyword_score = (keyword_matches / len(search_keywords) * 100) if search_keywords else 0
-            
+
             # Score final (média ponderada)
             final_score = (
                 scores['ratio'] * 0.2 +
@@ -132,7 +258,7 @@ class ProductSimilarityService:
                 scores['token_set_ratio'] * 0.2 +
                 keyword_score * 0.1
             )
-            
+
             if final_score >= min_similarity:
                 results.append({
                     **product,
@@ -147,27 +273,27 @@ class ProductSimilarityService:
                         'total_keywords': len(search_keywords)
                     }
                 })
-        
+
         # Ordena por score de similaridade (maior primeiro)
         results.sort(key=lambda x: x['similarity_score'], reverse=True)
-        
+
         return results[:limit]
-    
+
     def find_best_match(
-        self, 
-        search_name: str, 
+        self,
+        search_name: str,
         db: Session,
         empresa_id: int,
         min_similarity: int = 80
     ) -> Optional[Dict[str, Any]]:
         """Encontra a melhor correspondência para um produto"""
-        
+
         similar_products = self.find_similar_products(
             search_name, db, empresa_id, limit=1, min_similarity=min_similarity
         )
-        
+
         return similar_products[0] if similar_products else None
-    
+
     def batch_find_similar(
         self,
         product_names: List[str],
@@ -177,21 +303,24 @@ class ProductSimilarityService:
         min_similarity: int = 60
     ) -> Dict[str, List[Dict[str, Any]]]:
         """Encontra produtos similares para uma lista de nomes"""
-        
+
         results = {}
-        
+
         for name in product_names:
             similar = self.find_similar_products(
                 name, db, empresa_id, limit=limit_per_product, min_similarity=min_similarity
             )
             results[name] = similar
-        
+
         return results
-    
-    def clear_cache(self):
-        """Limpa o cache de produtos"""
-        self.products_cache = None
-        self.product_names_cache = None
+
+    def clear_cache(self, empresa_id: Optional[int] = None):
+        """Limpa o índice de produtos (de uma empresa ou de todas)"""
+        with self._lock:
+            if empresa_id is None:
+                self._indices.clear()
+            else:
+                self._indices.pop(empresa_id, None)
 
 # Instância global do serviço
-product_similarity_service = ProductSimilarityService()
\ No newline at end of file
+product_similarity_service = ProductSimilarityService()
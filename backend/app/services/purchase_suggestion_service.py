@@ -8,11 +8,11 @@ Utiliza movimentações de saída (vendas) para calcular estoque mínimo e quant
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import text, func
 import logging
 
 from ..db import models
 from .cliente_analytics_service import ClienteAnalyticsService
+from .demanda_snapshot_service import DemandaSnapshotService
 from .regras_sugestao_service import get_regras_empresa
 
 logger = logging.getLogger(__name__)
@@ -27,7 +27,8 @@ class PurchaseSuggestionService:
     def calculate_daily_demand(
         self,
         produto_id: int,
-        days_analysis: int = 90
+        days_analysis: int = 90,
+        empresa_id: Optional[int] = None
     ) -> Dict[str, Any]:
         """
         Calcula a demanda média diária de um produto baseado em movimentações de saída.
@@ -35,56 +36,84 @@ class PurchaseSuggestionService:
         Args:
             produto_id: ID do produto
             days_analysis: Período de análise em dias (padrão 90 dias)
+            empresa_id: ID da empresa (obtido do produto se não informado)
         
         Returns:
             Dict com estatísticas de demanda
         """
-        data_limite = datetime.now() - timedelta(days=days_analysis)
-        
-        # Busca movimentações de saída do produto
-        saidas = self.db.query(models.MovimentacaoEstoque).filter(
-            models.MovimentacaoEstoque.produto_id == produto_id,
-            models.MovimentacaoEstoque.tipo_movimentacao == 'SAIDA',
-            models.MovimentacaoEstoque.data_movimentacao >= data_limite
-        ).all()
-        
-        if not saidas:
-            return {
-                'total_vendido': 0,
-                'numero_vendas': 0,
-                'demanda_media_diaria': 0,
-                'demanda_maxima_diaria': 0,
-                'dias_com_vendas': 0,
-                'tem_historico_suficiente': False
-            }
-        
-        # Calcula estatísticas
-        total_vendido = sum(saida.quantidade for saida in saidas)
-        numero_vendas = len(saidas)
-        demanda_media_diaria = total_vendido / days_analysis
-        
-        # Agrupa vendas por dia para calcular variabilidade
-        vendas_por_dia = {}
-        for saida in saidas:
-            data_str = saida.data_movimentacao.date().isoformat()
-            if data_str not in vendas_por_dia:
-                vendas_por_dia[data_str] = 0
-            vendas_por_dia[data_str] += saida.quantidade
+        if empresa_id is None:
+            empresa_id = self.db.query(models.Produto.empresa_id).filter(
+                models.Produto.id == produto_id
+            ).scalar()
+        return self.calculate_daily_demand_batch(empresa_id, [produto_id], days_analysis)[produto_id]
+    
+    def calculate_daily_demand_batch(
+        self,
+        empresa_id: int,
+        produto_ids: Optional[List[int]] = None,
+        days_analysis: int = 90
+    ) -> Dict[int, Dict[str, Any]]:
+        """
+        Calcula a demanda de vários produtos a partir do snapshot diário de
+        demanda (mesmas estatísticas de calculate_daily_demand).
         
-        demanda_maxima_diaria = max(vendas_por_dia.values()) if vendas_por_dia else 0
-        dias_com_vendas = len(vendas_por_dia)
+        Args:
+            empresa_id: ID da empresa
+            produto_ids: IDs dos produtos (None = todos os produtos com vendas)
+            days_analysis: Período de análise em dias (padrão 90 dias)
         
-        # Valida histórico suficiente (mínimo 2 vendas)
-        tem_historico_suficiente = numero_vendas >= 2
+        Returns:
+            Dict produto_id -> estatísticas de demanda
+        """
+        data_limite = datetime.now() - timedelta(days=days_analysis)
+        resumo = DemandaSnapshotService(self.db).resumo_por_produto(
+            empresa_id, data_limite.date(), produto_ids
+        )
+        
+        resultado = {}
+        for produto_id in (produto_ids if produto_ids is not None else resumo.keys()):
+            dados = resumo.get(produto_id)
+            if not dados or dados['numero_vendas'] == 0:
+                resultado[produto_id] = {
+                    'total_vendido': 0,
+                    'numero_vendas': 0,
+                    'demanda_media_diaria': 0,
+                    'demanda_maxima_diaria': 0,
+                    'dias_com_vendas': 0,
+                    'tem_historico_suficiente': False
+                }
+                continue
+            
+            resultado[produto_id] = {
+                'total_vendido': dados['total_saida'],
+                'numero_vendas': dados['numero_vendas'],
+                'demanda_media_diaria': round(dados['total_saida'] / days_analysis, 2),
+                'demanda_maxima_diaria': dados['demanda_maxima_diaria'],
+                'dias_com_vendas': dados['dias_com_vendas'],
+                # Valida histórico suficiente (mínimo 2 vendas)
+                'tem_historico_suficiente': dados['numero_vendas'] >= 2
+            }
         
-        return {
-            'total_vendido': total_vendido,
-            'numero_vendas': numero_vendas,
-            'demanda_media_diaria': round(demanda_media_diaria, 2),
-            'demanda_maxima_diaria': demanda_maxima_diaria,
-            'dias_com_vendas': dias_com_vendas,
-            'tem_historico_suficiente': tem_historico_suficiente
-        }
+        return resultado
+    
+    def _contar_vendas_recentes_lote(self, empresa_id: int, produto_ids: List[int]) -> Dict[int, Dict[str, int]]:
+        """
+        Conta as saídas dos últimos 30 dias e dos 30 dias anteriores de cada
+        produto, a partir do snapshot diário (usado na justificativa de tendência).
+        """
+        if not produto_ids:
+            return {}
+        
+        agora = datetime.now()
+        inicio_recente = (agora - timedelta(days=30)).date()
+        inicio_anterior = (agora - timedelta(days=60)).date()
+        
+        contagem: Dict[int, Dict[str, int]] = {}
+        dias = DemandaSnapshotService(self.db).demanda_diaria(empresa_id, inicio_anterior, produto_ids)
+        for (produto_id, dia), valores in dias.items():
+            dados = contagem.setdefault(produto_id, {'recentes': 0, 'anteriores': 0})
+            dados['recentes' if dia >= inicio_recente else 'anteriores'] += valores['numero_vendas']
+        return contagem
     
     def calculate_minimum_stock(
         self,
@@ -176,53 +205,47 @@ class PurchaseSuggestionService:
         safety_margin = regras["margem_seguranca"]
         additional_safety_margin = regras["margem_adicional_cobertura"]
 
-        data_limite = datetime.now() - timedelta(days=days_analysis)
-        
-        # Query para buscar produtos com movimentações de saída
-        query = text("""
-            SELECT 
-                p.id as produto_id,
-                p.nome as produto_nome,
-                p.codigo,
-                p.categoria,
-                p.estoque_minimo as estoque_minimo_atual,
-                p.quantidade_em_estoque,
-                p.preco_custo,
-                p.preco_venda,
-                p.fornecedor_id,
-                COALESCE(SUM(m.quantidade), 0) as total_vendido,
-                COUNT(m.id) as numero_vendas
-            FROM produtos p
-            LEFT JOIN movimentacoes_estoque m ON p.id = m.produto_id 
-                AND m.tipo_movimentacao = 'SAIDA'
-                AND m.data_movimentacao >= :data_limite
-            WHERE p.empresa_id = :empresa_id
-            GROUP BY p.id, p.nome, p.codigo, p.categoria, p.estoque_minimo, 
-                     p.quantidade_em_estoque, p.preco_custo, p.preco_venda, p.fornecedor_id
-            HAVING COUNT(m.id) >= :min_sales_threshold
-            ORDER BY 
-                CASE 
-                    WHEN p.quantidade_em_estoque <= 0 THEN 1
-                    WHEN p.quantidade_em_estoque < p.estoque_minimo THEN 2
-                    ELSE 3
-                END,
-                p.quantidade_em_estoque ASC
-        """)
-        
-        result = self.db.execute(query, {
-            'empresa_id': empresa_id,
-            'data_limite': data_limite,
-            'min_sales_threshold': min_sales_threshold
-        })
-        
-        suggestions = []
-        
-        for row in result:
+        # Demanda de todos os produtos da empresa a partir do snapshot diário
+        demandas = self.calculate_daily_demand_batch(empresa_id, days_analysis=days_analysis)
+        
+        produtos = self.db.query(
+            models.Produto.id.label('produto_id'),
+            models.Produto.nome.label('produto_nome'),
+            models.Produto.codigo,
+            models.Produto.categoria,
+            models.Produto.estoque_minimo.label('estoque_minimo_atual'),
+            models.Produto.quantidade_em_estoque,
+            models.Produto.preco_custo,
+            models.Produto.preco_venda,
+            models.Produto.fornecedor_id
+        ).filter(models.Produto.empresa_id == empresa_id).all()
+        
+        def prioridade_estoque(row):
+            estoque = row.quantidade_em_estoque or 0
+            if estoque <= 0:
+                faixa = 1
+            elif row.estoque_minimo_atual is not None and estoque < row.estoque_minimo_atual:
+                faixa = 2
+            else:
+                faixa = 3
+            return (faixa, estoque)
+        
+        # Produtos com o número mínimo de vendas no período
+        sem_vendas = {'numero_vendas': 0, 'tem_historico_suficiente': False}
+        rows = sorted(
+            (
+                row for row in produtos
+                if demandas.get(row.produto_id, sem_vendas)['numero_vendas'] >= min_sales_threshold
+            ),
+            key=prioridade_estoque
+        )
+        
+        # Primeira passada: cálculo de estoque mínimo, quantidade e status
+        candidatos = []
+        for row in rows:
             produto_id = row.produto_id
             estoque_atual = row.quantidade_em_estoque or 0
-            
-            # Calcula demanda
-            demanda_info = self.calculate_daily_demand(produto_id, days_analysis)
+            demanda_info = demandas.get(produto_id, sem_vendas)
             
             if not demanda_info['tem_historico_suficiente']:
                 continue
@@ -252,6 +275,41 @@ class PurchaseSuggestionService:
             if quantidade_sugerida <= 0:
                 continue
             
+            candidatos.append((row, demanda_info, estoque_minimo_calculado, quantidade_sugerida))
+        
+        # Dados complementares dos produtos que precisam de compra, em lote
+        produto_ids = [row.produto_id for row, _, _, _ in candidatos]
+        fornecedor_ids = {row.fornecedor_id for row, _, _, _ in candidatos if row.fornecedor_id}
+        fornecedores = {}
+        if fornecedor_ids:
+            fornecedores = dict(self.db.query(models.Fornecedor.id, models.Fornecedor.nome).filter(
+                models.Fornecedor.id.in_(fornecedor_ids)
+            ).all())
+        
+        analises_produto = {}
+        try:
+            analises_produto = ClienteAnalyticsService(self.db).analisar_padroes_produtos_por_cliente_lote(
+                produto_ids=produto_ids,
+                empresa_id=empresa_id,
+                dias_analise=days_analysis,
+                limite_clientes=5
+            )
+        except Exception as e:
+            logger.warning(f"Erro ao analisar padrões por cliente dos produtos sugeridos: {e}")
+        
+        vendas_recentes_por_produto = self._contar_vendas_recentes_lote(empresa_id, [
+            row.produto_id for row, demanda_info, _, _ in candidatos
+            if demanda_info.get('numero_vendas', 0) > 5
+        ])
+        
+        # Segunda passada: status, justificativas e montagem das sugestões
+        suggestions = []
+        
+        for row, demanda_info, estoque_minimo_calculado, quantidade_sugerida in candidatos:
+            produto_id = row.produto_id
+            estoque_atual = row.quantidade_em_estoque or 0
+            demanda_media_diaria = demanda_info['demanda_media_diaria']
+            
             # Calcula dias de cobertura atual
             dias_cobertura_atual = estoque_atual / demanda_media_diaria if demanda_media_diaria > 0 else 0
             
@@ -265,77 +323,52 @@ class PurchaseSuggestionService:
             else:
                 status = 'ADEQUADO'
             
-            # Busca fornecedor se existir
-            fornecedor_nome = None
-            if row.fornecedor_id:
-                fornecedor = self.db.query(models.Fornecedor).filter(
-                    models.Fornecedor.id == row.fornecedor_id
-                ).first()
-                if fornecedor:
-                    fornecedor_nome = fornecedor.nome
+            fornecedor_nome = fornecedores.get(row.fornecedor_id) if row.fornecedor_id else None
             
-            # Análise por cliente usando ClienteAnalyticsService
+            # Análise por cliente (top 5 clientes por valor)
             justificativas = []
-            clientes_principais = []
+            analise_produto = analises_produto.get(produto_id, {})
+            top_clientes = analise_produto.get('clientes', [])
+            clientes_principais = top_clientes
             
-            try:
-                analytics_service = ClienteAnalyticsService(self.db)
-                analise_produto = analytics_service.analisar_padroes_produto_por_cliente(
-                    produto_id=produto_id,
-                    empresa_id=empresa_id,
-                    dias_analise=days_analysis
-                )
-                
-                # Top clientes que compram este produto
-                top_clientes = sorted(
-                    analise_produto.get('clientes', []),
-                    key=lambda x: x.get('total_valor', 0),
-                    reverse=True
-                )[:5]  # Top 5 clientes
-                
-                clientes_principais = top_clientes
-                
-                # Gerar justificativas baseadas nos clientes
-                if top_clientes:
-                    # Clientes que compram regularmente
-                    clientes_frequentes = [
-                        c for c in top_clientes 
-                        if c.get('frequencia_media_dias') and c.get('frequencia_media_dias') <= 30
-                    ]
-                    if clientes_frequentes:
-                        nomes = [c['cliente_nome'] for c in clientes_frequentes[:3]]
-                        if len(nomes) == 1:
-                            justificativas.append(
-                                f"Cliente {nomes[0]} compra regularmente este produto "
-                                f"(última compra: {clientes_frequentes[0].get('dias_ultima_compra', 'N/A')} dias atrás)"
-                            )
-                        else:
-                            justificativas.append(
-                                f"{len(clientes_frequentes)} clientes compram regularmente este produto: "
-                                f"{', '.join(nomes)}"
-                            )
-                    
-                    # Cliente com compra recente
-                    cliente_recente = min(
-                        [c for c in top_clientes if c.get('dias_ultima_compra') is not None],
-                        key=lambda x: x.get('dias_ultima_compra', 999),
-                        default=None
-                    )
-                    if cliente_recente and cliente_recente.get('dias_ultima_compra', 999) <= 7:
+            # Gerar justificativas baseadas nos clientes
+            if top_clientes:
+                # Clientes que compram regularmente
+                clientes_frequentes = [
+                    c for c in top_clientes 
+                    if c.get('frequencia_media_dias') and c.get('frequencia_media_dias') <= 30
+                ]
+                if clientes_frequentes:
+                    nomes = [c['cliente_nome'] for c in clientes_frequentes[:3]]
+                    if len(nomes) == 1:
                         justificativas.append(
-                            f"Cliente {cliente_recente['cliente_nome']} comprou recentemente "
-                            f"({cliente_recente['dias_ultima_compra']} dias atrás)"
+                            f"Cliente {nomes[0]} compra regularmente este produto "
+                            f"(última compra: {clientes_frequentes[0].get('dias_ultima_compra', 'N/A')} dias atrás)"
                         )
-                    
-                    # Múltiplos clientes
-                    if len(top_clientes) >= 3:
+                    else:
                         justificativas.append(
-                            f"Vendido para {analise_produto['clientes_unicos']} clientes diferentes "
-                            f"nos últimos {days_analysis} dias"
+                            f"{len(clientes_frequentes)} clientes compram regularmente este produto: "
+                            f"{', '.join(nomes)}"
                         )
                 
-            except Exception as e:
-                logger.warning(f"Erro ao analisar padrões por cliente para produto {produto_id}: {e}")
+                # Cliente com compra recente
+                cliente_recente = min(
+                    [c for c in top_clientes if c.get('dias_ultima_compra') is not None],
+                    key=lambda x: x.get('dias_ultima_compra', 999),
+                    default=None
+                )
+                if cliente_recente and cliente_recente.get('dias_ultima_compra', 999) <= 7:
+                    justificativas.append(
+                        f"Cliente {cliente_recente['cliente_nome']} comprou recentemente "
+                        f"({cliente_recente['dias_ultima_compra']} dias atrás)"
+                    )
+                
+                # Múltiplos clientes
+                if len(top_clientes) >= 3:
+                    justificativas.append(
+                        f"Vendido para {analise_produto['clientes_unicos']} clientes diferentes "
+                        f"nos últimos {days_analysis} dias"
+                    )
             
             # Justificativas gerais
             if estoque_atual <= 0:
@@ -345,21 +378,11 @@ class PurchaseSuggestionService:
             else:
                 justificativas.insert(0, f"Estoque atual: {estoque_atual} unidades (cobre {round(dias_cobertura_atual, 1)} dias)")
             
-            # Tendência de crescimento
+            # Tendência de crescimento: últimos 30 dias comparados com os 30 anteriores
             if demanda_info.get('numero_vendas', 0) > 5:
-                # Comparar últimos 30 dias com os 30 anteriores
-                vendas_recentes = self.db.query(models.MovimentacaoEstoque).filter(
-                    models.MovimentacaoEstoque.produto_id == produto_id,
-                    models.MovimentacaoEstoque.tipo_movimentacao == 'SAIDA',
-                    models.MovimentacaoEstoque.data_movimentacao >= datetime.now() - timedelta(days=30)
-                ).count()
-                
-                vendas_anteriores = self.db.query(models.MovimentacaoEstoque).filter(
-                    models.MovimentacaoEstoque.produto_id == produto_id,
-                    models.MovimentacaoEstoque.tipo_movimentacao == 'SAIDA',
-                    models.MovimentacaoEstoque.data_movimentacao >= datetime.now() - timedelta(days=60),
-                    models.MovimentacaoEstoque.data_movimentacao < datetime.now() - timedelta(days=30)
-                ).count()
+                contagem = vendas_recentes_por_produto.get(produto_id, {'recentes': 0, 'anteriores': 0})
+                vendas_recentes = contagem['recentes']
+                vendas_anteriores = contagem['anteriores']
                 
                 if vendas_anteriores > 0:
                     crescimento = ((vendas_recentes - vendas_anteriores) / vendas_anteriores) * 100
@@ -396,7 +419,7 @@ class PurchaseSuggestionService:
                 # Novos campos: análise por cliente
                 'justificativas': justificativas,
                 'clientes_principais': clientes_principais,
-                'numero_clientes_unicos': analise_produto.get('clientes_unicos', 0) if 'analise_produto' in locals() else 0
+                'numero_clientes_unicos': analise_produto.get('clientes_unicos', 0)
             }
             
             suggestions.append(suggestion)
@@ -440,7 +463,7 @@ class PurchaseSuggestionService:
         estoque_atual = produto.quantidade_em_estoque or 0
         
         # Calcula demanda
-        demanda_info = self.calculate_daily_demand(produto_id, days_analysis)
+        demanda_info = self.calculate_daily_demand(produto_id, days_analysis, empresa_id=empresa_id)
         demanda_media_diaria = demanda_info['demanda_media_diaria']
         
         # Calcula estoque mínimo
@@ -1,16 +1,64 @@
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 from fastapi import HTTPException, status
-from typing import Optional, Literal, List, Dict
+from typing import Any, Optional, Literal, List, Dict, Tuple
 from datetime import datetime
 
 from ..db import models
+from ..core.constants import CanalMovimentacao, PREFIXOS_CANAL_MOVIMENTACAO
 from ..core.logger import stock_operations_logger
 from ..schemas.movimentacao_estoque import MotivoMovimentacao, StatusMovimentacao
+from .demanda_snapshot_service import DemandaSnapshotService
+from .vendas_mensais_service import VendasMensaisService
 
 OrigemMovimentacao = Literal['VENDA', 'DEVOLUCAO', 'CORRECAO_MANUAL', 'COMPRA', 'AJUSTE', 'OUTRO']
 TipoMovimentacao = Literal['ENTRADA', 'SAIDA']
 
+# Número da NF dentro do texto livre de observacao ("NF 123456 - ...", "Entrada XML - NF 123456")
+_REGEX_NF_OBSERVACAO_SQL = 'NF ([[:alnum:]./-]*[[:alnum:]])'
+_REGEX_CHAVE_ACESSO_SQL = '[0-9]{44}'
+
+
+def normalizar_nota_fiscal(nota_fiscal) -> Optional[str]:
+    """Número da NF no formato gravado em movimentacoes_estoque.nota_fiscal (None se ausente ou 'N/A')."""
+    if nota_fiscal is None:
+        return None
+    valor = str(nota_fiscal).strip()
+    if not valor or valor.upper() == 'N/A':
+        return None
+    return valor[:50]
+
+
+_PREFIXOS_CANAL_MINUSCULOS = [(prefixo.lower(), canal) for prefixo, canal in PREFIXOS_CANAL_MOVIMENTACAO]
+
+
+def classificar_canal_movimentacao(observacao: Optional[str]) -> str:
+    """
+    Canal da movimentação (movimentacoes_estoque.canal) pelo prefixo da observação.
+    Chamado pelo modelo sempre que a observação é atribuída; mesma regra do
+    preenchimento em SQL (preencher_canal_movimentacoes).
+    """
+    if observacao:
+        texto = observacao.lower()
+        for prefixo, canal in _PREFIXOS_CANAL_MINUSCULOS:
+            if texto.startswith(prefixo):
+                return canal
+    return CanalMovimentacao.MANUAL.value
+
+
+def _sql_canal_por_observacao() -> Tuple[str, Dict[str, Any]]:
+    """CASE SQL equivalente a classificar_canal_movimentacao (ILIKE 'prefixo%')."""
+    casos = []
+    parametros: Dict[str, Any] = {'canal_manual': CanalMovimentacao.MANUAL.value}
+    for indice, (prefixo, canal) in enumerate(PREFIXOS_CANAL_MOVIMENTACAO):
+        prefixo_like = prefixo.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        casos.append(f"WHEN observacao ILIKE :prefixo_{indice} THEN :canal_{indice}")
+        parametros[f'prefixo_{indice}'] = f"{prefixo_like}%"
+        parametros[f'canal_{indice}'] = canal
+    return f"CASE {' '.join(casos)} ELSE :canal_manual END", parametros
+
+
 class StockService:
     
     @staticmethod
@@ -25,7 +73,9 @@ class StockService:
         observacao: Optional[str] = None,
         motivo_movimentacao: Optional[MotivoMovimentacao] = None,
         observacao_motivo: Optional[str] = None,
-        apply_immediately: bool = True
+        apply_immediately: bool = True,
+        nota_fiscal: Optional[str] = None,
+        chave_acesso: Optional[str] = None
     ) -> models.Produto:
         try:
             produto = db.query(models.Produto).with_for_update().filter(
@@ -71,7 +121,9 @@ class StockService:
                 quantidade_depois=quantidade_depois,
                 status='CONFIRMADO' if apply_immediately else 'PENDENTE',
                 motivo_movimentacao=motivo_movimentacao.value if motivo_movimentacao else None,
-                observacao_motivo=observacao_motivo
+                observacao_motivo=observacao_motivo,
+                nota_fiscal=normalizar_nota_fiscal(nota_fiscal),
+                chave_acesso=chave_acesso or None
             )
             
             db.add(movimentacao)
@@ -115,6 +167,174 @@ class StockService:
                 detail=f"Erro inesperado ao atualizar estoque: {str(e)}"
             )
     
+    @staticmethod
+    def post_stock_batch(
+        db: Session,
+        itens: List[Dict],
+        usuario_id: int,
+        empresa_id: int,
+        parcial: bool = False,
+        commit: bool = True
+    ) -> List[Dict]:
+        """
+        Lança várias movimentações confirmadas em uma única transação.
+
+        Todos os produtos envolvidos são travados em um único SELECT ... FOR UPDATE
+        ordenado por id (mesma ordem em qualquer lote, evitando deadlock entre
+        lançamentos concorrentes). O estoque de cada item é validado em memória,
+        na ordem dos itens (vários itens do mesmo produto acumulam), e as
+        movimentações são inseridas juntas com um único flush.
+
+        Cada item aceita as chaves produto_id, quantidade, tipo_movimentacao e,
+        opcionalmente, origem, observacao, motivo_movimentacao, observacao_motivo,
+        nota_fiscal e chave_acesso.
+
+        Args:
+            parcial: se False (padrão), qualquer item inválido rejeita o lote inteiro
+                com HTTPException, sem alterar estoque; se True, os itens inválidos
+                são apenas reportados e os demais são lançados.
+            commit: se False, não confirma nem desfaz a transação (o chamador grava
+                outros registros, faz um único commit no final e decide o rollback
+                em caso de erro).
+
+        Returns:
+            Um resultado por item, na ordem recebida, com sucesso, erro,
+            status_code, estoque_antes, estoque_depois, movimentacao_id, produto e
+            produto_nome (lido antes do commit, sem recarregar o produto).
+        """
+        if not itens:
+            return []
+
+        try:
+            produto_ids = sorted({item['produto_id'] for item in itens})
+            produtos = {
+                produto.id: produto
+                for produto in db.query(models.Produto).filter(
+                    models.Produto.id.in_(produto_ids),
+                    models.Produto.empresa_id == empresa_id
+                ).order_by(models.Produto.id).with_for_update().all()
+            }
+
+            # Estoque corrente de cada produto durante a validação; só é gravado
+            # nos produtos depois que o lote é aceito
+            estoque = {produto.id: produto.quantidade_em_estoque or 0 for produto in produtos.values()}
+            resultados = []
+            movimentacoes = []
+            for indice, item in enumerate(itens):
+                produto_id = item['produto_id']
+                quantidade = item['quantidade']
+                tipo_movimentacao = str(item.get('tipo_movimentacao') or '').upper()
+                produto = produtos.get(produto_id)
+                resultado = {
+                    'indice': indice,
+                    'produto_id': produto_id,
+                    'tipo_movimentacao': tipo_movimentacao,
+                    'quantidade': quantidade,
+                    'sucesso': False,
+                    'erro': None,
+                    'status_code': None,
+                    'estoque_antes': None,
+                    'estoque_depois': None,
+                    'movimentacao_id': None,
+                    'produto': produto,
+                    'produto_nome': produto.nome if produto else None
+                }
+                resultados.append(resultado)
+
+                if not produto:
+                    resultado['status_code'] = status.HTTP_404_NOT_FOUND
+                    resultado['erro'] = "Produto não encontrado ou não pertence à sua empresa."
+                    continue
+                if tipo_movimentacao not in ('ENTRADA', 'SAIDA'):
+                    resultado['status_code'] = status.HTTP_400_BAD_REQUEST
+                    resultado['erro'] = "O tipo de movimentação deve ser 'ENTRADA' ou 'SAIDA'"
+                    continue
+                if not quantidade or quantidade <= 0:
+                    resultado['status_code'] = status.HTTP_400_BAD_REQUEST
+                    resultado['erro'] = "A quantidade deve ser maior que zero."
+                    continue
+
+                quantidade_antes = estoque[produto_id]
+                if tipo_movimentacao == 'SAIDA':
+                    if quantidade_antes < quantidade:
+                        stock_operations_logger.warning(
+                            f"[postStockBatch] INSUFFICIENT_STOCK - produto_id={produto_id}, "
+                            f"requested={quantidade}, available={quantidade_antes}"
+                        )
+                        resultado['status_code'] = status.HTTP_400_BAD_REQUEST
+                        resultado['erro'] = f"Estoque insuficiente. Disponível: {quantidade_antes}, Solicitado: {quantidade}"
+                        continue
+                    quantidade_depois = quantidade_antes - quantidade
+                else:
+                    quantidade_depois = quantidade_antes + quantidade
+
+                estoque[produto_id] = quantidade_depois
+                motivo_movimentacao = item.get('motivo_movimentacao')
+                movimentacao = models.MovimentacaoEstoque(
+                    produto_id=produto_id,
+                    tipo_movimentacao=tipo_movimentacao,
+                    quantidade=quantidade,
+                    observacao=item.get('observacao'),
+                    usuario_id=usuario_id,
+                    origem=item.get('origem'),
+                    quantidade_antes=quantidade_antes,
+                    quantidade_depois=quantidade_depois,
+                    status='CONFIRMADO',
+                    motivo_movimentacao=motivo_movimentacao.value if isinstance(motivo_movimentacao, MotivoMovimentacao) else motivo_movimentacao,
+                    observacao_motivo=item.get('observacao_motivo'),
+                    nota_fiscal=normalizar_nota_fiscal(item.get('nota_fiscal')),
+                    chave_acesso=item.get('chave_acesso') or None
+                )
+                movimentacoes.append((resultado, movimentacao))
+                resultado['sucesso'] = True
+                resultado['estoque_antes'] = quantidade_antes
+                resultado['estoque_depois'] = quantidade_depois
+
+            falhas = [r for r in resultados if not r['sucesso']]
+            if falhas and not parcial:
+                if len(falhas) == 1:
+                    detalhe = falhas[0]['erro']
+                else:
+                    detalhe = f"{len(falhas)} itens com erro: " + "; ".join(
+                        f"produto {r['produto_id']}: {r['erro']}" for r in falhas
+                    )
+                stock_operations_logger.warning(
+                    f"[postStockBatch] REJECTED - {len(falhas)}/{len(itens)} itens inválidos, usuario_id={usuario_id}"
+                )
+                raise HTTPException(status_code=falhas[0]['status_code'], detail=detalhe)
+
+            for produto_id in {movimentacao.produto_id for _, movimentacao in movimentacoes}:
+                produtos[produto_id].quantidade_em_estoque = estoque[produto_id]
+            db.add_all([movimentacao for _, movimentacao in movimentacoes])
+            db.flush()
+            for resultado, movimentacao in movimentacoes:
+                resultado['movimentacao_id'] = movimentacao.id
+
+            if commit:
+                db.commit()
+
+            stock_operations_logger.info(
+                f"[postStockBatch] SUCCESS - {len(movimentacoes)} movimentações, {len(produtos)} produtos, "
+                f"{len(falhas)} itens rejeitados, usuario_id={usuario_id}, empresa_id={empresa_id}"
+            )
+            return resultados
+
+        except HTTPException:
+            # Com commit=False a transação é do chamador: ele decide se desfaz
+            if commit:
+                db.rollback()
+            raise
+        except SQLAlchemyError as e:
+            if commit:
+                db.rollback()
+            stock_operations_logger.error(
+                f"[postStockBatch] DATABASE_ERROR - usuario_id={usuario_id}, error={str(e)}"
+            )
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Erro ao atualizar estoque: {str(e)}"
+            )
+
     @staticmethod
     def bulk_update_stock(
         db: Session,
@@ -122,35 +342,102 @@ class StockService:
         usuario_id: int,
         empresa_id: int
     ) -> List[models.Produto]:
-        produtos_atualizados = []
-        
+        """Aplica vários lançamentos de estoque de forma atômica (tudo ou nada)."""
         try:
-            for update in updates:
-                produto = StockService.update_stock_transactionally(
-                    db=db,
-                    produto_id=update['produto_id'],
-                    quantidade=update['quantidade'],
-                    tipo_movimentacao=update['tipo_movimentacao'],
-                    usuario_id=usuario_id,
-                    empresa_id=empresa_id,
-                    origem=update.get('origem'),
-                    observacao=update.get('observacao')
-                )
-                produtos_atualizados.append(produto)
-            
-            stock_operations_logger.info(
-                f"[bulkUpdateStock] SUCCESS - updated {len(produtos_atualizados)} products, usuario_id={usuario_id}"
+            resultados = StockService.post_stock_batch(
+                db=db,
+                itens=updates,
+                usuario_id=usuario_id,
+                empresa_id=empresa_id
             )
-            
-            return produtos_atualizados
-            
         except Exception as e:
-            db.rollback()
             stock_operations_logger.error(
                 f"[bulkUpdateStock] FAILED - usuario_id={usuario_id}, error={str(e)}"
             )
             raise
+
+        stock_operations_logger.info(
+            f"[bulkUpdateStock] SUCCESS - updated {len(resultados)} products, usuario_id={usuario_id}"
+        )
+        return [resultado['produto'] for resultado in resultados]
     
+    @staticmethod
+    def preencher_nota_fiscal_movimentacoes(db: Session, tamanho_lote: int = 5000) -> int:
+        """
+        Preenche nota_fiscal/chave_acesso das movimentações antigas a partir do
+        texto de observacao, em lotes (um commit por lote). Idempotente: só toca
+        movimentações sem nota_fiscal cuja observação menciona uma NF.
+        Retorna a quantidade de movimentações atualizadas.
+        """
+        sql = text("""
+            UPDATE movimentacoes_estoque
+            SET nota_fiscal = LEFT(substring(observacao from :regex_nf), 50),
+                chave_acesso = COALESCE(chave_acesso, substring(observacao from :regex_chave))
+            WHERE id IN (
+                SELECT id FROM movimentacoes_estoque
+                WHERE nota_fiscal IS NULL
+                  AND observacao ~ :regex_nf
+                  AND substring(observacao from :regex_nf) <> 'N/A'
+                ORDER BY id
+                LIMIT :tamanho_lote
+            )
+        """)
+        parametros = {
+            'regex_nf': _REGEX_NF_OBSERVACAO_SQL,
+            'regex_chave': _REGEX_CHAVE_ACESSO_SQL,
+            'tamanho_lote': tamanho_lote
+        }
+        total = 0
+        try:
+            while True:
+                resultado = db.execute(sql, parametros)
+                db.commit()
+                atualizadas = resultado.rowcount or 0
+                total += atualizadas
+                if atualizadas < tamanho_lote:
+                    break
+        except Exception:
+            db.rollback()
+            raise
+
+        stock_operations_logger.info(f"[backfillNotaFiscal] SUCCESS - {total} movimentações preenchidas")
+        return total
+
+    @staticmethod
+    def preencher_canal_movimentacoes(db: Session, tamanho_lote: int = 5000) -> int:
+        """
+        Preenche o canal das movimentações antigas a partir da observação, em
+        lotes (um commit por lote). Idempotente: só toca movimentações sem canal.
+        Retorna a quantidade de movimentações atualizadas.
+        """
+        expressao_canal, parametros = _sql_canal_por_observacao()
+        sql = text(f"""
+            UPDATE movimentacoes_estoque
+            SET canal = {expressao_canal}
+            WHERE id IN (
+                SELECT id FROM movimentacoes_estoque
+                WHERE canal IS NULL
+                ORDER BY id
+                LIMIT :tamanho_lote
+            )
+        """)
+        parametros['tamanho_lote'] = tamanho_lote
+        total = 0
+        try:
+            while True:
+                resultado = db.execute(sql, parametros)
+                db.commit()
+                atualizadas = resultado.rowcount or 0
+                total += atualizadas
+                if atualizadas < tamanho_lote:
+                    break
+        except Exception:
+            db.rollback()
+            raise
+
+        stock_operations_logger.info(f"[backfillCanal] SUCCESS - {total} movimentações classificadas")
+        return total
+
     @staticmethod
     def get_stock_history(
         db: Session,
@@ -298,6 +585,10 @@ class StockService:
             movimentacao.data_aprovacao = datetime.utcnow()
             movimentacao.quantidade_depois = quantidade_depois
             
+            # Movimentação pendente já somada ao cubo mensal (fora das vendas) passa a contar
+            db.flush()
+            VendasMensaisService(db).recalcular_movimentacoes(empresa_id, [movimentacao])
+            
             db.commit()
             db.refresh(produto)
             db.refresh(movimentacao)
@@ -483,6 +774,15 @@ class StockService:
             }
             movimentacao.dados_depois_edicao = dados_depois
             
+            # Enquanto pendente a movimentação não contava no cubo mensal; agora conta com os dados editados
+            db.flush()
+            VendasMensaisService(db).recalcular_movimentacoes(empresa_id, [movimentacao])
+            # O snapshot de demanda já somou a movimentação com os dados de antes da edição
+            DemandaSnapshotService(db).recalcular_movimentacoes([
+                (dados_antes['produto_id'], movimentacao.data_movimentacao),
+                (movimentacao.produto_id, movimentacao.data_movimentacao)
+            ])
+            
             db.commit()
             db.refresh(produto)
             db.refresh(movimentacao)
@@ -584,6 +884,13 @@ class StockService:
             }
             movimentacao.dados_depois_edicao = dados_depois
             
+            # O snapshot de demanda já somou a movimentação com os dados de antes da edição
+            db.flush()
+            DemandaSnapshotService(db).recalcular_movimentacoes([
+                (dados_antes['produto_id'], movimentacao.data_movimentacao),
+                (movimentacao.produto_id, movimentacao.data_movimentacao)
+            ])
+            
             db.commit()
             db.refresh(movimentacao)
             
@@ -0,0 +1,454 @@
+"""
+Cubo mensal de vendas (vendas_mensais): empresa × mês × produto × vendedor × cliente.
+
+Cada fonte é somada a partir da sua posição em vendas_mensais_controle, com a
+janela de segurança de PosicaoIncremental para commits fora de ordem:
+- MOVIMENTACAO: saídas confirmadas dos canais de vendas em movimentacoes_estoque
+  (tendências e comparativo de vendedores de /produtos-mais-vendidos);
+- VENDAS_UNIFICADAS: vendas a clientes (NF-e + orçamentos sem NF) do read model
+  vendas_unificadas (/clientes/resultados-mensais e /clientes/todos/visao-geral).
+
+As confirmações de NF e de orçamento somam as linhas novas logo após o commit
+(`atualizar_apos_lancamento`); `manage.py refresh-sales-cube` e
+POST /admin/vendas-mensais/atualizar fazem o mesmo para os demais lançamentos.
+As leituras usam o cubo nos meses inteiros do período e completam com consulta
+direta nos meses parciais e nas linhas ainda não somadas, como o snapshot de demanda.
+A primeira execução e a reconstrução (--rebuild) travam as tabelas de origem
+contra novos lançamentos até o commit.
+
+Quando uma linha já somada passa a entrar (ou deixa de entrar) nas vendas —
+movimentação pendente confirmada, orçamento que recebe NF — as células do mês
+e produto afetados são recalculadas na mesma transação (`recalcular_*`).
+Outras edições retroativas exigem a reconstrução completa (--rebuild).
+"""
+
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import Integer, cast, delete, extract, func, literal, literal_column, or_, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from ..core.constants import CANAIS_ANALISE_VENDAS, ORIGENS_AUTOMATICAS
+from ..db import models
+from ..db.schema_capabilities import schema_capabilities
+from .posicao_incremental import PosicaoIncremental, consumidor_vendas_mensais, travar_tabelas
+
+logger = logging.getLogger(__name__)
+
+CONTROLE_ID = 1
+
+FONTE_MOVIMENTACAO = 'MOVIMENTACAO'
+FONTE_VENDAS_UNIFICADAS = 'VENDAS_UNIFICADAS'
+
+# Coluna de vendas_mensais_controle com a posição de cada fonte
+COLUNA_CONTROLE = {
+    FONTE_MOVIMENTACAO: 'ultima_movimentacao_id',
+    FONTE_VENDAS_UNIFICADAS: 'ultima_venda_unificada_id',
+}
+
+DIMENSOES = ['empresa_id', 'ano', 'mes', 'fonte', 'produto_id', 'vendedor_id', 'cliente_id']
+COLUNAS_CUBO = DIMENSOES + ['quantidade', 'valor', 'numero_registros', 'dias_com_venda', 'ultima_venda']
+
+
+class _Fonte:
+    """Tabela de origem de uma fonte do cubo: colunas de id, data e empresa e o SELECT agregado."""
+
+    def __init__(self, nome: str):
+        self.nome = nome
+        if nome == FONTE_MOVIMENTACAO:
+            mov = models.MovimentacaoEstoque
+            self.id_col = mov.id
+            self.data_col = mov.data_movimentacao
+            self.produto_col = mov.produto_id
+            self.empresa_col = models.Produto.empresa_id
+            self.vendedor_col = mov.usuario_id
+            self.cliente_col = literal(0)
+            self.quantidade_col = mov.quantidade
+            self.valor_col = literal(0.0)
+            self.agrupar_por = [mov.produto_id, mov.usuario_id]
+        elif nome == FONTE_VENDAS_UNIFICADAS:
+            venda = models.VendaUnificada
+            self.id_col = venda.id
+            self.data_col = venda.data_venda
+            self.produto_col = venda.produto_id
+            self.empresa_col = venda.empresa_id
+            self.vendedor_col = func.coalesce(venda.vendedor_id, literal_column('0'))
+            self.cliente_col = venda.cliente_id
+            self.quantidade_col = venda.quantidade
+            self.valor_col = venda.valor_total
+            self.agrupar_por = [venda.produto_id, self.vendedor_col, venda.cliente_id]
+        else:
+            raise ValueError(f"Fonte desconhecida: {nome}")
+
+    def posicao(self, db: Session) -> PosicaoIncremental:
+        return PosicaoIncremental(db, consumidor_vendas_mensais(self.nome), self.id_col)
+
+    def _com_filtros(self, consulta):
+        """Junções e filtros que definem o que é venda em cada fonte."""
+        if self.nome == FONTE_MOVIMENTACAO:
+            mov = models.MovimentacaoEstoque
+            return consulta.join(
+                models.Produto, models.Produto.id == mov.produto_id
+            ).where(
+                mov.tipo_movimentacao == 'SAIDA',
+                or_(mov.origem.in_(ORIGENS_AUTOMATICAS), mov.origem.is_(None)),
+                or_(mov.status == 'CONFIRMADO', mov.status.is_(None)),
+                mov.canal.in_(CANAIS_ANALISE_VENDAS),
+            )
+        # vendas_unificadas já contém apenas vendas (NF-e e orçamentos sem NF)
+        return consulta
+
+    def agregados(self):
+        """SELECT com as colunas de vendas_mensais agrupadas pelas dimensões do cubo."""
+        ano = extract('year', self.data_col)
+        mes = extract('month', self.data_col)
+        bit_dia = literal(1).op('<<')(cast(extract('day', self.data_col), Integer) - 1)
+        consulta = select(
+            self.empresa_col.label('empresa_id'),
+            cast(ano, Integer).label('ano'),
+            cast(mes, Integer).label('mes'),
+            literal(self.nome).label('fonte'),
+            self.produto_col.label('produto_id'),
+            self.vendedor_col.label('vendedor_id'),
+            self.cliente_col.label('cliente_id'),
+            func.sum(self.quantidade_col).label('quantidade'),
+            func.sum(self.valor_col).label('valor'),
+            func.count().label('numero_registros'),
+            func.bit_or(bit_dia).label('dias_com_venda'),
+            func.max(self.data_col).label('ultima_venda'),
+        ).where(self.data_col.isnot(None))
+        # Dimensões constantes (literal 0) ficam fora do GROUP BY
+        return self._com_filtros(consulta).group_by(self.empresa_col, ano, mes, *self.agrupar_por)
+
+
+def _inicio_mes(ano: int, mes: int) -> datetime:
+    return datetime(ano, mes, 1)
+
+
+def _proximo_mes(ano: int, mes: int) -> Tuple[int, int]:
+    return (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+
+
+def _indice_mes(ano: int, mes: int) -> int:
+    return ano * 12 + mes
+
+
+def _para_datetime(valor) -> Optional[datetime]:
+    # MAX sobre timestamp devolve string no SQLite
+    if isinstance(valor, str):
+        return datetime.fromisoformat(valor)
+    return valor
+
+
+def _nova_celula() -> Dict[str, Any]:
+    return {
+        'quantidade': 0.0,
+        'valor': 0.0,
+        'numero_registros': 0,
+        'dias_com_venda': 0,
+        'ultima_venda': None,
+    }
+
+
+def _somar_celula(destino: Dict[str, Any], linha) -> None:
+    destino['quantidade'] += float(linha.quantidade or 0)
+    destino['valor'] += float(linha.valor or 0)
+    destino['numero_registros'] += int(linha.numero_registros or 0)
+    destino['dias_com_venda'] |= int(linha.dias_com_venda or 0)
+    ultima = _para_datetime(linha.ultima_venda)
+    if ultima is not None and (destino['ultima_venda'] is None or ultima > destino['ultima_venda']):
+        destino['ultima_venda'] = ultima
+
+
+def contar_dias(dias_com_venda: int) -> int:
+    """Número de dias distintos com venda a partir da máscara de bits do cubo."""
+    return bin(dias_com_venda).count('1')
+
+
+class VendasMensaisService:
+    """Manutenção e leitura do cubo mensal de vendas."""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    # ============= JOB =============
+
+    def _cubo_disponivel(self) -> bool:
+        return schema_capabilities.has_table('vendas_mensais')
+
+    def posicoes(self) -> Dict[str, int]:
+        """Posição de cada fonte: linhas com id <= posição já estão no cubo (0 se nunca executado)."""
+        if not self._cubo_disponivel():
+            return {fonte: 0 for fonte in COLUNA_CONTROLE}
+        controle = self.db.get(models.VendasMensaisControle, CONTROLE_ID)
+        return {
+            fonte: (getattr(controle, coluna) or 0) if controle else 0
+            for fonte, coluna in COLUNA_CONTROLE.items()
+        }
+
+    def _travar_controle(self, bloquear: bool = True) -> Optional[models.VendasMensaisControle]:
+        """
+        Trava (FOR UPDATE) a linha de controle, criando-a se necessário.
+        Com bloquear=False devolve None se outra transação já estiver com ela.
+        """
+        controle_tabela = models.VendasMensaisControle.__table__
+        self.db.execute(
+            pg_insert(controle_tabela)
+            .values(id=CONTROLE_ID)
+            .on_conflict_do_nothing(index_elements=[controle_tabela.c.id])
+        )
+        return self.db.query(models.VendasMensaisControle).filter(
+            models.VendasMensaisControle.id == CONTROLE_ID
+        ).with_for_update(skip_locked=not bloquear).one_or_none()
+
+    def _somar_linhas(self, fonte: _Fonte, filtro) -> int:
+        tabela = models.VendaMensal.__table__
+        agregados = fonte.agregados().where(filtro)
+        stmt = pg_insert(tabela).from_select(COLUNAS_CUBO, agregados)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[tabela.c[coluna] for coluna in DIMENSOES],
+            set_={
+                'quantidade': tabela.c.quantidade + stmt.excluded.quantidade,
+                'valor': tabela.c.valor + stmt.excluded.valor,
+                'numero_registros': tabela.c.numero_registros + stmt.excluded.numero_registros,
+                'dias_com_venda': tabela.c.dias_com_venda.op('|')(stmt.excluded.dias_com_venda),
+                'ultima_venda': func.greatest(tabela.c.ultima_venda, stmt.excluded.ultima_venda),
+            }
+        )
+        return self.db.execute(stmt).rowcount
+
+    def atualizar_incremental(
+        self,
+        tamanho_lote: Optional[int] = None,
+        bloquear: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Soma ao cubo as linhas visíveis de cada fonte ainda não somadas (até
+        tamanho_lote por fonte, as de menor id primeiro) e avança as posições.
+        Na primeira execução faz a reconstrução completa (com bloquear=False,
+        apenas desiste).
+
+        A linha de controle é travada (FOR UPDATE) para que duas execuções
+        simultâneas não somem as mesmas linhas duas vezes; com bloquear=False a
+        execução é pulada se outra já estiver em andamento.
+        """
+        try:
+            controle = self._travar_controle(bloquear)
+            if controle is None:
+                self.db.rollback()
+                return {'processadas_ate': {}, 'linhas_afetadas': 0, 'ignorado': True}
+
+            fontes = [(_Fonte(nome), coluna) for nome, coluna in COLUNA_CONTROLE.items()]
+            if not all(fonte.posicao(self.db).inicializada(getattr(controle, coluna) or 0) for fonte, coluna in fontes):
+                self.db.rollback()
+                if not bloquear:
+                    return {'processadas_ate': {}, 'linhas_afetadas': 0, 'ignorado': True}
+                return self.reconstruir()
+
+            processadas_ate: Dict[str, int] = {}
+            linhas_afetadas = 0
+            for fonte, coluna in fontes:
+                posicao = fonte.posicao(self.db)
+                inicio = getattr(controle, coluna) or 0
+
+                marca = posicao.registrar_pendentes(inicio, tamanho_lote)
+                if marca is not None:
+                    linhas_afetadas += self._somar_linhas(fonte, posicao.filtro_execucao(marca))
+                limite = posicao.avancar(inicio)
+                setattr(controle, coluna, limite)
+                processadas_ate[fonte.nome] = limite
+
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+        logger.info(f"✓ Cubo mensal de vendas atualizado até {processadas_ate} ({linhas_afetadas} linhas)")
+        return {'processadas_ate': processadas_ate, 'linhas_afetadas': linhas_afetadas}
+
+    def atualizar_apos_lancamento(self) -> None:
+        """
+        Soma ao cubo o que acabou de ser lançado, sem esperar por outra execução
+        em andamento. Erros só são registrados: as leituras completam com as
+        linhas não somadas e o job recupera na próxima execução.
+        """
+        try:
+            self.atualizar_incremental(bloquear=False)
+        except Exception as e:
+            logger.warning(f"⚠️ Cubo mensal de vendas não atualizado após o lançamento: {e}")
+
+    def reconstruir(self) -> Dict[str, Any]:
+        """
+        Recria todo o cubo a partir das tabelas de origem. As origens ficam
+        travadas contra novos lançamentos até o commit, para que o maior id lido
+        de cada uma cubra todas as linhas com id menor.
+        """
+        try:
+            travar_tabelas(
+                self.db, models.MovimentacaoEstoque.__tablename__, models.VendaUnificada.__tablename__
+            )
+            controle = self._travar_controle()
+            self.db.execute(delete(models.VendaMensal))
+            processadas_ate: Dict[str, int] = {}
+            linhas_afetadas = 0
+            for nome, coluna in COLUNA_CONTROLE.items():
+                fonte = _Fonte(nome)
+                limite = self.db.execute(select(func.max(fonte.id_col))).scalar() or 0
+                resultado = self.db.execute(
+                    models.VendaMensal.__table__.insert().from_select(
+                        COLUNAS_CUBO, fonte.agregados().where(fonte.id_col <= limite)
+                    )
+                )
+                linhas_afetadas += resultado.rowcount
+                fonte.posicao(self.db).limpar()
+                setattr(controle, coluna, limite)
+                processadas_ate[nome] = limite
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+        logger.info(f"✓ Cubo mensal de vendas reconstruído até {processadas_ate} ({linhas_afetadas} linhas)")
+        return {'processadas_ate': processadas_ate, 'linhas_afetadas': linhas_afetadas}
+
+    # ============= RECÁLCULO (na transação do lançamento) =============
+
+    def _recalcular_celulas(
+        self,
+        nome_fonte: str,
+        empresa_id: int,
+        celulas: Iterable[Tuple[int, int, int]]
+    ) -> None:
+        """
+        Refaz as linhas do cubo de (ano, mes, produto_id) a partir da origem,
+        considerando apenas as linhas já somadas. Não faz commit: roda na transação
+        de quem alterou as linhas de origem (que devem estar com flush).
+        """
+        produtos_por_mes: Dict[Tuple[int, int], Set[int]] = defaultdict(set)
+        for ano, mes, produto_id in celulas:
+            produtos_por_mes[(int(ano), int(mes))].add(produto_id)
+        if not produtos_por_mes or not self._cubo_disponivel():
+            return
+
+        controle = self._travar_controle()
+        fonte = _Fonte(nome_fonte)
+        somadas = fonte.posicao(self.db).filtro_somados(getattr(controle, COLUNA_CONTROLE[nome_fonte]) or 0)
+        cubo = models.VendaMensal
+        for (ano, mes), produto_ids in produtos_por_mes.items():
+            self.db.execute(delete(cubo).where(
+                cubo.empresa_id == empresa_id,
+                cubo.fonte == nome_fonte,
+                cubo.ano == ano,
+                cubo.mes == mes,
+                cubo.produto_id.in_(produto_ids)
+            ))
+            agregados = fonte.agregados().where(
+                somadas,
+                fonte.empresa_col == empresa_id,
+                fonte.produto_col.in_(produto_ids),
+                fonte.data_col >= _inicio_mes(ano, mes),
+                fonte.data_col < _inicio_mes(*_proximo_mes(ano, mes))
+            )
+            self.db.execute(cubo.__table__.insert().from_select(COLUNAS_CUBO, agregados))
+
+    def recalcular_movimentacoes(
+        self,
+        empresa_id: int,
+        movimentacoes: Sequence[models.MovimentacaoEstoque]
+    ) -> None:
+        """Recalcula as células das movimentações cujo status/dados mudaram depois de somadas."""
+        celulas = [
+            (mov.data_movimentacao.year, mov.data_movimentacao.month, mov.produto_id)
+            for mov in movimentacoes
+            if mov.data_movimentacao is not None
+        ]
+        self._recalcular_celulas(FONTE_MOVIMENTACAO, empresa_id, celulas)
+
+    def recalcular_vendas_unificadas(self, empresa_id: int, celulas: Iterable[Tuple[int, int, int]]) -> None:
+        """Recalcula as células (ano, mes, produto_id) após remoção de linhas de vendas_unificadas."""
+        self._recalcular_celulas(FONTE_VENDAS_UNIFICADAS, empresa_id, celulas)
+
+    # ============= LEITURA =============
+
+    def celulas(
+        self,
+        empresa_id: int,
+        fontes: Sequence[str],
+        inicio: datetime,
+        fim: Optional[datetime] = None,
+        produto_id: Optional[int] = None
+    ) -> Dict[Tuple, Dict[str, Any]]:
+        """
+        Totais por (fonte, ano, mes, produto_id, vendedor_id, cliente_id) das vendas
+        com data em [inicio, fim) — fim=None = sem limite superior.
+
+        Meses inteiros no período vêm do cubo (mais as linhas ainda não somadas);
+        o mês parcial do início e o do fim são agregados direto da origem.
+        """
+        resultado: Dict[Tuple, Dict[str, Any]] = defaultdict(_nova_celula)
+
+        def acumular(linhas) -> None:
+            for linha in linhas:
+                chave = (
+                    linha.fonte, int(linha.ano), int(linha.mes),
+                    linha.produto_id, linha.vendedor_id or 0, linha.cliente_id or 0
+                )
+                _somar_celula(resultado[chave], linha)
+
+        # Meses inteiros: [primeiro_mes, ultimo_mes)
+        if inicio == _inicio_mes(inicio.year, inicio.month):
+            primeiro_mes = (inicio.year, inicio.month)
+        else:
+            primeiro_mes = _proximo_mes(inicio.year, inicio.month)
+        ultimo_mes = (fim.year, fim.month) if fim is not None else None
+        inicio_cubo = _inicio_mes(*primeiro_mes)
+        fim_cubo = _inicio_mes(*ultimo_mes) if ultimo_mes else None
+        tem_meses_inteiros = fim_cubo is None or inicio_cubo < fim_cubo
+
+        cubo_disponivel = self._cubo_disponivel()
+        posicoes = self.posicoes()
+        fontes_no_cubo = list(fontes) if tem_meses_inteiros and cubo_disponivel else []
+
+        if fontes_no_cubo:
+            cubo = models.VendaMensal
+            indice_mes = cubo.ano * 12 + cubo.mes
+            consulta = self.db.query(cubo).filter(
+                cubo.empresa_id == empresa_id,
+                cubo.fonte.in_(fontes_no_cubo),
+                cubo.ano >= primeiro_mes[0],
+                indice_mes >= _indice_mes(*primeiro_mes)
+            )
+            if ultimo_mes:
+                consulta = consulta.filter(cubo.ano <= ultimo_mes[0], indice_mes < _indice_mes(*ultimo_mes))
+            if produto_id is not None:
+                consulta = consulta.filter(cubo.produto_id == produto_id)
+            acumular(consulta.all())
+
+        for nome in fontes:
+            fonte = _Fonte(nome)
+            filtros_base = [fonte.empresa_col == empresa_id]
+            if produto_id is not None:
+                filtros_base.append(fonte.produto_col == produto_id)
+
+            intervalos: List[Tuple[datetime, Optional[datetime], List]] = []
+            if not tem_meses_inteiros:
+                intervalos.append((inicio, fim, []))
+            else:
+                if inicio < inicio_cubo:
+                    intervalos.append((inicio, inicio_cubo, []))
+                if fim_cubo is not None and fim_cubo < fim:
+                    intervalos.append((fim_cubo, fim, []))
+                # Linhas dos meses inteiros ainda não somadas ao cubo
+                nao_somadas = fonte.posicao(self.db).filtro_nao_somados(posicoes[nome]) if fontes_no_cubo else []
+                intervalos.append((inicio_cubo, fim_cubo, nao_somadas))
+
+            for de, ate, filtros in intervalos:
+                consulta = fonte.agregados().where(*filtros_base, *filtros, fonte.data_col >= de)
+                if ate is not None:
+                    consulta = consulta.where(fonte.data_col < ate)
+                acumular(self.db.execute(consulta).all())
+
+        return dict(resultado)
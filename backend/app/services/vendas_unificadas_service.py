@@ -0,0 +1,140 @@
+"""
+Read model das vendas a clientes (vendas_unificadas).
+
+Uma linha por item vendido, de duas origens:
+- NF: historico_preco_produto com nota fiscal e cliente;
+- ORCAMENTO: historico_vendas_cliente de orçamento finalizado que ainda não tem NF
+  vinculada (quando tem, a mesma venda já está na NF).
+
+As linhas são gravadas na transação do lançamento — confirmação de NF
+(NFProcessorService.confirmar_processamento e o processamento de PDF em
+/movimentacoes) e finalização de orçamento (crud/orcamento.confirmar_orcamento).
+Quando um orçamento recebe NF, suas linhas ORCAMENTO são removidas.
+`manage.py rebuild-unified-sales` recria a tabela a partir das origens.
+"""
+
+import logging
+from typing import Iterable
+
+from sqlalchemy import and_, delete, literal, null, or_, select
+from sqlalchemy.orm import Session
+
+from ..db import models
+from .vendas_mensais_service import VendasMensaisService
+
+logger = logging.getLogger(__name__)
+
+ORIGEM_NF = 'NF'
+ORIGEM_ORCAMENTO = 'ORCAMENTO'
+
+COLUNAS = [
+    'empresa_id', 'cliente_id', 'produto_id', 'vendedor_id', 'origem', 'nota_fiscal', 'orcamento_id',
+    'historico_preco_id', 'historico_venda_id', 'quantidade', 'preco_unitario', 'valor_total', 'data_venda'
+]
+
+
+def _selecao_nf():
+    """Linhas de historico_preco_produto que são vendas com NF-e a cliente."""
+    hp = models.HistoricoPrecoProduto
+    return select(
+        hp.empresa_id, hp.cliente_id, hp.produto_id, null(), literal(ORIGEM_NF), hp.nota_fiscal, null(),
+        hp.id, null(), hp.quantidade, hp.preco_unitario, hp.valor_total, hp.data_venda
+    ).where(
+        hp.nota_fiscal.isnot(None),
+        hp.cliente_id.isnot(None),
+        hp.data_venda.isnot(None)
+    )
+
+
+def _selecao_orcamento():
+    """Linhas de historico_vendas_cliente de orçamentos sem NF vinculada."""
+    hvc = models.HistoricoVendaCliente
+    orcamento = models.Orcamento
+    return select(
+        hvc.empresa_id, hvc.cliente_id, hvc.produto_id, hvc.vendedor_id, literal(ORIGEM_ORCAMENTO), null(),
+        hvc.orcamento_id, null(), hvc.id, hvc.quantidade_vendida, hvc.preco_unitario_vendido,
+        hvc.valor_total, hvc.data_venda
+    ).join(
+        orcamento, orcamento.id == hvc.orcamento_id
+    ).where(
+        or_(orcamento.numero_nf.is_(None), orcamento.numero_nf == '')
+    )
+
+
+class VendasUnificadasService:
+    """Manutenção do read model vendas_unificadas."""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def registrar_historicos_preco(self, historicos: Iterable[models.HistoricoPrecoProduto]) -> None:
+        """
+        Grava as vendas dos históricos de preço recém-criados (apenas os com NF e cliente).
+        Não faz commit: roda na transação do lançamento.
+        """
+        historicos = list(historicos)
+        if not historicos:
+            return
+        self.db.flush()
+        hp = models.HistoricoPrecoProduto
+        self.db.execute(
+            models.VendaUnificada.__table__.insert().from_select(
+                COLUNAS, _selecao_nf().where(hp.id.in_([h.id for h in historicos]))
+            )
+        )
+
+    def registrar_historicos_venda(self, historicos: Iterable[models.HistoricoVendaCliente]) -> None:
+        """
+        Grava as vendas dos históricos de orçamento recém-criados (se o orçamento não tem NF).
+        Não faz commit: roda na transação do lançamento.
+        """
+        historicos = list(historicos)
+        if not historicos:
+            return
+        self.db.flush()
+        hvc = models.HistoricoVendaCliente
+        self.db.execute(
+            models.VendaUnificada.__table__.insert().from_select(
+                COLUNAS, _selecao_orcamento().where(hvc.id.in_([h.id for h in historicos]))
+            )
+        )
+
+    def remover_vendas_orcamento(self, empresa_id: int, orcamento_id: int) -> None:
+        """
+        Remove as vendas ORCAMENTO de um orçamento que recebeu NF (a venda passa a
+        contar pela NF) e recalcula as células correspondentes do cubo mensal.
+        Não faz commit.
+        """
+        venda = models.VendaUnificada
+        filtros = and_(
+            venda.empresa_id == empresa_id,
+            venda.orcamento_id == orcamento_id,
+            venda.origem == ORIGEM_ORCAMENTO
+        )
+        celulas = [
+            (data_venda.year, data_venda.month, produto_id)
+            for data_venda, produto_id in self.db.query(venda.data_venda, venda.produto_id).filter(filtros).all()
+        ]
+        if not celulas:
+            return
+        self.db.execute(delete(venda).where(filtros))
+        VendasMensaisService(self.db).recalcular_vendas_unificadas(empresa_id, celulas)
+
+    def reconstruir(self) -> int:
+        """
+        Recria vendas_unificadas a partir de historico_preco_produto e
+        historico_vendas_cliente. Os ids mudam: o cubo mensal é reconstruído junto.
+        """
+        tabela = models.VendaUnificada.__table__
+        try:
+            self.db.execute(delete(models.VendaUnificada))
+            total = self.db.execute(tabela.insert().from_select(COLUNAS, _selecao_nf())).rowcount
+            total += self.db.execute(tabela.insert().from_select(COLUNAS, _selecao_orcamento())).rowcount
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+        logger.info(f"✓ Vendas unificadas reconstruídas ({total} linhas)")
+        VendasMensaisService(self.db).reconstruir()
+        return total
@@ -0,0 +1,222 @@
+"""
+Gramática das linhas de produto das NFs em PDF e dos relatórios de vendas.
+
+Os padrões ficam compilados uma única vez no import e cada layout tem um
+pré-filtro barato (caractere inicial, substring, conjunto de palavras) que
+descarta as linhas que não podem ser produto antes de chegar à regex — a maior
+parte do texto de uma DANFE é cabeçalho, impostos e dados adicionais.
+
+Layouts:
+- DANFE de saída (HIGIPLAS/HIGITEC): ITEM CÓDIGO DESCRIÇÃO NCM CST CFOP UN QTD
+  VL_UNIT DESCONTO VL_TOTAL ...
+- Entrada "CIRCUS": DESCRIÇÃO CÓDIGO(3) NCM CST CFOP UN QTD VL_UNIT VL_TOTAL ...
+- Entrada GIRASSOL compacto: código colado na descrição (1005805AGUASSANI ...)
+- Entrada genérica: padrões flexíveis (código de 4+ dígitos e valores)
+- Relatório "Resumo de Vendas por Item/Cliente" (PDFSalesProcessor)
+"""
+import re
+from typing import Any, Dict, Iterator, List, Match, Optional, Tuple
+
+# Número no formato PT-BR: 3.278,10 / 19,1400 / 12
+_NUMERO_PTBR = r'\d{1,3}(?:\.\d{3})+(?:,\d+)?|\d+(?:,\d+)?'
+
+
+def ptbr_para_float(valor: str) -> float:
+    """'3.278,10' -> 3278.1"""
+    return float(valor.replace('.', '').replace(',', '.'))
+
+
+# ---------------------------------------------------------------------------
+# DANFE de saída
+# ---------------------------------------------------------------------------
+
+MARCADORES_INICIO_PRODUTOS_DANFE = ('Dados dos Produtos', 'DADOS DOS PRODUTOS')
+MARCADORES_FIM_PRODUTOS_DANFE = ('Dados Adicionais', 'DADOS ADICIONAIS')
+
+PADRAO_ITEM_DANFE = re.compile(
+    r'^(\d+)\s+'                          # Item
+    r'(\d+)\s+'                           # Código
+    r'(.+?)\s+'                           # Descrição
+    r'(\d{8})\s+'                         # NCM
+    r'\d{4}\s+'                           # CST
+    r'\d{4}\s+'                           # CFOP
+    r'(\w+)\s+'                           # Unidade
+    rf'({_NUMERO_PTBR})\s+'               # Quantidade
+    rf'({_NUMERO_PTBR})\s+'               # Valor unitário
+    rf'(?:{_NUMERO_PTBR})\s+'             # Desconto
+    rf'({_NUMERO_PTBR})(?!\d)'            # Valor total
+)
+
+
+def ler_item_danfe(linha: str) -> Optional[Dict[str, Any]]:
+    """Produto de uma linha da tabela 'Dados dos Produtos' da DANFE, ou None."""
+    linha = linha.strip()
+    # Pré-filtro: toda linha de item começa pelo número do item
+    if not linha[:1].isdigit():
+        return None
+    match = PADRAO_ITEM_DANFE.match(linha)
+    if not match:
+        return None
+    try:
+        return {
+            'item': int(match.group(1)),
+            'codigo': match.group(2),
+            'descricao': match.group(3).strip(),
+            'ncm': match.group(4),
+            'unidade': match.group(5),
+            'quantidade': ptbr_para_float(match.group(6)),
+            'valor_unitario': ptbr_para_float(match.group(7)),
+            'valor_total': ptbr_para_float(match.group(8))
+        }
+    except ValueError:
+        return None
+
+
+def linhas_secao_produtos_danfe(texto: str) -> Iterator[str]:
+    """
+    Linhas entre 'Dados dos Produtos' e 'Dados Adicionais'. Só o trecho a
+    partir do início da seção é quebrado em linhas.
+    """
+    posicoes = [posicao for posicao in (texto.find(marcador) for marcador in MARCADORES_INICIO_PRODUTOS_DANFE) if posicao >= 0]
+    if not posicoes:
+        return
+    for linha in texto[min(posicoes):].split('\n')[1:]:
+        if any(marcador in linha for marcador in MARCADORES_INICIO_PRODUTOS_DANFE):
+            continue
+        if any(marcador in linha for marcador in MARCADORES_FIM_PRODUTOS_DANFE):
+            return
+        yield linha
+
+
+def extrair_itens_danfe(texto: str) -> List[Dict[str, Any]]:
+    """Produtos da seção 'Dados dos Produtos' de uma DANFE de saída."""
+    produtos = []
+    for linha in linhas_secao_produtos_danfe(texto):
+        produto = ler_item_danfe(linha)
+        if produto is not None:
+            produtos.append(produto)
+    return produtos
+
+
+# ---------------------------------------------------------------------------
+# Entrada: layout CIRCUS (descrição antes do código de 3 dígitos)
+# ---------------------------------------------------------------------------
+
+PADRAO_ITEM_CIRCUS = re.compile(
+    r'^(.+?)\s+'           # Descrição do produto
+    r'(\d{3})\s+'          # Código do produto (3 dígitos)
+    r'(\d{8})\s+'          # NCM (8 dígitos)
+    r'(\d{4})\s+'          # CST (4 dígitos)
+    r'(\d{4})\s+'          # CFOP (4 dígitos)
+    r'(UN)\s+'             # Unidade
+    r'([\d,]+)\s+'         # Quantidade
+    r'([\d,]+)\s+'         # Valor unitário
+    r'([\d,]+)\s+'         # Valor total
+    r'.*$'                 # Resto da linha (impostos, etc.)
+)
+
+
+def ler_item_circus(linha: str) -> Optional[Match[str]]:
+    """Match (descrição, código, NCM, CST, CFOP, unidade, qtd, unitário, total) ou None."""
+    linha = linha.strip()
+    # Pré-filtro: a unidade do layout é sempre UN
+    if 'UN' not in linha:
+        return None
+    return PADRAO_ITEM_CIRCUS.match(linha)
+
+
+# ---------------------------------------------------------------------------
+# Entrada: GIRASSOL compacto e padrões genéricos
+# ---------------------------------------------------------------------------
+
+# Exemplo de linha real:
+# 1005805AGUASSANI BB 5L 28289011 000 6101 UN 112       18,30      2.049,60      2.049,60    143,47 7
+PADRAO_ITEM_GIRASSOL_COMPACTO = re.compile(
+    r'^(\d{5,})\s*'                               # Código do produto (5+ dígitos)
+    r'([A-Z][A-Z0-9\s\./()\-]{3,}?)\s+'          # Descrição (maiúsculas, números e símbolos usuais)
+    r'(\d{8})\s+'                                  # NCM (8 dígitos)
+    r'(\d{3})\s+'                                  # CST (3 dígitos)
+    r'(\d{4})\s+'                                  # CFOP (4 dígitos)
+    r'([A-Z]{2,})\s+'                               # Unidade (UN, CX, etc.)
+    r'([\d\.]+,[\d]{0,3}|\d+)\s+'               # Quantidade (com ou sem decimais)
+    r'([\d\.]+,[\d]{2})\s+'                       # Valor unitário
+    r'([\d\.]+,[\d]{2})'                           # Valor total
+)
+
+# Padrões mais flexíveis para diferentes formatos de PDF (tentados em ordem)
+PADROES_ITEM_GENERICO = [
+    # Padrão 1: Código de 4+ dígitos + descrição + 3 valores numéricos
+    re.compile(r'^(\d{4,})\s+([A-Za-z][A-Za-z\s/\-()0-9.,]+?)\s+(\d+[,.]?\d*)\s+([\d,]+[,.]\d*)\s+([\d,]+[,.]\d*)'),
+    # Padrão 2: Código + descrição com NCM, CST, CFOP (formato GIRASSOL)
+    re.compile(r'^(\d{4,})\s+([A-Za-z][A-Za-z\s/\-()0-9.,]+?)\s+(\d{8})\s+(\d{3})\s+(\d{4})\s+(\w+)\s+(\d+[,.]?\d*)\s+([\d,]+[,.]\d*)\s+([\d,]+[,.]\d*)'),
+    # Padrão 3: Busca mais flexível por código e valores
+    re.compile(r'(\d{4,})\s+(.+?)\s+(\d+[,.]?\d*)\s+([\d,]+[,.]\d*)\s+([\d,]+[,.]\d*)$'),
+    # Padrão 4: Código seguido de texto e pelo menos 2 valores
+    re.compile(r'(\d{4,})\s+([A-Za-z].+?)\s+(\d+[,.]?\d*)\s+([\d,]+[,.]\d*)'),
+    # Padrão 5: Busca por qualquer linha com código e múltiplos valores
+    re.compile(r'(\d{4,}).*?([A-Za-z][A-Za-z\s/\-()0-9.,]{5,}?).*?(\d+[,.]?\d*).*?([\d,]+[,.]\d*).*?([\d,]+[,.]\d*)'),
+]
+
+# Palavras que indicam que a linha NÃO é um produto (totais, impostos, rodapé)
+PALAVRAS_NAO_PRODUTO = (
+    'TOTAL', 'TOTAIS', 'SUBTOTAL', 'SUBTOTAIS',
+    'ICMS', 'IPI', 'PIS', 'COFINS', 'IMPOSTO', 'IMPOSTOS',
+    'DESCONTO', 'DESCONTOS', 'ACRESCIMO', 'ACRESCIMOS',
+    'FRETE', 'SEGURO', 'OUTRAS DESPESAS',
+    'BASE DE CALCULO', 'VALOR DO ICMS', 'VALOR DO IPI',
+    'DADOS ADICIONAIS', 'INFORMACOES COMPLEMENTARES',
+    'OBSERVACOES', 'OBSERVACAO'
+)
+_PADRAO_NAO_PRODUTO = re.compile('|'.join(re.escape(palavra) for palavra in PALAVRAS_NAO_PRODUTO))
+# Todos os layouts de entrada têm um código de 4+ dígitos
+_PADRAO_CODIGO = re.compile(r'\d{4}')
+
+
+def linha_candidata_entrada(linha_limpa: str) -> bool:
+    """Pré-filtro das linhas de entrada (GIRASSOL/genérico): tamanho, palavras de total/imposto e código."""
+    if len(linha_limpa) < 5:
+        return False
+    if _PADRAO_NAO_PRODUTO.search(linha_limpa.upper()):
+        return False
+    return _PADRAO_CODIGO.search(linha_limpa) is not None
+
+
+def ler_item_girassol_compacto(linha_limpa: str) -> Optional[Match[str]]:
+    """Match do padrão GIRASSOL compacto ou None."""
+    # Pré-filtro: o padrão começa com o código de 5+ dígitos
+    if not linha_limpa[:5].isdigit():
+        return None
+    return PADRAO_ITEM_GIRASSOL_COMPACTO.match(linha_limpa)
+
+
+def iterar_itens_generico(linha_limpa: str) -> Iterator[Tuple[int, Match[str]]]:
+    """(índice do padrão, match) de cada padrão genérico que casa com a linha, em ordem."""
+    for indice, padrao in enumerate(PADROES_ITEM_GENERICO):
+        match = padrao.search(linha_limpa)
+        if match:
+            yield indice, match
+
+
+# ---------------------------------------------------------------------------
+# Relatório "Resumo de Vendas por Item/Cliente"
+# ---------------------------------------------------------------------------
+
+PADRAO_ITEM_RELATORIO = re.compile(r'Item:\s*(\d+)\s*-\s*(.+)')
+_PADRAO_VALOR_RELATORIO = re.compile(r'-?\d+[,.]\d+')
+
+
+def separar_linha_relatorio(partes: List[str]) -> Tuple[List[str], List[float]]:
+    """
+    Divide os tokens de uma linha da tabela (Cód. Cliente Quantidade Custo
+    Vendido Lucro %) em nome do cliente e valores numéricos, lendo da direita
+    para a esquerda. O primeiro token (código do cliente) é ignorado.
+    """
+    fim = len(partes)
+    while fim > 1:
+        parte = partes[fim - 1]
+        # Pré-filtro: todo valor termina em dígito
+        if not parte[-1:].isdigit() or not _PADRAO_VALOR_RELATORIO.fullmatch(parte):
+            break
+        fim -= 1
+    valores = [float(parte.replace(',', '.')) for parte in partes[fim:]]
+    return partes[1:fim], valores
@@ -0,0 +1,290 @@
+"""
+Extrator de XML de NF-e em passagem única (iterparse).
+
+O arquivo é lido em streaming: cabeçalho (ide), emitente, destinatário, cada
+item (det) e totais são extraídos assim que o bloco termina de ser lido e o
+elemento é limpo em seguida. A memória fica limitada ao bloco atual, mesmo em
+NF-e com centenas de itens ou em importações de XML em lote.
+
+As regras de busca são as do extrator anterior (ET.parse + find): vale o
+primeiro elemento com o namespace da NF-e e, se não houver, o primeiro sem
+namespace. O resultado é o mesmo.
+"""
+
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+NFE_NS = 'http://www.portalfiscal.inf.br/nfe'
+_PREFIXO_NS = '{' + NFE_NS + '}'
+
+# Blocos extraídos ao final da leitura do elemento (o 'ide' só dentro de infNFe).
+# O filtro de tags do lxml entrega só esses eventos; o resto do documento não passa pelo Python.
+_BLOCOS = ('infNFe', 'ide', 'emit', 'dest', 'det', 'total')
+_TAGS_BLOCOS = [_PREFIXO_NS + nome for nome in _BLOCOS] + list(_BLOCOS)
+
+
+def _buscar(elemento: etree._Element, nome: str) -> Optional[etree._Element]:
+    """Primeiro descendente `nome` com o namespace da NF-e, senão sem namespace."""
+    encontrado = elemento.find(f'.//{_PREFIXO_NS}{nome}')
+    if encontrado is None:
+        encontrado = elemento.find(f'.//{nome}')
+    return encontrado
+
+
+def _primeiros(elemento: etree._Element, tags: List[str]) -> Dict[str, etree._Element]:
+    """
+    _buscar para vários nomes percorrendo o bloco uma única vez (usado nos itens,
+    onde as buscas separadas dominavam o tempo de leitura).
+    """
+    com_ns: Dict[str, etree._Element] = {}
+    sem_ns: Dict[str, etree._Element] = {}
+    # Filtro de tags aplicado pelo lxml: só os elementos procurados chegam ao Python
+    for descendente in elemento.iterdescendants(tags):
+        tag = descendente.tag
+        if tag.startswith(_PREFIXO_NS):
+            nome, destino = tag[len(_PREFIXO_NS):], com_ns
+        else:
+            nome, destino = tag, sem_ns
+        if nome not in destino:
+            destino[nome] = descendente
+    return {**sem_ns, **com_ns}
+
+
+_CAMPOS_ITEM = ('cProd', 'xProd', 'NCM', 'uCom', 'qCom', 'vUnCom', 'vProd')
+_TAGS_ITEM = [_PREFIXO_NS + nome for nome in _CAMPOS_ITEM] + list(_CAMPOS_ITEM)
+
+
+def _ler_ide(ide: etree._Element) -> Dict[str, Any]:
+    dados = {}
+    n_num = _buscar(ide, 'nNF')
+    if n_num is not None:
+        dados['numero'] = n_num.text
+    serie = _buscar(ide, 'serie')
+    if serie is not None:
+        dados['serie'] = serie.text
+    dh_emi = _buscar(ide, 'dhEmi')
+    if dh_emi is not None:
+        # Converter formato ISO para datetime
+        try:
+            data_str = dh_emi.text
+            # Formato: 2025-01-15T10:30:00-03:00
+            data_str = data_str.split('-03:00')[0].split('-04:00')[0]  # Remover timezone
+            dados['data_emissao'] = datetime.fromisoformat(data_str).strftime('%d/%m/%Y')
+        except:
+            dados['data_emissao'] = dh_emi.text
+    return dados
+
+
+def _ler_participante(participante: etree._Element, tag_endereco: str, incluir_contato: bool) -> Dict[str, Any]:
+    """Dados do emitente (enderEmit) ou destinatário (enderDest, com telefone e e-mail)."""
+    dados = {
+        'cnpj': None,
+        'nome': None,
+        'endereco': None,
+        'telefone': None,
+        'email': None
+    }
+
+    cnpj = _buscar(participante, 'CNPJ')
+    if cnpj is not None:
+        dados['cnpj'] = cnpj.text
+
+    nome = _buscar(participante, 'xNome')
+    if nome is not None:
+        dados['nome'] = nome.text
+
+    endereco = _buscar(participante, tag_endereco)
+    if endereco is not None:
+        partes = [
+            elemento.text
+            for elemento in (_buscar(endereco, tag) for tag in ('xLgr', 'nro', 'xBairro', 'xMun'))
+            if elemento is not None
+        ]
+        dados['endereco'] = ', '.join(partes) if partes else None
+
+    if incluir_contato:
+        fone = _buscar(participante, 'fone')
+        if fone is not None:
+            dados['telefone'] = fone.text
+        email = _buscar(participante, 'email')
+        if email is not None:
+            dados['email'] = email.text
+
+    return dados
+
+
+def _ler_item(det: etree._Element, indice: int) -> Optional[Dict[str, Any]]:
+    """Produto de um <det>; None se o item não tiver <prod>."""
+    prod = _buscar(det, 'prod')
+    if prod is None:
+        return None
+
+    # nItem = número do item na nota
+    produto = {'nItem': det.get('nItem', str(indice))}
+    campos = _primeiros(prod, _TAGS_ITEM)
+
+    for tag, campo in (('cProd', 'codigo'), ('xProd', 'descricao'), ('NCM', 'ncm'), ('uCom', 'unidade')):
+        elemento = campos.get(tag)
+        if elemento is not None:
+            produto[campo] = elemento.text
+
+    q_com = campos.get('qCom')
+    if q_com is not None:
+        try:
+            produto['quantidade'] = float(q_com.text)
+        except:
+            produto['quantidade'] = 0
+
+    v_un_com = campos.get('vUnCom')
+    if v_un_com is not None:
+        try:
+            produto['valor_unitario'] = float(v_un_com.text)
+        except:
+            produto['valor_unitario'] = 0
+
+    v_prod = campos.get('vProd')
+    if v_prod is not None:
+        try:
+            produto['valor_total'] = float(v_prod.text)
+        except:
+            produto['valor_total'] = produto.get('valor_unitario', 0) * produto.get('quantidade', 0)
+
+    return produto
+
+
+def _ler_totais(total: etree._Element) -> Dict[str, Any]:
+    totais = {
+        'valor_total': 0,
+        'valor_produtos': 0,
+        'valor_impostos': 0
+    }
+    icms_tot = _buscar(total, 'ICMSTot')
+    if icms_tot is not None:
+        v_nf = _buscar(icms_tot, 'vNF')
+        if v_nf is not None:
+            try:
+                totais['valor_total'] = float(v_nf.text)
+            except:
+                pass
+        v_prod = _buscar(icms_tot, 'vProd')
+        if v_prod is not None:
+            try:
+                totais['valor_produtos'] = float(v_prod.text)
+            except:
+                pass
+    return totais
+
+
+def _preferir_ns(por_ns: Dict[bool, Any]) -> Any:
+    """Valor do bloco com namespace da NF-e; senão o sem namespace."""
+    return por_ns[True] if True in por_ns else por_ns.get(False)
+
+
+def extrair_documento_nfe(caminho_xml: str) -> Dict[str, Any]:
+    """
+    Extrai cabeçalho, emitente, destinatário, produtos e totais de um XML de NF-e
+    em uma única leitura do arquivo (sem banco de dados).
+
+    Returns:
+        {'dados_nf', 'emitente', 'destinatario', 'produtos', 'totais'}
+    """
+    # Primeiro bloco de cada tipo, separado por "com namespace" (True) / "sem namespace" (False)
+    chave_por_ns: Dict[bool, Optional[str]] = {}
+    ide_por_ns: Dict[bool, Dict[bool, Dict[str, Any]]] = {True: {}, False: {}}
+    emitente_por_ns: Dict[bool, Dict[str, Any]] = {}
+    destinatario_por_ns: Dict[bool, Dict[str, Any]] = {}
+    totais_por_ns: Dict[bool, Dict[str, Any]] = {}
+    dets_por_ns: Dict[bool, int] = {True: 0, False: 0}
+    produtos_por_ns: Dict[bool, List[Dict[str, Any]]] = {True: [], False: []}
+
+    # Pilha dos infNFe abertos: (com_ns, é o primeiro infNFe desse tipo)
+    inf_nfe_abertos: List[tuple] = []
+
+    contexto = etree.iterparse(
+        caminho_xml,
+        events=('start', 'end'),
+        tag=_TAGS_BLOCOS,
+        resolve_entities=False,
+        no_network=True
+    )
+    for evento, elemento in contexto:
+        if elemento.getparent() is None:
+            # Como no find('.//...'), a própria raiz não é candidata
+            continue
+
+        tag = elemento.tag
+        if tag.startswith(_PREFIXO_NS):
+            nome, com_ns = tag[len(_PREFIXO_NS):], True
+        else:
+            nome, com_ns = tag, False
+
+        if nome == 'infNFe':
+            if evento == 'start':
+                primeiro = com_ns not in chave_por_ns
+                if primeiro:
+                    chave_acesso = elemento.get('Id', '')
+                    chave_por_ns[com_ns] = chave_acesso.replace('NFe', '') if chave_acesso else None
+                inf_nfe_abertos.append((com_ns, primeiro))
+            else:
+                inf_nfe_abertos.pop()
+            continue
+
+        if evento == 'start':
+            continue
+
+        if nome == 'det':
+            dets_por_ns[com_ns] += 1
+            produto = _ler_item(elemento, dets_por_ns[com_ns])
+            if produto is not None:
+                produtos_por_ns[com_ns].append(produto)
+        elif nome == 'ide':
+            # ide é buscado dentro do infNFe escolhido (o primeiro de cada tipo)
+            for inf_com_ns, inf_primeiro in inf_nfe_abertos:
+                if inf_primeiro and com_ns not in ide_por_ns[inf_com_ns]:
+                    ide_por_ns[inf_com_ns][com_ns] = _ler_ide(elemento)
+        elif nome == 'emit':
+            if com_ns not in emitente_por_ns:
+                emitente_por_ns[com_ns] = _ler_participante(elemento, 'enderEmit', incluir_contato=False)
+        elif nome == 'dest':
+            if com_ns not in destinatario_por_ns:
+                destinatario_por_ns[com_ns] = _ler_participante(elemento, 'enderDest', incluir_contato=True)
+        elif nome == 'total':
+            if com_ns not in totais_por_ns:
+                totais_por_ns[com_ns] = _ler_totais(elemento)
+
+        # Bloco já extraído: libera o elemento e os irmãos anteriores já processados
+        elemento.clear()
+        while elemento.getprevious() is not None:
+            del elemento.getparent()[0]
+
+    dados_nf = {
+        'numero': None,
+        'serie': None,
+        'data_emissao': None,
+        'chave_acesso': None
+    }
+    if chave_por_ns:
+        inf_com_ns = True in chave_por_ns
+        dados_nf['chave_acesso'] = chave_por_ns[inf_com_ns]
+        dados_nf.update(_preferir_ns(ide_por_ns[inf_com_ns]) or {})
+
+    vazio = {'cnpj': None, 'nome': None, 'endereco': None, 'telefone': None, 'email': None}
+
+    # Mesma regra do extrator anterior: usar a lista de <det> (com/sem namespace) com mais elementos
+    com_ns = dets_por_ns[True] >= dets_por_ns[False]
+    logger.info(f"Total de elementos <det> encontrados no XML: {dets_por_ns[com_ns]}")
+    produtos = produtos_por_ns[com_ns]
+    logger.info(f"Total de produtos extraídos do XML: {len(produtos)}")
+
+    return {
+        'dados_nf': dados_nf,
+        'emitente': _preferir_ns(emitente_por_ns) or dict(vazio),
+        'destinatario': _preferir_ns(destinatario_por_ns) or dict(vazio),
+        'produtos': produtos,
+        'totais': _preferir_ns(totais_por_ns) or {'valor_total': 0, 'valor_produtos': 0, 'valor_impostos': 0}
+    }
@@ -1,6 +1,13 @@
-import re
 from typing import List, Dict, Any
 
+from app.utils.nf_linhas import (
+    iterar_itens_generico,
+    ler_item_circus,
+    ler_item_girassol_compacto,
+    linha_candidata_entrada,
+    ptbr_para_float,
+)
+
 def extrair_produtos_inteligente_entrada_melhorado(texto_completo: str) -> List[Dict[str, Any]]:
     """Extração inteligente de produtos para PDFs de entrada - Versão melhorada com logs detalhados."""
     
@@ -10,47 +17,14 @@ def extrair_produtos_inteligente_entrada_melhorado(texto_completo: str) -> List[
     print(f"DEBUG: Total de linhas no PDF: {len(linhas)}")
     
     # Primeiro, tentar detectar o formato específico do PDF (ex: CIRCUS)
-    # Padrão: ITEM CÓDIGO DESCRIÇÃO NCM CST CFOP UN QTD VALOR_UNIT ... VALOR_TOTAL
-    padrao_circus = re.compile(
-        r'^(\d+)\s+'      # Item
-        r'(\d+)\s+'       # Código
-        r'(.+?)\s+'       # Descrição (captura tudo até o próximo espaço + números)
-        r'(\d{8})\s+'     # NCM (8 dígitos)
-        r'(\d{4})\s+'     # CST (4 dígitos)
-        r'(\d{4})\s+'     # CFOP (4 dígitos)
-        r'(\w+)\s+'       # Unidade
-        r'([\d,]+)\s+'    # Quantidade
-        r'([\d,]+)\s+'    # Valor unitário
-        r'.*?([\d,]+)\s+' # Valor total
-        r'.*$'            # Resto da linha
-    )
-    
     print("DEBUG: Tentando extrair produtos com padrão CIRCUS...")
     
-    # Padrão específico para PDFs do tipo "CIRCUS" - formato real observado
-    padrao_circus_especifico = re.compile(
-        r'^(.+?)\s+'           # Descrição do produto
-        r'(\d{3})\s+'          # Código do produto (3 dígitos)
-        r'(\d{8})\s+'          # NCM (8 dígitos)
-        r'(\d{4})\s+'          # CST (4 dígitos)
-        r'(\d{4})\s+'          # CFOP (4 dígitos)
-        r'(UN)\s+'             # Unidade
-        r'([\d,]+)\s+'         # Quantidade
-        r'([\d,]+)\s+'         # Valor unitário
-        r'([\d,]+)\s+'         # Valor total
-        r'.*$'                 # Resto da linha (impostos, etc.)
-    )
-    
-    # Primeiro, identificar linhas que contêm produtos
-    linhas_produtos = []
-    for linha in linhas:
-        linha_limpa = linha.strip()
-        if re.search(r'\b\d{3}\s+\d{8}\s+\d{4}\s+\d{4}\s+UN\s+', linha_limpa):
-            linhas_produtos.append(linha_limpa)
+    # Padrão específico para PDFs do tipo "CIRCUS" - formato real observado (app.utils.nf_linhas)
+    linhas_produtos = [match for match in map(ler_item_circus, linhas) if match is not None]
     
     # Processar as linhas de produtos identificadas
-    for i, linha in enumerate(linhas_produtos):
-        match = padrao_circus_especifico.match(linha)
+    for i, match in enumerate(linhas_produtos):
+        linha = match.string
         if match:
             try:
                 descricao = match.group(1).strip()
@@ -121,32 +95,6 @@ def extrair_produtos_inteligente_entrada_melhorado(texto_completo: str) -> List[
     
     print(f"DEBUG: Processando linhas {linha_inicio} a {linha_fim} (todas as linhas do PDF)")
     
-    # Padrão GIRASSOL onde o código do produto vem colado à descrição (sem espaço)
-    # Exemplo de linha real:
-    # 1005805AGUASSANI BB 5L 28289011 000 6101 UN 112       18,30      2.049,60      2.049,60    143,47 7
-    padrao_girassol_compacto = re.compile(
-        r'^(\d{5,})\s*'                               # Código do produto (5+ dígitos)
-        r'([A-Z][A-Z0-9\s\./()\-]{3,}?)\s+'          # Descrição (maiúsculas, números e símbolos usuais)
-        r'(\d{8})\s+'                                  # NCM (8 dígitos)
-        r'(\d{3})\s+'                                  # CST (3 dígitos)
-        r'(\d{4})\s+'                                  # CFOP (4 dígitos)
-        r'([A-Z]{2,})\s+'                               # Unidade (UN, CX, etc.)
-        r'([\d\.]+,[\d]{0,3}|\d+)\s+'               # Quantidade (com ou sem decimais)
-        r'([\d\.]+,[\d]{2})\s+'                       # Valor unitário
-        r'([\d\.]+,[\d]{2})'                           # Valor total
-    )
-    
-    # Palavras-chave que indicam que a linha NÃO é um produto
-    palavras_excluir = [
-        'TOTAL', 'TOTAIS', 'SUBTOTAL', 'SUBTOTAIS',
-        'ICMS', 'IPI', 'PIS', 'COFINS', 'IMPOSTO', 'IMPOSTOS',
-        'DESCONTO', 'DESCONTOS', 'ACRESCIMO', 'ACRESCIMOS',
-        'FRETE', 'SEGURO', 'OUTRAS DESPESAS',
-        'BASE DE CALCULO', 'VALOR DO ICMS', 'VALOR DO IPI',
-        'DADOS ADICIONAIS', 'INFORMACOES COMPLEMENTARES',
-        'OBSERVACOES', 'OBSERVACAO'
-    ]
-    
     # Códigos já processados para evitar duplicatas
     codigos_processados = set()
     
@@ -159,17 +107,8 @@ def extrair_produtos_inteligente_entrada_melhorado(texto_completo: str) -> List[
         linha = linhas[i]
         linha_limpa = linha.strip()
         
-        # Pular linhas vazias ou muito curtas
-        if not linha_limpa or len(linha_limpa) < 5:
-            continue
-        
-        # Filtrar linhas que claramente não são produtos
-        linha_upper = linha_limpa.upper()
-        if any(palavra in linha_upper for palavra in palavras_excluir):
-            continue
-        
-        # Pular linhas que começam com palavras que indicam totais/impostos
-        if any(linha_upper.startswith(palavra) for palavra in ['TOTAL', 'SUBTOTAL', 'ICMS', 'IPI', 'PIS', 'COFINS']):
+        # Pular linhas vazias, muito curtas, de totais/impostos ou sem código de produto
+        if not linha_candidata_entrada(linha_limpa):
             continue
         
         # Log de linhas com potencial de serem produtos
@@ -178,17 +117,15 @@ def extrair_produtos_inteligente_entrada_melhorado(texto_completo: str) -> List[
         
         # 1) Tentar primeiro o padrão GIRASSOL compacto (código colado na descrição)
         try:
-            mg = padrao_girassol_compacto.search(linha_limpa)
+            mg = ler_item_girassol_compacto(linha_limpa)
             if mg:
                 codigo = mg.group(1)
                 descricao = mg.group(2).strip()
                 unidade = mg.group(6)
                 # Converter números no formato PT-BR
-                def _ptbr_to_float(s: str) -> float:
-                    return float(s.replace('.', '').replace(',', '.'))
-                quantidade = _ptbr_to_float(mg.group(7))
-                valor_unitario = _ptbr_to_float(mg.group(8))
-                valor_total = _ptbr_to_float(mg.group(9))
+                quantidade = ptbr_para_float(mg.group(7))
+                valor_unitario = ptbr_para_float(mg.group(8))
+                valor_total = ptbr_para_float(mg.group(9))
                 
                 # Validar se não é duplicata e se os valores fazem sentido
                 if codigo in codigos_processados:
@@ -221,26 +158,11 @@ def extrair_produtos_inteligente_entrada_melhorado(texto_completo: str) -> List[
         except Exception as e:
             print(f"DEBUG: Erro no parse GIRASSOL compacto: {e}")
         
-        # 2) Padrões mais flexíveis para diferentes formatos de PDF
-        padroes_produto = [
-            # Padrão 1: Código de 4+ dígitos + descrição + 3 valores numéricos
-            r'^(\d{4,})\s+([A-Za-z][A-Za-z\s/\-()0-9.,]+?)\s+(\d+[,.]?\d*)\s+([\d,]+[,.]\d*)\s+([\d,]+[,.]\d*)',
-            # Padrão 2: Código + descrição com NCM, CST, CFOP (formato GIRASSOL)
-            r'^(\d{4,})\s+([A-Za-z][A-Za-z\s/\-()0-9.,]+?)\s+(\d{8})\s+(\d{3})\s+(\d{4})\s+(\w+)\s+(\d+[,.]?\d*)\s+([\d,]+[,.]\d*)\s+([\d,]+[,.]\d*)',
-            # Padrão 3: Busca mais flexível por código e valores
-            r'(\d{4,})\s+(.+?)\s+(\d+[,.]?\d*)\s+([\d,]+[,.]\d*)\s+([\d,]+[,.]\d*)$',
-            # Padrão 4: Código seguido de texto e pelo menos 2 valores
-            r'(\d{4,})\s+([A-Za-z].+?)\s+(\d+[,.]?\d*)\s+([\d,]+[,.]\d*)',
-            # Padrão 5: Busca por qualquer linha com código e múltiplos valores
-            r'(\d{4,}).*?([A-Za-z][A-Za-z\s/\-()0-9.,]{5,}?).*?(\d+[,.]?\d*).*?([\d,]+[,.]\d*).*?([\d,]+[,.]\d*)',
-        ]
-        
+        # 2) Padrões mais flexíveis para diferentes formatos de PDF (app.utils.nf_linhas)
         produto_encontrado = False
         
-        for j, padrao in enumerate(padroes_produto):
+        for j, produto_match in iterar_itens_generico(linha_limpa):
             try:
-                produto_match = re.search(padrao, linha_limpa)
-                
                 if produto_match:
                     print(f"DEBUG: MATCH! Padrão {j} na linha {i}:")
                     print(f"DEBUG: Grupos encontrados: {produto_match.groups()}")
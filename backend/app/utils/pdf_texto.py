@@ -0,0 +1,207 @@
+"""
+Extração de texto de PDF página a página, com páginas em paralelo e parada antecipada.
+
+Substitui os laços `texto += page.extract_text()` espalhados pelos extratores de
+NF e de relatórios de vendas:
+
+- blocos de páginas consecutivas são lidos em processos separados
+  (pdfplumber/PyPDF2 são CPU-bound e não liberam o GIL), com no máximo
+  PDF_PAGINAS_PROCESSOS blocos em andamento; cada bloco abre o PDF uma vez;
+- as páginas chegam ao chamador em ordem, como um fluxo (iterar_paginas /
+  iterar_linhas), e o texto completo é montado com um único join;
+- com `parar_em`, a leitura termina na página em que o marcador aparece (ex.:
+  "Dados Adicionais" da DANFE de saída) e as páginas seguintes nem são extraídas.
+
+PDFs com poucas páginas (PDF_PAGINAS_MIN_PARALELO) ou máquinas com uma CPU leem
+no próprio processo, sem pool. Dentro dos processos do pool de parsing
+(parse_executor) a leitura é sempre sequencial: o paralelismo já vem de lá, e
+um pool de páginas por worker multiplicaria os interpretadores.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Deque, Iterator, List, Optional, Sequence
+
+import pdfplumber
+
+from app.core.config import settings
+from app.core.parse_executor import em_worker_parse
+
+logger = logging.getLogger(__name__)
+
+MOTOR_PDFPLUMBER = 'pdfplumber'
+MOTOR_PYPDF = 'pypdf'
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _classe_leitor_pypdf():
+    # pypdf (versões novas) ou PyPDF2 (requirements.txt)
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        from PyPDF2 import PdfReader
+    return PdfReader
+
+
+def _processos_paginas() -> int:
+    if settings.PDF_PAGINAS_PROCESSOS > 0:
+        return settings.PDF_PAGINAS_PROCESSOS
+    return min(4, os.cpu_count() or 1)
+
+
+def _obter_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, como no parse_executor (não herda conexões/locks do processo pai)
+            _pool = ProcessPoolExecutor(
+                max_workers=_processos_paginas(),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            logger.info(f"✓ Pool de extração de páginas de PDF iniciado ({_processos_paginas()} processos)")
+        return _pool
+
+
+def encerrar_pool_paginas(quebrado: Optional[ProcessPoolExecutor] = None) -> None:
+    """
+    Finaliza o pool de páginas deste processo (shutdown da aplicação). Com
+    `quebrado`, só descarta se ele ainda for o pool atual, para não encerrar
+    um pool já recriado por outra leitura.
+    """
+    global _pool
+    with _pool_lock:
+        if quebrado is not None and quebrado is not _pool:
+            return
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def contar_paginas(caminho_pdf: str, motor: str = MOTOR_PDFPLUMBER) -> int:
+    if motor == MOTOR_PYPDF:
+        return len(_classe_leitor_pypdf()(caminho_pdf).pages)
+    with pdfplumber.open(caminho_pdf) as pdf:
+        return len(pdf.pages)
+
+
+def _extrair_paginas(caminho_pdf: str, motor: str, inicio: int, fim: int) -> List[str]:
+    """Texto das páginas [inicio, fim) (executado nos processos do pool; abre o PDF uma vez por bloco)."""
+    if motor == MOTOR_PYPDF:
+        paginas = _classe_leitor_pypdf()(caminho_pdf).pages
+        return [paginas[indice].extract_text() or "" for indice in range(inicio, fim)]
+    textos = []
+    # pages=[...] é 1-based: só as páginas do bloco são carregadas
+    with pdfplumber.open(caminho_pdf, pages=list(range(inicio + 1, fim + 1))) as pdf:
+        for pagina in pdf.pages:
+            textos.append(pagina.extract_text() or "")
+            pagina.close()
+    return textos
+
+
+def _contem_marcador(texto: str, parar_em: Sequence[str]) -> bool:
+    return any(marcador in texto for marcador in parar_em)
+
+
+def _iterar_sequencial(caminho_pdf: str, motor: str, parar_em: Sequence[str]) -> Iterator[str]:
+    if motor == MOTOR_PYPDF:
+        for pagina in _classe_leitor_pypdf()(caminho_pdf).pages:
+            texto = pagina.extract_text() or ""
+            yield texto
+            if parar_em and _contem_marcador(texto, parar_em):
+                return
+        return
+
+    with pdfplumber.open(caminho_pdf) as pdf:
+        for pagina in pdf.pages:
+            texto = pagina.extract_text() or ""
+            # Libera os objetos da página já lida (PDFs longos)
+            pagina.close()
+            yield texto
+            if parar_em and _contem_marcador(texto, parar_em):
+                return
+
+
+def _iterar_paralelo(caminho_pdf: str, motor: str, total: int, processos: int, parar_em: Sequence[str]) -> Iterator[str]:
+    pool = _obter_pool()
+    # Cerca de dois blocos por processo; janela de um bloco por processo em andamento:
+    # ao parar no marcador, os blocos seguintes não foram pedidos
+    tamanho_bloco = max(1, -(-total // (processos * 2)))
+    pendentes: Deque[Future] = deque()
+    proxima = 0
+    try:
+        while proxima < total or pendentes:
+            while proxima < total and len(pendentes) < processos:
+                fim = min(total, proxima + tamanho_bloco)
+                pendentes.append(pool.submit(_extrair_paginas, caminho_pdf, motor, proxima, fim))
+                proxima = fim
+            for texto in pendentes.popleft().result():
+                yield texto
+                if parar_em and _contem_marcador(texto, parar_em):
+                    return
+    except BrokenProcessPool:
+        # Um processo morreu (ex.: PDF que derruba a biblioteca); recria o pool na próxima leitura
+        logger.error("Pool de extração de páginas quebrado; será recriado")
+        encerrar_pool_paginas(pool)
+        raise
+    finally:
+        for futuro in pendentes:
+            futuro.cancel()
+
+
+def iterar_paginas(
+    caminho_pdf: str,
+    motor: str = MOTOR_PDFPLUMBER,
+    parar_em: Sequence[str] = ()
+) -> Iterator[str]:
+    """
+    Texto de cada página, em ordem (páginas sem texto vêm como "").
+
+    Args:
+        motor: MOTOR_PDFPLUMBER (layout de tabelas da DANFE) ou MOTOR_PYPDF
+        parar_em: marcadores; a leitura termina na página que contiver algum deles
+            (a própria página é entregue inteira)
+    """
+    processos = 1 if em_worker_parse() else _processos_paginas()
+    if processos > 1:
+        total = contar_paginas(caminho_pdf, motor)
+        if total >= settings.PDF_PAGINAS_MIN_PARALELO:
+            yield from _iterar_paralelo(caminho_pdf, motor, total, processos, parar_em)
+            return
+    yield from _iterar_sequencial(caminho_pdf, motor, parar_em)
+
+
+def iterar_linhas(
+    caminho_pdf: str,
+    motor: str = MOTOR_PDFPLUMBER,
+    parar_em: Sequence[str] = ()
+) -> Iterator[str]:
+    """Linhas do PDF em fluxo; com `parar_em`, termina na linha do marcador (inclusive)."""
+    for texto in iterar_paginas(caminho_pdf, motor, parar_em):
+        for linha in texto.split('\n'):
+            yield linha
+            if parar_em and _contem_marcador(linha, parar_em):
+                return
+
+
+def extrair_texto(
+    caminho_pdf: str,
+    motor: str = MOTOR_PDFPLUMBER,
+    parar_em: Sequence[str] = (),
+    separador: str = "\n"
+) -> str:
+    """
+    Texto das páginas com conteúdo, cada uma seguida de `separador`.
+    Com `parar_em`, vai até o fim da página em que o marcador aparece.
+    """
+    partes: List[str] = []
+    for texto in iterar_paginas(caminho_pdf, motor, parar_em):
+        if texto:
+            partes.append(texto)
+            partes.append(separador)
+    return "".join(partes)
@@ -1,7 +1,7 @@
 from difflib import SequenceMatcher
 from sqlalchemy.orm import Session
 from app.db import models
-from typing import Tuple, Optional
+from typing import Any, Dict, List, Tuple, Optional
 
 
 def similarity(a: str, b: str) -> float:
@@ -9,55 +9,141 @@ def similarity(a: str, b: str) -> float:
     return SequenceMatcher(None, a.lower(), b.lower()).ratio()
 
 
+class ProductMatcher:
+    """
+    Motor de associação de produtos de NF com o catálogo da empresa.
+
+    Carrega o catálogo uma única vez (snapshot normalizado) e permite associar
+    todos os itens de uma nota fiscal em uma única passada, sem consultar o
+    banco novamente para cada linha.
+    """
+
+    def __init__(self, db: Session, empresa_id: int):
+        self.db = db
+        self.empresa_id = empresa_id
+        self._produtos_por_codigo: Dict[str, models.Produto] = {}
+        self._catalogo: List[Tuple[models.Produto, SequenceMatcher]] = []
+        self._carregar_catalogo()
+
+    def _carregar_catalogo(self) -> None:
+        """Carrega os produtos da empresa e pré-processa códigos e nomes."""
+        produtos = self.db.query(models.Produto).filter(
+            models.Produto.empresa_id == self.empresa_id
+        ).order_by(models.Produto.id).all()
+
+        for produto in produtos:
+            if produto.codigo is not None:
+                self._produtos_por_codigo.setdefault(str(produto.codigo), produto)
+            if not produto.nome:
+                continue
+            # O nome do produto é o lado "b" da comparação; o SequenceMatcher
+            # guarda o índice dele, reaproveitado para todas as linhas da NF.
+            matcher = SequenceMatcher(None)
+            matcher.set_seq2(produto.nome.lower())
+            self._catalogo.append((produto, matcher))
+
+    def find_by_code(self, codigo: Optional[str]) -> Optional[models.Produto]:
+        """Busca exata pelo código do produto no snapshot."""
+        if not codigo:
+            return None
+        return self._produtos_por_codigo.get(str(codigo))
+
+    def find_by_name(self, product_name: str, threshold: float = 0.6) -> Tuple[Optional[models.Produto], float]:
+        """
+        Encontra o produto de nome mais similar no snapshot.
+
+        Usa os limites superiores baratos do SequenceMatcher (real_quick_ratio e
+        quick_ratio) para descartar produtos que não podem superar o melhor
+        score atual, com o mesmo resultado da comparação completa.
+        """
+        if not product_name or product_name.strip() == '':
+            return None, 0.0
+
+        nome_busca = product_name.lower()
+        best_match = None
+        best_score = 0.0
+
+        for produto, matcher in self._catalogo:
+            matcher.set_seq1(nome_busca)
+            minimo = max(threshold, best_score)
+            if matcher.real_quick_ratio() < minimo or matcher.quick_ratio() < minimo:
+                continue
+
+            score = matcher.ratio()
+            if score > best_score and score >= threshold:
+                best_match = produto
+                best_score = score
+
+        return best_match, best_score
+
+    def match(self, codigo: Optional[str], descricao: Optional[str], threshold: float = 0.6) -> Tuple[Optional[models.Produto], str, float]:
+        """
+        Busca um produto primeiro pelo código, depois pelo nome.
+
+        Returns:
+            Tuple (produto ou None, método 'codigo'/'nome'/'nao_encontrado', score)
+        """
+        produto = self.find_by_code(codigo)
+        if produto:
+            return produto, 'codigo', 1.0
+
+        if descricao:
+            produto, score = self.find_by_name(descricao, threshold)
+            if produto:
+                return produto, 'nome', score
+
+        return None, 'nao_encontrado', 0.0
+
+    def match_batch(self, itens: List[Dict[str, Any]], threshold: float = 0.6) -> List[Tuple[Optional[models.Produto], str, float]]:
+        """
+        Associa todos os itens de uma nota fiscal em uma única passada.
+
+        Args:
+            itens: Lista de dicionários com as chaves 'codigo' e 'descricao'
+            threshold: Limite mínimo de similaridade para busca por nome
+
+        Returns:
+            Lista de tuplas (produto, método, score) na mesma ordem dos itens
+        """
+        return [
+            self.match(item.get('codigo'), item.get('descricao', ''), threshold)
+            for item in itens
+        ]
+
+
 def find_product_by_name(db: Session, product_name: str, empresa_id: int, threshold: float = 0.6) -> Tuple[Optional[models.Produto], float]:
     """
     Encontra um produto no banco de dados baseado na similaridade do nome.
-    
+
+    Para associar várias linhas de uma mesma NF, prefira ProductMatcher.match_batch,
+    que carrega o catálogo uma única vez.
+
     Args:
         db: Sessão do banco de dados
         product_name: Nome do produto a ser buscado
         empresa_id: ID da empresa
         threshold: Limite mínimo de similaridade (0.0 a 1.0)
-    
+
     Returns:
         Tuple contendo o produto encontrado (ou None) e o score de similaridade
     """
     if not product_name or product_name.strip() == '':
         return None, 0.0
-    
-    # Buscar todos os produtos da empresa
-    produtos = db.query(models.Produto).filter(
-        models.Produto.empresa_id == empresa_id
-    ).all()
-    
-    best_match = None
-    best_score = 0.0
-    
-    # Calcular similaridade com cada produto
-    for produto in produtos:
-        if not produto.nome:
-            continue
-            
-        score = similarity(product_name, produto.nome)
-        
-        if score > best_score and score >= threshold:
-            best_match = produto
-            best_score = score
-    
-    return best_match, best_score
+
+    return ProductMatcher(db, empresa_id).find_by_name(product_name, threshold)
 
 
 def find_product_by_code_or_name(db: Session, codigo: str, descricao: str, empresa_id: int, threshold: float = 0.6) -> Tuple[Optional[models.Produto], str, float]:
     """
     Busca um produto primeiro pelo código, depois pelo nome se não encontrar.
-    
+
     Args:
         db: Sessão do banco de dados
         codigo: Código do produto
         descricao: Descrição/nome do produto
         empresa_id: ID da empresa
         threshold: Limite mínimo de similaridade para busca por nome
-    
+
     Returns:
         Tuple contendo:
         - produto encontrado (ou None)
@@ -70,14 +156,14 @@ def find_product_by_code_or_name(db: Session, codigo: str, descricao: str, empre
             models.Produto.codigo == str(codigo),
             models.Produto.empresa_id == empresa_id
         ).first()
-        
+
         if produto:
             return produto, 'codigo', 1.0
-    
+
     # Se não encontrou pelo código, tentar por nome
     if descricao:
         produto, score = find_product_by_name(db, descricao, empresa_id, threshold)
         if produto:
             return produto, 'nome', score
-    
-    return None, 'nao_encontrado', 0.0
\ No newline at end of file
+
+    return None, 'nao_encontrado', 0.0
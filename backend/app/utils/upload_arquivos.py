@@ -0,0 +1,76 @@
+"""
+Gravação dos arquivos enviados (UploadFile) em disco, em blocos.
+
+O UploadFile do Starlette já fica em um SpooledTemporaryFile (memória até 1 MB,
+depois disco). Em vez de `await arquivo.read()` — que traz o arquivo inteiro
+para a memória, até MAX_UPLOAD_SIZE — os blocos são copiados para o arquivo
+temporário usado pelos extratores e o SHA256 (mesmo valor de
+parse_cache.hash_conteudo) é calculado no caminho. O pico de memória por upload
+fica limitado a TAMANHO_BLOCO_UPLOAD.
+"""
+import hashlib
+import os
+import tempfile
+from typing import BinaryIO, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile, status
+
+TAMANHO_BLOCO_UPLOAD = 1024 * 1024  # 1 MB
+
+
+async def copiar_upload(
+    arquivo: UploadFile,
+    destino: BinaryIO,
+    max_bytes: Optional[int] = None
+) -> Tuple[str, int]:
+    """
+    Copia o upload para `destino` bloco a bloco.
+
+    Returns:
+        (SHA256 do conteúdo, tamanho em bytes)
+
+    Raises:
+        HTTPException 413 se o arquivo passar de `max_bytes`
+    """
+    sha256 = hashlib.sha256()
+    tamanho = 0
+    while True:
+        bloco = await arquivo.read(TAMANHO_BLOCO_UPLOAD)
+        if not bloco:
+            break
+        tamanho += len(bloco)
+        if max_bytes is not None and tamanho > max_bytes:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"O arquivo '{arquivo.filename}' excede o tamanho máximo permitido"
+            )
+        sha256.update(bloco)
+        destino.write(bloco)
+    return sha256.hexdigest(), tamanho
+
+
+async def salvar_upload_temporario(
+    arquivo: UploadFile,
+    sufixo: str,
+    max_bytes: Optional[int] = None
+) -> Tuple[str, str]:
+    """
+    Grava o upload em um arquivo temporário (delete=False; quem chama remove).
+
+    Returns:
+        (caminho do arquivo temporário, SHA256 do conteúdo)
+    """
+    with tempfile.NamedTemporaryFile(delete=False, suffix=sufixo) as temp_file:
+        try:
+            hash_arquivo, _tamanho = await copiar_upload(arquivo, temp_file, max_bytes)
+        except BaseException:
+            temp_file.close()
+            os.unlink(temp_file.name)
+            raise
+    return temp_file.name, hash_arquivo
+
+
+def ler_inicio_arquivo(caminho: str, tamanho: int) -> bytes:
+    """Primeiros `tamanho` bytes do arquivo (validação de formato sem ler tudo)."""
+    with open(caminho, 'rb') as arquivo:
+        return arquivo.read(tamanho)
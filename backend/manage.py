@@ -4,6 +4,7 @@ import typer
 import getpass
 from sqlalchemy.orm import Session
 import json
+from typing import Optional
 from app.db.connection import get_db
 from app.crud import usuario as crud_usuario
 from app.schemas import usuario as schemas_usuario
@@ -148,6 +149,126 @@ def seed_historical_data():
     finally:
         db.close()
 
+@cli_app.command()
+def rebuild_price_stats(empresa_id: Optional[int] = typer.Option(None, help="Reconstrói apenas esta empresa")):
+    """
+    Reconstrói a tabela estatisticas_preco_produto a partir do histórico de preços.
+    """
+    from app.services.estatisticas_preco_service import EstatisticasPrecoService
+
+    db: Session = next(get_db())
+    try:
+        total = EstatisticasPrecoService.reconstruir(db, empresa_id=empresa_id)
+        print(f"--- ✅ Estatísticas de preço reconstruídas: {total} produtos ---")
+    except Exception as e:
+        print(f"❌ Erro ao reconstruir estatísticas de preço: {e}")
+        raise typer.Abort()
+    finally:
+        db.close()
+
+@cli_app.command()
+def refresh_demand_snapshot(
+    rebuild: bool = typer.Option(False, "--rebuild", help="Recria todo o snapshot a partir das movimentações"),
+    batch_size: Optional[int] = typer.Option(None, help="Máximo de movimentações processadas nesta execução")
+):
+    """
+    Atualiza o snapshot diário de demanda (demanda_diaria_produto).
+    Pensado para rodar via cron (ex.: toda noite); incremental por padrão.
+    """
+    from app.services.demanda_snapshot_service import DemandaSnapshotService
+
+    db: Session = next(get_db())
+    try:
+        service = DemandaSnapshotService(db)
+        resultado = service.reconstruir() if rebuild else service.atualizar_incremental(batch_size)
+        print(f"--- ✅ Snapshot de demanda atualizado até a movimentação {resultado['processadas_ate']} "
+              f"({resultado['linhas_afetadas']} linhas) ---")
+    except Exception as e:
+        print(f"❌ Erro ao atualizar snapshot de demanda: {e}")
+        raise typer.Abort()
+    finally:
+        db.close()
+
+@cli_app.command()
+def refresh_sales_cube(
+    rebuild: bool = typer.Option(False, "--rebuild", help="Recria todo o cubo a partir das tabelas de origem"),
+    batch_size: Optional[int] = typer.Option(None, help="Máximo de linhas de cada fonte processadas nesta execução")
+):
+    """
+    Atualiza o cubo mensal de vendas (vendas_mensais).
+    Os lançamentos de NF e orçamento já somam o que criam; o job cobre o restante.
+    """
+    from app.services.vendas_mensais_service import VendasMensaisService
+
+    db: Session = next(get_db())
+    try:
+        service = VendasMensaisService(db)
+        resultado = service.reconstruir() if rebuild else service.atualizar_incremental(batch_size)
+        print(f"--- ✅ Cubo mensal de vendas atualizado até {resultado['processadas_ate']} "
+              f"({resultado['linhas_afetadas']} linhas) ---")
+    except Exception as e:
+        print(f"❌ Erro ao atualizar cubo mensal de vendas: {e}")
+        raise typer.Abort()
+    finally:
+        db.close()
+
+@cli_app.command()
+def rebuild_unified_sales():
+    """
+    Recria vendas_unificadas (NF-e + orçamentos sem NF) a partir dos históricos e reconstrói o cubo mensal.
+    """
+    from app.services.vendas_unificadas_service import VendasUnificadasService
+
+    db: Session = next(get_db())
+    try:
+        total = VendasUnificadasService(db).reconstruir()
+        print(f"--- ✅ Vendas unificadas reconstruídas ({total} linhas) ---")
+    except Exception as e:
+        print(f"❌ Erro ao reconstruir vendas unificadas: {e}")
+        raise typer.Abort()
+    finally:
+        db.close()
+
+@cli_app.command()
+def backfill_movement_nf(
+    batch_size: int = typer.Option(5000, help="Movimentações atualizadas por transação")
+):
+    """
+    Preenche nota_fiscal/chave_acesso das movimentações antigas a partir do texto de observação.
+    Idempotente: só altera movimentações que ainda não têm nota_fiscal.
+    """
+    from app.services.stock_service import StockService
+
+    db: Session = next(get_db())
+    try:
+        total = StockService.preencher_nota_fiscal_movimentacoes(db, tamanho_lote=batch_size)
+        print(f"--- ✅ nota_fiscal preenchida em {total} movimentações ---")
+    except Exception as e:
+        print(f"❌ Erro ao preencher nota_fiscal das movimentações: {e}")
+        raise typer.Abort()
+    finally:
+        db.close()
+
+@cli_app.command()
+def backfill_movement_canal(
+    batch_size: int = typer.Option(5000, help="Movimentações atualizadas por transação")
+):
+    """
+    Classifica o canal (vendedor, NF, manual...) das movimentações antigas a partir da observação.
+    Idempotente: só altera movimentações que ainda não têm canal.
+    """
+    from app.services.stock_service import StockService
+
+    db: Session = next(get_db())
+    try:
+        total = StockService.preencher_canal_movimentacoes(db, tamanho_lote=batch_size)
+        print(f"--- ✅ canal preenchido em {total} movimentações ---")
+    except Exception as e:
+        print(f"❌ Erro ao preencher canal das movimentações: {e}")
+        raise typer.Abort()
+    finally:
+        db.close()
+
 # Ponto de entrada para o Typer
 if __name__ == "__main__":
     # Import necessário para a Enum de PerfilUsuario funcionar com Typer
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark da gramática de linhas de produto (app/utils/nf_linhas.py).
+
+Usa os textos de exemplo backend/movimento_text_*.txt (DANFEs já extraídas do
+PDF) e mede linhas por segundo de cada extrator.
+
+Uso (a partir de backend/):
+    python scripts/benchmark_linhas_nf.py [--repeticoes 200]
+"""
+import argparse
+import contextlib
+import glob
+import io
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from app.utils.nf_linhas import (  # noqa: E402
+    extrair_itens_danfe,
+    ler_item_circus,
+    ler_item_danfe,
+    linha_candidata_entrada,
+)
+from app.utils.pdf_extractor_melhorado import extrair_produtos_inteligente_entrada_melhorado  # noqa: E402
+
+
+def medir(nome, funcao, textos, total_linhas, repeticoes):
+    inicio = time.perf_counter()
+    # Os extratores de entrada imprimem DEBUG por linha; a saída não entra na medição
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeticoes):
+            for texto in textos:
+                funcao(texto)
+    decorrido = time.perf_counter() - inicio
+    linhas = total_linhas * repeticoes
+    print(f"{nome:<42} {linhas / decorrido:>14,.0f} linhas/s  ({decorrido:.3f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeticoes', type=int, default=200)
+    args = parser.parse_args()
+
+    arquivos = sorted(glob.glob(os.path.join(BACKEND_DIR, 'movimento_text_*.txt')))
+    if not arquivos:
+        print("Nenhum arquivo movimento_text_*.txt encontrado em backend/")
+        return 1
+
+    textos = []
+    for caminho in arquivos:
+        with open(caminho, encoding='utf-8') as arquivo:
+            textos.append(arquivo.read())
+    linhas = [linha for texto in textos for linha in texto.split('\n')]
+    total_linhas = len(linhas)
+
+    itens = sum(len(extrair_itens_danfe(texto)) for texto in textos)
+    rejeitadas_danfe = sum(1 for linha in linhas if not linha.strip()[:1].isdigit())
+    rejeitadas_entrada = sum(1 for linha in linhas if not linha_candidata_entrada(linha.strip()))
+    print(f"{len(arquivos)} arquivos, {total_linhas} linhas, {itens} itens de DANFE")
+    print(f"Pré-filtro DANFE descarta {rejeitadas_danfe / total_linhas:.0%} das linhas; "
+          f"pré-filtro de entrada descarta {rejeitadas_entrada / total_linhas:.0%}")
+    print()
+
+    medir("DANFE saída (extrair_itens_danfe)", extrair_itens_danfe, textos, total_linhas, args.repeticoes)
+    medir("DANFE linha a linha (ler_item_danfe)",
+          lambda texto: [ler_item_danfe(linha) for linha in texto.split('\n')],
+          textos, total_linhas, args.repeticoes)
+    medir("Entrada CIRCUS (ler_item_circus)",
+          lambda texto: [ler_item_circus(linha) for linha in texto.split('\n')],
+          textos, total_linhas, args.repeticoes)
+    medir("Entrada completa (extrator melhorado)",
+          extrair_produtos_inteligente_entrada_melhorado, textos, total_linhas, max(1, args.repeticoes // 10))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
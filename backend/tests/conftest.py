@@ -0,0 +1,96 @@
+"""
+Fixtures dos testes: banco SQLite temporário com o schema dos models.
+
+Alguns serviços usam recursos do Postgres. Nos testes, o `insert` do dialeto
+SQLite (mesma API de on_conflict_do_update) substitui o pg_insert
+(fixture `upsert_sqlite`) e as funções bit_or/greatest são registradas em
+cada conexão.
+"""
+import os
+import tempfile
+
+# Antes de importar o app: o engine é criado a partir de settings.DATABASE_URL
+_DIRETORIO = tempfile.mkdtemp(prefix="higiplas_testes_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_DIRETORIO, 'testes.db')}"
+for _variavel, _valor in {
+    "DB_USER": "testes",
+    "DB_PASSWORD": "testes",
+    "DB_NAME": "testes",
+    "SECRET_KEY": "chave-dos-testes",
+    "SUPERUSER_EMAIL": "admin@testes.local",
+    "SUPERUSER_PASSWORD": "testes",
+    "NEXT_PUBLIC_API_URL": "http://localhost:8000",
+}.items():
+    os.environ.setdefault(_variavel, _valor)
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.db import models
+from app.db.connection import Base, SessionLocal, engine
+from app.db.schema_capabilities import schema_capabilities
+
+
+class _BitOr:
+    """Agregado bit_or do Postgres."""
+
+    def __init__(self):
+        self.valor = 0
+
+    def step(self, valor):
+        if valor is not None:
+            self.valor |= int(valor)
+
+    def finalize(self):
+        return self.valor
+
+
+def _greatest(*valores):
+    # GREATEST do Postgres ignora NULL
+    presentes = [valor for valor in valores if valor is not None]
+    return max(presentes) if presentes else None
+
+
+@event.listens_for(engine, "connect")
+def _registrar_funcoes(conexao, _registro):
+    conexao.create_aggregate("bit_or", 1, _BitOr)
+    conexao.create_function("greatest", -1, _greatest)
+
+
+@pytest.fixture(scope="session")
+def _schema():
+    engine.dispose()
+    Base.metadata.create_all(engine)
+    schema_capabilities.refresh()
+    yield
+    engine.dispose()
+
+
+@pytest.fixture
+def db(_schema):
+    """Sessão com empresa 1 e usuário 1; as tabelas são esvaziadas ao final."""
+    sessao = SessionLocal()
+    sessao.add(models.Empresa(id=1, nome="HIGIPLAS", cnpj="1"))
+    sessao.flush()
+    sessao.add(models.Usuario(
+        id=1, nome="Ana", email="ana@testes.local", hashed_password="x", perfil="ADMIN", empresa_id=1
+    ))
+    sessao.commit()
+    try:
+        yield sessao
+    finally:
+        sessao.rollback()
+        for tabela in reversed(Base.metadata.sorted_tables):
+            sessao.execute(tabela.delete())
+        sessao.commit()
+        sessao.close()
+
+
+@pytest.fixture
+def upsert_sqlite(monkeypatch):
+    """Troca o pg_insert dos serviços incrementais pelo insert do SQLite."""
+    from app.services import demanda_snapshot_service, vendas_mensais_service
+
+    monkeypatch.setattr(demanda_snapshot_service, "pg_insert", sqlite_insert)
+    monkeypatch.setattr(vendas_mensais_service, "pg_insert", sqlite_insert)
@@ -0,0 +1,95 @@
+"""Snapshot diário de demanda: atualização incremental (com commits atrasados) x reconstrução."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.core.config import settings
+from app.db import models
+from app.services.demanda_snapshot_service import DemandaSnapshotService
+
+AGORA = datetime.now().replace(microsecond=0)
+
+
+@pytest.fixture
+def service(db, upsert_sqlite):
+    for produto_id in (1, 2, 3):
+        db.add(models.Produto(
+            id=produto_id, nome=f"Produto {produto_id}", codigo=f"C{produto_id}",
+            preco_venda=1, empresa_id=1, quantidade_em_estoque=0
+        ))
+    db.commit()
+    return DemandaSnapshotService(db)
+
+
+def _lancar(db, *ids):
+    for mov_id in ids:
+        db.add(models.MovimentacaoEstoque(
+            id=mov_id,
+            produto_id=mov_id % 3 + 1,
+            tipo_movimentacao='SAIDA' if mov_id % 3 else 'ENTRADA',
+            quantidade=mov_id % 7 + 1,
+            origem='COMPRA' if mov_id % 5 == 0 else None,
+            data_movimentacao=AGORA - timedelta(days=mov_id % 20, hours=mov_id % 5),
+            usuario_id=1
+        ))
+    db.commit()
+
+
+def _snapshot(db):
+    tabela = models.DemandaDiariaProduto.__table__
+    return sorted(tuple(linha) for linha in db.execute(tabela.select()).all())
+
+
+def _resumo(service):
+    return service.resumo_por_produto(1, (AGORA - timedelta(days=30)).date())
+
+
+def test_incremental_com_commits_atrasados_igual_a_reconstrucao(db, service, monkeypatch):
+    _lancar(db, *range(1, 31))
+    assert service.atualizar_incremental()['processadas_ate'] == 30  # primeira execução reconstrói
+
+    # 35 e 45 recebem o id mas fazem commit depois das demais
+    _lancar(db, *(i for i in range(31, 51) if i not in (35, 45)))
+    service.atualizar_incremental(tamanho_lote=5)
+    service.atualizar_incremental()
+
+    _lancar(db, 35, 45)
+    antes = _resumo(service)  # leitura completa com as linhas ainda não somadas
+    service.atualizar_incremental()
+    assert _resumo(service) == antes
+
+    # Fora da janela de segurança a posição avança e os registros são descartados
+    monkeypatch.setattr(settings, 'INCREMENTAL_JANELA_SEGURANCA_MINUTOS', -1)
+    assert service.atualizar_incremental()['processadas_ate'] == 50
+    assert db.query(models.RegistroProcessadoIncremental).count() == 0
+    assert _resumo(service) == antes
+
+    incremental = _snapshot(db)
+    service.reconstruir()
+    assert _snapshot(db) == incremental
+
+    total = sum(dados['total_saida'] + dados['total_entrada'] for dados in antes.values())
+    assert total == sum(mov.quantidade for mov in db.query(models.MovimentacaoEstoque))
+
+
+def test_edicao_de_movimentacao_ja_somada_atualiza_o_snapshot(db, service):
+    from app.services.stock_service import StockService
+
+    db.query(models.Produto).update({'quantidade_em_estoque': 100})
+    _lancar(db, *range(1, 11))
+    for mov_id in (4, 7):
+        db.get(models.MovimentacaoEstoque, mov_id).status = 'PENDENTE'
+    db.commit()
+    service.atualizar_incremental()
+
+    # Produto, quantidade e tipo mudam depois de a movimentação estar no snapshot
+    StockService.edit_pending_movimentacao(db, 4, empresa_id=1, produto_id=3, quantidade=9, tipo_movimentacao='SAIDA')
+    StockService.edit_and_confirm_movimentacao(
+        db, 7, aprovado_por_id=1, empresa_id=1, quantidade=6, tipo_movimentacao='ENTRADA'
+    )
+
+    editado = _snapshot(db)
+    resumo = _resumo(service)
+    service.reconstruir()
+    assert _snapshot(db) == editado
+    assert _resumo(service) == resumo
@@ -0,0 +1,56 @@
+"""Lotes de importação de NFs: arquivos pendentes de lotes interrompidos contam como erro."""
+import os
+import tempfile
+from datetime import datetime, timezone
+
+import pytest
+
+from app.db import models
+from app.services import nf_importacao_lote_service
+from app.services.nf_importacao_lote_service import NFImportacaoLoteService
+
+
+def _lote(db, lote_id, processado_por, status_arquivos, diretorio=None):
+    db.add(models.ImportacaoNFLote(
+        id=lote_id, empresa_id=1, usuario_id=1, status='PROCESSANDO', total_arquivos=len(status_arquivos),
+        arquivos_concluidos=status_arquivos.count('CONCLUIDO'), arquivos_com_erro=status_arquivos.count('ERRO'),
+        arquivos_duplicados=0, processado_por=processado_por, heartbeat_em=datetime.now(timezone.utc),
+        diretorio=diretorio
+    ))
+    for indice, status_arquivo in enumerate(status_arquivos):
+        db.add(models.ImportacaoNFArquivo(
+            lote_id=lote_id, nome_arquivo=f"{indice}.pdf", tipo_arquivo='PDF',
+            hash_arquivo=f"{lote_id}-{indice}", status=status_arquivo
+        ))
+    db.commit()
+
+
+def _lotes(db):
+    db.expire_all()
+    return {
+        lote.id: (lote.status, lote.arquivos_concluidos + lote.arquivos_com_erro, lote.total_arquivos)
+        for lote in db.query(models.ImportacaoNFLote)
+    }
+
+
+def test_lote_interrompido_no_startup_conta_pendentes_como_erro(db):
+    diretorio = tempfile.mkdtemp(prefix="importacao_nf_lote_")
+    # Dono é este próprio processo: lote de uma execução anterior com o mesmo pid
+    _lote(db, 1, nf_importacao_lote_service.INSTANCIA, ['CONCLUIDO', 'ERRO', 'PENDENTE', 'PENDENTE'], diretorio)
+    _lote(db, 2, nf_importacao_lote_service.INSTANCIA, ['PENDENTE'])
+    _lote(db, 3, 'outro-host:1', ['PENDENTE'])
+
+    assert NFImportacaoLoteService.marcar_lotes_interrompidos() == 2
+
+    assert _lotes(db) == {1: ('INTERROMPIDO', 4, 4), 2: ('INTERROMPIDO', 1, 1), 3: ('PROCESSANDO', 0, 1)}
+    assert not os.path.exists(diretorio)
+
+
+@pytest.mark.parametrize('status_lote, finalizados', [('INTERROMPIDO', 3), ('CONCLUIDO', 2)])
+def test_finalizar_lote_conta_pendentes_interrompidos(db, status_lote, finalizados):
+    _lote(db, 1, nf_importacao_lote_service.INSTANCIA, ['CONCLUIDO', 'ERRO', 'PENDENTE'])
+
+    nf_importacao_lote_service._finalizar_lote(1, status_lote)
+
+    assert _lotes(db) == {1: (status_lote, finalizados, 3)}
+    assert db.get(models.ImportacaoNFLote, 1).data_conclusao is not None
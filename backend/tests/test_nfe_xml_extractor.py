@@ -0,0 +1,128 @@
+"""Extrator de XML de NF-e (app/utils/nfe_xml_extractor.py), com e sem namespace."""
+import pytest
+
+from app.utils.nfe_xml_extractor import NFE_NS, extrair_documento_nfe
+
+XML_NFE = """<?xml version="1.0" encoding="UTF-8"?>
+<nfeProc{xmlns} versao="4.00">
+  <NFe>
+    <infNFe Id="NFe35250112345678000199550010000012341000012345" versao="4.00">
+      <ide>
+        <cUF>35</cUF>
+        <nNF>1234</nNF>
+        <serie>1</serie>
+        <dhEmi>2025-01-15T10:30:00-03:00</dhEmi>
+      </ide>
+      <emit>
+        <CNPJ>12345678000199</CNPJ>
+        <xNome>FORNECEDOR LTDA</xNome>
+        <enderEmit>
+          <xLgr>Rua A</xLgr>
+          <nro>100</nro>
+          <xBairro>Centro</xBairro>
+          <xMun>São Paulo</xMun>
+          <fone>1133334444</fone>
+        </enderEmit>
+      </emit>
+      <dest>
+        <CNPJ>98765432000155</CNPJ>
+        <xNome>HIGIPLAS COMERCIO</xNome>
+        <enderDest>
+          <xLgr>Av. B</xLgr>
+          <nro>200</nro>
+          <xBairro>Renascença</xBairro>
+          <xMun>São Luís</xMun>
+          <fone>9832321010</fone>
+        </enderDest>
+        <email>compras@higiplas.com.br</email>
+      </dest>
+      <det nItem="1">
+        <prod>
+          <cProd>P001</cProd>
+          <xProd>DETERGENTE 5L</xProd>
+          <NCM>34022000</NCM>
+          <uCom>UN</uCom>
+          <qCom>2.0000</qCom>
+          <vUnCom>10.5000</vUnCom>
+          <vProd>21.00</vProd>
+        </prod>
+        <imposto><vTotTrib>1.00</vTotTrib></imposto>
+      </det>
+      <det nItem="2">
+        <prod>
+          <cProd>P002</cProd>
+          <xProd>PAPEL TOALHA</xProd>
+          <NCM>48182000</NCM>
+          <uCom>FD</uCom>
+          <qCom>5.0000</qCom>
+          <vUnCom>10.0000</vUnCom>
+          <vProd>50.00</vProd>
+        </prod>
+      </det>
+      <total>
+        <ICMSTot>
+          <vProd>71.00</vProd>
+          <vNF>71.00</vNF>
+        </ICMSTot>
+      </total>
+    </infNFe>
+  </NFe>
+</nfeProc>
+"""
+
+ESPERADO = {
+    'dados_nf': {
+        'numero': '1234',
+        'serie': '1',
+        'data_emissao': '15/01/2025',
+        'chave_acesso': '35250112345678000199550010000012341000012345'
+    },
+    'emitente': {
+        'cnpj': '12345678000199',
+        'nome': 'FORNECEDOR LTDA',
+        'endereco': 'Rua A, 100, Centro, São Paulo',
+        'telefone': None,
+        'email': None
+    },
+    'destinatario': {
+        'cnpj': '98765432000155',
+        'nome': 'HIGIPLAS COMERCIO',
+        'endereco': 'Av. B, 200, Renascença, São Luís',
+        'telefone': '9832321010',
+        'email': 'compras@higiplas.com.br'
+    },
+    'produtos': [
+        {
+            'nItem': '1', 'codigo': 'P001', 'descricao': 'DETERGENTE 5L', 'ncm': '34022000',
+            'unidade': 'UN', 'quantidade': 2.0, 'valor_unitario': 10.5, 'valor_total': 21.0
+        },
+        {
+            'nItem': '2', 'codigo': 'P002', 'descricao': 'PAPEL TOALHA', 'ncm': '48182000',
+            'unidade': 'FD', 'quantidade': 5.0, 'valor_unitario': 10.0, 'valor_total': 50.0
+        },
+    ],
+    'totais': {'valor_total': 71.0, 'valor_produtos': 71.0, 'valor_impostos': 0}
+}
+
+
+@pytest.mark.parametrize("xmlns", [f' xmlns="{NFE_NS}"', ""], ids=["com_namespace", "sem_namespace"])
+def test_extrai_documento(tmp_path, xmlns):
+    caminho = tmp_path / "nfe.xml"
+    caminho.write_text(XML_NFE.format(xmlns=xmlns), encoding="utf-8")
+
+    assert extrair_documento_nfe(str(caminho)) == ESPERADO
+
+
+def test_item_sem_prod_e_valores_invalidos(tmp_path):
+    xml = XML_NFE.format(xmlns=f' xmlns="{NFE_NS}"')
+    xml = xml.replace('<det nItem="2">', '<det>').replace('<qCom>5.0000</qCom>', '<qCom>abc</qCom>')
+    xml = xml.replace('<total>', '<det nItem="3"><infAdProd>sem prod</infAdProd></det>\n      <total>')
+    caminho = tmp_path / "nfe.xml"
+    caminho.write_text(xml, encoding="utf-8")
+
+    produtos = extrair_documento_nfe(str(caminho))['produtos']
+
+    # Sem nItem vale a posição do <det>; o <det> sem <prod> é ignorado
+    assert [produto['nItem'] for produto in produtos] == ['1', '2']
+    assert produtos[1]['quantidade'] == 0
+    assert produtos[1]['valor_total'] == 50.0
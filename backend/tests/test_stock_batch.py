@@ -0,0 +1,85 @@
+"""Lançamento de estoque em lote (StockService.post_stock_batch)."""
+import pytest
+from fastapi import HTTPException
+
+from app.db import models
+from app.services.stock_service import StockService
+
+
+@pytest.fixture
+def produtos(db):
+    for produto_id in (1, 2):
+        db.add(models.Produto(
+            id=produto_id, nome=f"Produto {produto_id}", codigo=f"C{produto_id}",
+            preco_venda=1, empresa_id=1, quantidade_em_estoque=10
+        ))
+    db.add(models.Empresa(id=2, nome="HIGITEC", cnpj="2"))
+    db.flush()
+    db.add(models.Produto(id=3, nome="Outra empresa", codigo="C3", preco_venda=1, empresa_id=2, quantidade_em_estoque=10))
+    db.commit()
+
+
+def _estoque(db, produto_id):
+    db.expire_all()
+    return db.get(models.Produto, produto_id).quantidade_em_estoque
+
+
+def test_lote_valido_acumula_itens_do_mesmo_produto(db, produtos):
+    resultados = StockService.post_stock_batch(db, [
+        {'produto_id': 1, 'quantidade': 3, 'tipo_movimentacao': 'SAIDA'},
+        {'produto_id': 1, 'quantidade': 5, 'tipo_movimentacao': 'saida'},
+        {'produto_id': 2, 'quantidade': 4, 'tipo_movimentacao': 'ENTRADA'},
+    ], usuario_id=1, empresa_id=1)
+
+    assert [(r['estoque_antes'], r['estoque_depois']) for r in resultados] == [(10, 7), (7, 2), (10, 14)]
+    assert all(r['sucesso'] and r['movimentacao_id'] for r in resultados)
+    assert (_estoque(db, 1), _estoque(db, 2)) == (2, 14)
+    movimentacoes = db.query(models.MovimentacaoEstoque).order_by(models.MovimentacaoEstoque.id).all()
+    assert [(m.quantidade_antes, m.quantidade_depois, m.status) for m in movimentacoes] == [
+        (10, 7, 'CONFIRMADO'), (7, 2, 'CONFIRMADO'), (10, 14, 'CONFIRMADO')
+    ]
+
+
+def test_item_invalido_rejeita_o_lote_inteiro(db, produtos):
+    with pytest.raises(HTTPException) as erro:
+        StockService.post_stock_batch(db, [
+            {'produto_id': 1, 'quantidade': 3, 'tipo_movimentacao': 'SAIDA'},
+            {'produto_id': 2, 'quantidade': 30, 'tipo_movimentacao': 'SAIDA'},
+        ], usuario_id=1, empresa_id=1)
+
+    assert erro.value.status_code == 400
+    assert 'Estoque insuficiente' in erro.value.detail
+    assert (_estoque(db, 1), _estoque(db, 2)) == (10, 10)
+    assert db.query(models.MovimentacaoEstoque).count() == 0
+
+
+def test_rejeicao_sem_commit_preserva_a_transacao_do_chamador(db, produtos):
+    db.add(models.Cliente(id=9, razao_social="Cliente pendente", cnpj="9", empresa_vinculada="HIGIPLAS", empresa_id=1))
+    db.flush()
+
+    with pytest.raises(HTTPException):
+        StockService.post_stock_batch(db, [
+            {'produto_id': 1, 'quantidade': 3, 'tipo_movimentacao': 'SAIDA'},
+            {'produto_id': 2, 'quantidade': 0, 'tipo_movimentacao': 'SAIDA'},
+        ], usuario_id=1, empresa_id=1, commit=False)
+    db.commit()
+
+    assert db.get(models.Cliente, 9) is not None
+    assert (_estoque(db, 1), _estoque(db, 2)) == (10, 10)
+
+
+def test_parcial_lanca_os_validos_e_reporta_os_invalidos(db, produtos):
+    resultados = StockService.post_stock_batch(db, [
+        {'produto_id': 1, 'quantidade': 3, 'tipo_movimentacao': 'SAIDA'},
+        {'produto_id': 1, 'quantidade': 8, 'tipo_movimentacao': 'SAIDA'},
+        {'produto_id': 3, 'quantidade': 1, 'tipo_movimentacao': 'ENTRADA'},
+        {'produto_id': 2, 'quantidade': 1, 'tipo_movimentacao': 'AJUSTE'},
+        {'produto_id': 2, 'quantidade': 5, 'tipo_movimentacao': 'ENTRADA'},
+    ], usuario_id=1, empresa_id=1, parcial=True)
+
+    assert [r['sucesso'] for r in resultados] == [True, False, False, False, True]
+    assert [r['status_code'] for r in resultados] == [None, 400, 404, 400, None]
+    # O item rejeitado não altera o estoque usado pelos seguintes
+    assert resultados[1]['erro'] == "Estoque insuficiente. Disponível: 7, Solicitado: 8"
+    assert (_estoque(db, 1), _estoque(db, 2), _estoque(db, 3)) == (7, 15, 10)
+    assert db.query(models.MovimentacaoEstoque).count() == 2
@@ -0,0 +1,39 @@
+"""Conversão de números da planilha de produtos: parse_float_br_serie x parse_float_br."""
+import pandas as pd
+import pytest
+
+from app.routers.upload_excel import parse_float_br, parse_float_br_serie
+
+VALORES_VALIDOS = [
+    "15,75", "1.234,56", "1,234.56", "15.75", " 3,5 ", "1.234", "-2,5", "0", "",
+    15.75, 10, 0,
+]
+VALORES_INVALIDOS = ["abc", "1,234,567", "12,3x"]
+
+
+def test_serie_igual_a_conversao_por_valor():
+    serie = pd.Series(VALORES_VALIDOS, dtype=object)
+
+    convertido = parse_float_br_serie(serie)
+
+    assert convertido.tolist() == pytest.approx([parse_float_br(valor) for valor in VALORES_VALIDOS])
+
+
+def test_texto_invalido_fica_na():
+    serie = pd.Series(VALORES_VALIDOS[:1] + VALORES_INVALIDOS, dtype=object)
+
+    convertido = parse_float_br_serie(serie)
+
+    assert convertido.iloc[0] == pytest.approx(15.75)
+    assert convertido.iloc[1:].isna().all()
+    for valor in VALORES_INVALIDOS:
+        with pytest.raises(ValueError):
+            parse_float_br(valor)
+
+
+def test_celula_vazia_fica_na():
+    # parse_float_br(None) vale 0; na planilha a célula vazia é tratada por quem chama
+    convertido = parse_float_br_serie(pd.Series([pd.NA, None, "7,5"], dtype=object))
+
+    assert convertido.iloc[:2].isna().all()
+    assert convertido.iloc[2] == pytest.approx(7.5)
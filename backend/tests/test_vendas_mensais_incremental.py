@@ -0,0 +1,101 @@
+"""Cubo mensal de vendas: atualização incremental (com commits atrasados) x reconstrução."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.core.config import settings
+from app.db import models
+from app.services.vendas_mensais_service import (
+    FONTE_MOVIMENTACAO,
+    FONTE_VENDAS_UNIFICADAS,
+    VendasMensaisService,
+)
+
+AGORA = datetime.now().replace(microsecond=0)
+FONTES = [FONTE_MOVIMENTACAO, FONTE_VENDAS_UNIFICADAS]
+
+
+@pytest.fixture
+def service(db, upsert_sqlite):
+    for produto_id in (1, 2, 3):
+        db.add(models.Produto(
+            id=produto_id, nome=f"Produto {produto_id}", codigo=f"C{produto_id}",
+            preco_venda=10, empresa_id=1, quantidade_em_estoque=0
+        ))
+    for cliente_id in (1, 2):
+        db.add(models.Cliente(
+            id=cliente_id, razao_social=f"Cliente {cliente_id}", cnpj=str(cliente_id),
+            empresa_vinculada="HIGIPLAS", empresa_id=1
+        ))
+    db.commit()
+    return VendasMensaisService(db)
+
+
+def _lancar(db, *ids):
+    """Uma movimentação de venda e uma linha de vendas_unificadas com cada id."""
+    for registro_id in ids:
+        data = AGORA - timedelta(days=(registro_id * 7) % 100, hours=registro_id % 5)
+        quantidade = registro_id % 4 + 1
+        produto_id = registro_id % 3 + 1
+        db.add(models.MovimentacaoEstoque(
+            id=registro_id, produto_id=produto_id, tipo_movimentacao='SAIDA', quantidade=quantidade,
+            data_movimentacao=data, status='CONFIRMADO', canal='VENDA_VENDEDOR', usuario_id=1
+        ))
+        db.add(models.VendaUnificada(
+            id=registro_id, empresa_id=1, cliente_id=registro_id % 2 + 1, produto_id=produto_id,
+            vendedor_id=1 if registro_id % 2 else None, origem='NF', nota_fiscal=str(registro_id),
+            quantidade=quantidade, preco_unitario=10, valor_total=10 * quantidade, data_venda=data
+        ))
+    db.commit()
+
+
+def _cubo(db):
+    tabela = models.VendaMensal.__table__
+    return sorted(tuple(linha) for linha in db.execute(tabela.select()).all())
+
+
+def _leituras(service):
+    """Meses inteiros (cubo) e início no meio do mês (origem), como nas telas de análise."""
+    inicio_mes = (AGORA - timedelta(days=120)).replace(day=1, hour=0, minute=0, second=0)
+    return (
+        dict(service.celulas(1, FONTES, inicio_mes)),
+        dict(service.celulas(1, FONTES, AGORA - timedelta(days=45), AGORA + timedelta(days=1))),
+    )
+
+
+def test_incremental_com_commits_atrasados_igual_a_reconstrucao(db, service, monkeypatch):
+    _lancar(db, *range(1, 21))
+    resultado = service.atualizar_incremental()  # primeira execução reconstrói
+    assert resultado['processadas_ate'] == {FONTE_MOVIMENTACAO: 20, FONTE_VENDAS_UNIFICADAS: 20}
+
+    # 25 e 35 recebem o id mas fazem commit depois das demais
+    _lancar(db, *(i for i in range(21, 41) if i not in (25, 35)))
+    service.atualizar_incremental(tamanho_lote=7)
+    service.atualizar_apos_lancamento()
+
+    _lancar(db, 25, 35)
+    antes = _leituras(service)  # cubo + linhas ainda não somadas
+    service.atualizar_apos_lancamento()
+    assert _leituras(service) == antes
+
+    monkeypatch.setattr(settings, 'INCREMENTAL_JANELA_SEGURANCA_MINUTOS', -1)
+    resultado = service.atualizar_incremental()
+    assert resultado['processadas_ate'] == {FONTE_MOVIMENTACAO: 40, FONTE_VENDAS_UNIFICADAS: 40}
+    assert db.query(models.RegistroProcessadoIncremental).count() == 0
+    assert _leituras(service) == antes
+
+    incremental = _cubo(db)
+    service.reconstruir()
+    assert _cubo(db) == incremental
+
+    quantidade_cubo = sum(linha.quantidade for linha in db.query(models.VendaMensal))
+    quantidade_origem = sum(mov.quantidade for mov in db.query(models.MovimentacaoEstoque))
+    assert quantidade_cubo == 2 * quantidade_origem
+
+
+def test_lancamento_sem_cubo_inicializado_nao_reconstroi(db, service):
+    _lancar(db, 1, 2)
+
+    assert service.atualizar_incremental(bloquear=False)['ignorado'] is True
+    assert _cubo(db) == []
+    assert service.celulas(1, FONTES, AGORA - timedelta(days=200))
@@ -1,6 +1,6 @@
 'use client';
 
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useCallback } from 'react';
 import { useAuth } from '@/contexts/AuthContext';
 import { Header } from '@/components/dashboard/Header';
 import { apiService } from '@/services/apiService';
@@ -27,6 +27,35 @@ interface Movimentacao {
 }
 
 
+const TAMANHO_PAGINA = 200;
+
+const mapearMovimentacao = (mov: Record<string, unknown>): Movimentacao | null => {
+  try {
+    return {
+      id: mov.id || 0,
+      produto: {
+        id: mov.produto_id || 0,
+        nome: mov.produto_nome || 'Nome não disponível',
+        codigo: mov.produto_codigo || 'N/A'
+      },
+      tipo_movimentacao: mov.tipo_movimentacao || 'ENTRADA',
+      quantidade: mov.quantidade || 0,
+      quantidade_antes: mov.quantidade_antes || null,
+      quantidade_depois: mov.quantidade_depois || null,
+      data_movimentacao: mov.data_movimentacao || new Date().toISOString(),
+      usuario: {
+        nome: mov.usuario_nome || 'N/A'
+      },
+      observacao: mov.observacao || null,
+      nota_fiscal: mov.nota_fiscal || null,
+      origem: mov.origem || null
+    } as Movimentacao;
+  } catch (error) {
+    console.error('Erro ao mapear movimentação:', error, mov);
+    return null;
+  }
+};
+
 function HistoricoGeralContent() {
   const [movimentacoes, setMovimentacoes] = useState<Movimentacao[]>([]);
   const [loading, setLoading] = useState(true);
@@ -36,42 +65,28 @@ function HistoricoGeralContent() {
   const [notaFiscalReverter, setNotaFiscalReverter] = useState('');
   const [revertendo, setRevertendo] = useState(false);
   const [resultadoReversao, setResultadoReversao] = useState<{sucesso: boolean, mensagem: string} | null>(null);
+  const [proximoCursor, setProximoCursor] = useState<string | null>(null);
+  const [carregandoMais, setCarregandoMais] = useState(false);
   const { logout } = useAuth();
 
+  // Carrega uma página do histórico (paginação por cursor no backend)
+  const carregarPagina = useCallback(async (cursor: string | null) => {
+    const params = new URLSearchParams({ limit: String(TAMANHO_PAGINA) });
+    if (cursor) params.set('cursor', cursor);
+    const response = await apiService.get(`/movimentacoes/historico-geral?${params.toString()}`);
+    const movimentacoesData: Record<string, unknown>[] = response?.data?.movimentacoes || [];
+    const movimentacoesMapeadas = movimentacoesData
+      .map(mapearMovimentacao)
+      .filter((mov): mov is Movimentacao => mov !== null);
+    setProximoCursor(response?.data?.paginacao?.proximo_cursor || null);
+    setMovimentacoes(prev => cursor ? [...prev, ...movimentacoesMapeadas] : movimentacoesMapeadas);
+  }, []);
+
   useEffect(() => {
     const fetchHistoricoGeral = async () => {
       try {
         setLoading(true);
-        const response = await apiService.get('/movimentacoes/historico-geral');
-        const movimentacoesData = response?.data?.movimentacoes || [];
-        const movimentacoesMapeadas = movimentacoesData.map((mov: Record<string, unknown>) => {
-          try {
-            return {
-              id: mov.id || 0,
-              produto: {
-                id: mov.produto_id || 0,
-                nome: mov.produto_nome || 'Nome não disponível',
-                codigo: mov.produto_codigo || 'N/A'
-              },
-              tipo_movimentacao: mov.tipo_movimentacao || 'ENTRADA',
-              quantidade: mov.quantidade || 0,
-              quantidade_antes: mov.quantidade_antes || null,
-              quantidade_depois: mov.quantidade_depois || null,
-              data_movimentacao: mov.data_movimentacao || new Date().toISOString(),
-              usuario: {
-                nome: mov.usuario_nome || 'N/A'
-              },
-              observacao: mov.observacao || null,
-              nota_fiscal: mov.nota_fiscal || null,
-              origem: mov.origem || null
-            };
-          } catch (error) {
-            console.error('Erro ao mapear movimentação:', error, mov);
-            return null;
-          }
-        }).filter(Boolean);
-
-        setMovimentacoes(movimentacoesMapeadas);
+        await carregarPagina(null);
       } catch (err) {
         const message = err instanceof Error ? err.message : "Erro desconhecido";
         setError(message);
@@ -82,7 +97,20 @@ function HistoricoGeralContent() {
     };
 
     fetchHistoricoGeral();
-  }, [logout]);
+  }, [logout, carregarPagina]);
+
+  const handleCarregarMais = async () => {
+    if (!proximoCursor) return;
+    setCarregandoMais(true);
+    try {
+      await carregarPagina(proximoCursor);
+    } catch (err) {
+      const message = err instanceof Error ? err.message : "Erro desconhecido";
+      setError(message);
+    } finally {
+      setCarregandoMais(false);
+    }
+  };
 
   const movimentacoesFiltradas = movimentacoes.filter(mov => {
     try {
@@ -152,28 +180,7 @@ function HistoricoGeralContent() {
         });
         setNotaFiscalReverter('');
         // Recarregar histórico
-        const histResponse = await apiService.get('/movimentacoes/historico-geral');
-        const movimentacoesData = histResponse?.data?.movimentacoes || [];
-        const movimentacoesMapeadas = movimentacoesData.map((mov: Record<string, unknown>) => ({
-          id: mov.id || 0,
-          produto: {
-            id: mov.produto_id || 0,
-            nome: mov.produto_nome || 'Nome não disponível',
-            codigo: mov.produto_codigo || 'N/A'
-          },
-          tipo_movimentacao: mov.tipo_movimentacao || 'ENTRADA',
-          quantidade: mov.quantidade || 0,
-          quantidade_antes: mov.quantidade_antes || null,
-          quantidade_depois: mov.quantidade_depois || null,
-          data_movimentacao: mov.data_movimentacao || new Date().toISOString(),
-          usuario: {
-            nome: mov.usuario_nome || 'N/A'
-          },
-          observacao: mov.observacao || null,
-          nota_fiscal: mov.nota_fiscal || null,
-          origem: mov.origem || null
-        })).filter(Boolean);
-        setMovimentacoes(movimentacoesMapeadas);
+        await carregarPagina(null);
       } else {
         setResultadoReversao({
           sucesso: false,
@@ -432,6 +439,18 @@ function HistoricoGeralContent() {
                   </p>
                 </div>
               )}
+
+              {proximoCursor && (
+                <div className="flex justify-center p-4 border-t border-gray-200 dark:border-gray-700">
+                  <button
+                    onClick={handleCarregarMais}
+                    disabled={carregandoMais}
+                    className="px-4 py-2 bg-blue-600 hover:bg-blue-700 disabled:bg-gray-400 text-white rounded-md text-sm font-medium transition-colors"
+                  >
+                    {carregandoMais ? 'Carregando...' : 'Carregar mais'}
+                  </button>
+                </div>
+              )}
             </div>
           )}
         </div>
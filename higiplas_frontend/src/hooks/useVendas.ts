@@ -67,7 +67,11 @@ export function useVendas() {
       setError(null);
       let url = '/vendas/produtos/disponiveis';
       const params = new URLSearchParams();
-      if (busca) params.append('busca', busca);
+      if (busca) {
+        params.append('busca', busca);
+        // Busca incremental (a cada tecla): limita a página no servidor
+        params.append('limit', '50');
+      }
       if (categoria) params.append('categoria', categoria);
       if (clienteId) params.append('cliente_id', clienteId.toString());
       if (params.toString()) url += `?${params.toString()}`;